@@ -1,4 +1,5 @@
 import os
+import zlib
 from pathlib import Path
 from dotenv import load_dotenv
 
@@ -8,8 +9,101 @@ load_dotenv()
 # 基础配置
 BASE_URL = os.getenv("BASE_URL", "http://localhost:8000")
 UPLOAD_DIR = Path(os.getenv("UPLOAD_DIR", "uploads"))
+DATA_DIR = Path(os.getenv("DATA_DIR", "data"))  # 内部数据目录 (索引数据库等, 不对外提供访问)
 MAX_FILE_SIZE = int(os.getenv("MAX_FILE_SIZE", 104857600))  # 默认 100MB
 DOWNLOAD_TIMEOUT = int(os.getenv("DOWNLOAD_TIMEOUT", 30))  # 默认 30 秒
+DOWNLOAD_MAX_CONNECTIONS = int(os.getenv("DOWNLOAD_MAX_CONNECTIONS", 100))  # 下载连接池总连接数
+DOWNLOAD_MAX_KEEPALIVE_CONNECTIONS = int(os.getenv("DOWNLOAD_MAX_KEEPALIVE_CONNECTIONS", 20))  # 保持空闲的长连接数
+DOWNLOAD_MAX_CONNECTIONS_PER_HOST = int(os.getenv("DOWNLOAD_MAX_CONNECTIONS_PER_HOST", 10))  # 单个主机的并发连接数
+DOWNLOAD_HTTP2 = os.getenv("DOWNLOAD_HTTP2", "false").lower() in ("1", "true", "yes")  # 启用 HTTP/2 (需安装 h2)
+BATCH_URL_CONCURRENCY = int(os.getenv("BATCH_URL_CONCURRENCY", 16))  # 批量 URL 上传的全局并发数 (每个 worker 进程内所有请求共享)
+BATCH_URL_PER_HOST_CONCURRENCY = int(os.getenv("BATCH_URL_PER_HOST_CONCURRENCY", 4))  # 批量 URL 上传的单主机并发数 (每个 worker 进程内所有请求共享)
+BATCH_URL_ITEM_TIMEOUT = int(os.getenv("BATCH_URL_ITEM_TIMEOUT", 120))  # 批量 URL 上传单项超时 (秒)
+ARCHIVE_MAX_MEMBERS = int(os.getenv("ARCHIVE_MAX_MEMBERS", 10000))  # 压缩包上传的最大条目数
+ARCHIVE_MAX_TOTAL_SIZE = int(os.getenv("ARCHIVE_MAX_TOTAL_SIZE", 10737418240))  # 压缩包解压后的总大小上限, 默认 10GB
+ARCHIVE_MAX_RATIO = float(os.getenv("ARCHIVE_MAX_RATIO", 100))  # 解压比例上限 (解压后大小 / 已接收大小), 防止压缩炸弹
+IMPORT_JOB_DB_PATH = Path(os.getenv("IMPORT_JOB_DB_PATH", str(DATA_DIR / "jobs.db")))
+IMPORT_JOB_WORKERS = int(os.getenv("IMPORT_JOB_WORKERS", 8))  # 异步导入任务的 worker 数
+IMPORT_JOB_MAX_ATTEMPTS = int(os.getenv("IMPORT_JOB_MAX_ATTEMPTS", 3))  # 临时故障时的最大尝试次数
+IMPORT_JOB_RETRY_BACKOFF = float(os.getenv("IMPORT_JOB_RETRY_BACKOFF", 2.0))  # 重试退避基数 (秒), 每次翻倍
+IMPORT_JOB_RETENTION = int(os.getenv("IMPORT_JOB_RETENTION", 604800))  # 已结束任务的保留时间 (秒), 默认 7 天
+IMPORT_JOB_MAX_WAIT = int(os.getenv("IMPORT_JOB_MAX_WAIT", 60))  # 长轮询最长等待时间 (秒)
+IMPORT_JOB_LEASE = float(os.getenv("IMPORT_JOB_LEASE", 30))  # 执行中任务的租约时长 (秒), 持有者退出后超时的任务重新排队
+URL_CACHE_ENABLED = os.getenv("URL_CACHE_ENABLED", "false").lower() in ("1", "true", "yes")  # 重复导入同一 URL 时复用已保存的文件
+URL_CACHE_TTL = int(os.getenv("URL_CACHE_TTL", 3600))  # 缓存有效期 (秒), 过期后向源站发送条件请求
+URL_CACHE_MEMORY_ENTRIES = int(os.getenv("URL_CACHE_MEMORY_ENTRIES", 10000))  # 内存中保留的最近使用记录数
+URL_CACHE_DB_PATH = Path(os.getenv("URL_CACHE_DB_PATH", str(DATA_DIR / "url_cache.db")))
+STORAGE_DEDUP = os.getenv("STORAGE_DEDUP", "false").lower() in ("1", "true", "yes")  # 内容寻址去重存储
+STORAGE_SHARD_DEPTH = int(os.getenv("STORAGE_SHARD_DEPTH", 0))  # 分片目录层数, 0 表示平铺
+STORAGE_SHARD_WIDTH = int(os.getenv("STORAGE_SHARD_WIDTH", 2))  # 每层分片目录名长度 (十六进制字符数)
+STORAGE_ROOTS = [Path(p.strip()) for p in os.getenv("STORAGE_ROOTS", "").split(",") if p.strip()]  # UPLOAD_DIR 之外的存储根目录 (多块磁盘)
+STORAGE_LAYOUT_RELOAD = float(os.getenv("STORAGE_LAYOUT_RELOAD", 5))  # 检查布局文件变化的间隔 (秒)
+STORAGE_IO_WORKERS = int(os.getenv("STORAGE_IO_WORKERS", 8))  # 存储写入专用线程数
+STORAGE_FSYNC = os.getenv("STORAGE_FSYNC", "off").lower()  # 提交时的落盘方式: off / always / group
+STORAGE_GROUP_COMMIT_WINDOW = float(os.getenv("STORAGE_GROUP_COMMIT_WINDOW", 0.002))  # group 模式下等待合并 fsync 的时间 (秒)
+STORAGE_GROUP_COMMIT_MAX = int(os.getenv("STORAGE_GROUP_COMMIT_MAX", 128))  # group 模式下每批最多合并的提交数
+VOLUME_SMALL_FILE_MAX = int(os.getenv("VOLUME_SMALL_FILE_MAX", 0))  # 不大于该值的文件写入卷存储, 0 表示不启用
+VOLUME_SIZE = int(os.getenv("VOLUME_SIZE", 1073741824))  # 每个卷文件的预分配大小, 默认 1GB
+METADATA_ENABLED = os.getenv("METADATA_ENABLED", "true").lower() in ("1", "true", "yes")  # 文件元数据索引
+METADATA_DB_PATH = Path(os.getenv("METADATA_DB_PATH", str(DATA_DIR / "metadata.db")))
+METADATA_BATCH_SIZE = int(os.getenv("METADATA_BATCH_SIZE", 500))  # 每批写入的最大记录数
+METADATA_FLUSH_INTERVAL = float(os.getenv("METADATA_FLUSH_INTERVAL", 0.5))  # 批量写入间隔 (秒)
+METADATA_BULK_STAT_LIMIT = int(os.getenv("METADATA_BULK_STAT_LIMIT", 5000))  # 批量查询单次最多文件数
+LIFECYCLE_ENABLED = os.getenv("LIFECYCLE_ENABLED", "false").lower() in ("1", "true", "yes")  # 过期清理和磁盘配额 (依赖元数据索引)
+LIFECYCLE_DEFAULT_TTL = int(os.getenv("LIFECYCLE_DEFAULT_TTL", 0))  # 默认保留时间 (秒), 0 表示永久保留
+LIFECYCLE_FORMAT_TTL = {
+    file_format.strip().lower(): int(ttl)
+    for file_format, ttl in (
+        item.split("=") for item in os.getenv("LIFECYCLE_FORMAT_TTL", "").split(",")
+        if item.strip()
+    )
+}  # 按格式覆盖默认保留时间, 如 "mp4=604800,gif=86400"
+LIFECYCLE_DISK_QUOTA = int(os.getenv("LIFECYCLE_DISK_QUOTA", 0))  # 文件总大小上限 (字节), 超出时淘汰最久未访问的文件, 0 表示不限
+LIFECYCLE_SWEEP_INTERVAL = float(os.getenv("LIFECYCLE_SWEEP_INTERVAL", 60))  # 清理间隔 (秒)
+LIFECYCLE_SWEEP_BATCH = int(os.getenv("LIFECYCLE_SWEEP_BATCH", 100))  # 每批删除的文件数
+LIFECYCLE_SWEEP_PAUSE = float(os.getenv("LIFECYCLE_SWEEP_PAUSE", 0.1))  # 批次之间的间隔 (秒), 避免占满磁盘 IO
+FILES_CACHE_CONTROL = os.getenv("FILES_CACHE_CONTROL", "public, max-age=31536000, immutable")  # 直链响应的缓存策略
+HOT_CACHE_ENABLED = os.getenv("HOT_CACHE_ENABLED", "false").lower() in ("1", "true", "yes")  # 热点小文件共享内存缓存 (同一节点的 worker 共用)
+HOT_CACHE_SIZE = int(os.getenv("HOT_CACHE_SIZE", 268435456))  # 缓存总大小, 默认 256MB
+HOT_CACHE_MAX_OBJECT = int(os.getenv("HOT_CACHE_MAX_OBJECT", 1048576))  # 单个文件的大小上限, 默认 1MB
+HOT_CACHE_SLOTS = int(os.getenv("HOT_CACHE_SLOTS", 65536))  # 索引槽位数 (最多缓存的文件数)
+HOT_CACHE_PATH = Path(os.getenv(
+    "HOT_CACHE_PATH",
+    f"/dev/shm/linkforge-{zlib.crc32(str(UPLOAD_DIR.resolve()).encode()):08x}.cache"
+    if os.path.isdir("/dev/shm") else str(DATA_DIR / "hot.cache")
+))  # 共享内存文件 (默认按上传目录区分, 同一目录的实例共享)
+IMAGE_VARIANT_SIZES = {
+    tuple(int(n) for n in size.lower().split("x"))
+    for size in os.getenv("IMAGE_VARIANT_SIZES", "64x64,160x120,320x240,640x480,1280x720").split(",")
+    if size.strip()
+}  # 允许的缩略图尺寸 (宽x高)
+IMAGE_VARIANT_CACHE_DIR = Path(os.getenv("IMAGE_VARIANT_CACHE_DIR", str(DATA_DIR / "variants")))
+IMAGE_VARIANT_CACHE_MAX_BYTES = int(os.getenv("IMAGE_VARIANT_CACHE_MAX_BYTES", 1073741824))  # 缩略图缓存上限 (所有 worker 共享), 默认 1GB
+IMAGE_VARIANT_WORKERS = int(os.getenv("IMAGE_VARIANT_WORKERS", min(os.cpu_count() or 1, 4)))  # 缩略图生成进程数
+IMAGE_OPTIMIZE_ENABLED = os.getenv("IMAGE_OPTIMIZE_ENABLED", "false").lower() in ("1", "true", "yes")  # 入库后生成 WebP / AVIF 等更小的编码
+IMAGE_OPTIMIZE_DIR = Path(os.getenv("IMAGE_OPTIMIZE_DIR", str(DATA_DIR / "optimized")))
+IMAGE_OPTIMIZE_QUALITY = int(os.getenv("IMAGE_OPTIMIZE_QUALITY", 80))  # 有损编码质量 (1-100)
+IMAGE_OPTIMIZE_WORKERS = int(os.getenv("IMAGE_OPTIMIZE_WORKERS", 1))  # 格式优化进程数 (与缩略图进程池分开)
+CHUNKED_UPLOAD_MAX_SIZE = int(os.getenv("CHUNKED_UPLOAD_MAX_SIZE", 10737418240))  # 分块上传的最大文件大小, 默认 10GB
+UPLOAD_SESSION_TTL = int(os.getenv("UPLOAD_SESSION_TTL", 86400))  # 分块上传会话无活动后的过期时间 (秒)
+MP4_FASTSTART = os.getenv("MP4_FASTSTART", "false").lower() in ("1", "true", "yes")  # 入库时将 moov 移到文件开头
+MEDIA_PROBE_ENABLED = os.getenv("MEDIA_PROBE_ENABLED", "true").lower() in ("1", "true", "yes")  # 入库时读取文件头获取宽高、时长和编码
+METRICS_ENABLED = os.getenv("METRICS_ENABLED", "true").lower() in ("1", "true", "yes")  # 记录处理指标并提供 /metrics
+METRICS_DIR = Path(os.getenv("METRICS_DIR", str(DATA_DIR / "metrics")))  # 各 worker 进程的指标快照目录, 采集时合并
+METRICS_FLUSH_INTERVAL = float(os.getenv("METRICS_FLUSH_INTERVAL", 5))  # 各进程写出指标快照的间隔 (秒)
+ADMISSION_CONCURRENCY = {
+    kind.strip(): int(limit)
+    for kind, limit in (
+        item.split("=") for item in os.getenv("ADMISSION_CONCURRENCY", "file=64,binary=64,url=64,batch=8,chunk=64").split(",")
+        if item.strip()
+    )
+}  # 各类上传请求的并发上限 (每个 worker 进程)
+ADMISSION_MEMORY_BUDGET = int(os.getenv("ADMISSION_MEMORY_BUDGET", 536870912))  # 每个 worker 进程上传写入缓冲区的内存预算, 默认 512MB, 0 表示不限
+ADMISSION_DISK_BUDGET = int(os.getenv("ADMISSION_DISK_BUDGET", 0))  # 每个 worker 进程正在接收的数据的磁盘预算, 0 表示不限
+ADMISSION_MAX_WAIT = float(os.getenv("ADMISSION_MAX_WAIT", 10))  # 超出限制时的最长排队时间 (秒)
+ADMISSION_RETRY_AFTER = int(os.getenv("ADMISSION_RETRY_AFTER", 5))  # 拒绝时返回的 Retry-After (秒)
+UPLOAD_CHUNK_SIZE = int(os.getenv("UPLOAD_CHUNK_SIZE", 1048576))  # 流式写入缓冲区, 默认 1MB
+MIME_SNIFF_SIZE = int(os.getenv("MIME_SNIFF_SIZE", 8192))  # 格式检测读取的头部字节数, 默认 8KB
 
 # 支持的文件格式
 ALLOWED_IMAGE_FORMATS = set(
@@ -20,5 +114,6 @@ ALLOWED_VIDEO_FORMATS = set(
 )
 ALLOWED_FORMATS = ALLOWED_IMAGE_FORMATS | ALLOWED_VIDEO_FORMATS
 
-# 确保上传目录存在
+# 确保上传目录和数据目录存在
 UPLOAD_DIR.mkdir(parents=True, exist_ok=True)
+DATA_DIR.mkdir(parents=True, exist_ok=True)
@@ -1,9 +1,45 @@
+from contextlib import asynccontextmanager
 from fastapi import FastAPI
 from fastapi.middleware.cors import CORSMiddleware
-from fastapi.staticfiles import StaticFiles
-from fastapi.responses import JSONResponse
-from routers import upload
-from config import UPLOAD_DIR
+from fastapi.responses import JSONResponse, PlainTextResponse
+from routers import upload, upload_sessions, jobs, files, metadata
+from config import UPLOAD_DIR, METRICS_ENABLED
+from services.download_service import download_service
+from services.hot_cache_service import hot_cache_service
+from services.image_service import image_service
+from services.import_job_service import import_job_service
+from services.lifecycle_service import lifecycle_service
+from services.url_cache_service import url_cache_service
+from services.metadata_service import metadata_service
+from services.metrics_service import metrics_service
+from services.storage_io import storage_io
+from services.volume_service import volume_service
+from utils import metrics
+
+
+@asynccontextmanager
+async def lifespan(app: FastAPI):
+    """应用生命周期: 启动和关闭长期持有的资源"""
+    await download_service.start()
+    await volume_service.start()
+    metadata_service.start()
+    image_service.start()
+    await url_cache_service.start()
+    await import_job_service.start()
+    lifecycle_service.start()
+    hot_cache_service.start()
+    metrics_service.start()
+    yield
+    await metrics_service.stop()
+    await hot_cache_service.stop()
+    await lifecycle_service.stop()
+    await import_job_service.stop()
+    url_cache_service.stop()
+    await download_service.close()
+    metadata_service.stop()
+    image_service.stop()
+    volume_service.close()
+    storage_io.stop()
 
 # 创建 FastAPI 应用
 app = FastAPI(
@@ -11,7 +47,8 @@ app = FastAPI(
     description="图片和视频直链生成 API - 支持文件上传、二进制上传、URL 上传和批量处理",
     version="1.0.0",
     docs_url="/docs",
-    redoc_url="/redoc"
+    redoc_url="/redoc",
+    lifespan=lifespan
 )
 
 # 配置 CORS
@@ -23,11 +60,16 @@ app.add_middleware(
     allow_headers=["*"],
 )
 
+# 请求指标 (最外层, 包含其他中间件的耗时)
+if METRICS_ENABLED:
+    app.add_middleware(metrics.MetricsMiddleware)
+
 # 注册路由
 app.include_router(upload.router)
-
-# 挂载静态文件服务 (用于直链访问)
-app.mount("/files", StaticFiles(directory=str(UPLOAD_DIR)), name="files")
+app.include_router(upload_sessions.router)
+app.include_router(jobs.router)
+app.include_router(files.router)  # 直链访问 (/files/{filename})
+app.include_router(metadata.router)
 
 
 @app.get("/", tags=["根路径"])
@@ -42,7 +84,9 @@ async def root():
             "文件上传 (multipart/form-data)",
             "二进制数据上传 (application/octet-stream)",
             "URL 直链上传",
-            "批量上传支持"
+            "批量上传支持",
+            "可续传的分块上传",
+            "异步 URL 导入任务"
         ]
     }
 
@@ -53,6 +97,14 @@ async def health_check():
     return {"status": "healthy"}
 
 
+@app.get("/metrics", tags=["健康检查"], response_class=PlainTextResponse)
+async def prometheus_metrics():
+    """Prometheus 指标 (汇总所有 worker 进程)"""
+    if not METRICS_ENABLED:
+        return PlainTextResponse("metrics disabled\n", status_code=404)
+    return PlainTextResponse(await metrics_service.render(), media_type="text/plain; version=0.0.4")
+
+
 if __name__ == "__main__":
     import uvicorn
     uvicorn.run(app, host="0.0.0.0", port=8000)
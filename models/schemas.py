@@ -1,4 +1,5 @@
-from typing import Optional, List
+from datetime import datetime
+from typing import Dict, Optional, List
 from pydantic import BaseModel, HttpUrl, Field
 
 
@@ -8,6 +9,10 @@ class FileInfo(BaseModel):
     url: str = Field(..., description="直链 URL")
     size: int = Field(..., description="文件大小(字节)")
     format: str = Field(..., description="文件格式")
+    width: Optional[int] = Field(None, description="宽度(像素, 图片和视频)")
+    height: Optional[int] = Field(None, description="高度(像素, 图片和视频)")
+    duration: Optional[float] = Field(None, description="时长(秒, 视频)")
+    codec: Optional[str] = Field(None, description="视频编码 (如 avc1 / V_VP9)")
 
 
 class UploadResponse(BaseModel):
@@ -21,6 +26,7 @@ class UrlUploadRequest(BaseModel):
     """URL 上传请求"""
     url: HttpUrl = Field(..., description="文件 URL")
     filename: Optional[str] = Field(None, description="自定义文件名(可选)")
+    ttl: Optional[int] = Field(None, description="保留时间 (秒, 可选), 过期后自动删除", gt=0)
 
 
 class BatchUrlUploadRequest(BaseModel):
@@ -28,6 +34,69 @@ class BatchUrlUploadRequest(BaseModel):
     urls: List[HttpUrl] = Field(..., description="文件 URL 列表", min_length=1)
 
 
+class UploadSessionRequest(BaseModel):
+    """创建分块上传会话请求"""
+    filename: str = Field(..., description="原始文件名 (用于确定文件格式)")
+    size: int = Field(..., description="文件总大小(字节)", gt=0)
+
+
+class UploadSessionInfo(BaseModel):
+    """分块上传会话状态"""
+    session_id: str = Field(..., description="会话 ID")
+    filename: str = Field(..., description="原始文件名")
+    size: int = Field(..., description="文件总大小(字节)")
+    received: int = Field(..., description="已接收的字节数")
+    ranges: List[List[int]] = Field(default_factory=list, description="已接收的区间 [start, end), 按偏移排序")
+    complete: bool = Field(..., description="是否已接收全部数据")
+    expires_at: datetime = Field(..., description="无活动时的过期时间")
+
+
+class UploadSessionResponse(BaseModel):
+    """分块上传会话响应"""
+    success: bool = Field(..., description="是否成功")
+    message: str = Field(..., description="响应消息")
+    data: UploadSessionInfo = Field(..., description="会话状态")
+
+
+class BatchItemResult(BaseModel):
+    """批量上传单项结果 (NDJSON 流式响应中的一行)"""
+    index: int = Field(..., description="在请求列表中的序号")
+    url: str = Field(..., description="文件 URL")
+    success: bool = Field(..., description="是否成功")
+    data: Optional[FileInfo] = Field(None, description="文件信息")
+    error: Optional[str] = Field(None, description="错误信息")
+
+
+class ImportJobRequest(BaseModel):
+    """异步 URL 导入请求"""
+    urls: List[HttpUrl] = Field(..., description="文件 URL 列表, 每个 URL 一个任务", min_length=1)
+
+
+class ImportJob(BaseModel):
+    """异步 URL 导入任务"""
+    job_id: str = Field(..., description="任务 ID")
+    url: str = Field(..., description="文件 URL")
+    status: str = Field(..., description="任务状态: queued / running / succeeded / failed")
+    attempts: int = Field(..., description="已尝试次数")
+    data: Optional[FileInfo] = Field(None, description="文件信息 (成功时)")
+    error: Optional[str] = Field(None, description="错误信息 (失败或等待重试时)")
+    created_at: datetime = Field(..., description="提交时间")
+    updated_at: datetime = Field(..., description="最近更新时间")
+
+
+class ImportJobResponse(BaseModel):
+    """单个导入任务响应"""
+    success: bool = Field(..., description="是否成功")
+    data: ImportJob = Field(..., description="任务")
+
+
+class ImportJobListResponse(BaseModel):
+    """批量提交导入任务响应"""
+    success: bool = Field(..., description="是否成功")
+    message: str = Field(..., description="响应消息")
+    data: List[ImportJob] = Field(default_factory=list, description="任务列表")
+
+
 class BatchUploadResponse(BaseModel):
     """批量上传响应"""
     success: bool = Field(..., description="是否全部成功")
@@ -37,3 +106,38 @@ class BatchUploadResponse(BaseModel):
     failed: int = Field(..., description="失败数")
     data: List[FileInfo] = Field(default_factory=list, description="成功上传的文件列表")
     errors: List[dict] = Field(default_factory=list, description="失败的文件及错误信息")
+
+
+class FileRecord(BaseModel):
+    """元数据索引中的文件记录"""
+    filename: str = Field(..., description="文件名")
+    url: str = Field(..., description="直链 URL")
+    size: int = Field(..., description="文件大小(字节)")
+    format: str = Field(..., description="文件格式")
+    sha256: Optional[str] = Field(None, description="文件内容 SHA-256")
+    source_url: Optional[str] = Field(None, description="来源 URL (URL 上传)")
+    width: Optional[int] = Field(None, description="宽度(像素, 图片和视频)")
+    height: Optional[int] = Field(None, description="高度(像素, 图片和视频)")
+    duration: Optional[float] = Field(None, description="时长(秒, 视频)")
+    codec: Optional[str] = Field(None, description="视频编码 (如 avc1 / V_VP9)")
+    created_at: datetime = Field(..., description="上传时间")
+    accessed_at: Optional[datetime] = Field(None, description="最近访问时间")
+    expires_at: Optional[datetime] = Field(None, description="过期时间 (过期后自动删除, 为空表示永久保留)")
+
+
+class FileListResponse(BaseModel):
+    """文件列表响应"""
+    success: bool = Field(..., description="是否成功")
+    data: List[FileRecord] = Field(default_factory=list, description="文件列表")
+    next_cursor: Optional[str] = Field(None, description="下一页游标, 为空表示没有更多")
+
+
+class BulkStatRequest(BaseModel):
+    """批量查询请求"""
+    filenames: List[str] = Field(..., description="文件名列表", min_length=1)
+
+
+class BulkStatResponse(BaseModel):
+    """批量查询响应"""
+    success: bool = Field(..., description="是否成功")
+    data: Dict[str, Optional[FileRecord]] = Field(..., description="文件名 -> 文件记录, 不存在时为 null")
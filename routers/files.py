@@ -0,0 +1,114 @@
+import os
+from mimetypes import guess_type
+from typing import Optional
+import anyio
+from fastapi import APIRouter, HTTPException, Query, Request
+from config import FILES_CACHE_CONTROL
+from services.hot_cache_service import hot_cache_service
+from services.image_service import image_service
+from services.metadata_service import metadata_service
+from services.storage_service import storage_service
+from utils.file_response import build_bytes_response, build_file_response
+
+router = APIRouter(tags=["直链"])
+
+
+@router.api_route("/files/{filename}", methods=["GET", "HEAD"], summary="直链文件访问")
+async def get_file(
+    filename: str,
+    request: Request,
+    w: Optional[int] = Query(None, gt=0, description="缩略图宽度 (须与 h 同时提供)"),
+    h: Optional[int] = Query(None, gt=0, description="缩略图高度 (须与 w 同时提供)"),
+    fit: str = Query("cover", description="缩放模式: cover 裁剪填满 / contain 完整缩放")
+):
+    """
+    通过直链访问已上传的文件
+    
+    文件按存储布局 (平铺或分片目录, 小文件可能位于卷存储) 定位, 直链 URL 与存储布局无关。
+    
+    - 支持单段和多段 Range 请求 (206), 视频可直接拖动播放
+    - 强 ETag, 支持 If-None-Match / If-Modified-Since (304) 和 If-Range
+    - 文件名唯一且内容不变, 默认返回 Cache-Control: immutable
+    - 图片可通过 w/h/fit 获取缩略图, 尺寸须在 IMAGE_VARIANT_SIZES 中
+    - 启用格式优化时按 Accept 返回最小的可接受编码 (Vary: Accept)
+    - 启用热点缓存时, 反复访问的小文件直接从共享内存返回
+    """
+    # 缩略图和按 Accept 协商的图片不经过热点缓存
+    cacheable = hot_cache_service.enabled and w is None and h is None and not image_service.negotiates(filename)
+    if cacheable:
+        cached = hot_cache_service.get(filename)
+        if cached is not None:
+            metadata_service.touch(filename)
+            return build_bytes_response(
+                request.method,
+                request.headers,
+                cached.content,
+                cached.stat_result,
+                cache_control=FILES_CACHE_CONTROL,
+                media_type=guess_type(filename)[0] or "application/octet-stream"
+            )
+    
+    file_path = storage_service.resolve_file_path(filename)
+    location = None
+    media_type = None
+    vary = None
+    if file_path is None:
+        if storage_service.is_valid_filename(filename):
+            location = await storage_service.volumes.locate(filename)
+        if location is None:
+            raise HTTPException(status_code=404, detail="文件不存在")
+    
+    if w is not None or h is not None:
+        if w is None or h is None:
+            raise HTTPException(status_code=400, detail="缩略图需要同时提供 w 和 h")
+        if not image_service.available:
+            raise HTTPException(status_code=501, detail="服务器未安装 Pillow, 不支持缩略图")
+        try:
+            file_path = await image_service.get_variant(filename, file_path or location, w, h, fit)
+        except ValueError as e:
+            raise HTTPException(status_code=400, detail=str(e))
+        location = None
+    elif image_service.negotiates(filename):
+        # 响应内容随 Accept 变化, 原图和优化编码都需要带上 Vary
+        vary = "Accept"
+        selected = await anyio.to_thread.run_sync(
+            image_service.select_encoding, filename, file_path or location, request.headers.get("accept")
+        )
+        if selected is not None:
+            file_path, media_type = selected
+            location = None
+    
+    if location is not None:
+        # 卷存储中的小文件: 直接发送卷文件中的对应区间
+        stat_result = location.stat_result()
+        metadata_service.touch(filename)
+        if cacheable:
+            hot_cache_service.offer(filename, location, stat_result)
+        return build_file_response(
+            request.method,
+            request.headers,
+            location.path,
+            stat_result,
+            cache_control=FILES_CACHE_CONTROL,
+            media_type=guess_type(filename)[0] or "application/octet-stream",
+            file_offset=location.offset,
+            vary=vary
+        )
+    
+    try:
+        stat_result = await anyio.to_thread.run_sync(os.stat, file_path)
+    except FileNotFoundError:
+        raise HTTPException(status_code=404, detail="文件不存在")
+    
+    metadata_service.touch(filename)
+    if cacheable:
+        hot_cache_service.offer(filename, file_path, stat_result)
+    return build_file_response(
+        request.method,
+        request.headers,
+        file_path,
+        stat_result,
+        cache_control=FILES_CACHE_CONTROL,
+        media_type=media_type,
+        vary=vary
+    )
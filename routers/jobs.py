@@ -0,0 +1,72 @@
+from datetime import datetime
+from fastapi import APIRouter, HTTPException, Query
+from config import IMPORT_JOB_MAX_WAIT
+from models.schemas import (
+    FileInfo,
+    ImportJob,
+    ImportJobRequest,
+    ImportJobResponse,
+    ImportJobListResponse
+)
+from services.import_job_service import import_job_service
+
+router = APIRouter(prefix="/api/jobs", tags=["导入任务"])
+
+
+def _to_job(row: dict) -> ImportJob:
+    return ImportJob(
+        job_id=row["job_id"],
+        url=row["url"],
+        status=row["status"],
+        attempts=row["attempts"],
+        data=FileInfo.model_validate_json(row["result"]) if row["result"] else None,
+        error=row["error"],
+        created_at=datetime.fromtimestamp(row["created_at"]),
+        updated_at=datetime.fromtimestamp(row["updated_at"])
+    )
+
+
+@router.post("", response_model=ImportJobListResponse, status_code=202, summary="提交 URL 导入任务")
+async def submit_jobs(request: ImportJobRequest):
+    """
+    提交 URL 导入任务, 立即返回任务 ID, 下载在后台进行
+    
+    请求体:
+    ```json
+    {
+        "urls": [
+            "https://example.com/image1.jpg",
+            "https://example.com/video1.mp4"
+        ]
+    }
+    ```
+    
+    超时、连接错误和源站 5xx 等临时故障会按指数退避自动重试。
+    """
+    try:
+        rows = await import_job_service.submit([str(url) for url in request.urls])
+    except Exception as e:
+        raise HTTPException(status_code=500, detail=f"提交失败: {str(e)}")
+    
+    return ImportJobListResponse(
+        success=True,
+        message=f"已提交 {len(rows)} 个导入任务",
+        data=[_to_job(row) for row in rows]
+    )
+
+
+@router.get("/{job_id}", response_model=ImportJobResponse, summary="查询导入任务")
+async def get_job(
+    job_id: str,
+    wait: int = Query(0, ge=0, le=IMPORT_JOB_MAX_WAIT, description="长轮询: 任务未结束时最多等待的秒数")
+):
+    """
+    查询导入任务状态
+    
+    带上 wait 参数时, 任务结束 (succeeded / failed) 后立即返回, 否则最多等待 wait 秒。
+    """
+    row = await import_job_service.wait(job_id, wait)
+    if row is None:
+        raise HTTPException(status_code=404, detail="任务不存在")
+    
+    return ImportJobResponse(success=True, data=_to_job(row))
@@ -0,0 +1,83 @@
+from datetime import datetime
+from typing import Optional
+from fastapi import APIRouter, HTTPException, Query
+from config import METADATA_BULK_STAT_LIMIT
+from models.schemas import FileRecord, FileListResponse, BulkStatRequest, BulkStatResponse
+from services.file_service import file_service
+from services.metadata_service import metadata_service
+
+router = APIRouter(prefix="/api/files", tags=["文件索引"])
+
+
+def _to_record(row: dict) -> FileRecord:
+    return FileRecord(
+        url=file_service.generate_direct_link(row["filename"]),
+        **{
+            **row,
+            "created_at": datetime.fromtimestamp(row["created_at"]),
+            "accessed_at": datetime.fromtimestamp(row["accessed_at"]) if row["accessed_at"] else None,
+            "expires_at": datetime.fromtimestamp(row["expires_at"]) if row["expires_at"] else None
+        }
+    )
+
+
+def _ensure_enabled() -> None:
+    if not metadata_service.enabled:
+        raise HTTPException(status_code=404, detail="元数据索引未启用")
+
+
+@router.get("", response_model=FileListResponse, summary="分页列出文件")
+async def list_files(
+    format: Optional[str] = Query(None, description="按文件格式过滤"),
+    created_after: Optional[datetime] = Query(None, description="上传时间不早于"),
+    created_before: Optional[datetime] = Query(None, description="上传时间早于"),
+    cursor: Optional[str] = Query(None, description="上一页返回的 next_cursor"),
+    limit: int = Query(100, ge=1, le=1000, description="每页数量")
+):
+    """
+    按上传时间倒序分页列出已上传的文件
+    
+    使用游标翻页, 深度翻页的开销与第一页相同。
+    """
+    _ensure_enabled()
+    try:
+        rows, next_cursor = await metadata_service.list_files(
+            file_format=format.lower() if format else None,
+            created_after=created_after,
+            created_before=created_before,
+            cursor=cursor,
+            limit=limit
+        )
+    except ValueError as e:
+        raise HTTPException(status_code=400, detail=str(e))
+    
+    return FileListResponse(
+        success=True,
+        data=[_to_record(row) for row in rows],
+        next_cursor=next_cursor
+    )
+
+
+@router.post("/stat", response_model=BulkStatResponse, summary="批量查询文件")
+async def bulk_stat(request: BulkStatRequest):
+    """
+    批量查询文件是否存在及其元数据
+    
+    单次最多查询 METADATA_BULK_STAT_LIMIT 个文件, 不存在的文件返回 null。
+    
+    请求体:
+    ```json
+    {
+        "filenames": ["uuid1.jpg", "uuid2.mp4"]
+    }
+    ```
+    """
+    _ensure_enabled()
+    if len(request.filenames) > METADATA_BULK_STAT_LIMIT:
+        raise HTTPException(status_code=400, detail=f"单次最多查询 {METADATA_BULK_STAT_LIMIT} 个文件")
+    
+    rows = await metadata_service.get_files(request.filenames)
+    return BulkStatResponse(
+        success=True,
+        data={name: _to_record(rows[name]) if name in rows else None for name in request.filenames}
+    )
@@ -1,6 +1,8 @@
-from typing import List, Optional
-from fastapi import APIRouter, UploadFile, File, Header, HTTPException, Request
-from fastapi.responses import JSONResponse
+from contextlib import AsyncExitStack
+from typing import AsyncIterator, List, Optional
+from fastapi import APIRouter, Header, HTTPException, Query, Request
+from fastapi.responses import JSONResponse, StreamingResponse
+from starlette.background import BackgroundTask
 from models.schemas import (
     UploadResponse,
     BatchUploadResponse,
@@ -8,26 +10,106 @@ from models.schemas import (
     BatchUrlUploadRequest,
     FileInfo
 )
+from services.admission_service import admission_service, AdmissionRejected
 from services.file_service import file_service
+from utils.archive_stream import ArchiveStreamReader, ArchiveError
+from utils.multipart_stream import MultipartStreamReader
 
 router = APIRouter(prefix="/api/upload", tags=["上传"])
 
+NDJSON_MEDIA_TYPE = "application/x-ndjson"
 
-@router.post("/file", response_model=UploadResponse, summary="单文件上传")
-async def upload_file(file: UploadFile = File(..., description="要上传的文件")):
+# 上传接口共用的保留时间参数
+_TTL_QUERY = Query(None, gt=0, description="保留时间 (秒, 可选), 过期后自动删除; 默认按格式配置")
+
+
+def _multipart_openapi(field: str, multiple: bool) -> dict:
+    """生成 multipart 请求体的 OpenAPI 描述 (路由直接解析请求流, FastAPI 无法自动推断)"""
+    file_schema = {"type": "string", "format": "binary"}
+    return {
+        "requestBody": {
+            "required": True,
+            "content": {
+                "multipart/form-data": {
+                    "schema": {
+                        "type": "object",
+                        "required": [field],
+                        "properties": {
+                            field: {"type": "array", "items": file_schema} if multiple else file_schema
+                        }
+                    }
+                }
+            }
+        }
+    }
+
+
+def _multipart_reader(request: Request, chunks: AsyncIterator[bytes]) -> MultipartStreamReader:
+    """
+    基于请求体数据流创建 multipart 解析器
+    
+    Raises:
+        ValueError: 请求不是 multipart/form-data
+    """
+    content_type = request.headers.get("content-type", "")
+    if not content_type.startswith("multipart/form-data"):
+        raise ValueError("请求必须为 multipart/form-data")
+    return MultipartStreamReader(content_type, chunks)
+
+
+def _content_length(request: Request) -> Optional[int]:
+    """
+    读取请求声明的 Content-Length
+    
+    Raises:
+        HTTPException: Content-Length 无效
+    """
+    content_length = request.headers.get("content-length")
+    if content_length is not None and not content_length.isdigit():
+        raise HTTPException(status_code=400, detail="无效的 Content-Length")
+    return int(content_length) if content_length is not None else None
+
+
+def _service_unavailable(e: AdmissionRejected) -> HTTPException:
+    """准入控制拒绝时返回 503, 提示客户端稍后重试"""
+    return HTTPException(status_code=503, detail=str(e), headers={"Retry-After": str(e.retry_after)})
+
+
+@router.post(
+    "/file",
+    response_model=UploadResponse,
+    summary="单文件上传",
+    openapi_extra=_multipart_openapi("file", multiple=False)
+)
+async def upload_file(request: Request, ttl: Optional[int] = _TTL_QUERY):
     """
-    上传单个文件 (multipart/form-data)
+    上传单个文件 (multipart/form-data, 字段名 file)
+    
+    文件内容边接收边写入磁盘, 不会整体缓存在内存中。
     
     支持的图片格式: jpg, jpeg, png, gif, webp, bmp, svg, ico
     支持的视频格式: mp4, avi, mov, mkv, flv, wmv, webm, m4v, mpg, mpeg
     """
     try:
-        file_info = await file_service.save_upload_file(file)
+        file_info = None
+        async with admission_service.admit("file", _content_length(request)) as ticket:
+            async for part in _multipart_reader(request, ticket.meter(request.stream())).parts():
+                if part.field_name == "file" and part.filename is not None:
+                    file_info = await file_service.save_upload_stream(part.filename, part.iter_chunks(), ttl)
+                    break
+        
+        if file_info is None:
+            raise HTTPException(status_code=400, detail="未提供文件")
+        
         return UploadResponse(
             success=True,
             message="文件上传成功",
             data=file_info
         )
+    except HTTPException:
+        raise
+    except AdmissionRejected as e:
+        raise _service_unavailable(e)
     except ValueError as e:
         raise HTTPException(status_code=400, detail=str(e))
     except Exception as e:
@@ -38,7 +120,8 @@ async def upload_file(file: UploadFile = File(..., description="要上传的文
 async def upload_binary(
     request: Request,
     content_type: Optional[str] = Header(None),
-    filename: Optional[str] = Header(None, description="原始文件名")
+    filename: Optional[str] = Header(None, description="原始文件名"),
+    ttl: Optional[int] = _TTL_QUERY
 ):
     """
     上传二进制数据 (application/octet-stream)
@@ -47,25 +130,31 @@ async def upload_binary(
     - Content-Type: application/octet-stream
     - filename: 原始文件名(可选,用于确定文件格式)
     
-    请求体: 二进制文件内容
+    请求体: 二进制文件内容 (流式写入磁盘, 超过大小限制立即中止)
     """
     try:
-        content = await request.body()
-        
-        if not content:
+        content_length = _content_length(request)
+        if content_length == 0:
             raise HTTPException(status_code=400, detail="请求体为空")
         
-        file_info = await file_service.save_binary_data(
-            content=content,
-            original_filename=filename,
-            content_type=content_type
-        )
+        async with admission_service.admit("binary", content_length) as ticket:
+            file_info = await file_service.save_binary_stream(
+                chunks=ticket.meter(request.stream()),
+                original_filename=filename,
+                content_type=content_type,
+                content_length=content_length,
+                ttl=ttl
+            )
         
         return UploadResponse(
             success=True,
             message="二进制数据上传成功",
             data=file_info
         )
+    except HTTPException:
+        raise
+    except AdmissionRejected as e:
+        raise _service_unavailable(e)
     except ValueError as e:
         raise HTTPException(status_code=400, detail=str(e))
     except Exception as e:
@@ -81,14 +170,16 @@ async def upload_from_url(request: UrlUploadRequest):
     ```json
     {
         "url": "https://example.com/image.jpg",
-        "filename": "custom_name.jpg"  // 可选
+        "filename": "custom_name.jpg",  // 可选
+        "ttl": 86400  // 可选, 保留时间 (秒)
     }
     ```
     """
     try:
         file_info = await file_service.save_from_url(
             url=str(request.url),
-            custom_filename=request.filename
+            custom_filename=request.filename,
+            ttl=request.ttl
         )
         
         return UploadResponse(
@@ -96,37 +187,57 @@ async def upload_from_url(request: UrlUploadRequest):
             message="URL 文件上传成功",
             data=file_info
         )
+    except AdmissionRejected as e:
+        raise _service_unavailable(e)
     except ValueError as e:
         raise HTTPException(status_code=400, detail=str(e))
     except Exception as e:
         raise HTTPException(status_code=500, detail=f"上传失败: {str(e)}")
 
 
-@router.post("/batch/files", response_model=BatchUploadResponse, summary="批量文件上传")
-async def batch_upload_files(files: List[UploadFile] = File(..., description="要上传的文件列表")):
+@router.post(
+    "/batch/files",
+    response_model=BatchUploadResponse,
+    summary="批量文件上传",
+    openapi_extra=_multipart_openapi("files", multiple=True)
+)
+async def batch_upload_files(request: Request, ttl: Optional[int] = _TTL_QUERY):
     """
-    批量上传文件 (multipart/form-data)
+    批量上传文件 (multipart/form-data, 字段名 files)
     
-    支持同时上传多个文件
+    支持同时上传多个文件, 各文件依次流式写入磁盘
     """
-    if not files:
-        raise HTTPException(status_code=400, detail="未提供文件")
-    
     results = []
     errors = []
+    total = 0
+    
+    try:
+        async with admission_service.admit("batch", _content_length(request)) as ticket:
+            async for part in _multipart_reader(request, ticket.meter(request.stream())).parts():
+                if part.field_name != "files" or part.filename is None:
+                    continue
+                
+                idx = total
+                total += 1
+                try:
+                    file_info = await file_service.save_upload_stream(part.filename, part.iter_chunks(), ttl)
+                    results.append(file_info)
+                except AdmissionRejected:
+                    raise
+                except Exception as e:
+                    errors.append({
+                        "index": idx,
+                        "filename": part.filename,
+                        "error": str(e)
+                    })
+    except AdmissionRejected as e:
+        raise _service_unavailable(e)
+    except ValueError as e:
+        raise HTTPException(status_code=400, detail=str(e))
+    
+    if not total:
+        raise HTTPException(status_code=400, detail="未提供文件")
     
-    for idx, file in enumerate(files):
-        try:
-            file_info = await file_service.save_upload_file(file)
-            results.append(file_info)
-        except Exception as e:
-            errors.append({
-                "index": idx,
-                "filename": file.filename,
-                "error": str(e)
-            })
-    
-    total = len(files)
     successful = len(results)
     failed = len(errors)
     
@@ -141,10 +252,90 @@ async def batch_upload_files(files: List[UploadFile] = File(..., description="
     )
 
 
-@router.post("/batch/urls", response_model=BatchUploadResponse, summary="批量 URL 上传")
-async def batch_upload_from_urls(request: BatchUrlUploadRequest):
+@router.post("/batch/archive", response_model=BatchUploadResponse, summary="压缩包批量上传")
+async def batch_upload_archive(request: Request, ttl: Optional[int] = _TTL_QUERY):
     """
-    从多个 URL 下载文件并保存
+    上传一个压缩包 (zip / tar / tar.gz), 逐个保存其中的文件
+    
+    请求体为压缩包的二进制内容, 格式按开头的字节识别。压缩包边接收边解压,
+    每个文件直接流式写入存储, 不会先解包到临时目录。
+    
+    - 每个文件按扩展名和大小单独校验, 失败的文件记录在 errors 中
+    - 目录、链接和 __MACOSX 等附带文件会被跳过
+    - 条目数、解压后的总大小和解压比例超出限制时停止读取后续文件
+    """
+    results = []
+    errors = []
+    total = 0
+    current = None
+    
+    try:
+        async with admission_service.admit("batch", _content_length(request)) as ticket:
+            try:
+                async for member in ArchiveStreamReader(request.stream()).members():
+                    idx = total
+                    total += 1
+                    if member.error is not None:
+                        errors.append({"index": idx, "filename": member.name, "error": member.error})
+                        continue
+                    
+                    current = (idx, member.name)
+                    try:
+                        # 按解压后的大小计入磁盘预留
+                        file_info = await file_service.save_upload_stream(
+                            member.name,
+                            ticket.meter(member.iter_chunks()),
+                            ttl
+                        )
+                        results.append(file_info)
+                    except (AdmissionRejected, ArchiveError):
+                        raise
+                    except Exception as e:
+                        errors.append({"index": idx, "filename": member.name, "error": str(e)})
+                    current = None
+            except ArchiveError as e:
+                # 压缩包本身无法继续读取: 已保存的文件照常返回
+                if not total:
+                    raise
+                if current is None:
+                    errors.append({"index": total, "filename": None, "error": str(e)})
+                    total += 1
+                else:
+                    errors.append({"index": current[0], "filename": current[1], "error": str(e)})
+    except AdmissionRejected as e:
+        raise _service_unavailable(e)
+    except ValueError as e:
+        raise HTTPException(status_code=400, detail=str(e))
+    
+    if not total:
+        raise HTTPException(status_code=400, detail="压缩包中没有文件")
+    
+    successful = len(results)
+    failed = total - successful
+    
+    return BatchUploadResponse(
+        success=not errors,
+        message=f"压缩包上传完成: 成功 {successful}/{total}",
+        total=total,
+        successful=successful,
+        failed=failed,
+        data=results,
+        errors=errors
+    )
+
+
+@router.post(
+    "/batch/urls",
+    response_model=BatchUploadResponse,
+    summary="批量 URL 上传",
+    responses={200: {"content": {NDJSON_MEDIA_TYPE: {}}}}
+)
+async def batch_upload_from_urls(
+    request: BatchUrlUploadRequest,
+    accept: Optional[str] = Header(None)
+):
+    """
+    从多个 URL 并发下载文件并保存
     
     请求体:
     ```json
@@ -155,23 +346,49 @@ async def batch_upload_from_urls(request: BatchUrlUploadRequest):
         ]
     }
     ```
+    
+    请求头 `Accept: application/x-ndjson` 时, 每完成一项立即返回一行 JSON
+    (BatchItemResult), 否则等待全部完成后返回 BatchUploadResponse。
     """
     if not request.urls:
         raise HTTPException(status_code=400, detail="未提供 URL")
     
+    # 准入在返回响应前完成, 名额在全部 URL 处理完 (包括流式输出结束) 后释放
+    admission = AsyncExitStack()
+    try:
+        # 批量请求只占用 batch 名额, 内存和磁盘由每个 URL 下载各自准入时预留
+        await admission.enter_async_context(admission_service.admit("batch", buffered=False))
+    except AdmissionRejected as e:
+        raise _service_unavailable(e)
+    
+    items = file_service.iter_save_from_urls([str(url) for url in request.urls])
+    
+    if accept and NDJSON_MEDIA_TYPE in accept:
+        async def ndjson_lines():
+            async with admission:
+                async for item in items:
+                    yield item.model_dump_json() + "\n"
+        
+        # 客户端在输出开始前断开时生成器不会执行, 由后台任务兜底释放名额
+        return StreamingResponse(
+            ndjson_lines(),
+            media_type=NDJSON_MEDIA_TYPE,
+            background=BackgroundTask(admission.aclose)
+        )
+    
     results = []
     errors = []
     
-    for idx, url in enumerate(request.urls):
-        try:
-            file_info = await file_service.save_from_url(str(url))
-            results.append(file_info)
-        except Exception as e:
-            errors.append({
-                "index": idx,
-                "url": str(url),
-                "error": str(e)
-            })
+    async with admission:
+        async for item in items:
+            if item.success:
+                results.append(item)
+            else:
+                errors.append(item)
+    
+    # 按请求顺序返回
+    results.sort(key=lambda item: item.index)
+    errors.sort(key=lambda item: item.index)
     
     total = len(request.urls)
     successful = len(results)
@@ -183,6 +400,6 @@ async def batch_upload_from_urls(request: BatchUrlUploadRequest):
         total=total,
         successful=successful,
         failed=failed,
-        data=results,
-        errors=errors
+        data=[item.data for item in results],
+        errors=[{"index": item.index, "url": item.url, "error": item.error} for item in errors]
     )
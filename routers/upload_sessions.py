@@ -0,0 +1,128 @@
+from datetime import datetime
+from fastapi import APIRouter, HTTPException, Query, Request
+from models.schemas import (
+    UploadResponse,
+    UploadSessionRequest,
+    UploadSessionInfo,
+    UploadSessionResponse
+)
+from services.admission_service import admission_service, AdmissionRejected
+from services.file_service import file_service
+from services.upload_session_service import upload_session_service, UploadSession, UploadSessionNotFound
+
+router = APIRouter(prefix="/api/upload/sessions", tags=["分块上传"])
+
+
+def _to_info(session: UploadSession) -> UploadSessionInfo:
+    return UploadSessionInfo(
+        session_id=session.session_id,
+        filename=session.original_filename,
+        size=session.size,
+        received=session.received,
+        ranges=session.ranges,
+        complete=session.complete,
+        expires_at=datetime.fromtimestamp(session.updated_at + upload_session_service.ttl)
+    )
+
+
+@router.post("", response_model=UploadSessionResponse, summary="创建分块上传会话")
+async def create_session(request: UploadSessionRequest):
+    """
+    创建可续传的分块上传会话
+    
+    请求体:
+    ```json
+    {
+        "filename": "video.mp4",
+        "size": 1073741824
+    }
+    ```
+    
+    之后用 PUT 按偏移上传数据块 (可并行), 全部到齐后调用 complete。
+    """
+    try:
+        session = await upload_session_service.create(request.filename, request.size)
+    except ValueError as e:
+        raise HTTPException(status_code=400, detail=str(e))
+    except Exception as e:
+        raise HTTPException(status_code=500, detail=f"上传失败: {str(e)}")
+    
+    return UploadSessionResponse(success=True, message="上传会话已创建", data=_to_info(session))
+
+
+@router.get("/{session_id}", response_model=UploadSessionResponse, summary="查询分块上传进度")
+async def get_session(session_id: str):
+    """
+    查询已接收的区间, 断线重连后据此只补传缺失的部分
+    """
+    try:
+        session = await upload_session_service.get(session_id)
+    except UploadSessionNotFound as e:
+        raise HTTPException(status_code=404, detail=str(e))
+    
+    return UploadSessionResponse(success=True, message="查询成功", data=_to_info(session))
+
+
+@router.put("/{session_id}", response_model=UploadSessionResponse, summary="上传数据块")
+async def upload_chunk(
+    session_id: str,
+    request: Request,
+    offset: int = Query(..., ge=0, description="数据块在文件中的起始偏移")
+):
+    """
+    在指定偏移写入一个数据块
+    
+    请求体: 二进制数据 (流式写入, 中途断开时已写入的部分仍会保留)
+    
+    同一会话的不同数据块可以并行上传。服务繁忙时返回 503 和 Retry-After。
+    """
+    content_length = request.headers.get("content-length")
+    size = int(content_length) if content_length and content_length.isdigit() else None
+    try:
+        async with admission_service.admit("chunk", size) as ticket:
+            session = await upload_session_service.write_chunk(session_id, offset, ticket.meter(request.stream()))
+    except AdmissionRejected as e:
+        raise HTTPException(status_code=503, detail=str(e), headers={"Retry-After": str(e.retry_after)})
+    except UploadSessionNotFound as e:
+        raise HTTPException(status_code=404, detail=str(e))
+    except ValueError as e:
+        raise HTTPException(status_code=400, detail=str(e))
+    except Exception as e:
+        raise HTTPException(status_code=500, detail=f"上传失败: {str(e)}")
+    
+    return UploadSessionResponse(success=True, message="数据块已接收", data=_to_info(session))
+
+
+@router.post("/{session_id}/complete", response_model=UploadResponse, summary="完成分块上传")
+async def complete_session(session_id: str):
+    """
+    校验数据已全部接收并生成直链 (数据文件原地提交, 不再复制)
+    """
+    try:
+        file_info = await file_service.complete_upload_session(session_id)
+        
+        return UploadResponse(
+            success=True,
+            message="文件上传成功",
+            data=file_info
+        )
+    except UploadSessionNotFound as e:
+        raise HTTPException(status_code=404, detail=str(e))
+    except ValueError as e:
+        raise HTTPException(status_code=400, detail=str(e))
+    except Exception as e:
+        raise HTTPException(status_code=500, detail=f"上传失败: {str(e)}")
+
+
+@router.delete("/{session_id}", summary="取消分块上传")
+async def cancel_session(session_id: str):
+    """
+    取消上传并删除已接收的数据
+    """
+    try:
+        session = await upload_session_service.get(session_id)
+    except UploadSessionNotFound as e:
+        raise HTTPException(status_code=404, detail=str(e))
+    
+    await upload_session_service.discard(session, remove_data=True)
+    return {"success": True, "message": "上传已取消"}
@@ -0,0 +1,212 @@
+import asyncio
+from collections import deque
+from contextlib import asynccontextmanager
+from typing import AsyncIterator, Deque, Dict, Optional
+from config import (
+    ADMISSION_CONCURRENCY,
+    ADMISSION_MEMORY_BUDGET,
+    ADMISSION_DISK_BUDGET,
+    ADMISSION_MAX_WAIT,
+    ADMISSION_RETRY_AFTER,
+    UPLOAD_CHUNK_SIZE
+)
+from utils.metrics import ADMISSION_QUEUED, ADMISSION_REJECTED, ADMISSION_RESERVED_BYTES
+
+
+class AdmissionRejected(Exception):
+    """服务繁忙, 请求被拒绝 (路由返回 503 和 Retry-After)"""
+    
+    def __init__(self, message: str, retry_after: int):
+        super().__init__(message)
+        self.retry_after = retry_after
+
+
+class Ticket:
+    """已准入的请求: 记录预留的磁盘字节数, 按实际接收的字节数追加预留"""
+    
+    def __init__(self, service: "AdmissionService", kind: str, reserved: int):
+        self.service = service
+        self.kind = kind
+        self.reserved = reserved
+        self.used = 0
+    
+    def reserve(self, total: int) -> None:
+        """
+        确保预留的字节数不少于 total (如收到响应头中的 Content-Length)
+        
+        Args:
+            total: 需要预留的总字节数
+        
+        Raises:
+            AdmissionRejected: 超出磁盘预算
+        """
+        if total > self.reserved:
+            self.service.grow(self, total - self.reserved)
+    
+    def consume(self, size: int) -> None:
+        """
+        记录实际接收的字节数
+        
+        Args:
+            size: 本次接收的字节数
+        
+        Raises:
+            AdmissionRejected: 超出磁盘预算
+        """
+        self.used += size
+        if self.used > self.reserved:
+            self.service.grow(self, self.used - self.reserved)
+    
+    async def meter(self, chunks: AsyncIterator[bytes]) -> AsyncIterator[bytes]:
+        """
+        包装数据流, 边接收边计入预留
+        
+        Args:
+            chunks: 数据块流
+        
+        Yields:
+            bytes: 数据块
+        """
+        async for chunk in chunks:
+            self.consume(len(chunk))
+            yield chunk
+
+
+class AdmissionService:
+    """
+    上传准入控制
+    
+    每类请求 (file / binary / url / batch / chunk) 有独立的并发上限, 所有请求共享内存预算
+    (每个数据流一个写入缓冲区) 和磁盘预算 (正在接收的字节数, 按 Content-Length 预留,
+    没有声明长度时按实际接收量追加)。只有本类别已满或预算不足时才排队, 同类请求按到达顺序准入,
+    不同类别互不阻塞; 等待超过 ADMISSION_MAX_WAIT 或单个请求无法满足时拒绝, 由路由返回 503 和 Retry-After。
+    
+    计数和预算按进程计算, 多 worker 部署时总量为 worker 数 × 配置值。
+    """
+    
+    def __init__(
+        self,
+        concurrency: Dict[str, int] = ADMISSION_CONCURRENCY,
+        memory_budget: int = ADMISSION_MEMORY_BUDGET,
+        disk_budget: int = ADMISSION_DISK_BUDGET,
+        max_wait: float = ADMISSION_MAX_WAIT,
+        retry_after: int = ADMISSION_RETRY_AFTER,
+        stream_memory: int = UPLOAD_CHUNK_SIZE
+    ):
+        self.concurrency = concurrency
+        self.memory_budget = memory_budget
+        self.disk_budget = disk_budget
+        self.max_wait = max_wait
+        self.retry_after = retry_after
+        self.stream_memory = stream_memory
+        self._active: Dict[str, int] = {}
+        self._memory = 0
+        self._disk = 0
+        # 每个类别一个等待队列, 队首的等待者可以准入时才唤醒后面的
+        self._waiters: Dict[str, Deque[asyncio.Event]] = {}
+    
+    def _fits(self, kind: str, memory: int, disk: int) -> bool:
+        limit = self.concurrency.get(kind, 0)
+        if limit and self._active.get(kind, 0) >= limit:
+            return False
+        if self.memory_budget and memory and self._memory + memory > self.memory_budget:
+            return False
+        return not self.disk_budget or self._disk + disk <= self.disk_budget
+    
+    def _reject(self, kind: str, message: str) -> AdmissionRejected:
+        ADMISSION_REJECTED.inc(1, kind)
+        return AdmissionRejected(message, self.retry_after)
+    
+    @asynccontextmanager
+    async def admit(self, kind: str, size: Optional[int] = None, buffered: bool = True) -> AsyncIterator[Ticket]:
+        """
+        申请处理一个上传请求, 退出时释放预留
+        
+        Args:
+            kind: 请求类别 (file / binary / url / batch / chunk)
+            size: 声明的数据大小(可选)
+            buffered: 是否占用一个写入缓冲区的内存预算
+                (只调度子请求的批量 URL 请求不占用, 由每个下载各自准入)
+        
+        Yields:
+            Ticket: 准入凭据
+        
+        Raises:
+            AdmissionRejected: 排队超时或请求超出预算
+        """
+        disk = size or 0
+        if self.disk_budget and disk > self.disk_budget:
+            raise self._reject(kind, f"服务繁忙: 请求大小 {disk} 字节超出可用空间")
+        
+        memory = self.stream_memory if buffered else 0
+        if self._waiters.get(kind) or not self._fits(kind, memory, disk):
+            await self._wait(kind, memory, disk)
+        
+        self._active[kind] = self._active.get(kind, 0) + 1
+        self._memory += memory
+        self._disk += disk
+        self._update_gauges()
+        ticket = Ticket(self, kind, disk)
+        try:
+            yield ticket
+        finally:
+            self._active[kind] -= 1
+            self._memory -= memory
+            self._disk -= ticket.reserved
+            self._update_gauges()
+            self._wake()
+    
+    async def _wait(self, kind: str, memory: int, disk: int) -> None:
+        # 同类请求按到达顺序排队: 只有队首在满足条件时准入, 每次有请求结束或离开队列时重新检查
+        loop = asyncio.get_running_loop()
+        deadline = loop.time() + self.max_wait
+        queue = self._waiters.setdefault(kind, deque())
+        waiter = asyncio.Event()
+        queue.append(waiter)
+        ADMISSION_QUEUED.inc()
+        try:
+            while queue[0] is not waiter or not self._fits(kind, memory, disk):
+                remaining = deadline - loop.time()
+                if remaining <= 0:
+                    raise self._reject(kind, "服务繁忙, 请稍后重试")
+                waiter.clear()
+                try:
+                    await asyncio.wait_for(waiter.wait(), remaining)
+                except asyncio.TimeoutError:
+                    raise self._reject(kind, "服务繁忙, 请稍后重试")
+        finally:
+            queue.remove(waiter)
+            if not queue:
+                del self._waiters[kind]
+            ADMISSION_QUEUED.dec()
+            # 无论准入还是超时离开, 同类的下一个等待者都可能可以进入了
+            self._wake()
+    
+    def _wake(self) -> None:
+        for queue in self._waiters.values():
+            queue[0].set()
+    
+    def grow(self, ticket: Ticket, size: int) -> None:
+        """
+        追加磁盘预留 (由 Ticket 调用)
+        
+        Args:
+            ticket: 准入凭据
+            size: 追加的字节数
+        
+        Raises:
+            AdmissionRejected: 超出磁盘预算
+        """
+        if self.disk_budget and self._disk + size > self.disk_budget:
+            raise self._reject(ticket.kind, "服务繁忙: 正在接收的数据超出可用空间")
+        ticket.reserved += size
+        self._disk += size
+        self._update_gauges()
+    
+    def _update_gauges(self) -> None:
+        ADMISSION_RESERVED_BYTES.set(self._memory, "memory")
+        ADMISSION_RESERVED_BYTES.set(self._disk, "disk")
+
+
+# 创建全局实例
+admission_service = AdmissionService()
@@ -1,67 +1,195 @@
+import importlib.util
+import time
+from contextlib import asynccontextmanager
 from pathlib import Path
-from typing import Optional
+from typing import AsyncIterator, Dict, Optional
 import httpx
-from config import DOWNLOAD_TIMEOUT, MAX_FILE_SIZE
+from config import (
+    DOWNLOAD_TIMEOUT,
+    MAX_FILE_SIZE,
+    DOWNLOAD_MAX_CONNECTIONS,
+    DOWNLOAD_MAX_KEEPALIVE_CONNECTIONS,
+    DOWNLOAD_MAX_CONNECTIONS_PER_HOST,
+    DOWNLOAD_HTTP2
+)
+from services.admission_service import admission_service, Ticket
+from utils.concurrency import KeyedSemaphore
+from utils.metrics import observe_stage, DOWNLOAD_ERRORS
 from utils.validators import get_extension_from_mime
 
+# HTTP/2 需要可选依赖 h2 (pip install httpx[http2])
+H2_AVAILABLE = importlib.util.find_spec("h2") is not None
+
+# 视为临时故障的 HTTP 状态码 (可稍后重试)
+RETRYABLE_STATUS_CODES = {408, 425, 429, 500, 502, 503, 504}
+
+
+class TransientDownloadError(ValueError):
+    """临时性下载失败 (超时、连接错误、源站 5xx 等), 稍后重试可能成功"""
+
+
+class DownloadStream:
+    """正在下载的响应流"""
+    
+    def __init__(self, url: str, response: httpx.Response, max_size: int, ticket: Optional[Ticket] = None):
+        self.url = url
+        self.response = response
+        self.max_size = max_size
+        self.ticket = ticket
+        # 条件请求命中 (304): 源站内容未变化, 没有响应体
+        self.not_modified = response.status_code == 304
+        # 源站缓存校验字段, 用于之后的条件请求
+        self.etag = response.headers.get("etag")
+        self.last_modified = response.headers.get("last-modified")
+        
+        content_length = response.headers.get("content-length")
+        self.content_length = int(content_length) if content_length and content_length.isdigit() else None
+        
+        # 尝试从 Content-Type 获取文件扩展名
+        content_type = response.headers.get("content-type", "").split(";")[0].strip()
+        extension = get_extension_from_mime(content_type)
+        
+        # 如果无法从 MIME 获取,尝试从 URL 获取
+        if not extension:
+            url_path = Path(url.split("?")[0])  # 移除查询参数
+            if url_path.suffix:
+                extension = url_path.suffix.lstrip(".")
+        
+        self.extension = extension
+    
+    async def iter_chunks(self) -> AsyncIterator[bytes]:
+        """
+        按块读取响应体, 超过大小限制时立即中止
+        
+        Yields:
+            bytes: 数据块
+        
+        Raises:
+            ValueError: 文件过大
+            AdmissionRejected: 超出准入控制的磁盘预算
+        """
+        received = 0
+        async for chunk in self.response.aiter_bytes():
+            received += len(chunk)
+            if received > self.max_size:
+                DOWNLOAD_ERRORS.inc(1, "too_large")
+                raise ValueError(f"文件过大: 超过 {self.max_size} 字节")
+            if self.ticket is not None:
+                self.ticket.consume(len(chunk))
+            yield chunk
+
 
 class DownloadService:
-    """URL 下载服务"""
+    """URL 下载服务 (长连接复用的连接池, 由应用生命周期管理)"""
     
     def __init__(self):
         self.timeout = DOWNLOAD_TIMEOUT
         self.max_size = MAX_FILE_SIZE
+        self._client: Optional[httpx.AsyncClient] = None
+        self._host_limiter = KeyedSemaphore(DOWNLOAD_MAX_CONNECTIONS_PER_HOST)
+    
+    def _create_client(self) -> httpx.AsyncClient:
+        limits = httpx.Limits(
+            max_connections=DOWNLOAD_MAX_CONNECTIONS,
+            max_keepalive_connections=DOWNLOAD_MAX_KEEPALIVE_CONNECTIONS
+        )
+        return httpx.AsyncClient(
+            timeout=self.timeout,
+            limits=limits,
+            http2=DOWNLOAD_HTTP2 and H2_AVAILABLE,
+            follow_redirects=True
+        )
+    
+    async def start(self) -> None:
+        """创建连接池 (应用启动时调用)"""
+        if self._client is None:
+            self._client = self._create_client()
+    
+    async def close(self) -> None:
+        """关闭连接池 (应用关闭时调用)"""
+        if self._client is not None:
+            await self._client.aclose()
+            self._client = None
     
-    async def download_from_url(self, url: str) -> tuple[bytes, Optional[str]]:
+    @property
+    def client(self) -> httpx.AsyncClient:
+        """共享的 HTTP 客户端 (未启动时按需创建)"""
+        if self._client is None:
+            self._client = self._create_client()
+        return self._client
+    
+    @asynccontextmanager
+    async def stream_from_url(
+        self,
+        url: str,
+        etag: Optional[str] = None,
+        last_modified: Optional[str] = None
+    ) -> AsyncIterator[DownloadStream]:
         """
-        从 URL 下载文件
+        从 URL 流式下载文件
+        
+        只发送一次 GET 请求, 根据响应的 Content-Length 提前拒绝过大的文件,
+        响应体由调用方按块读取并直接写入磁盘。
+        提供 etag / last_modified 时发送条件请求, 源站返回 304 时 not_modified 为 True。
         
         Args:
             url: 文件 URL
-            
-        Returns:
-            tuple[bytes, Optional[str]]: (文件内容, 文件扩展名)
-            
+            etag: 上次响应的 ETag(可选)
+            last_modified: 上次响应的 Last-Modified(可选)
+        
+        Yields:
+            DownloadStream: 响应流
+        
         Raises:
+            AdmissionRejected: 下载并发或预算已满且排队超时
+            TransientDownloadError: 超时、连接错误或源站临时故障
             ValueError: 下载失败或文件过大
         """
         try:
-            async with httpx.AsyncClient(timeout=self.timeout, follow_redirects=True) as client:
-                # 先发送 HEAD 请求检查文件大小
-                head_response = await client.head(url)
-                content_length = head_response.headers.get("content-length")
-                
-                if content_length and int(content_length) > self.max_size:
-                    raise ValueError(f"文件过大: {int(content_length)} 字节 (最大: {self.max_size} 字节)")
-                
-                # 下载文件
-                response = await client.get(url)
-                response.raise_for_status()
-                
-                content = response.content
-                
-                # 检查实际下载大小
-                if len(content) > self.max_size:
-                    raise ValueError(f"文件过大: {len(content)} 字节 (最大: {self.max_size} 字节)")
-                
-                # 尝试从 Content-Type 获取文件扩展名
-                content_type = response.headers.get("content-type", "").split(";")[0].strip()
-                extension = get_extension_from_mime(content_type)
-                
-                # 如果无法从 MIME 获取,尝试从 URL 获取
-                if not extension:
-                    url_path = Path(url.split("?")[0])  # 移除查询参数
-                    if url_path.suffix:
-                        extension = url_path.suffix.lstrip(".")
-                
-                return content, extension
-                
-        except httpx.TimeoutException:
-            raise ValueError(f"下载超时: {url}")
-        except httpx.HTTPStatusError as e:
-            raise ValueError(f"HTTP 错误 {e.response.status_code}: {url}")
-        except Exception as e:
-            raise ValueError(f"下载失败: {str(e)}")
+            host = httpx.URL(url).host
+        except httpx.InvalidURL:
+            DOWNLOAD_ERRORS.inc(1, "invalid_url")
+            raise ValueError(f"无效的 URL: {url}")
+        
+        headers: Dict[str, str] = {}
+        if etag:
+            headers["if-none-match"] = etag
+        if last_modified:
+            headers["if-modified-since"] = last_modified
+        
+        async with admission_service.admit("url") as ticket, self._host_limiter.acquire(host):
+            started = time.perf_counter()
+            try:
+                async with self.client.stream("GET", url, headers=headers) as response:
+                    # 条件请求的 304 不是错误, 由调用方复用已保存的文件
+                    if not (response.status_code == 304 and headers):
+                        response.raise_for_status()
+                    
+                    download = DownloadStream(url, response, self.max_size, ticket)
+                    # 连接建立到收到响应头的耗时
+                    observe_stage("fetch", time.perf_counter() - started, download.extension)
+                    if download.content_length is not None and download.content_length > self.max_size:
+                        DOWNLOAD_ERRORS.inc(1, "too_large")
+                        raise ValueError(
+                            f"文件过大: {download.content_length} 字节 (最大: {self.max_size} 字节)"
+                        )
+                    if download.content_length is not None and not download.not_modified:
+                        ticket.reserve(download.content_length)
+                    
+                    yield download
+            except httpx.TimeoutException:
+                DOWNLOAD_ERRORS.inc(1, "timeout")
+                raise TransientDownloadError(f"下载超时: {url}")
+            except httpx.HTTPStatusError as e:
+                DOWNLOAD_ERRORS.inc(1, f"http_{e.response.status_code // 100}xx")
+                error = TransientDownloadError if e.response.status_code in RETRYABLE_STATUS_CODES else ValueError
+                raise error(f"HTTP 错误 {e.response.status_code}: {url}")
+            except httpx.TransportError as e:
+                DOWNLOAD_ERRORS.inc(1, "transport")
+                raise TransientDownloadError(f"下载失败: {str(e)}")
+            except httpx.HTTPError as e:
+                DOWNLOAD_ERRORS.inc(1, "other")
+                raise ValueError(f"下载失败: {str(e)}")
 
 
 # 创建全局实例
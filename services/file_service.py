@@ -1,24 +1,57 @@
+import asyncio
+import logging
+import time
 import uuid
 from pathlib import Path
-from typing import Union, Optional
-from fastapi import UploadFile
+from typing import AsyncIterator, List, Tuple, Union, Optional
+from urllib.parse import urlsplit
 import aiofiles
-from config import BASE_URL
-from models.schemas import FileInfo
+from config import (
+    BASE_URL,
+    MAX_FILE_SIZE,
+    MIME_SNIFF_SIZE,
+    BATCH_URL_CONCURRENCY,
+    BATCH_URL_PER_HOST_CONCURRENCY,
+    BATCH_URL_ITEM_TIMEOUT,
+    MP4_FASTSTART,
+    MEDIA_PROBE_ENABLED
+)
+from models.schemas import FileInfo, BatchItemResult
 from services.storage_service import storage_service
 from services.download_service import download_service
+from services.image_service import image_service
+from services.lifecycle_service import lifecycle_service
+from services.metadata_service import metadata_service
+from services.upload_session_service import upload_session_service
+from services.url_cache_service import url_cache_service, CachedUrl
+from services.volume_service import VolumeLocation
 from utils.validators import (
     validate_file_extension,
     validate_file_size,
     get_file_extension,
-    detect_mime_type,
+    detect_extension_from_buffer,
     get_extension_from_mime
 )
+from utils.concurrency import KeyedSemaphore
+from utils.faststart import faststart
+from utils.media_probe import MediaInfo, probe_file
+from utils.metrics import current_endpoint, observe_stage, STORED_BYTES, UPLOADS_IN_FLIGHT, UPLOAD_BYTES_IN_FLIGHT
+from utils.streams import read_stream_head
+
+logger = logging.getLogger(__name__)
+
+# 入库时做 faststart 改写的视频格式 (ISO-BMFF / QuickTime)
+FASTSTART_FORMATS = {"mp4", "mov", "m4v"}
 
 
 class FileService:
     """文件处理服务"""
     
+    def __init__(self):
+        # 批量 URL 上传的并发限制由本进程内的所有批量请求共享
+        self._batch_limit = asyncio.Semaphore(BATCH_URL_CONCURRENCY)
+        self._batch_host_limit = KeyedSemaphore(BATCH_URL_PER_HOST_CONCURRENCY)
+    
     @staticmethod
     def generate_filename(extension: str) -> str:
         """
@@ -45,12 +78,21 @@ class FileService:
         """
         return f"{BASE_URL}/files/{filename}"
     
-    async def save_upload_file(self, file: UploadFile) -> FileInfo:
+    async def save_upload_stream(
+        self,
+        original_filename: Optional[str],
+        chunks: AsyncIterator[bytes],
+        ttl: Optional[int] = None
+    ) -> FileInfo:
         """
-        保存上传的文件
+        流式保存上传的文件
+        
+        先校验扩展名, 再边接收边写入临时文件, 超过大小限制立即中止。
         
         Args:
-            file: 上传的文件对象
+            original_filename: 原始文件名
+            chunks: 文件内容数据块流
+            ttl: 保留时间 (秒, 可选, 默认按格式配置)
             
         Returns:
             FileInfo: 文件信息
@@ -59,43 +101,196 @@ class FileService:
             ValueError: 文件验证失败
         """
         # 验证文件扩展名
-        if not validate_file_extension(file.filename):
-            raise ValueError(f"不支持的文件格式: {file.filename}")
+        started = time.perf_counter()
+        if not original_filename or not validate_file_extension(original_filename):
+            raise ValueError(f"不支持的文件格式: {original_filename}")
+        
+        extension = get_file_extension(original_filename)
+        observe_stage("validate", time.perf_counter() - started, extension)
+        return await self._save_stream(chunks, extension, ttl=ttl)
+        
+    async def _save_stream(
+        self,
+        chunks: AsyncIterator[bytes],
+        extension: str,
+        source_url: Optional[str] = None,
+        ttl: Optional[int] = None
+    ) -> FileInfo:
+        """
+        将数据块流写入存储并记录到元数据索引
         
-        # 读取文件内容
-        content = await file.read()
-        file_size = len(content)
+        Args:
+            chunks: 文件内容数据块流
+            extension: 文件扩展名
+            source_url: 来源 URL(可选)
+            ttl: 保留时间 (秒, 可选, 默认按格式配置)
         
-        # 验证文件大小
-        if not validate_file_size(file_size):
-            raise ValueError(f"文件过大: {file_size} 字节")
+        Returns:
+            FileInfo: 文件信息
         
-        # 生成文件名并保存
-        extension = get_file_extension(file.filename)
+        Raises:
+            ValueError: 文件为空或过大
+        """
         filename = self.generate_filename(extension)
         
-        await storage_service.save_file(content, filename)
+        # 分别累计等待数据 (网络 / multipart 解析) 和写入存储的耗时, 每个文件只记录一次
+        receive_seconds = store_seconds = 0.0
+        received_bytes = 0
+        UPLOADS_IN_FLIGHT.inc()
+        try:
+            async with storage_service.open_writer(
+                filename,
+                max_size=MAX_FILE_SIZE,
+                compute_hash=metadata_service.enabled
+            ) as writer:
+                started = time.perf_counter()
+                async for chunk in chunks:
+                    received = time.perf_counter()
+                    receive_seconds += received - started
+                    received_bytes += len(chunk)
+                    UPLOAD_BYTES_IN_FLIGHT.inc(len(chunk))
+                    await writer.write(chunk)
+                    started = time.perf_counter()
+                    store_seconds += started - received
+                receive_seconds += time.perf_counter() - started
+                observe_stage("receive", receive_seconds, extension)
+                
+                # 验证文件大小
+                if not validate_file_size(writer.size):
+                    raise ValueError("文件为空" if writer.size == 0 else f"文件过大: {writer.size} 字节")
+                
+                # moov 在文件尾部的视频改写为 faststart, 直链无需先取尾部即可播放
+                if MP4_FASTSTART and extension in FASTSTART_FORMATS:
+                    started = time.perf_counter()
+                    await writer.rewrite(faststart)
+                    observe_stage("faststart", time.perf_counter() - started, extension)
+                
+                started = time.perf_counter()
+                await writer.commit()
+                observe_stage("store", store_seconds + time.perf_counter() - started, extension)
+        finally:
+            UPLOADS_IN_FLIGHT.dec()
+            UPLOAD_BYTES_IN_FLIGHT.dec(received_bytes)
+        STORED_BYTES.inc(writer.size, current_endpoint(), extension)
         
-        return FileInfo(
+        media = await self._probe(filename, extension)
+        file_info = FileInfo(
             filename=filename,
             url=self.generate_direct_link(filename),
-            size=file_size,
-            format=extension
+            size=writer.size,
+            format=extension,
+            **media._asdict()
+        )
+        metadata_service.record(
+            file_info,
+            sha256=writer.sha256,
+            source_url=source_url,
+            expires_at=lifecycle_service.expires_at(extension, ttl)
         )
+        await self._schedule_optimize(file_info)
+        return file_info
     
-    async def save_binary_data(
+    async def complete_upload_session(self, session_id: str) -> FileInfo:
+        """
+        完成分块上传: 校验数据已全部到齐, 将会话的数据文件原地提交为正式文件
+        
+        Args:
+            session_id: 会话 ID
+        
+        Returns:
+            FileInfo: 文件信息
+        
+        Raises:
+            UploadSessionNotFound: 会话不存在或已过期
+            ValueError: 数据尚未全部接收, 或仍有数据块正在上传
+            OSError: 提交失败 (会话和已接收的数据保留, 可以重试)
+        """
+        # 等待所有 worker 上进行中的数据块写完; 之后到达的数据块请求不会再写入
+        async with upload_session_service.finalize(session_id) as session:
+            extension = session.extension
+            filename = self.generate_filename(extension)
+            async with storage_service.adopt_file(
+                session.data_path,
+                filename,
+                compute_hash=metadata_service.enabled
+            ) as writer:
+                if MP4_FASTSTART and extension in FASTSTART_FORMATS:
+                    started = time.perf_counter()
+                    await writer.rewrite(faststart)
+                    observe_stage("faststart", time.perf_counter() - started, extension)
+                
+                started = time.perf_counter()
+                await writer.commit()
+                observe_stage("store", time.perf_counter() - started, extension)
+        STORED_BYTES.inc(writer.size, current_endpoint(), extension)
+        
+        media = await self._probe(filename, session.extension)
+        file_info = FileInfo(
+            filename=filename,
+            url=self.generate_direct_link(filename),
+            size=writer.size,
+            format=session.extension,
+            **media._asdict()
+        )
+        metadata_service.record(
+            file_info,
+            sha256=writer.sha256,
+            expires_at=lifecycle_service.expires_at(session.extension)
+        )
+        await self._schedule_optimize(file_info)
+        return file_info
+    
+    @staticmethod
+    async def _probe(filename: str, extension: str) -> MediaInfo:
+        # 只读取已保存文件的文件头和元数据, 探测失败不影响上传
+        if not MEDIA_PROBE_ENABLED:
+            return MediaInfo()
+        started = time.perf_counter()
+        source = storage_service.resolve_file_path(filename) or await storage_service.volumes.locate(filename)
+        try:
+            if isinstance(source, VolumeLocation):
+                media = await asyncio.to_thread(probe_file, source.path, extension, source.offset, source.size)
+            elif source is not None:
+                media = await asyncio.to_thread(probe_file, source, extension)
+            else:
+                media = None
+        except Exception:
+            # 文件已经提交, 探测的任何异常都不能让上传失败
+            logger.warning("探测媒体信息失败: %s", filename, exc_info=True)
+            media = None
+        observe_stage("probe", time.perf_counter() - started, extension)
+        return media or MediaInfo()
+    
+    @staticmethod
+    async def _schedule_optimize(file_info: FileInfo) -> None:
+        # 图片入库后在后台生成更小的编码, 不影响上传响应
+        if not image_service.negotiates(file_info.filename):
+            return
+        filename = file_info.filename
+        source = storage_service.resolve_file_path(filename) or await storage_service.volumes.locate(filename)
+        if source is not None:
+            image_service.schedule_optimize(filename, source, file_info.size)
+    
+    async def save_binary_stream(
         self,
-        content: bytes,
+        chunks: AsyncIterator[bytes],
         original_filename: Optional[str] = None,
-        content_type: Optional[str] = None
+        content_type: Optional[str] = None,
+        content_length: Optional[int] = None,
+        ttl: Optional[int] = None
     ) -> FileInfo:
         """
-        保存二进制数据
+        流式保存二进制数据
+        
+        扩展名无法从文件名或 Content-Type 确定时, 仅缓存开头的少量字节用于
+        格式检测, 其余数据直接写入最终文件。
         
         Args:
-            content: 二进制内容
+            chunks: 二进制内容数据块流
             original_filename: 原始文件名(可选)
             content_type: 内容类型(可选)
+            content_length: 声明的内容长度(可选, 用于提前拒绝)
+            ttl: 保留时间 (秒, 可选, 默认按格式配置)
             
         Returns:
             FileInfo: 文件信息
@@ -103,11 +298,9 @@ class FileService:
         Raises:
             ValueError: 文件验证失败
         """
-        file_size = len(content)
-        
-        # 验证文件大小
-        if not validate_file_size(file_size):
-            raise ValueError(f"文件过大: {file_size} 字节")
+        # 根据声明的长度提前拒绝
+        if content_length is not None and content_length > MAX_FILE_SIZE:
+            raise ValueError(f"文件过大: {content_length} 字节")
         
         # 确定文件扩展名
         extension = None
@@ -120,44 +313,36 @@ class FileService:
         
         # 2. 尝试从 Content-Type 获取
         if not extension and content_type:
-            extension = get_extension_from_mime(content_type)
+            extension = get_extension_from_mime(content_type.split(";")[0].strip())
         
-        # 3. 保存临时文件并检测 MIME 类型
+        # 3. 根据数据开头的字节检测 MIME 类型
         if not extension:
-            temp_filename = f"temp_{uuid.uuid4()}"
-            temp_path = await storage_service.save_file(content, temp_filename)
-            mime_type = detect_mime_type(temp_path)
-            
-            if mime_type:
-                extension = get_extension_from_mime(mime_type)
+            extension, chunks = await self._sniff_extension(chunks)
             
-            # 删除临时文件
-            temp_path.unlink(missing_ok=True)
-        
         if not extension:
             raise ValueError("无法确定文件格式")
         
-        if extension not in validate_file_extension(f"dummy.{extension}"):
+        if not validate_file_extension(f"dummy.{extension}"):
             raise ValueError(f"不支持的文件格式: {extension}")
         
-        # 生成文件名并保存
-        filename = self.generate_filename(extension)
-        await storage_service.save_file(content, filename)
-        
-        return FileInfo(
-            filename=filename,
-            url=self.generate_direct_link(filename),
-            size=file_size,
-            format=extension
-        )
+        return await self._save_stream(chunks, extension, ttl=ttl)
     
-    async def save_from_url(self, url: str, custom_filename: Optional[str] = None) -> FileInfo:
+    async def save_from_url(
+        self,
+        url: str,
+        custom_filename: Optional[str] = None,
+        ttl: Optional[int] = None
+    ) -> FileInfo:
         """
         从 URL 下载并保存文件
         
+        响应体边下载边写入磁盘, 不会整体缓存在内存中。
+        启用 URL 缓存且未指定自定义文件名和保留时间时, 重复导入同一 URL 返回已保存的文件。
+        
         Args:
             url: 文件 URL
             custom_filename: 自定义文件名(可选)
+            ttl: 保留时间 (秒, 可选, 默认按格式配置)
             
         Returns:
             FileInfo: 文件信息
@@ -165,44 +350,118 @@ class FileService:
         Raises:
             ValueError: 下载或验证失败
         """
-        # 下载文件
-        content, extension = await download_service.download_from_url(url)
+        if url_cache_service.enabled and not custom_filename and ttl is None:
+            return await url_cache_service.fetch(url, self._fetch_url)
+        
+        fetched = await self._fetch_url(url, None, custom_filename, ttl)
+        return fetched.file_info
+    
+    async def _fetch_url(
+        self,
+        url: str,
+        cached: Optional[CachedUrl],
+        custom_filename: Optional[str] = None,
+        ttl: Optional[int] = None
+    ) -> Optional[CachedUrl]:
+        """
+        下载并保存文件, 有上次的缓存记录时发送条件请求
         
-        # 如果提供了自定义文件名,使用其扩展名
-        if custom_filename:
-            custom_ext = get_file_extension(custom_filename)
-            if validate_file_extension(custom_filename):
-                extension = custom_ext
+        Args:
+            url: 文件 URL
+            cached: 上次导入的缓存记录(可选)
+            custom_filename: 自定义文件名(可选)
+            ttl: 保留时间 (秒, 可选, 默认按格式配置)
         
-        # 如果仍然没有扩展名,尝试检测
-        if not extension:
-            temp_filename = f"temp_{uuid.uuid4()}"
-            temp_path = await storage_service.save_file(content, temp_filename)
-            mime_type = detect_mime_type(temp_path)
+        Returns:
+            Optional[CachedUrl]: 新的缓存记录, 源站返回 304 时为 None
+        
+        Raises:
+            ValueError: 下载或验证失败
+        """
+        async with download_service.stream_from_url(
+            url,
+            etag=cached.etag if cached else None,
+            last_modified=cached.last_modified if cached else None
+        ) as download:
+            if download.not_modified:
+                return None
+            
+            extension = download.extension
+            chunks = download.iter_chunks()
             
-            if mime_type:
-                extension = get_extension_from_mime(mime_type)
+            # 如果提供了自定义文件名,使用其扩展名
+            if custom_filename:
+                custom_ext = get_file_extension(custom_filename)
+                if validate_file_extension(custom_filename):
+                    extension = custom_ext
             
-            temp_path.unlink(missing_ok=True)
+            # 如果仍然没有扩展名,根据数据开头的字节检测
+            if not extension:
+                extension, chunks = await self._sniff_extension(chunks)
+            
+            if not extension:
+                raise ValueError(f"无法确定文件格式: {url}")
+            
+            if not validate_file_extension(f"dummy.{extension}"):
+                raise ValueError(f"不支持的文件格式: {extension}")
+            
+            file_info = await self._save_stream(chunks, extension, source_url=url, ttl=ttl)
+            return CachedUrl(file_info, download.etag, download.last_modified, time.time())
+    
+    async def iter_save_from_urls(self, urls: List[str]) -> AsyncIterator[BatchItemResult]:
+        """
+        并发下载并保存多个 URL, 按完成顺序产出结果
         
-        if not extension:
-            raise ValueError(f"无法确定文件格式: {url}")
+        并发数受全局与单主机两级信号量限制 (本进程内所有批量请求共享), 每一项有独立的超时。
+        先取得主机名额再占用全局名额, 排队等待同一主机的任务不会占住全局名额。
         
-        if not validate_file_extension(f"dummy.{extension}"):
-            raise ValueError(f"不支持的文件格式: {extension}")
+        Args:
+            urls: 文件 URL 列表
         
-        # 生成文件名并保存
-        filename = self.generate_filename(extension)
-        file_size = len(content)
+        Yields:
+            BatchItemResult: 单项结果
+        """
+        async def run(idx: int, url: str) -> BatchItemResult:
+            async with self._batch_host_limit.acquire(urlsplit(url).hostname), self._batch_limit:
+                try:
+                    file_info = await asyncio.wait_for(self.save_from_url(url), BATCH_URL_ITEM_TIMEOUT)
+                    return BatchItemResult(index=idx, url=url, success=True, data=file_info)
+                except asyncio.TimeoutError:
+                    error = f"处理超时: {url}"
+                except Exception as e:
+                    error = str(e)
+                return BatchItemResult(index=idx, url=url, success=False, error=error)
         
-        await storage_service.save_file(content, filename)
+        tasks = [asyncio.create_task(run(idx, url)) for idx, url in enumerate(urls)]
+        try:
+            for next_done in asyncio.as_completed(tasks):
+                yield await next_done
+        finally:
+            # 调用方提前退出 (如客户端断开) 时取消剩余任务
+            for task in tasks:
+                task.cancel()
+    
+    @staticmethod
+    async def _sniff_extension(
+        chunks: AsyncIterator[bytes]
+    ) -> Tuple[Optional[str], AsyncIterator[bytes]]:
+        """
+        读取数据流开头的少量字节检测文件格式
         
-        return FileInfo(
-            filename=filename,
-            url=self.generate_direct_link(filename),
-            size=file_size,
-            format=extension
-        )
+        Args:
+            chunks: 数据块流
+        
+        Returns:
+            Tuple[Optional[str], AsyncIterator[bytes]]: (扩展名, 包含已读数据的完整数据流)
+        """
+        started = time.perf_counter()
+        head, chunks = await read_stream_head(chunks, MIME_SNIFF_SIZE)
+        received = time.perf_counter()
+        extension = detect_extension_from_buffer(head)
+        # 等待文件头数据计入 receive, detect 只包含格式检测本身
+        observe_stage("receive", received - started, extension)
+        observe_stage("detect", time.perf_counter() - received, extension)
+        return extension, chunks
 
 
 # 创建全局实例
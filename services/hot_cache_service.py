@@ -0,0 +1,355 @@
+import asyncio
+import logging
+import mmap
+import os
+import stat
+import struct
+import threading
+import zlib
+from collections import OrderedDict
+from pathlib import Path
+from typing import NamedTuple, Optional, Set, Union
+from config import (
+    HOT_CACHE_ENABLED,
+    HOT_CACHE_PATH,
+    HOT_CACHE_SIZE,
+    HOT_CACHE_MAX_OBJECT,
+    HOT_CACHE_SLOTS
+)
+from services.volume_service import VolumeLocation
+from utils.metrics import HOT_CACHE_REQUESTS, HOT_CACHE_INSERTED_BYTES
+
+logger = logging.getLogger(__name__)
+
+# fcntl 仅在类 Unix 系统可用, 不可用时不启用共享缓存
+try:
+    import fcntl
+    FCNTL_AVAILABLE = True
+except ImportError:
+    FCNTL_AVAILABLE = False
+
+# 共享内存布局: 文件头 | 槽位表 | 环形数据区
+# 文件头: 魔数, 数据区大小, 槽位数, 写入位置 (单调递增, 对数据区大小取模得到实际位置), 失效计数
+_MAGIC = b"LFHOTC01"
+_HEADER = struct.Struct("<8sQQQ")
+_HEAD_OFFSET = 24
+_EPOCH_OFFSET = 32
+_HEADER_SIZE = 64
+
+# 槽位: 序号 (奇数表示正在写入), 数据位置, 长度, inode, mtime_ns, 文件名
+_SLOT = struct.Struct("<QQQQQ64s")
+_SLOT_FIELDS = struct.Struct("<QQQQ64s")
+_SEQ = struct.Struct("<Q")
+_MAX_NAME = 64
+
+# 组相联: 每个文件名只可能位于所在组的这几个槽位中
+_WAYS = 4
+
+
+class CachedObject(NamedTuple):
+    """缓存命中的文件内容及其文件状态 (用于 ETag / Last-Modified)"""
+    content: bytes
+    stat_result: os.stat_result
+
+
+class HotCacheService:
+    """
+    热点小文件缓存 (同一节点的所有 worker 进程共享一份)
+    
+    缓存位于共享内存文件 (默认 /dev/shm) 的 mmap 中:
+    
+    - 数据区为环形缓冲区, 新内容追加写入, 写满后覆盖最早写入的内容; 命中的文件
+      即将被覆盖时重新写入, 近似按最近访问淘汰
+    - 文件第二次未命中时才载入, 只访问一次的文件不会挤占缓存
+    - 读取不加锁 (序号校验): 命中时只有一次内存复制, 不需要 stat / open / read 等系统调用;
+      写入和失效在 flock 下进行
+    - 文件删除时失效, 所有进程立即可见
+    
+    没有其他存活进程使用缓存文件时 (如整个服务重启), 启动时清空缓存。
+    """
+    
+    def __init__(
+        self,
+        enabled: bool = HOT_CACHE_ENABLED,
+        path: Path = HOT_CACHE_PATH,
+        size: int = HOT_CACHE_SIZE,
+        max_object: int = HOT_CACHE_MAX_OBJECT,
+        slots: int = HOT_CACHE_SLOTS
+    ):
+        self.enabled = enabled and FCNTL_AVAILABLE
+        self.path = path
+        self.size = size
+        self.max_object = min(max_object, size // 4)
+        self._sets = max(slots // _WAYS, 1)
+        self._data_start = _HEADER_SIZE + self._sets * _WAYS * _SLOT.size
+        self._fd: Optional[int] = None
+        self._lock_fd: Optional[int] = None
+        self._map: Optional[mmap.mmap] = None
+        # flock 不区分同一进程内的线程, 另用线程锁互斥
+        self._thread_lock = threading.Lock()
+        # 最近未命中过一次的文件名 (本进程内)
+        self._candidates: "OrderedDict[str, None]" = OrderedDict()
+        # 正在重新写入的热点文件名 (本进程内)
+        self._refreshing: Set[str] = set()
+        self._loads: Set[asyncio.Future] = set()
+    
+    def start(self) -> None:
+        """打开 (必要时初始化) 共享内存文件 (应用启动时调用)"""
+        if not self.enabled or self._map is not None:
+            return
+        
+        total = self._data_start + self.size
+        self.path.parent.mkdir(parents=True, exist_ok=True)
+        fd = os.open(self.path, os.O_RDWR | os.O_CREAT, 0o600)
+        lock_fd = os.open(f"{self.path}.lock", os.O_RDWR | os.O_CREAT, 0o600)
+        fcntl.flock(fd, fcntl.LOCK_EX)
+        try:
+            # 每个使用缓存的进程都持有 .lock 的共享锁; 能拿到排他锁说明没有其他存活进程
+            try:
+                fcntl.flock(lock_fd, fcntl.LOCK_EX | fcntl.LOCK_NB)
+                alone = True
+            except BlockingIOError:
+                alone = False
+            fcntl.flock(lock_fd, fcntl.LOCK_SH)
+            
+            if alone:
+                os.ftruncate(fd, 0)
+                os.ftruncate(fd, total)
+                os.pwrite(fd, _HEADER.pack(_MAGIC, self.size, self._sets * _WAYS, 0), 0)
+            
+            magic, size, slots, _ = _HEADER.unpack(os.pread(fd, _HEADER.size, 0))
+            if (magic, size, slots) == (_MAGIC, self.size, self._sets * _WAYS) and os.fstat(fd).st_size == total:
+                self._map = mmap.mmap(fd, total)
+        finally:
+            fcntl.flock(fd, fcntl.LOCK_UN)
+        
+        if self._map is None:
+            # 其他进程以不同的配置创建了缓存, 本进程不使用
+            logger.warning("热点缓存文件 %s 的配置与当前配置不一致, 本进程不启用缓存", self.path)
+            os.close(fd)
+            os.close(lock_fd)
+            self.enabled = False
+            return
+        self._fd = fd
+        self._lock_fd = lock_fd
+    
+    async def stop(self) -> None:
+        """等待正在进行的载入并关闭共享内存 (应用关闭时调用)"""
+        if self._loads:
+            await asyncio.gather(*self._loads, return_exceptions=True)
+        if self._map is not None:
+            self._map.close()
+            self._map = None
+            os.close(self._fd)
+            os.close(self._lock_fd)
+            self._fd = self._lock_fd = None
+    
+    def _set_base(self, key: bytes) -> int:
+        # 文件名哈希需要在各进程中一致, 不能使用 hash()
+        return _HEADER_SIZE + (zlib.crc32(key) % self._sets) * _WAYS * _SLOT.size
+    
+    def get(self, filename: str) -> Optional[CachedObject]:
+        """
+        查找缓存的文件 (不加锁, 不产生系统调用)
+        
+        Args:
+            filename: 文件名
+        
+        Returns:
+            Optional[CachedObject]: 命中时返回文件内容和状态, 未命中返回 None
+        """
+        if self._map is None:
+            return None
+        key = filename.encode()
+        if len(key) > _MAX_NAME:
+            return None
+        
+        buffer = self._map
+        epoch = _SEQ.unpack_from(buffer, _EPOCH_OFFSET)[0]
+        base = self._set_base(key)
+        for way in range(_WAYS):
+            slot = base + way * _SLOT.size
+            seq, offset, length, inode, mtime_ns, name = _SLOT.unpack_from(buffer, slot)
+            if seq & 1 or not length or name.rstrip(b"\0") != key:
+                continue
+            
+            start = self._data_start + offset % self.size
+            content = buffer[start:start + length]
+            # 复制之后再检查: 槽位未被改写, 且数据未被后来的写入覆盖
+            head = _SEQ.unpack_from(buffer, _HEAD_OFFSET)[0]
+            if _SEQ.unpack_from(buffer, slot)[0] != seq or head > offset + self.size:
+                break
+            HOT_CACHE_REQUESTS.inc(1, "hit")
+            cached = CachedObject(content, _stat_result(length, inode, mtime_ns))
+            if head > offset + self.size // 2 and filename not in self._refreshing:
+                # 已进入即将被覆盖的一半, 重新写入以保留热点文件
+                self._refreshing.add(filename)
+                self._submit(self._refresh, filename, cached, epoch)
+            return cached
+        
+        HOT_CACHE_REQUESTS.inc(1, "miss")
+        return None
+    
+    def offer(self, filename: str, source: Union[Path, VolumeLocation], stat_result: os.stat_result) -> None:
+        """
+        未命中的文件从磁盘返回后调用: 第二次未命中时在后台载入
+        
+        Args:
+            filename: 文件名
+            source: 文件路径或卷存储中的位置
+            stat_result: 文件状态
+        """
+        if self._map is None or stat_result.st_size > self.max_object or stat_result.st_size == 0:
+            return
+        if filename not in self._candidates:
+            self._candidates[filename] = None
+            while len(self._candidates) > self._sets * _WAYS:
+                self._candidates.popitem(last=False)
+            return
+        
+        del self._candidates[filename]
+        epoch = _SEQ.unpack_from(self._map, _EPOCH_OFFSET)[0]
+        self._submit(self._load, filename, source, stat_result, epoch)
+    
+    def _submit(self, func, *args) -> None:
+        future = asyncio.ensure_future(asyncio.to_thread(func, *args))
+        self._loads.add(future)
+        future.add_done_callback(self._loads.discard)
+    
+    def _refresh(self, filename: str, cached: CachedObject, epoch: int) -> None:
+        try:
+            self.put(filename, cached.content, cached.stat_result, epoch)
+        finally:
+            self._refreshing.discard(filename)
+    
+    def _load(
+        self,
+        filename: str,
+        source: Union[Path, VolumeLocation],
+        stat_result: os.stat_result,
+        epoch: int
+    ) -> None:
+        try:
+            if isinstance(source, VolumeLocation):
+                with open(source.path, "rb") as file:
+                    content = os.pread(file.fileno(), source.size, source.offset)
+            else:
+                with open(source, "rb") as file:
+                    current = os.fstat(file.fileno())
+                    if (current.st_ino, current.st_mtime_ns) != (stat_result.st_ino, stat_result.st_mtime_ns):
+                        return
+                    content = file.read(stat_result.st_size + 1)
+        except OSError:
+            return
+        if len(content) == stat_result.st_size:
+            self.put(filename, content, stat_result, epoch)
+    
+    def put(self, filename: str, content: bytes, stat_result: os.stat_result, epoch: Optional[int] = None) -> None:
+        """
+        写入缓存 (在 flock 下进行)
+        
+        Args:
+            filename: 文件名
+            content: 文件内容
+            stat_result: 文件状态
+            epoch: 读取内容之前的失效计数(可选); 之后有文件失效时放弃写入, 避免缓存已删除的文件
+        """
+        key = filename.encode()
+        if self._map is None or len(key) > _MAX_NAME or not 0 < len(content) <= self.max_object:
+            return
+        with self._locked():
+            buffer = self._map
+            if epoch is not None and _SEQ.unpack_from(buffer, _EPOCH_OFFSET)[0] != epoch:
+                return
+            head = _SEQ.unpack_from(buffer, _HEAD_OFFSET)[0]
+            slot = self._choose_slot(key, head)
+            
+            position = head
+            if position % self.size + len(content) > self.size:
+                # 环形缓冲区末尾放不下, 从开头写入
+                position += self.size - position % self.size
+            seq = _SEQ.unpack_from(buffer, slot)[0] | 1
+            _SEQ.pack_into(buffer, slot, seq)
+            # 先发布新的写入位置, 读者据此发现被覆盖的旧内容
+            _SEQ.pack_into(buffer, _HEAD_OFFSET, position + len(content))
+            start = self._data_start + position % self.size
+            buffer[start:start + len(content)] = content
+            _SLOT_FIELDS.pack_into(
+                buffer, slot + _SEQ.size,
+                position, len(content), stat_result.st_ino, stat_result.st_mtime_ns, key
+            )
+            _SEQ.pack_into(buffer, slot, seq + 1)
+        HOT_CACHE_INSERTED_BYTES.inc(len(content))
+    
+    def _choose_slot(self, key: bytes, head: int) -> int:
+        # 优先: 同名槽位 > 空闲或内容已被覆盖的槽位 > 最早写入的槽位
+        base = self._set_base(key)
+        oldest, oldest_offset = base, None
+        for way in range(_WAYS):
+            slot = base + way * _SLOT.size
+            _, offset, length, _, _, name = _SLOT.unpack_from(self._map, slot)
+            if name.rstrip(b"\0") == key or not length or head > offset + self.size:
+                return slot
+            if oldest_offset is None or offset < oldest_offset:
+                oldest, oldest_offset = slot, offset
+        return oldest
+    
+    def invalidate(self, filename: str) -> None:
+        """
+        使缓存的文件失效 (文件删除或替换时调用, 所有进程立即可见)
+        
+        Args:
+            filename: 文件名
+        """
+        key = filename.encode()
+        self._candidates.pop(filename, None)
+        if self._map is None or len(key) > _MAX_NAME:
+            return
+        with self._locked():
+            _SEQ.pack_into(self._map, _EPOCH_OFFSET, _SEQ.unpack_from(self._map, _EPOCH_OFFSET)[0] + 1)
+            base = self._set_base(key)
+            for way in range(_WAYS):
+                slot = base + way * _SLOT.size
+                seq, _, _, _, _, name = _SLOT.unpack_from(self._map, slot)
+                if name.rstrip(b"\0") == key:
+                    _SEQ.pack_into(self._map, slot, seq | 1)
+                    _SLOT_FIELDS.pack_into(self._map, slot + _SEQ.size, 0, 0, 0, 0, b"")
+                    _SEQ.pack_into(self._map, slot, (seq | 1) + 1)
+    
+    def _locked(self) -> "_FileLock":
+        return _FileLock(self._thread_lock, self._fd)
+
+
+class _FileLock:
+    """线程锁 + flock, 在同一进程的线程之间和不同进程之间都互斥"""
+    
+    def __init__(self, thread_lock: threading.Lock, fd: int):
+        self._thread_lock = thread_lock
+        self._fd = fd
+    
+    def __enter__(self) -> None:
+        self._thread_lock.acquire()
+        try:
+            fcntl.flock(self._fd, fcntl.LOCK_EX)
+        except BaseException:
+            self._thread_lock.release()
+            raise
+    
+    def __exit__(self, *exc_info) -> None:
+        try:
+            fcntl.flock(self._fd, fcntl.LOCK_UN)
+        finally:
+            self._thread_lock.release()
+
+
+def _stat_result(size: int, inode: int, mtime_ns: int) -> os.stat_result:
+    # 与磁盘上的文件状态生成相同的 ETag / Last-Modified
+    seconds = mtime_ns // 1_000_000_000
+    return os.stat_result(
+        (stat.S_IFREG | 0o644, inode, 0, 1, 0, 0, size, seconds, seconds, seconds),
+        {"st_mtime": mtime_ns / 1e9, "st_mtime_ns": mtime_ns}
+    )
+
+
+# 创建全局实例
+hot_cache_service = HotCacheService()
@@ -0,0 +1,536 @@
+import asyncio
+import io
+import logging
+import os
+import time
+import uuid
+from collections import OrderedDict
+from concurrent.futures import ProcessPoolExecutor
+from pathlib import Path
+from typing import Dict, List, Optional, Set, Tuple, Union
+from config import (
+    IMAGE_VARIANT_SIZES,
+    IMAGE_VARIANT_CACHE_DIR,
+    IMAGE_VARIANT_CACHE_MAX_BYTES,
+    IMAGE_VARIANT_WORKERS,
+    IMAGE_OPTIMIZE_ENABLED,
+    IMAGE_OPTIMIZE_DIR,
+    IMAGE_OPTIMIZE_QUALITY,
+    IMAGE_OPTIMIZE_WORKERS
+)
+from services.volume_service import VolumeLocation
+from utils.concurrency import SingleFlight
+
+logger = logging.getLogger(__name__)
+
+# Pillow 为可选依赖, 未安装时不提供缩略图和格式优化
+try:
+    from PIL import Image, ImageOps, features
+    PIL_AVAILABLE = True
+    # AVIF 编码需要 Pillow 编译时带有 libavif
+    AVIF_AVAILABLE = features.check("avif")
+except ImportError:
+    PIL_AVAILABLE = False
+    AVIF_AVAILABLE = False
+
+# 支持的缩放模式: cover 裁剪填满, contain 完整缩放到框内
+VARIANT_FITS = ("cover", "contain")
+
+# 重新扫描缩略图缓存目录的最短间隔 (秒): 多个 worker 共享同一目录, 扫描后按所有进程写入的总量淘汰
+_CACHE_RESCAN_INTERVAL = 60
+
+# 可缩放的原图格式 -> 缩略图输出格式 (扩展名, Pillow 格式名)
+_OUTPUT_FORMATS = {
+    "jpg": ("jpg", "JPEG"),
+    "jpeg": ("jpg", "JPEG"),
+    "bmp": ("jpg", "JPEG"),
+    "png": ("png", "PNG"),
+    "gif": ("png", "PNG"),
+    "ico": ("png", "PNG"),
+    "webp": ("webp", "WEBP"),
+}
+
+# 入库后做格式优化的原图格式 -> 同类重新压缩的输出 (扩展名, Pillow 格式名)
+# BMP 没有压缩, 以无损 PNG 作为通用替代
+_OPTIMIZE_FORMATS = {
+    "jpg": ("jpg", "JPEG"),
+    "jpeg": ("jpg", "JPEG"),
+    "png": ("png", "PNG"),
+    "bmp": ("png", "PNG"),
+}
+
+# 优化编码的扩展名 -> MIME 类型
+_ENCODING_TYPES = {
+    "jpg": "image/jpeg",
+    "png": "image/png",
+    "webp": "image/webp",
+    "avif": "image/avif",
+}
+
+# 只有 Accept 中明确列出时才返回的格式 (通配符 */* 不算)
+_EXPLICIT_TYPES = {"image/webp", "image/avif"}
+
+
+def _render_variant(
+    source: Union[str, Tuple[str, int, int]],
+    target: str,
+    width: int,
+    height: int,
+    fit: str,
+    output_format: str
+) -> int:
+    """
+    在进程池中生成缩略图 (模块级函数, 便于跨进程调用)
+    
+    Args:
+        source: 原图路径, 或卷存储中的 (卷文件路径, 偏移, 长度)
+    
+    Returns:
+        int: 生成的文件大小
+    """
+    with Image.open(_load_source(source)) as image:
+        # JPEG 可在解码时直接按比例缩小, 大图省去大部分解码开销
+        image.draft("RGB", (width, height))
+        image = ImageOps.exif_transpose(image)
+        if output_format == "JPEG" and image.mode not in ("RGB", "L"):
+            image = image.convert("RGB")
+        elif image.mode not in ("RGB", "RGBA", "L", "LA"):
+            image = image.convert("RGBA")
+        
+        if fit == "cover":
+            image = ImageOps.fit(image, (width, height), Image.Resampling.LANCZOS)
+        else:
+            image.thumbnail((width, height), Image.Resampling.LANCZOS)
+        
+        options = {"quality": 85, "optimize": True} if output_format in ("JPEG", "WEBP") else {"optimize": True}
+        image.save(target, output_format, **options)
+    return os.path.getsize(target)
+
+
+def _load_source(source: Union[str, Tuple[str, int, int]]) -> Union[str, io.BytesIO]:
+    if isinstance(source, tuple):
+        path, offset, size = source
+        with open(path, "rb") as file:
+            file.seek(offset)
+            return io.BytesIO(file.read(size))
+    return source
+
+
+def _optimize_image(
+    source: Union[str, Tuple[str, int, int]],
+    target_prefix: str,
+    original_size: int,
+    encodings: List[Tuple[str, str]],
+    quality: int
+) -> Dict[str, int]:
+    """
+    在进程池中生成更小的编码 (模块级函数, 便于跨进程调用)
+    
+    只保留比原图小的结果, 文件名为 target_prefix + 扩展名。
+    
+    Args:
+        source: 原图路径, 或卷存储中的 (卷文件路径, 偏移, 长度)
+        target_prefix: 输出路径前缀
+        original_size: 原图大小
+        encodings: 需要生成的 (扩展名, Pillow 格式名) 列表
+        quality: 有损编码质量
+    
+    Returns:
+        Dict[str, int]: 扩展名 -> 生成的文件大小
+    """
+    results = {}
+    with Image.open(_load_source(source)) as image:
+        icc_profile = image.info.get("icc_profile")
+        # 重新编码不保留 EXIF, 先按方向信息旋转
+        image = ImageOps.exif_transpose(image)
+        if image.mode not in ("RGB", "RGBA", "L", "LA"):
+            image = image.convert("RGBA" if "transparency" in image.info else "RGB")
+        
+        for extension, output_format in encodings:
+            encoded = image
+            options = {"icc_profile": icc_profile} if icc_profile else {}
+            if output_format == "JPEG":
+                encoded = image.convert("RGB") if image.mode not in ("RGB", "L") else image
+                options.update(quality=quality, optimize=True, progressive=True)
+            elif output_format == "PNG":
+                options.update(optimize=True)
+            elif output_format == "WEBP":
+                options.update(quality=quality, method=4)
+            else:
+                options.update(quality=quality)
+            
+            target = f"{target_prefix}{extension}"
+            temp_path = f"{target}.{uuid.uuid4().hex}.part"
+            try:
+                encoded.save(temp_path, output_format, **options)
+                size = os.path.getsize(temp_path)
+                if size < original_size:
+                    os.replace(temp_path, target)
+                    results[extension] = size
+            finally:
+                if os.path.exists(temp_path):
+                    os.remove(temp_path)
+    return results
+
+
+def _touch(path: Path) -> None:
+    # 只刷新访问时间: 修改时间参与 ETag 和 Last-Modified, 必须保持不变
+    os.utime(path, ns=(time.time_ns(), os.stat(path).st_mtime_ns))
+
+
+def _remove_files(paths: List[Path]) -> None:
+    for path in paths:
+        try:
+            os.remove(path)
+        except FileNotFoundError:
+            pass
+
+
+def parse_accept(header: Optional[str]) -> Set[str]:
+    """
+    解析 Accept 请求头中可接受 (q > 0) 的 MIME 类型
+    
+    Args:
+        header: Accept 请求头
+    
+    Returns:
+        Set[str]: MIME 类型集合 (小写, 可能包含 image/* 和 */*)
+    """
+    accepted = set()
+    for item in (header or "").split(","):
+        media_type, *params = item.strip().split(";")
+        quality = 1.0
+        for param in params:
+            key, _, value = param.strip().partition("=")
+            if key.strip().lower() == "q":
+                try:
+                    quality = float(value)
+                except ValueError:
+                    quality = 0.0
+        if media_type and quality > 0:
+            accepted.add(media_type.strip().lower())
+    return accepted
+
+
+class ImageService:
+    """
+    图片服务
+    
+    - 缩略图: 进程池生成, 磁盘缓存按 LRU 淘汰 (最近使用时间记录在文件的访问时间中,
+      修改时间保持不变, 缩略图的 ETag 因此稳定; 多个 worker 共享同一个缓存上限)
+    - 格式优化 (可选): 入库后在后台进程池生成 WebP / AVIF 和重新压缩的版本,
+      直链按 Accept 请求头返回最小的可接受编码, 原图保持不变
+    """
+    
+    def __init__(
+        self,
+        cache_dir: Path = IMAGE_VARIANT_CACHE_DIR,
+        max_cache_bytes: int = IMAGE_VARIANT_CACHE_MAX_BYTES,
+        allowed_sizes: Set[Tuple[int, int]] = IMAGE_VARIANT_SIZES,
+        workers: int = IMAGE_VARIANT_WORKERS,
+        optimize_enabled: bool = IMAGE_OPTIMIZE_ENABLED,
+        optimize_dir: Path = IMAGE_OPTIMIZE_DIR,
+        optimize_quality: int = IMAGE_OPTIMIZE_QUALITY,
+        optimize_workers: int = IMAGE_OPTIMIZE_WORKERS
+    ):
+        self.cache_dir = cache_dir
+        self.max_cache_bytes = max_cache_bytes
+        self.allowed_sizes = allowed_sizes
+        self.workers = workers
+        self.optimize_dir = optimize_dir
+        self.optimize_quality = optimize_quality
+        self.optimize_workers = optimize_workers
+        self.optimize_enabled = optimize_enabled and PIL_AVAILABLE
+        self._executor: Optional[ProcessPoolExecutor] = None
+        # 格式优化使用独立的进程池, 后台任务不占用缩略图的处理能力
+        self._optimize_executor: Optional[ProcessPoolExecutor] = None
+        self._optimize_tasks: Set[asyncio.Future] = set()
+        self._entries: "OrderedDict[str, int]" = OrderedDict()
+        self._cache_bytes = 0
+        self._loaded = False
+        self._last_scan = 0.0
+        self._single_flight = SingleFlight()
+    
+    @property
+    def available(self) -> bool:
+        """是否可以生成缩略图 (需要安装 Pillow)"""
+        return PIL_AVAILABLE
+    
+    def start(self) -> None:
+        """加载已有缓存并创建进程池 (应用启动时调用)"""
+        self._load_cache()
+        if PIL_AVAILABLE and self._executor is None:
+            self._executor = ProcessPoolExecutor(max_workers=self.workers)
+        if self.optimize_enabled and self._optimize_executor is None:
+            self._optimize_executor = ProcessPoolExecutor(max_workers=self.optimize_workers)
+    
+    def stop(self) -> None:
+        """关闭进程池 (应用关闭时调用, 未完成的格式优化任务被放弃)"""
+        for executor in (self._executor, self._optimize_executor):
+            if executor is not None:
+                executor.shutdown(wait=False, cancel_futures=True)
+        self._executor = None
+        self._optimize_executor = None
+    
+    def _load_cache(self) -> None:
+        if self._loaded:
+            return
+        self._entries, self._cache_bytes = self._scan_cache()
+        self._last_scan = time.monotonic()
+        self._loaded = True
+    
+    def _scan_cache(self) -> Tuple["OrderedDict[str, int]", int]:
+        # 按访问时间恢复 LRU 顺序 (命中时显式刷新访问时间), 包括其他 worker 进程生成的缩略图
+        self.cache_dir.mkdir(parents=True, exist_ok=True)
+        found = []
+        with os.scandir(self.cache_dir) as scan:
+            for entry in scan:
+                if entry.is_file() and not entry.name.startswith("."):
+                    try:
+                        stat_result = entry.stat()
+                    except FileNotFoundError:
+                        continue
+                    found.append((stat_result.st_atime_ns, entry.name, stat_result.st_size))
+        entries: "OrderedDict[str, int]" = OrderedDict()
+        for _, name, size in sorted(found):
+            entries[name] = size
+        return entries, sum(entries.values())
+    
+    def validate_request(self, file_format: str, width: int, height: int, fit: str) -> None:
+        """
+        校验缩略图请求
+        
+        Raises:
+            ValueError: 格式不支持或尺寸不在允许列表中
+        """
+        if file_format not in _OUTPUT_FORMATS:
+            raise ValueError(f"该格式不支持缩略图: {file_format}")
+        if (width, height) not in self.allowed_sizes:
+            allowed = ", ".join(f"{w}x{h}" for w, h in sorted(self.allowed_sizes))
+            raise ValueError(f"不支持的尺寸 {width}x{height}, 可选: {allowed}")
+        if fit not in VARIANT_FITS:
+            raise ValueError(f"不支持的缩放模式 {fit}, 可选: {', '.join(VARIANT_FITS)}")
+    
+    async def get_variant(
+        self,
+        filename: str,
+        source: Union[Path, VolumeLocation],
+        width: int,
+        height: int,
+        fit: str
+    ) -> Path:
+        """
+        获取缩略图, 缓存未命中时生成
+        
+        同一缩略图的并发请求只会解码一次原图。
+        
+        Args:
+            filename: 原图文件名
+            source: 原图路径或卷存储中的位置
+            width: 宽度
+            height: 高度
+            fit: 缩放模式
+        
+        Returns:
+            Path: 缩略图路径
+        
+        Raises:
+            ValueError: 请求无效或原图无法解码
+            RuntimeError: 未安装 Pillow
+        """
+        if not PIL_AVAILABLE:
+            raise RuntimeError("未安装 Pillow, 无法生成缩略图")
+        
+        file_format = Path(filename).suffix.lower().lstrip(".")
+        self.validate_request(file_format, width, height, fit)
+        self._load_cache()
+        
+        out_ext, output_format = _OUTPUT_FORMATS[file_format]
+        name = f"{filename}.{width}x{height}.{fit}.{out_ext}"
+        path = self.cache_dir / name
+        
+        if name in self._entries:
+            self._entries.move_to_end(name)
+            try:
+                await asyncio.to_thread(_touch, path)
+                return path
+            except FileNotFoundError:
+                # 被其他 worker 进程淘汰 (等待期间可能已被本进程移出缓存表)
+                size = self._entries.pop(name, None)
+                if size is not None:
+                    self._cache_bytes -= size
+        
+        return await self._single_flight.do(
+            name,
+            lambda: self._render(name, source, width, height, fit, output_format)
+        )
+    
+    async def _render(
+        self,
+        name: str,
+        source: Union[Path, VolumeLocation],
+        width: int,
+        height: int,
+        fit: str,
+        output_format: str
+    ) -> Path:
+        path = self.cache_dir / name
+        temp_path = self.cache_dir / f".{uuid.uuid4().hex}.part"
+        if self._executor is None:
+            self.start()
+        
+        if isinstance(source, VolumeLocation):
+            source_arg = (str(source.path), source.offset, source.size)
+        else:
+            source_arg = str(source)
+        
+        loop = asyncio.get_running_loop()
+        try:
+            size = await loop.run_in_executor(
+                self._executor, _render_variant,
+                source_arg, str(temp_path), width, height, fit, output_format
+            )
+        except Exception as e:
+            await asyncio.to_thread(temp_path.unlink, missing_ok=True)
+            raise ValueError(f"无法生成缩略图: {str(e)}")
+        
+        await asyncio.to_thread(os.replace, temp_path, path)
+        if time.monotonic() - self._last_scan >= _CACHE_RESCAN_INTERVAL:
+            self._last_scan = time.monotonic()
+            self._entries, self._cache_bytes = await asyncio.to_thread(self._scan_cache)
+        if name not in self._entries:
+            self._entries[name] = size
+            self._cache_bytes += size
+        self._entries.move_to_end(name)
+        await self._evict()
+        return path
+    
+    def _optimized_prefix(self, filename: str) -> Path:
+        # 按文件名前两个字符分目录, 避免单个目录下文件过多
+        return self.optimize_dir / filename[:2] / f"{filename}."
+    
+    def schedule_optimize(self, filename: str, source: Union[Path, VolumeLocation], size: int) -> None:
+        """
+        在后台生成更小的编码 (不阻塞调用方, 失败只记录日志)
+        
+        Args:
+            filename: 原图文件名
+            source: 原图路径或卷存储中的位置
+            size: 原图大小
+        """
+        file_format = Path(filename).suffix.lower().lstrip(".")
+        if not self.optimize_enabled or file_format not in _OPTIMIZE_FORMATS:
+            return
+        if self._optimize_executor is None:
+            self.start()
+        
+        encodings = [_OPTIMIZE_FORMATS[file_format], ("webp", "WEBP")]
+        if AVIF_AVAILABLE:
+            encodings.append(("avif", "AVIF"))
+        if isinstance(source, VolumeLocation):
+            source_arg = (str(source.path), source.offset, source.size)
+        else:
+            source_arg = str(source)
+        
+        prefix = self._optimized_prefix(filename)
+        prefix.parent.mkdir(parents=True, exist_ok=True)
+        future = asyncio.get_running_loop().run_in_executor(
+            self._optimize_executor, _optimize_image,
+            source_arg, str(prefix), size, encodings, self.optimize_quality
+        )
+        self._optimize_tasks.add(future)
+        
+        def done(completed: asyncio.Future) -> None:
+            self._optimize_tasks.discard(completed)
+            if not completed.cancelled() and completed.exception() is not None:
+                logger.warning("图片格式优化失败: %s: %s", filename, completed.exception())
+        
+        future.add_done_callback(done)
+    
+    def negotiates(self, filename: str) -> bool:
+        """
+        该文件的直链响应是否随 Accept 请求头变化 (需要 Vary: Accept)
+        
+        Args:
+            filename: 文件名
+        
+        Returns:
+            bool: 是否参与格式协商
+        """
+        return self.optimize_enabled and Path(filename).suffix.lower().lstrip(".") in _OPTIMIZE_FORMATS
+    
+    def select_encoding(
+        self,
+        filename: str,
+        source: Union[Path, VolumeLocation],
+        accept: Optional[str]
+    ) -> Optional[Tuple[Path, str]]:
+        """
+        按 Accept 请求头选择最小的可接受编码 (在线程池中调用, 会访问磁盘)
+        
+        WebP / AVIF 仅在 Accept 中明确列出时返回; 重新压缩的同类编码按通配符匹配。
+        
+        Args:
+            filename: 原图文件名
+            source: 原图路径或卷存储中的位置
+            accept: Accept 请求头
+        
+        Returns:
+            Optional[Tuple[Path, str]]: (编码文件路径, MIME 类型), 原图最小或没有可用编码时返回 None
+        """
+        if not self.negotiates(filename):
+            return None
+        if isinstance(source, VolumeLocation):
+            original_size = source.size
+        else:
+            try:
+                original_size = source.stat().st_size
+            except FileNotFoundError:
+                return None
+        
+        accepted = parse_accept(accept)
+        # 没有 Accept 请求头等同于接受任意类型
+        wildcard = not accepted or "*/*" in accepted or "image/*" in accepted
+        prefix = self._optimized_prefix(filename)
+        
+        best = None
+        best_size = original_size
+        for extension, media_type in _ENCODING_TYPES.items():
+            if media_type not in accepted and (media_type in _EXPLICIT_TYPES or not wildcard):
+                continue
+            path = Path(f"{prefix}{extension}")
+            try:
+                size = path.stat().st_size
+            except FileNotFoundError:
+                continue
+            if size < best_size:
+                best, best_size = (path, media_type), size
+        return best
+    
+    def discard_optimized(self, filename: str) -> None:
+        """
+        删除文件的所有优化编码 (原图删除时调用)
+        
+        Args:
+            filename: 原图文件名
+        """
+        prefix = self._optimized_prefix(filename)
+        for extension in _ENCODING_TYPES:
+            try:
+                os.remove(f"{prefix}{extension}")
+            except FileNotFoundError:
+                pass
+    
+    async def _evict(self) -> None:
+        # 先在内存中选出淘汰的缩略图, 再在线程中统一删除文件
+        victims = []
+        while self._cache_bytes > self.max_cache_bytes and len(self._entries) > 1:
+            name, size = self._entries.popitem(last=False)
+            self._cache_bytes -= size
+            victims.append(self.cache_dir / name)
+        if victims:
+            await asyncio.to_thread(_remove_files, victims)
+
+
+# 创建全局实例
+image_service = ImageService()
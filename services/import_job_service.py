@@ -0,0 +1,388 @@
+import asyncio
+import logging
+import os
+import random
+import socket
+import sqlite3
+import threading
+import time
+import uuid
+from pathlib import Path
+from typing import Dict, List, Optional, Set
+from config import (
+    IMPORT_JOB_DB_PATH,
+    IMPORT_JOB_WORKERS,
+    IMPORT_JOB_MAX_ATTEMPTS,
+    IMPORT_JOB_RETRY_BACKOFF,
+    IMPORT_JOB_RETENTION,
+    IMPORT_JOB_LEASE,
+    BATCH_URL_ITEM_TIMEOUT
+)
+from models.schemas import FileInfo
+from services.admission_service import AdmissionRejected
+from services.download_service import TransientDownloadError
+from services.file_service import file_service
+
+logger = logging.getLogger(__name__)
+
+_SCHEMA = """
+CREATE TABLE IF NOT EXISTS import_jobs (
+    job_id TEXT PRIMARY KEY,
+    url TEXT NOT NULL,
+    status TEXT NOT NULL,
+    attempts INTEGER NOT NULL DEFAULT 0,
+    result TEXT,
+    error TEXT,
+    created_at REAL NOT NULL,
+    updated_at REAL NOT NULL,
+    next_attempt_at REAL NOT NULL
+);
+CREATE INDEX IF NOT EXISTS idx_import_jobs_status ON import_jobs (status, next_attempt_at);
+"""
+
+_COLUMNS = "job_id, url, status, attempts, result, error, created_at, updated_at, next_attempt_at"
+
+# 后来加入的列 (旧数据库启动时自动补齐): 执行中任务的持有者和租约到期时间
+_ADDED_COLUMNS = {
+    "owner": "TEXT",
+    "lease_expires_at": "REAL",
+}
+
+# 长轮询检查数据库的间隔 (秒): 任务可能由其他 worker 进程执行, 本进程收不到完成通知
+_WAIT_POLL_INTERVAL = 1.0
+
+# 任务状态
+QUEUED = "queued"
+RUNNING = "running"
+SUCCEEDED = "succeeded"
+FAILED = "failed"
+FINISHED_STATUSES = (SUCCEEDED, FAILED)
+
+
+class ImportJobService:
+    """
+    异步 URL 导入任务
+    
+    提交后立即返回任务 ID, 由固定数量的后台 worker 下载; 临时故障按指数退避重试。
+    任务状态保存在 SQLite 中, 排队中的任务在服务重启后继续执行。
+    
+    多个 worker 进程共享同一个数据库: 执行任务前原子地抢占并取得租约, 执行期间定期续约;
+    定期检查时只有租约已过期 (持有者已退出) 的任务才重新排队, 排队中的任务由任意进程执行。
+    """
+    
+    def __init__(
+        self,
+        db_path: Path = IMPORT_JOB_DB_PATH,
+        workers: int = IMPORT_JOB_WORKERS,
+        max_attempts: int = IMPORT_JOB_MAX_ATTEMPTS,
+        retry_backoff: float = IMPORT_JOB_RETRY_BACKOFF,
+        retention: int = IMPORT_JOB_RETENTION,
+        attempt_timeout: float = BATCH_URL_ITEM_TIMEOUT,
+        lease: float = IMPORT_JOB_LEASE
+    ):
+        self.db_path = db_path
+        self.workers = workers
+        self.max_attempts = max_attempts
+        self.retry_backoff = retry_backoff
+        self.retention = retention
+        self.attempt_timeout = attempt_timeout
+        self.lease = lease
+        self.owner = f"{socket.gethostname()}:{os.getpid()}:{uuid.uuid4().hex[:8]}"
+        self._conn: Optional[sqlite3.Connection] = None
+        self._db_lock = threading.Lock()
+        self._queue: Optional[asyncio.Queue] = None
+        self._tasks: List[asyncio.Task] = []
+        self._timers: Set[asyncio.TimerHandle] = set()
+        # 已在本进程队列或定时器中的任务, 定期检查时不重复加入
+        self._scheduled: Set[str] = set()
+        # 长轮询: 任务 ID -> 完成通知, 以及正在等待的请求数 (最后一个等待方离开时移除)
+        self._waiters: Dict[str, asyncio.Event] = {}
+        self._waiter_counts: Dict[str, int] = {}
+    
+    async def start(self) -> None:
+        """恢复未完成的任务并启动 worker (应用启动时调用)"""
+        if self._queue is not None:
+            return
+        
+        self.db_path.parent.mkdir(parents=True, exist_ok=True)
+        self._conn = sqlite3.connect(self.db_path, timeout=30, check_same_thread=False)
+        self._conn.row_factory = sqlite3.Row
+        await asyncio.to_thread(self._prepare)
+        
+        self._queue = asyncio.Queue()
+        await self._reap()
+        self._tasks = [asyncio.create_task(self._worker()) for _ in range(self.workers)]
+        self._tasks.append(asyncio.create_task(self._reap_loop()))
+    
+    async def stop(self) -> None:
+        """停止 worker (执行中的任务重新排队, 由其他进程或下次启动时执行)"""
+        for timer in self._timers:
+            timer.cancel()
+        self._timers.clear()
+        self._scheduled.clear()
+        for task in self._tasks:
+            task.cancel()
+        await asyncio.gather(*self._tasks, return_exceptions=True)
+        self._tasks = []
+        self._queue = None
+        if self._conn is not None:
+            # 正常退出时立即交还租约, 其他进程不必等待租约过期
+            await asyncio.to_thread(
+                self._execute,
+                "UPDATE import_jobs SET status = ?, owner = NULL, lease_expires_at = NULL WHERE owner = ? AND status = ?",
+                (QUEUED, self.owner, RUNNING)
+            )
+            self._conn.close()
+            self._conn = None
+    
+    def _execute(self, sql: str, params=()) -> List[sqlite3.Row]:
+        with self._db_lock, self._conn:
+            return self._conn.execute(sql, params).fetchall()
+    
+    def _prepare(self) -> None:
+        with self._db_lock, self._conn:
+            self._conn.execute("PRAGMA journal_mode=WAL")
+            self._conn.executescript(_SCHEMA)
+            columns = {row["name"] for row in self._conn.execute("PRAGMA table_info(import_jobs)")}
+            for column, column_type in _ADDED_COLUMNS.items():
+                if column not in columns:
+                    self._conn.execute(f"ALTER TABLE import_jobs ADD COLUMN {column} {column_type}")
+            self._conn.execute(
+                "DELETE FROM import_jobs WHERE status IN (?, ?) AND updated_at < ?",
+                (*FINISHED_STATUSES, time.time() - self.retention)
+            )
+    
+    def _recover(self) -> List[tuple]:
+        now = time.time()
+        with self._db_lock, self._conn:
+            # 租约过期的任务 (持有者已退出) 重新排队; 其他进程仍在执行的任务保持不变
+            self._conn.execute(
+                "UPDATE import_jobs SET status = ?, owner = NULL, lease_expires_at = NULL, updated_at = ? "
+                "WHERE status = ? AND (lease_expires_at IS NULL OR lease_expires_at < ?)",
+                (QUEUED, now, RUNNING, now)
+            )
+            rows = self._conn.execute(
+                "SELECT job_id, next_attempt_at FROM import_jobs WHERE status = ? ORDER BY created_at",
+                (QUEUED,)
+            ).fetchall()
+        return [(row["job_id"], row["next_attempt_at"]) for row in rows]
+    
+    async def _reap(self) -> None:
+        # 排队中的任务可能由已退出的进程提交, 不在任何进程的队列中; 抢占是原子的, 多个进程同时加入也只执行一次
+        for job_id, next_attempt_at in await asyncio.to_thread(self._recover):
+            if job_id not in self._scheduled:
+                self._schedule(job_id, next_attempt_at)
+    
+    async def _reap_loop(self) -> None:
+        while True:
+            await asyncio.sleep(self.lease)
+            try:
+                await self._reap()
+            except Exception:
+                logger.exception("检查导入任务租约失败")
+    
+    async def submit(self, urls: List[str]) -> List[dict]:
+        """
+        提交导入任务
+        
+        Args:
+            urls: 文件 URL 列表 (每个 URL 一个任务)
+        
+        Returns:
+            List[dict]: 新建的任务记录
+        
+        Raises:
+            RuntimeError: 任务服务未启动
+        """
+        if self._queue is None:
+            raise RuntimeError("导入任务服务未启动")
+        
+        now = time.time()
+        jobs = [
+            {
+                "job_id": uuid.uuid4().hex,
+                "url": url,
+                "status": QUEUED,
+                "attempts": 0,
+                "result": None,
+                "error": None,
+                "created_at": now,
+                "updated_at": now,
+                "next_attempt_at": now,
+            }
+            for url in urls
+        ]
+        await asyncio.to_thread(self._insert, jobs)
+        for job in jobs:
+            self._schedule(job["job_id"], now)
+        return jobs
+    
+    def _insert(self, jobs: List[dict]) -> None:
+        with self._db_lock, self._conn:
+            self._conn.executemany(
+                f"INSERT INTO import_jobs ({_COLUMNS}) VALUES "
+                "(:job_id, :url, :status, :attempts, :result, :error, :created_at, :updated_at, :next_attempt_at)",
+                jobs
+            )
+    
+    async def get(self, job_id: str) -> Optional[dict]:
+        """
+        查询任务
+        
+        Args:
+            job_id: 任务 ID
+        
+        Returns:
+            Optional[dict]: 任务记录, 不存在时返回 None
+        """
+        rows = await asyncio.to_thread(
+            self._execute, f"SELECT {_COLUMNS} FROM import_jobs WHERE job_id = ?", (job_id,)
+        )
+        return dict(rows[0]) if rows else None
+    
+    async def wait(self, job_id: str, timeout: float) -> Optional[dict]:
+        """
+        长轮询: 等待任务结束或超时后返回任务记录
+        
+        本进程执行的任务完成时立即返回; 其他进程执行的任务每隔 _WAIT_POLL_INTERVAL 秒查询一次。
+        
+        Args:
+            job_id: 任务 ID
+            timeout: 最长等待时间 (秒)
+        
+        Returns:
+            Optional[dict]: 任务记录, 不存在时返回 None
+        """
+        job = await self.get(job_id)
+        if job is None or job["status"] in FINISHED_STATUSES or timeout <= 0:
+            return job
+        
+        deadline = time.monotonic() + timeout
+        event = self._waiters.setdefault(job_id, asyncio.Event())
+        self._waiter_counts[job_id] = self._waiter_counts.get(job_id, 0) + 1
+        try:
+            while True:
+                # 注册等待之后再查一次, 避免错过刚好在两次查询之间完成的通知; 任务可能已被保留期清理
+                job = await self.get(job_id)
+                remaining = deadline - time.monotonic()
+                if job is None or job["status"] in FINISHED_STATUSES or remaining <= 0:
+                    return job
+                try:
+                    await asyncio.wait_for(event.wait(), min(remaining, _WAIT_POLL_INTERVAL))
+                except asyncio.TimeoutError:
+                    pass
+        finally:
+            # 任务由其他进程执行或等待超时时, 本进程不会收到完成通知, 由最后一个等待方清理
+            self._waiter_counts[job_id] -= 1
+            if not self._waiter_counts[job_id]:
+                del self._waiter_counts[job_id]
+                del self._waiters[job_id]
+    
+    def _schedule(self, job_id: str, run_at: float) -> None:
+        self._scheduled.add(job_id)
+        delay = run_at - time.time()
+        if delay <= 0:
+            self._queue.put_nowait(job_id)
+            return
+        
+        def enqueue() -> None:
+            self._timers.discard(timer)
+            if self._queue is not None:
+                self._queue.put_nowait(job_id)
+        
+        timer = asyncio.get_running_loop().call_later(delay, enqueue)
+        self._timers.add(timer)
+    
+    async def _worker(self) -> None:
+        while True:
+            job_id = await self._queue.get()
+            self._scheduled.discard(job_id)
+            try:
+                await self._run(job_id)
+            except asyncio.CancelledError:
+                raise
+            except Exception:
+                logger.exception("导入任务执行失败: %s", job_id)
+    
+    async def _run(self, job_id: str) -> None:
+        # 先抢占任务 (状态仍为 queued 才执行) 并取得租约, 防止重复执行
+        now = time.time()
+        claimed = await asyncio.to_thread(
+            self._execute,
+            "UPDATE import_jobs SET status = ?, attempts = attempts + 1, updated_at = ?, owner = ?, "
+            f"lease_expires_at = ? WHERE job_id = ? AND status = ? RETURNING {_COLUMNS}",
+            (RUNNING, now, self.owner, now + self.lease, job_id, QUEUED)
+        )
+        if not claimed:
+            return
+        job = dict(claimed[0])
+        
+        attempt = asyncio.ensure_future(
+            asyncio.wait_for(file_service.save_from_url(job["url"]), self.attempt_timeout)
+        )
+        lease_lost = asyncio.Event()
+        renewer = asyncio.create_task(self._renew(job_id, attempt, lease_lost))
+        try:
+            file_info: FileInfo = await attempt
+        except asyncio.CancelledError:
+            if not lease_lost.is_set():
+                raise
+            # 租约已失效 (本进程长时间无响应, 任务可能已被其他进程接手): 放弃本次执行, 不更新状态
+            logger.warning("导入任务租约失效, 放弃执行: %s", job_id)
+            return
+        except (TransientDownloadError, AdmissionRejected, asyncio.TimeoutError) as e:
+            error = str(e) or f"处理超时: {job['url']}"
+            if job["attempts"] < self.max_attempts:
+                # 指数退避并加入随机抖动, 避免同一源站的任务同时重试
+                delay = self.retry_backoff * 2 ** (job["attempts"] - 1) * random.uniform(0.5, 1.5)
+                await self._update(job_id, QUEUED, error=error, next_attempt_at=time.time() + delay)
+                self._schedule(job_id, time.time() + delay)
+                return
+            await self._update(job_id, FAILED, error=error)
+        except Exception as e:
+            await self._update(job_id, FAILED, error=str(e))
+        else:
+            await self._update(job_id, SUCCEEDED, result=file_info.model_dump_json())
+        finally:
+            renewer.cancel()
+    
+    async def _renew(self, job_id: str, attempt: asyncio.Future, lease_lost: asyncio.Event) -> None:
+        # 每隔租约的三分之一续约一次; 续约失败说明任务已被重新排队, 立即放弃本次执行
+        while True:
+            await asyncio.sleep(self.lease / 3)
+            renewed = await asyncio.to_thread(
+                self._execute,
+                "UPDATE import_jobs SET lease_expires_at = ? WHERE job_id = ? AND owner = ? AND status = ? "
+                "RETURNING job_id",
+                (time.time() + self.lease, job_id, self.owner, RUNNING)
+            )
+            if not renewed:
+                lease_lost.set()
+                attempt.cancel()
+                return
+    
+    async def _update(
+        self,
+        job_id: str,
+        status: str,
+        result: Optional[str] = None,
+        error: Optional[str] = None,
+        next_attempt_at: Optional[float] = None
+    ) -> None:
+        # 只有仍持有租约时才更新, 避免覆盖已由其他进程接手的任务
+        now = time.time()
+        await asyncio.to_thread(
+            self._execute,
+            "UPDATE import_jobs SET status = ?, result = ?, error = ?, updated_at = ?, "
+            "next_attempt_at = COALESCE(?, next_attempt_at), owner = NULL, lease_expires_at = NULL "
+            "WHERE job_id = ? AND owner = ?",
+            (status, result, error, now, next_attempt_at, job_id, self.owner)
+        )
+        if status in FINISHED_STATUSES:
+            event = self._waiters.get(job_id)
+            if event is not None:
+                event.set()
+
+
+# 创建全局实例
+import_job_service = ImportJobService()
@@ -0,0 +1,207 @@
+import asyncio
+import logging
+import os
+import time
+from pathlib import Path
+from typing import Dict, List, Optional, Tuple
+from config import (
+    DATA_DIR,
+    LIFECYCLE_ENABLED,
+    LIFECYCLE_DEFAULT_TTL,
+    LIFECYCLE_FORMAT_TTL,
+    LIFECYCLE_DISK_QUOTA,
+    LIFECYCLE_SWEEP_INTERVAL,
+    LIFECYCLE_SWEEP_BATCH,
+    LIFECYCLE_SWEEP_PAUSE
+)
+from services.image_service import image_service
+from services.metadata_service import metadata_service
+from services.storage_service import storage_service
+from utils.metrics import LIFECYCLE_REMOVED, LIFECYCLE_USED_BYTES
+
+# fcntl 仅在类 Unix 系统可用, 不可用时每个进程都执行清理
+try:
+    import fcntl
+except ImportError:
+    fcntl = None
+
+logger = logging.getLogger(__name__)
+
+# 超出配额时淘汰到配额的该比例以下, 避免每次清理只删掉刚好超出的部分
+_QUOTA_TARGET = 0.9
+
+
+class LifecycleService:
+    """
+    文件生命周期管理
+    
+    - 过期清理: 上传时指定或按格式默认的保留时间, 过期后自动删除
+    - 磁盘配额: 文件总大小超出 LIFECYCLE_DISK_QUOTA 时, 按最近访问时间淘汰最久未访问的文件
+    
+    过期时间、文件大小和访问时间都记录在元数据索引中 (访问时间由直链请求批量更新),
+    清理任务在后台按小批次执行, 批次之间暂停, 不会长时间占用事件循环或磁盘 IO。
+    
+    多个 worker 进程中只有持有 lock_path 排他锁 (flock) 的一个执行清理,
+    其余进程每轮尝试加锁, 执行清理的进程退出后由其他进程接替。
+    """
+    
+    def __init__(
+        self,
+        enabled: bool = LIFECYCLE_ENABLED,
+        default_ttl: int = LIFECYCLE_DEFAULT_TTL,
+        format_ttl: Dict[str, int] = LIFECYCLE_FORMAT_TTL,
+        disk_quota: int = LIFECYCLE_DISK_QUOTA,
+        sweep_interval: float = LIFECYCLE_SWEEP_INTERVAL,
+        batch_size: int = LIFECYCLE_SWEEP_BATCH,
+        pause: float = LIFECYCLE_SWEEP_PAUSE,
+        lock_path: Path = DATA_DIR / "lifecycle.lock"
+    ):
+        self.enabled = enabled
+        self.default_ttl = default_ttl
+        self.format_ttl = format_ttl
+        self.disk_quota = disk_quota
+        self.sweep_interval = sweep_interval
+        self.batch_size = batch_size
+        self.pause = pause
+        self.lock_path = lock_path
+        self._task: Optional[asyncio.Task] = None
+        self._lock_fd: Optional[int] = None
+    
+    def expires_at(self, file_format: str, ttl: Optional[int] = None) -> Optional[float]:
+        """
+        计算新文件的过期时间
+        
+        Args:
+            file_format: 文件格式
+            ttl: 上传时指定的保留时间 (秒, 可选, 优先于默认值)
+        
+        Returns:
+            Optional[float]: 过期时间戳, 永久保留时返回 None
+        """
+        if not self.enabled:
+            return None
+        if ttl is None:
+            ttl = self.format_ttl.get(file_format, self.default_ttl)
+        return time.time() + ttl if ttl > 0 else None
+    
+    def start(self) -> None:
+        """启动后台清理任务 (应用启动时调用)"""
+        if not self.enabled or self._task is not None:
+            return
+        if not metadata_service.enabled:
+            logger.warning("生命周期管理依赖元数据索引, METADATA_ENABLED 关闭时不执行清理")
+            return
+        self._task = asyncio.create_task(self._run())
+    
+    async def stop(self) -> None:
+        """停止后台清理任务 (应用关闭时调用)"""
+        if self._task is None:
+            return
+        self._task.cancel()
+        try:
+            await self._task
+        except asyncio.CancelledError:
+            pass
+        self._task = None
+        if self._lock_fd is not None:
+            os.close(self._lock_fd)
+            self._lock_fd = None
+    
+    def _elect(self) -> bool:
+        # 锁随文件描述符持有到进程退出或 stop, 进程崩溃时由内核释放
+        if fcntl is None or self._lock_fd is not None:
+            return True
+        fd = os.open(self.lock_path, os.O_RDWR | os.O_CREAT, 0o644)
+        try:
+            fcntl.flock(fd, fcntl.LOCK_EX | fcntl.LOCK_NB)
+        except OSError:
+            os.close(fd)
+            return False
+        self._lock_fd = fd
+        return True
+    
+    async def _run(self) -> None:
+        while True:
+            try:
+                if not self._elect():
+                    await asyncio.sleep(self.sweep_interval)
+                    continue
+                expired, evicted = await self.sweep()
+                if expired or evicted:
+                    logger.info("生命周期清理: 删除过期文件 %d 个, 淘汰文件 %d 个", expired, evicted)
+            except Exception as e:
+                logger.error("生命周期清理失败: %s", e)
+            await asyncio.sleep(self.sweep_interval)
+    
+    async def sweep(self) -> Tuple[int, int]:
+        """
+        执行一轮清理: 先删除过期文件, 再在超出配额时淘汰最久未访问的文件
+        
+        Returns:
+            Tuple[int, int]: (删除的过期文件数, 因配额淘汰的文件数)
+        """
+        expired = 0
+        while True:
+            rows = await metadata_service.expired_files(time.time(), self.batch_size)
+            if not rows:
+                break
+            await self._remove(rows, "expired")
+            expired += len(rows)
+            if len(rows) < self.batch_size:
+                break
+            await asyncio.sleep(self.pause)
+        
+        # 开启去重时多个文件名共享同一份内容, 配额按实际占用计算: 相同内容只计一次,
+        # 删除最后一个引用它的文件名时才释放空间
+        dedup = storage_service.dedup
+        evicted = 0
+        used = await metadata_service.total_size(distinct_content=dedup)
+        if self.disk_quota and used > self.disk_quota:
+            target = self.disk_quota * _QUOTA_TARGET
+            while used > target:
+                rows = await metadata_service.least_recently_accessed(self.batch_size)
+                if not rows:
+                    break
+                references = {}
+                if dedup:
+                    references = await metadata_service.reference_counts(
+                        [row["sha256"] for row in rows if row["sha256"]]
+                    )
+                
+                # 最后一批只删到低于目标为止
+                selected = []
+                for row in rows:
+                    selected.append(row)
+                    sha256 = row["sha256"]
+                    if sha256 in references:
+                        references[sha256] -= 1
+                        if references[sha256] > 0:
+                            continue
+                    used -= row["size"]
+                    if used <= target:
+                        break
+                await self._remove(selected, "quota")
+                evicted += len(selected)
+                await asyncio.sleep(self.pause)
+        LIFECYCLE_USED_BYTES.set(used)
+        return expired, evicted
+    
+    async def _remove(self, rows: List[dict], reason: str) -> None:
+        removed = []
+        for row in rows:
+            filename = row["filename"]
+            try:
+                await storage_service.delete_file(filename, row["sha256"])
+                await asyncio.to_thread(image_service.discard_optimized, filename)
+            except OSError as e:
+                # 保留记录, 下一轮清理时重试
+                logger.warning("删除文件失败: %s: %s", filename, e)
+                continue
+            # 文件已不存在 (如被手动删除) 时记录同样移除
+            removed.append(filename)
+        await metadata_service.remove(removed)
+        LIFECYCLE_REMOVED.inc(len(removed), reason)
+
+
+# 创建全局实例
+lifecycle_service = LifecycleService()
@@ -0,0 +1,432 @@
+import asyncio
+import logging
+import queue
+import sqlite3
+import threading
+import time
+from concurrent.futures import Future
+from datetime import datetime
+from pathlib import Path
+from typing import Dict, List, NamedTuple, Optional, Tuple
+from config import (
+    METADATA_ENABLED,
+    METADATA_DB_PATH,
+    METADATA_BATCH_SIZE,
+    METADATA_FLUSH_INTERVAL
+)
+from models.schemas import FileInfo
+
+logger = logging.getLogger(__name__)
+
+_SCHEMA = """
+CREATE TABLE IF NOT EXISTS files (
+    filename TEXT PRIMARY KEY,
+    size INTEGER NOT NULL,
+    format TEXT NOT NULL,
+    sha256 TEXT,
+    source_url TEXT,
+    created_at REAL NOT NULL,
+    accessed_at REAL,
+    expires_at REAL,
+    width INTEGER,
+    height INTEGER,
+    duration REAL,
+    codec TEXT
+);
+CREATE INDEX IF NOT EXISTS idx_files_created ON files (created_at, filename);
+CREATE INDEX IF NOT EXISTS idx_files_format_created ON files (format, created_at, filename);
+"""
+
+# 生命周期管理使用的索引 (在补齐旧数据库的列之后创建)
+_LIFECYCLE_SCHEMA = """
+CREATE INDEX IF NOT EXISTS idx_files_expires ON files (expires_at) WHERE expires_at IS NOT NULL;
+CREATE INDEX IF NOT EXISTS idx_files_accessed ON files (accessed_at);
+CREATE INDEX IF NOT EXISTS idx_files_sha256 ON files (sha256) WHERE sha256 IS NOT NULL;
+"""
+
+_COLUMNS = "filename, size, format, sha256, source_url, created_at, accessed_at, expires_at, width, height, duration, codec"
+_PLACEHOLDERS = ", ".join("?" * len(_COLUMNS.split(",")))
+
+# 旧版本创建的数据库缺少的列
+_ADDED_COLUMNS = {
+    "expires_at": "REAL",
+    "width": "INTEGER",
+    "height": "INTEGER",
+    "duration": "REAL",
+    "codec": "TEXT",
+}
+
+# 批量查询时单条 SQL 的参数上限 (SQLite 默认 999)
+_SQL_PARAM_CHUNK = 900
+
+
+class _Removal(NamedTuple):
+    """交给后台写入线程的删除请求"""
+    filenames: List[str]
+    future: Future
+
+
+class MetadataService:
+    """
+    文件元数据索引 (SQLite, WAL 模式)
+    
+    写入不在请求路径上执行: record/touch 只把记录放进内存队列,
+    由后台线程按批提交, 查询在线程池中通过只读连接执行。
+    删除同样交给后台线程, 与之前排队的记录按顺序提交。
+    """
+    
+    def __init__(
+        self,
+        db_path: Path = METADATA_DB_PATH,
+        enabled: bool = METADATA_ENABLED,
+        batch_size: int = METADATA_BATCH_SIZE,
+        flush_interval: float = METADATA_FLUSH_INTERVAL
+    ):
+        self.db_path = db_path
+        self.enabled = enabled
+        self.batch_size = batch_size
+        self.flush_interval = flush_interval
+        # 队列元素: 新记录 (元组) / 待删除的文件名 (列表和完成通知) / None (停止)
+        self._queue: "queue.Queue[Optional[tuple]]" = queue.Queue()
+        self._touches: Dict[str, float] = {}
+        self._touch_lock = threading.Lock()
+        self._local = threading.local()
+        self._writer: Optional[threading.Thread] = None
+    
+    def _connect(self) -> sqlite3.Connection:
+        conn = sqlite3.connect(self.db_path, timeout=30, check_same_thread=False)
+        conn.execute("PRAGMA journal_mode=WAL")
+        conn.execute("PRAGMA synchronous=NORMAL")
+        conn.row_factory = sqlite3.Row
+        return conn
+    
+    def start(self) -> None:
+        """创建数据表并启动后台写入线程 (应用启动时调用)"""
+        if not self.enabled or self._writer is not None:
+            return
+        
+        self.db_path.parent.mkdir(parents=True, exist_ok=True)
+        conn = self._connect()
+        conn.executescript(_SCHEMA)
+        columns = {row["name"] for row in conn.execute("PRAGMA table_info(files)")}
+        for column, column_type in _ADDED_COLUMNS.items():
+            if column not in columns:
+                conn.execute(f"ALTER TABLE files ADD COLUMN {column} {column_type}")
+        conn.executescript(_LIFECYCLE_SCHEMA)
+        conn.close()
+        
+        self._writer = threading.Thread(target=self._write_loop, name="metadata-writer", daemon=True)
+        self._writer.start()
+    
+    def stop(self) -> None:
+        """写入剩余记录并停止后台线程 (应用关闭时调用)"""
+        if self._writer is None:
+            return
+        self._queue.put(None)
+        self._writer.join()
+        self._writer = None
+    
+    def record(
+        self,
+        file_info: FileInfo,
+        sha256: Optional[str] = None,
+        source_url: Optional[str] = None,
+        expires_at: Optional[float] = None
+    ) -> None:
+        """
+        记录新保存的文件 (异步批量写入, 不阻塞调用方)
+        
+        Args:
+            file_info: 文件信息
+            sha256: 文件内容的 SHA-256(可选)
+            source_url: 来源 URL(可选)
+            expires_at: 过期时间戳(可选, 为空表示永久保留)
+        """
+        if not self.enabled:
+            return
+        now = time.time()
+        self._queue.put((
+            file_info.filename, file_info.size, file_info.format, sha256, source_url, now, now, expires_at,
+            file_info.width, file_info.height, file_info.duration, file_info.codec
+        ))
+    
+    def touch(self, filename: str) -> None:
+        """
+        记录文件被访问 (同一文件在一个批次内只写一次)
+        
+        Args:
+            filename: 文件名
+        """
+        if not self.enabled:
+            return
+        with self._touch_lock:
+            self._touches[filename] = time.time()
+    
+    def _write_loop(self) -> None:
+        conn = self._connect()
+        running = True
+        while running:
+            rows = []
+            removal = None
+            try:
+                item = self._queue.get(timeout=self.flush_interval)
+                while True:
+                    if item is None:
+                        running = False
+                        break
+                    if isinstance(item, _Removal):
+                        # 删除在之前排队的记录之后提交, 本批到此为止
+                        removal = item
+                        break
+                    rows.append(item)
+                    if len(rows) >= self.batch_size:
+                        break
+                    item = self._queue.get_nowait()
+            except queue.Empty:
+                pass
+            
+            with self._touch_lock:
+                touches, self._touches = self._touches, {}
+            
+            if rows or touches or removal:
+                try:
+                    with conn:
+                        if rows:
+                            conn.executemany(
+                                f"INSERT OR REPLACE INTO files ({_COLUMNS}) VALUES ({_PLACEHOLDERS})",
+                                rows
+                            )
+                        if touches:
+                            conn.executemany(
+                                "UPDATE files SET accessed_at = ? WHERE filename = ?",
+                                [(ts, name) for name, ts in touches.items()]
+                            )
+                        if removal:
+                            self._delete_names(conn, removal.filenames)
+                except sqlite3.Error as e:
+                    logger.error("元数据写入失败: %s", e)
+                    if removal:
+                        removal.future.set_exception(e)
+                else:
+                    if removal:
+                        removal.future.set_result(None)
+        conn.close()
+    
+    def _reader(self) -> sqlite3.Connection:
+        conn = getattr(self._local, "conn", None)
+        if conn is None:
+            conn = self._local.conn = self._connect()
+        return conn
+    
+    def _query_files(
+        self,
+        file_format: Optional[str],
+        created_after: Optional[float],
+        created_before: Optional[float],
+        cursor: Optional[Tuple[float, str]],
+        limit: int
+    ) -> List[sqlite3.Row]:
+        conditions = []
+        params: list = []
+        if file_format:
+            conditions.append("format = ?")
+            params.append(file_format)
+        if created_after is not None:
+            conditions.append("created_at >= ?")
+            params.append(created_after)
+        if created_before is not None:
+            conditions.append("created_at < ?")
+            params.append(created_before)
+        if cursor is not None:
+            conditions.append("(created_at, filename) < (?, ?)")
+            params.extend(cursor)
+        
+        where = f"WHERE {' AND '.join(conditions)}" if conditions else ""
+        sql = f"SELECT {_COLUMNS} FROM files {where} ORDER BY created_at DESC, filename DESC LIMIT ?"
+        return self._reader().execute(sql, [*params, limit]).fetchall()
+    
+    async def list_files(
+        self,
+        file_format: Optional[str] = None,
+        created_after: Optional[datetime] = None,
+        created_before: Optional[datetime] = None,
+        cursor: Optional[str] = None,
+        limit: int = 100
+    ) -> Tuple[List[dict], Optional[str]]:
+        """
+        分页列出文件 (按上传时间倒序, 基于游标翻页)
+        
+        Args:
+            file_format: 文件格式过滤(可选)
+            created_after: 上传时间下限(可选)
+            created_before: 上传时间上限(可选)
+            cursor: 上一页返回的游标(可选)
+            limit: 每页数量
+        
+        Returns:
+            Tuple[List[dict], Optional[str]]: (文件记录列表, 下一页游标)
+        
+        Raises:
+            ValueError: 游标无效
+        """
+        parsed_cursor = None
+        if cursor:
+            created_at, sep, filename = cursor.partition(":")
+            try:
+                parsed_cursor = (float(created_at), filename)
+            except ValueError:
+                raise ValueError(f"无效的游标: {cursor}")
+            if not sep:
+                raise ValueError(f"无效的游标: {cursor}")
+        
+        rows = await asyncio.to_thread(
+            self._query_files,
+            file_format,
+            created_after.timestamp() if created_after else None,
+            created_before.timestamp() if created_before else None,
+            parsed_cursor,
+            limit
+        )
+        next_cursor = None
+        if len(rows) == limit:
+            last = rows[-1]
+            next_cursor = f"{last['created_at']!r}:{last['filename']}"
+        return [dict(row) for row in rows], next_cursor
+    
+    def _query_names(self, filenames: List[str]) -> Dict[str, dict]:
+        found = {}
+        conn = self._reader()
+        for i in range(0, len(filenames), _SQL_PARAM_CHUNK):
+            chunk = filenames[i:i + _SQL_PARAM_CHUNK]
+            placeholders = ",".join("?" * len(chunk))
+            for row in conn.execute(f"SELECT {_COLUMNS} FROM files WHERE filename IN ({placeholders})", chunk):
+                found[row["filename"]] = dict(row)
+        return found
+    
+    async def get_files(self, filenames: List[str]) -> Dict[str, dict]:
+        """
+        批量查询文件记录
+        
+        Args:
+            filenames: 文件名列表
+        
+        Returns:
+            Dict[str, dict]: 文件名 -> 文件记录 (不存在的文件不包含在结果中)
+        """
+        if not filenames:
+            return {}
+        return await asyncio.to_thread(self._query_names, list(dict.fromkeys(filenames)))
+    
+    
+    def _query_expired(self, now: float, limit: int) -> List[sqlite3.Row]:
+        return self._reader().execute(
+            "SELECT filename, size, sha256 FROM files WHERE expires_at <= ? ORDER BY expires_at LIMIT ?",
+            (now, limit)
+        ).fetchall()
+    
+    async def expired_files(self, now: float, limit: int) -> List[dict]:
+        """
+        查询已过期的文件 (按过期时间顺序)
+        
+        Args:
+            now: 当前时间戳
+            limit: 最多返回的数量
+        
+        Returns:
+            List[dict]: 文件记录 (filename, size, sha256)
+        """
+        rows = await asyncio.to_thread(self._query_expired, now, limit)
+        return [dict(row) for row in rows]
+    
+    def _query_least_recent(self, limit: int) -> List[sqlite3.Row]:
+        return self._reader().execute(
+            "SELECT filename, size, sha256 FROM files ORDER BY accessed_at LIMIT ?",
+            (limit,)
+        ).fetchall()
+    
+    async def least_recently_accessed(self, limit: int) -> List[dict]:
+        """
+        查询最久未访问的文件 (访问时间由 touch 批量更新, 不依赖文件系统 atime)
+        
+        Args:
+            limit: 最多返回的数量
+        
+        Returns:
+            List[dict]: 文件记录 (filename, size, sha256)
+        """
+        rows = await asyncio.to_thread(self._query_least_recent, limit)
+        return [dict(row) for row in rows]
+    
+    async def total_size(self, distinct_content: bool = False) -> int:
+        """
+        统计索引中所有文件的总大小
+        
+        Args:
+            distinct_content: 相同 SHA-256 的文件只计算一次 (开启去重时多个文件名共享同一份内容)
+        
+        Returns:
+            int: 总字节数
+        """
+        if distinct_content:
+            sql = (
+                "SELECT COALESCE(SUM(size), 0) FROM ("
+                "SELECT size FROM files WHERE sha256 IS NULL "
+                "UNION ALL SELECT MAX(size) FROM files WHERE sha256 IS NOT NULL GROUP BY sha256)"
+            )
+        else:
+            sql = "SELECT COALESCE(SUM(size), 0) FROM files"
+        row = await asyncio.to_thread(lambda: self._reader().execute(sql).fetchone())
+        return row[0]
+    
+    def _query_references(self, hashes: List[str]) -> Dict[str, int]:
+        counts = {}
+        conn = self._reader()
+        for i in range(0, len(hashes), _SQL_PARAM_CHUNK):
+            chunk = hashes[i:i + _SQL_PARAM_CHUNK]
+            placeholders = ",".join("?" * len(chunk))
+            for row in conn.execute(
+                f"SELECT sha256, COUNT(*) FROM files WHERE sha256 IN ({placeholders}) GROUP BY sha256", chunk
+            ):
+                counts[row[0]] = row[1]
+        return counts
+    
+    async def reference_counts(self, hashes: List[str]) -> Dict[str, int]:
+        """
+        统计每个 SHA-256 被多少个文件名引用
+        
+        Args:
+            hashes: SHA-256 列表
+        
+        Returns:
+            Dict[str, int]: SHA-256 -> 引用数 (没有记录的不包含在结果中)
+        """
+        if not hashes:
+            return {}
+        return await asyncio.to_thread(self._query_references, list(dict.fromkeys(hashes)))
+    
+    @staticmethod
+    def _delete_names(conn: sqlite3.Connection, filenames: List[str]) -> None:
+        for i in range(0, len(filenames), _SQL_PARAM_CHUNK):
+            chunk = filenames[i:i + _SQL_PARAM_CHUNK]
+            placeholders = ",".join("?" * len(chunk))
+            conn.execute(f"DELETE FROM files WHERE filename IN ({placeholders})", chunk)
+    
+    async def remove(self, filenames: List[str]) -> None:
+        """
+        删除文件记录 (由后台写入线程提交, 返回后之后的查询不会再返回这些文件)
+        
+        Args:
+            filenames: 文件名列表
+        
+        Raises:
+            sqlite3.Error: 提交失败
+        """
+        if not self.enabled or not filenames or self._writer is None:
+            return
+        removal = _Removal(list(filenames), Future())
+        self._queue.put(removal)
+        await asyncio.wrap_future(removal.future)
+
+
+# 创建全局实例
+metadata_service = MetadataService()
@@ -0,0 +1,171 @@
+import asyncio
+import json
+import logging
+import os
+import uuid
+from pathlib import Path
+from typing import Dict, List, Optional
+from config import METRICS_ENABLED, METRICS_DIR, METRICS_FLUSH_INTERVAL
+from utils import metrics
+
+# fcntl 仅在类 Unix 系统可用, 不可用时 /metrics 只返回处理该请求的进程的指标
+try:
+    import fcntl
+except ImportError:
+    fcntl = None
+
+logger = logging.getLogger(__name__)
+
+# 已退出进程的计数器和直方图合并后保存在该文件中
+_ARCHIVE_NAME = "archive.json"
+
+
+class MetricsService:
+    """
+    多 worker 进程的指标汇总
+    
+    指标记录在各进程内存中。每个进程每隔 flush_interval 秒把本进程的指标快照写入共享目录
+    (<进程号>-<随机串>.json), 采集时合并目录中所有快照和本进程的最新指标,
+    因此任一 worker 返回的都是整个服务的指标 (其他进程的数据最多滞后 flush_interval 秒)。
+    
+    每个进程持有与快照同名的 .lock 文件的排他锁 (flock) 直到退出。采集时锁已释放的快照属于
+    已退出的进程: 其计数器和直方图并入 archive.json 后删除快照, 仪表值 (gauge) 直接丢弃,
+    目录中的文件数量不随 worker 重启增长。
+    """
+    
+    def __init__(
+        self,
+        enabled: bool = METRICS_ENABLED,
+        directory: Path = METRICS_DIR,
+        flush_interval: float = METRICS_FLUSH_INTERVAL
+    ):
+        self.enabled = enabled
+        self.directory = directory
+        self.flush_interval = flush_interval
+        self._name = f"{os.getpid()}-{uuid.uuid4().hex[:8]}"
+        self._lock_fd: Optional[int] = None
+        self._task: Optional[asyncio.Task] = None
+    
+    @property
+    def shared(self) -> bool:
+        """是否与其他进程共享指标"""
+        return self._lock_fd is not None
+    
+    def start(self) -> None:
+        """锁定本进程的快照并启动定期写出任务 (应用启动时调用)"""
+        if not self.enabled or fcntl is None or self._lock_fd is not None:
+            return
+        self.directory.mkdir(parents=True, exist_ok=True)
+        fd = os.open(self.directory / f"{self._name}.lock", os.O_RDWR | os.O_CREAT, 0o644)
+        fcntl.flock(fd, fcntl.LOCK_EX)
+        self._lock_fd = fd
+        self._write(json.dumps(metrics.snapshot()))
+        self._task = asyncio.create_task(self._run())
+    
+    async def stop(self) -> None:
+        """写出最终快照并释放锁 (应用关闭时调用, 之后的采集会将其并入 archive.json)"""
+        if self._task is not None:
+            self._task.cancel()
+            try:
+                await self._task
+            except asyncio.CancelledError:
+                pass
+            self._task = None
+        if self._lock_fd is not None:
+            try:
+                self._write(json.dumps(metrics.snapshot()))
+            except OSError as e:
+                logger.warning("写入指标快照失败: %s", e)
+            os.close(self._lock_fd)
+            self._lock_fd = None
+    
+    async def render(self) -> str:
+        """
+        导出所有进程汇总后的指标 (Prometheus 文本格式)
+        
+        Returns:
+            str: 指标文本
+        """
+        if not self.shared:
+            return metrics.render()
+        # 在事件循环中取本进程的快照, 避免与正在记录的指标并发读写
+        local = metrics.snapshot()
+        others = await asyncio.to_thread(self._collect)
+        return metrics.render([local, *others])
+    
+    async def _run(self) -> None:
+        while True:
+            await asyncio.sleep(self.flush_interval)
+            try:
+                await asyncio.to_thread(self._write, json.dumps(metrics.snapshot()))
+            except OSError as e:
+                logger.warning("写入指标快照失败: %s", e)
+    
+    def _write(self, data: str) -> None:
+        # 先写临时文件再重命名, 采集时不会读到写了一半的快照
+        temp_path = self.directory / f".{self._name}.tmp"
+        with open(temp_path, "w", encoding="utf-8") as file:
+            file.write(data)
+        os.replace(temp_path, self.directory / f"{self._name}.json")
+    
+    def _collect(self) -> List[Dict[str, list]]:
+        """读取其他进程的快照, 并把已退出进程的快照并入 archive.json"""
+        archive_path = self.directory / _ARCHIVE_NAME
+        merge_fd = os.open(self.directory / ".merge.lock", os.O_RDWR | os.O_CREAT, 0o644)
+        try:
+            # 多个进程同时采集时只有一个进程归档同一份快照
+            fcntl.flock(merge_fd, fcntl.LOCK_EX)
+            snapshots = []
+            retired = []
+            for path in self.directory.glob("*.json"):
+                if path.name == _ARCHIVE_NAME or path.stem == self._name:
+                    continue
+                data = _read_snapshot(path)
+                if data is None:
+                    continue
+                if _alive(path.with_suffix(".lock")):
+                    snapshots.append(data)
+                else:
+                    retired.append((path, data))
+            
+            archive = _read_snapshot(archive_path) or {}
+            if retired:
+                archive = metrics.merge_snapshots(
+                    [archive, *(data for _, data in retired)], include_gauges=False
+                )
+                temp_path = self.directory / f".{_ARCHIVE_NAME}.tmp"
+                temp_path.write_text(json.dumps(archive), encoding="utf-8")
+                os.replace(temp_path, archive_path)
+                for path, _ in retired:
+                    path.unlink(missing_ok=True)
+                    path.with_suffix(".lock").unlink(missing_ok=True)
+            snapshots.append(archive)
+            return snapshots
+        finally:
+            os.close(merge_fd)
+
+
+def _read_snapshot(path: Path) -> Optional[Dict[str, list]]:
+    try:
+        return json.loads(path.read_text(encoding="utf-8"))
+    except (FileNotFoundError, ValueError):
+        return None
+
+
+def _alive(lock_path: Path) -> bool:
+    # 能拿到排他锁说明持有锁的进程已退出 (进程崩溃时由内核释放)
+    try:
+        fd = os.open(lock_path, os.O_RDWR)
+    except FileNotFoundError:
+        return False
+    try:
+        fcntl.flock(fd, fcntl.LOCK_EX | fcntl.LOCK_NB)
+    except OSError:
+        return True
+    finally:
+        os.close(fd)
+    return False
+
+
+# 创建全局实例
+metrics_service = MetricsService()
@@ -0,0 +1,320 @@
+import hashlib
+import json
+import logging
+import math
+import os
+import shutil
+import time
+import uuid
+from pathlib import Path
+from typing import List, NamedTuple, Optional
+from config import UPLOAD_DIR, STORAGE_ROOTS, STORAGE_LAYOUT_RELOAD
+
+logger = logging.getLogger(__name__)
+
+# 布局文件名 (位于主目录, 以 . 开头不会被当作上传的文件)
+LAYOUT_FILENAME = ".layout.json"
+
+# 主目录 (UPLOAD_DIR) 的根目录 ID
+PRIMARY_ROOT_ID = "primary"
+
+
+class StorageRoot(NamedTuple):
+    """存储根目录"""
+    id: str
+    path: Path
+    weight: float
+    readonly: bool = False
+
+
+def free_space_weight(path: Path) -> float:
+    """
+    按剩余空间计算根目录的权重 (GiB)
+    
+    Args:
+        path: 根目录
+    
+    Returns:
+        float: 权重
+    """
+    return max(round(shutil.disk_usage(path).free / 2 ** 30, 3), 0.001)
+
+
+def _score(root: StorageRoot, filename: str) -> float:
+    # 加权 rendezvous 哈希: 每个 (根目录, 文件名) 得到 (0, 1) 内的均匀随机数 u, 得分 -w / ln(u) 最高者胜出;
+    # 增删根目录或调整权重时只有归属发生变化的那部分文件需要移动
+    digest = hashlib.md5(f"{root.id}/{filename}".encode("utf-8"), usedforsecurity=False).digest()
+    u = (int.from_bytes(digest[:8], "big") + 1) / (2 ** 64 + 1)
+    return -root.weight / math.log(u)
+
+
+def place(roots: List[StorageRoot], filename: str) -> StorageRoot:
+    """
+    计算文件在一组根目录中的位置 (只在可写的根目录中选择)
+    
+    Args:
+        roots: 根目录列表
+        filename: 文件名
+    
+    Returns:
+        StorageRoot: 文件所在的根目录
+    """
+    writable = [root for root in roots if not root.readonly] or roots
+    if len(writable) == 1:
+        return writable[0]
+    return max(writable, key=lambda root: _score(root, filename))
+
+
+class StorageLayout:
+    """
+    多个存储根目录 (多块磁盘) 的文件布局
+    
+    文件按文件名的加权一致性哈希 (rendezvous) 分布到各根目录, 权重在加入根目录时按剩余空间确定
+    并保存在布局文件中, 之后不随使用量变化, 因此查找文件不需要扫描目录, 直链也与布局无关。
+    
+    调整布局 (加入根目录、设为只读排空) 时, 旧布局保留在 previous 中直到
+    tools.rebalance_storage 把文件移动到新位置: 查找依次检查新旧布局计算出的位置,
+    最多检查几个固定的路径。
+    
+    只有一个根目录且没有布局文件时不创建布局文件, 行为与单目录存储相同。
+    """
+    
+    def __init__(
+        self,
+        primary: Path = UPLOAD_DIR,
+        extra_roots: Optional[List[Path]] = None,
+        reload_interval: float = STORAGE_LAYOUT_RELOAD
+    ):
+        self.primary = primary
+        self.path = primary / LAYOUT_FILENAME
+        self.reload_interval = reload_interval
+        self.roots: List[StorageRoot] = []
+        self.previous: List[List[StorageRoot]] = []
+        self._mtime_ns: Optional[int] = None
+        self._next_check = 0.0
+        
+        extra_roots = STORAGE_ROOTS if extra_roots is None else extra_roots
+        if not self._load() and extra_roots:
+            self._create(extra_roots)
+        for root in self.all_roots():
+            root.path.mkdir(parents=True, exist_ok=True)
+    
+    def _default_roots(self) -> List[StorageRoot]:
+        return [StorageRoot(PRIMARY_ROOT_ID, self.primary, 1.0)]
+    
+    def _load(self) -> bool:
+        try:
+            stat_result = os.stat(self.path)
+            with open(self.path, "r", encoding="utf-8") as file:
+                data = json.load(file)
+        except FileNotFoundError:
+            self.roots, self.previous, self._mtime_ns = self._default_roots(), [], None
+            return False
+        
+        def parse(items: List[dict]) -> List[StorageRoot]:
+            # 主目录始终以 UPLOAD_DIR 为准, 上传目录整体搬迁后布局仍然有效
+            return [
+                StorageRoot(
+                    item["id"],
+                    self.primary if item["id"] == PRIMARY_ROOT_ID else Path(item["path"]),
+                    float(item["weight"]),
+                    bool(item.get("readonly"))
+                )
+                for item in items
+            ]
+        
+        self.roots = parse(data["roots"])
+        self.previous = [parse(generation) for generation in data.get("previous", [])]
+        self._mtime_ns = stat_result.st_mtime_ns
+        return True
+    
+    def _create(self, extra_roots: List[Path]) -> None:
+        # 首次启动时按剩余空间确定权重; 多个 worker 同时启动时只有一个能创建, 其余读取它的结果
+        paths = [self.primary] + [path for path in extra_roots if path.resolve() != self.primary.resolve()]
+        for path in paths:
+            path.mkdir(parents=True, exist_ok=True)
+        self.roots = [
+            StorageRoot(PRIMARY_ROOT_ID if index == 0 else uuid.uuid4().hex, path.resolve(), free_space_weight(path))
+            for index, path in enumerate(paths)
+        ]
+        self.previous = []
+        temp_path = self.primary / f".{uuid.uuid4().hex}.layout"
+        self._write(temp_path)
+        try:
+            os.link(temp_path, self.path)
+        except FileExistsError:
+            pass
+        finally:
+            os.remove(temp_path)
+        self._load()
+    
+    def _write(self, path: Path) -> None:
+        def dump(roots: List[StorageRoot]) -> List[dict]:
+            return [
+                {"id": root.id, "path": str(root.path), "weight": root.weight, "readonly": root.readonly}
+                for root in roots
+            ]
+        
+        data = {"roots": dump(self.roots), "previous": [dump(generation) for generation in self.previous]}
+        with open(path, "w", encoding="utf-8") as file:
+            json.dump(data, file, ensure_ascii=False, indent=2)
+            file.flush()
+            os.fsync(file.fileno())
+    
+    def save(self) -> None:
+        """原子写入布局文件 (运行中的服务在 STORAGE_LAYOUT_RELOAD 秒内生效)"""
+        temp_path = self.primary / f".{uuid.uuid4().hex}.layout"
+        self._write(temp_path)
+        os.replace(temp_path, self.path)
+        self._mtime_ns = os.stat(self.path).st_mtime_ns
+    
+    def refresh(self) -> None:
+        """布局文件变化时重新加载 (每 reload_interval 秒最多检查一次)"""
+        now = time.monotonic()
+        if now < self._next_check:
+            return
+        self._next_check = now + self.reload_interval
+        try:
+            mtime_ns = os.stat(self.path).st_mtime_ns
+        except FileNotFoundError:
+            mtime_ns = None
+        if mtime_ns != self._mtime_ns:
+            try:
+                self._load()
+            except (OSError, ValueError, KeyError) as e:
+                logger.error("加载存储布局失败, 继续使用当前布局: %s", e)
+                return
+            for root in self.all_roots():
+                root.path.mkdir(parents=True, exist_ok=True)
+            logger.info("存储布局已更新: %d 个根目录, %d 个待迁移的旧布局", len(self.roots), len(self.previous))
+    
+    def all_roots(self) -> List[StorageRoot]:
+        """
+        当前和旧布局中出现的所有根目录 (按 ID 去重)
+        
+        Returns:
+            List[StorageRoot]: 根目录列表
+        """
+        seen = {}
+        for generation in [self.roots] + self.previous:
+            for root in generation:
+                seen.setdefault(root.id, root)
+        return list(seen.values())
+    
+    def place(self, filename: str) -> StorageRoot:
+        """
+        新文件的写入位置
+        
+        Args:
+            filename: 文件名
+        
+        Returns:
+            StorageRoot: 根目录
+        """
+        return place(self.roots, filename)
+    
+    def candidates(self, filename: str) -> List[StorageRoot]:
+        """
+        查找文件时依次检查的根目录: 当前布局的位置, 然后是尚未迁移完成的旧布局中的位置
+        
+        Args:
+            filename: 文件名
+        
+        Returns:
+            List[StorageRoot]: 根目录列表 (去重)
+        """
+        if not self.previous:
+            return [place(self.roots, filename)]
+        result = []
+        for generation in [self.roots] + self.previous:
+            root = place(generation, filename)
+            if all(root.id != known.id for known in result):
+                result.append(root)
+        return result
+    
+    def find(self, path: Path) -> Optional[StorageRoot]:
+        """
+        按路径查找根目录
+        
+        Args:
+            path: 根目录路径
+        
+        Returns:
+            Optional[StorageRoot]: 根目录, 不在布局中时返回 None
+        """
+        resolved = path.resolve()
+        for root in self.all_roots():
+            if root.path.resolve() == resolved:
+                return root
+        return None
+    
+    def _change(self, roots: List[StorageRoot]) -> None:
+        # 当前布局进入 previous, 直到 rebalance 完成
+        self.previous.insert(0, self.roots)
+        self.roots = roots
+    
+    def add_root(self, path: Path, weight: Optional[float] = None) -> StorageRoot:
+        """
+        加入根目录 (权重默认按剩余空间)
+        
+        Args:
+            path: 根目录
+            weight: 权重(可选)
+        
+        Returns:
+            StorageRoot: 新的根目录
+        
+        Raises:
+            ValueError: 根目录已在布局中
+        """
+        if self.find(path) is not None:
+            raise ValueError(f"根目录已在布局中: {path}")
+        path.mkdir(parents=True, exist_ok=True)
+        if self._mtime_ns is None:
+            # 还没有布局文件 (单目录): 主目录同样按剩余空间确定权重
+            self.roots = [StorageRoot(PRIMARY_ROOT_ID, self.primary.resolve(), free_space_weight(self.primary))]
+        root = StorageRoot(uuid.uuid4().hex, path.resolve(), weight or free_space_weight(path))
+        self._change(self.roots + [root])
+        return root
+    
+    def set_readonly(self, path: Path, readonly: bool) -> None:
+        """
+        设置根目录只读 (排空: 不再写入新文件, 已有文件由 rebalance 移走) 或恢复可写
+        
+        Args:
+            path: 根目录
+            readonly: 是否只读
+        
+        Raises:
+            ValueError: 根目录不在当前布局中, 或没有其他可写的根目录
+        """
+        target = self.find(path)
+        if target is None or all(root.id != target.id for root in self.roots):
+            raise ValueError(f"根目录不在当前布局中: {path}")
+        roots = [root._replace(readonly=readonly) if root.id == target.id else root for root in self.roots]
+        if all(root.readonly for root in roots):
+            raise ValueError("至少需要保留一个可写的根目录")
+        self._change(roots)
+    
+    def remove_root(self, path: Path) -> None:
+        """
+        从布局中移除已排空的根目录
+        
+        Args:
+            path: 根目录
+        
+        Raises:
+            ValueError: 根目录不存在、不是只读, 或仍有未完成的迁移
+        """
+        target = self.find(path)
+        if target is None or target.id == PRIMARY_ROOT_ID:
+            raise ValueError(f"只能移除主目录以外、布局中已有的根目录: {path}")
+        if self.previous:
+            raise ValueError("请先完成 rebalance")
+        if not any(root.id == target.id and root.readonly for root in self.roots):
+            raise ValueError(f"请先将根目录设为只读并完成 rebalance: {path}")
+        self.roots = [root for root in self.roots if root.id != target.id]
+    
+    def finish_rebalance(self) -> None:
+        """所有文件都已位于当前布局的位置, 丢弃旧布局"""
+        self.previous = []
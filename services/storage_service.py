@@ -1,14 +1,227 @@
+import asyncio
+import errno
+import hashlib
+import os
+import shutil
+import uuid
 from pathlib import Path
-import aiofiles
-from config import UPLOAD_DIR
+from typing import Callable, List, Optional, Tuple
+from config import (
+    UPLOAD_DIR,
+    UPLOAD_CHUNK_SIZE,
+    STORAGE_DEDUP,
+    STORAGE_SHARD_DEPTH,
+    STORAGE_SHARD_WIDTH
+)
+from services.hot_cache_service import hot_cache_service
+from services.storage_io import StorageIO, storage_io
+from services.storage_layout import StorageLayout
+from services.volume_service import VolumeService, volume_service
+
+
+class StorageWriter:
+    """流式写入器: 分块写入临时文件, 提交时原子重命名到最终文件名"""
+    
+    def __init__(
+        self,
+        storage: "StorageService",
+        filename: str,
+        max_size: Optional[int] = None,
+        buffer_size: int = UPLOAD_CHUNK_SIZE,
+        compute_hash: bool = False,
+        temp_path: Optional[Path] = None
+    ):
+        self.storage = storage
+        self.filename = filename
+        self.max_size = max_size
+        self.buffer_size = buffer_size
+        self.temp_path = temp_path or storage.get_temp_path(filename)
+        self.size = 0
+        self.sha256: Optional[str] = None
+        self._hasher = hashlib.sha256() if storage.dedup or compute_hash else None
+        # 接管已写好的文件或改写后, 哈希需要从磁盘重新计算
+        self._hash_stale = temp_path is not None
+        # 临时文件是否已完整写入磁盘 (首次落盘前数据只在缓冲区中)
+        self._on_disk = temp_path is not None
+        # 接管的文件属于调用方 (如分块上传的数据文件), 放弃写入时保留
+        self._adopted = temp_path is not None
+        self._buffer = bytearray()
+        self._fd: Optional[int] = None
+        self._closed = False
+    
+    async def __aenter__(self) -> "StorageWriter":
+        if self._on_disk:
+            self.size = (await self.storage.io.run(os.stat, self.temp_path)).st_size
+        return self
+    
+    async def __aexit__(self, exc_type, exc, tb) -> None:
+        if not self._closed:
+            await self.abort()
+    
+    async def write(self, chunk: bytes) -> None:
+        """
+        写入一个数据块
+        
+        Args:
+            chunk: 数据块
+        
+        Raises:
+            ValueError: 累计大小超过限制
+        """
+        self.size += len(chunk)
+        if self.max_size is not None and self.size > self.max_size:
+            raise ValueError(f"文件过大: 超过 {self.max_size} 字节")
+        
+        self._buffer += chunk
+        if len(self._buffer) >= self.buffer_size:
+            await self._flush()
+    
+    async def _flush(self) -> None:
+        if self._buffer:
+            # 临时文件在第一次落盘时才创建, 写入卷存储的小文件不会产生临时文件
+            if self._fd is None:
+                self._fd = await self.storage.io.run(_open_temp, self.temp_path)
+            data = bytes(self._buffer)
+            self._buffer.clear()
+            if self._hasher is None:
+                await self.storage.io.run(_write_all, self._fd, data)
+            else:
+                # 哈希计算 (默认线程池) 与磁盘写入 (存储线程池) 并行, 都不占用事件循环
+                await asyncio.gather(
+                    asyncio.to_thread(self._hasher.update, data),
+                    self.storage.io.run(_write_all, self._fd, data)
+                )
+    
+    async def _close_file(self) -> None:
+        if self._on_disk:
+            return
+        if self._fd is None:
+            self._fd = await self.storage.io.run(_open_temp, self.temp_path)
+        await self._flush()
+        fd, self._fd = self._fd, None
+        await self.storage.io.run(os.close, fd)
+        self._on_disk = True
+    
+    async def rewrite(self, transform: Callable[[str, str], bool]) -> bool:
+        """
+        提交前改写已写入的内容 (在线程池中执行, 如视频 faststart)
+        
+        调用后不能再 write, 只能 commit 或 abort。
+        
+        Args:
+            transform: transform(源路径, 目标路径), 生成了新文件时返回 True
+        
+        Returns:
+            bool: 内容是否被改写
+        """
+        await self._close_file()
+        # 与原临时文件位于同一目录, 替换是原子的
+        new_path = self.temp_path.with_name(f".{uuid.uuid4().hex}.part")
+        try:
+            changed = await asyncio.to_thread(transform, str(self.temp_path), str(new_path))
+        except BaseException:
+            await self.storage.io.run(_remove_quietly, new_path)
+            raise
+        if not changed:
+            await self.storage.io.run(_remove_quietly, new_path)
+            return False
+        
+        await self.storage.io.run(os.replace, new_path, self.temp_path)
+        self.size = (await self.storage.io.run(os.stat, self.temp_path)).st_size
+        self._hash_stale = True
+        return True
+    
+    async def commit(self) -> Path:
+        """
+        完成写入并原子重命名到最终位置
+        
+        数据未超过缓冲区且不大于 VOLUME_SMALL_FILE_MAX 时, 改为追加写入卷存储。
+        开启 STORAGE_FSYNC 时, 返回前数据和目录项都已落盘。
+        
+        Returns:
+            Path: 保存后的文件路径 (写入卷存储时为卷文件路径)
+        """
+        if not self._on_disk and self._fd is None and self.storage.volumes.accepts(len(self._buffer)):
+            data = bytes(self._buffer)
+            self._buffer.clear()
+            self._closed = True
+            if self._hasher is not None:
+                self._hasher.update(data)
+                self.sha256 = self._hasher.hexdigest()
+            location = await self.storage.volumes.put(self.filename, data)
+            return location.path
+        
+        await self._close_file()
+        self._closed = True
+        if self._hasher is not None:
+            if self._hash_stale:
+                self._hasher = await asyncio.to_thread(_hash_file, self.temp_path)
+            self.sha256 = self._hasher.hexdigest()
+        return await self.storage.commit_file(self.temp_path, self.filename, self.sha256)
+    
+    async def abort(self) -> None:
+        """放弃写入并删除临时文件 (接管的文件保留给调用方)"""
+        self._closed = True
+        self._buffer.clear()
+        if self._fd is not None:
+            fd, self._fd = self._fd, None
+            await self.storage.io.run(os.close, fd)
+        if not self._adopted:
+            await self.storage.io.run(_remove_quietly, self.temp_path)
+
+
+def _open_temp(path: Path) -> int:
+    return os.open(path, os.O_WRONLY | os.O_CREAT | os.O_TRUNC | getattr(os, "O_BINARY", 0), 0o644)
+
+
+def _write_all(fd: int, data: bytes) -> None:
+    view = memoryview(data)
+    while view:
+        view = view[os.write(fd, view):]
+
+
+def _remove_quietly(path: Path) -> None:
+    try:
+        os.remove(path)
+    except FileNotFoundError:
+        pass
+
+
+def _hash_file(path: Path) -> "hashlib._Hash":
+    hasher = hashlib.sha256()
+    with open(path, "rb") as file:
+        while chunk := file.read(UPLOAD_CHUNK_SIZE):
+            hasher.update(chunk)
+    return hasher
 
 
 class StorageService:
-    """存储管理服务"""
+    """
+    存储管理服务
+    
+    文件可分布在多个根目录 (多块磁盘) 上, 按文件名的加权一致性哈希定位, 见 StorageLayout。
+    """
     
-    def __init__(self, base_dir: Path = UPLOAD_DIR):
+    def __init__(
+        self,
+        base_dir: Path = UPLOAD_DIR,
+        dedup: bool = STORAGE_DEDUP,
+        shard_depth: int = STORAGE_SHARD_DEPTH,
+        shard_width: int = STORAGE_SHARD_WIDTH,
+        volumes: VolumeService = volume_service,
+        layout: Optional[StorageLayout] = None,
+        io: StorageIO = storage_io
+    ):
         self.base_dir = base_dir
         self.base_dir.mkdir(parents=True, exist_ok=True)
+        self.dedup = dedup
+        self.blob_dir = self.base_dir / ".blobs"
+        self.shard_depth = shard_depth
+        self.shard_width = shard_width
+        self.volumes = volumes
+        self.layout = layout or StorageLayout(base_dir)
+        self.io = io
+        self._known_dirs = set()
     
     async def save_file(self, content: bytes, filename: str) -> Path:
         """
@@ -21,16 +234,233 @@ class StorageService:
         Returns:
             Path: 保存后的文件路径
         """
-        file_path = self.base_dir / filename
+        async with self.open_writer(filename) as writer:
+            await writer.write(content)
+            return await writer.commit()
+    
+    def open_writer(
+        self,
+        filename: str,
+        max_size: Optional[int] = None,
+        compute_hash: bool = False
+    ) -> StorageWriter:
+        """
+        打开流式写入器
         
-        async with aiofiles.open(file_path, "wb") as f:
-            await f.write(content)
+        数据先写入目标根目录下的隐藏临时文件, commit 时原子重命名,
+        因此直链永远不会指向写了一半的文件。
+        
+        Args:
+            filename: 最终文件名
+            max_size: 最大允许字节数(可选)
+            compute_hash: 是否计算内容 SHA-256 (开启去重时总是计算)
         
+        Returns:
+            StorageWriter: 写入器 (需配合 async with 使用)
+        """
+        return StorageWriter(self, filename, max_size=max_size, compute_hash=compute_hash)
+    
+    def adopt_file(self, temp_path: Path, filename: str, compute_hash: bool = False) -> StorageWriter:
+        """
+        接管已在上传目录中写好的临时文件 (如分块上传), 提交时原地重命名, 不复制数据;
+        提交失败时文件保留在原位置 (rewrite 改写过的内容除外)
+        
+        Args:
+            temp_path: 临时文件路径 (与目标根目录不在同一文件系统时提交会复制数据)
+            filename: 最终文件名
+            compute_hash: 是否计算内容 SHA-256 (开启去重时总是计算)
+        
+        Returns:
+            StorageWriter: 写入器 (不可再 write, 需配合 async with 使用)
+        """
+        return StorageWriter(self, filename, compute_hash=compute_hash, temp_path=temp_path)
+    
+    async def commit_file(self, temp_path: Path, filename: str, sha256: Optional[str] = None) -> Path:
+        """
+        将写好的临时文件提交为正式文件
+        
+        开启去重时, 相同内容只保存一份 (.blobs/<sha256>), 各个文件名通过
+        硬链接指向同一份数据, 引用计数即 inode 的链接数。
+        
+        开启 STORAGE_FSYNC 时, 重命名前 fsync 临时文件, 重命名后 fsync 所在目录,
+        返回时文件在断电后仍然完整存在。
+        
+        Args:
+            temp_path: 临时文件路径
+            filename: 最终文件名
+            sha256: 文件内容的 SHA-256 (开启去重时提供)
+        
+        Returns:
+            Path: 保存后的文件路径
+        """
+        self.layout.refresh()
+        root = self.layout.place(filename).path
+        file_path = self.get_shard_dir(filename, root) / filename
+        # 数据先于目录项落盘, 断电后不会出现指向空文件的文件名
+        await self.io.sync(temp_path)
+        created = await self._ensure_parent(file_path, root)
+        try:
+            if self.dedup and sha256:
+                blob_path = self.get_blob_path(sha256, root)
+                created += await self._ensure_parent(blob_path, root)
+                await self.io.run(self._commit_blob, temp_path, file_path, blob_path)
+                await self.io.sync(file_path.parent, blob_path.parent, *created)
+            else:
+                await self.io.run(os.replace, temp_path, file_path)
+                await self.io.sync(file_path.parent, *created)
+        except OSError as e:
+            if e.errno != errno.EXDEV:
+                raise
+            # 临时文件在另一块磁盘上 (如分块上传的数据文件, 或写入期间布局发生变化): 先复制到目标根目录
+            local_path = root / f".{uuid.uuid4().hex}.part"
+            try:
+                await self.io.run(shutil.copyfile, temp_path, local_path)
+                file_path = await self.commit_file(local_path, filename, sha256)
+            finally:
+                await self.io.run(_remove_quietly, local_path)
+            # 提交成功后才删除原临时文件, 失败时由写入方决定是否保留
+            await self.io.run(_remove_quietly, temp_path)
         return file_path
     
+    def _commit_blob(self, temp_path: Path, file_path: Path, blob_path: Path) -> None:
+        try:
+            # 新内容: 临时文件成为 blob, 再以最终文件名提交同一个 inode
+            os.link(temp_path, blob_path)
+        except FileExistsError:
+            # 重复内容: 丢弃本次数据, 直接链接到已有 blob
+            try:
+                os.link(blob_path, file_path)
+            except FileNotFoundError:
+                # blob 恰好被回收, 退回普通提交
+                os.replace(temp_path, file_path)
+                return
+            os.remove(temp_path)
+        else:
+            os.replace(temp_path, file_path)
+    
+    def get_blob_path(self, sha256: str, root: Optional[Path] = None) -> Path:
+        """
+        获取内容寻址的 blob 路径 (硬链接不能跨磁盘, 每个根目录有各自的 blob)
+        
+        Args:
+            sha256: 文件内容的 SHA-256
+            root: 根目录(可选, 默认 base_dir)
+        
+        Returns:
+            Path: blob 路径
+        """
+        blob_dir = self.blob_dir if root is None else root / ".blobs"
+        return blob_dir / sha256[:2] / sha256
+    
+    async def delete_file(self, filename: str, sha256: Optional[str] = None) -> bool:
+        """
+        删除文件
+        
+        开启去重时, 若提供了内容哈希且已没有其他文件名引用该 blob, 一并回收 blob;
+        未提供哈希时, 孤立的 blob 由 collect_garbage 统一回收。
+        
+        Args:
+            filename: 文件名
+            sha256: 文件内容的 SHA-256(可选)
+        
+        Returns:
+            bool: 文件是否存在并被删除
+        """
+        # 删除前后各失效一次热点缓存: 删除前阻止新的命中, 删除后丢弃删除期间载入的旧内容
+        await self.io.run(hot_cache_service.invalidate, filename)
+        try:
+            located = self._locate(filename)
+            if located is None:
+                return await self.volumes.delete(filename) if self.is_valid_filename(filename) else False
+            file_path, root = located
+            try:
+                await self.io.run(os.remove, file_path)
+            except FileNotFoundError:
+                return False
+        finally:
+            await self.io.run(hot_cache_service.invalidate, filename)
+        
+        if self.dedup and sha256:
+            await self.io.run(self._release_blob, self.get_blob_path(sha256, root))
+        return True
+    
+    @staticmethod
+    def _release_blob(blob_path: Path) -> None:
+        try:
+            if os.stat(blob_path).st_nlink <= 1:
+                os.remove(blob_path)
+        except FileNotFoundError:
+            pass
+    
+    def collect_garbage(self) -> int:
+        """
+        回收没有任何文件名引用的 blob (链接数为 1)
+        
+        Returns:
+            int: 回收的 blob 数量
+        """
+        removed = 0
+        for root in self.layout.all_roots():
+            blob_dir = root.path / ".blobs"
+            if not blob_dir.exists():
+                continue
+            for shard in os.scandir(blob_dir):
+                if not shard.is_dir():
+                    continue
+                for entry in os.scandir(shard.path):
+                    if entry.stat().st_nlink <= 1:
+                        self._release_blob(Path(entry.path))
+                        removed += 1
+        return removed
+    
+    def get_temp_path(self, filename: Optional[str] = None) -> Path:
+        """
+        生成临时文件路径 (与最终文件位于同一根目录, 保证重命名是原子的)
+        
+        Args:
+            filename: 最终文件名(可选, 默认位于 base_dir)
+        
+        Returns:
+            Path: 临时文件路径
+        """
+        root = self.layout.place(filename).path if filename else self.base_dir
+        return root / f".{uuid.uuid4().hex}.part"
+    
+    def get_shard_dir(self, filename: str, root: Optional[Path] = None) -> Path:
+        """
+        获取文件所在的分片目录
+        
+        分片由文件名的哈希决定 (如 ab/cd/), 与文件内容无关, 直链因此保持不变。
+        
+        Args:
+            filename: 文件名
+            root: 根目录(可选, 默认为文件在当前布局中的根目录)
+        
+        Returns:
+            Path: 分片目录 (未开启分片时为根目录)
+        """
+        if root is None:
+            root = self.layout.place(filename).path
+        if not self.shard_depth:
+            return root
+        
+        digest = hashlib.md5(filename.encode("utf-8"), usedforsecurity=False).hexdigest()
+        width = self.shard_width
+        parts = [digest[i * width:(i + 1) * width] for i in range(self.shard_depth)]
+        return root.joinpath(*parts)
+    
+    async def _ensure_parent(self, file_path: Path, root: Path) -> List[Path]:
+        # 返回需要随提交一起落盘的上级目录: 本进程首次使用的目录, 其目录项可能刚刚创建
+        parent = file_path.parent
+        if parent in self._known_dirs:
+            return []
+        await self.io.run(lambda: os.makedirs(parent, exist_ok=True))
+        self._known_dirs.add(parent)
+        return [path for path in parent.parents if path == root or root in path.parents]
+    
     def get_file_path(self, filename: str) -> Path:
         """
-        获取文件路径
+        获取文件在当前布局中的路径 (新文件的写入位置)
         
         Args:
             filename: 文件名
@@ -38,9 +468,55 @@ class StorageService:
         Returns:
             Path: 文件路径
         """
-        return self.base_dir / filename
+        self.layout.refresh()
+        return self.get_shard_dir(filename) / filename
+    
+    @staticmethod
+    def is_valid_filename(filename: str) -> bool:
+        """
+        检查文件名能否对外访问 (拒绝路径穿越和内部使用的隐藏文件)
+        
+        Args:
+            filename: 文件名
+        
+        Returns:
+            bool: 是否合法
+        """
+        return bool(filename) and not filename.startswith(".") and not any(c in filename for c in "/\\\0")
+    
+    def resolve_file_path(self, filename: str) -> Optional[Path]:
+        """
+        查找文件的实际路径
+        
+        优先查找分片目录; 迁移到分片布局期间, 尚未迁移的文件仍可从平铺目录找到。
+        调整多磁盘布局后、rebalance 完成之前, 依次查找新旧布局计算出的位置 (不扫描目录)。
+        
+        Args:
+            filename: 文件名
+        
+        Returns:
+            Optional[Path]: 文件路径, 不存在时返回 None
+        """
+        located = self._locate(filename)
+        return located[0] if located else None
+    
+    def _locate(self, filename: str) -> Optional[Tuple[Path, Path]]:
+        if not self.is_valid_filename(filename):
+            return None
+        
+        self.layout.refresh()
+        for root in self.layout.candidates(filename):
+            file_path = self.get_shard_dir(filename, root.path) / filename
+            if file_path.is_file():
+                return file_path, root.path
+            
+            if self.shard_depth:
+                legacy_path = root.path / filename
+                if legacy_path.is_file():
+                    return legacy_path, root.path
+        return None
     
-    def file_exists(self, filename: str) -> bool:
+    async def file_exists(self, filename: str) -> bool:
         """
         检查文件是否存在
         
@@ -50,7 +526,9 @@ class StorageService:
         Returns:
             bool: 是否存在
         """
-        return (self.base_dir / filename).exists()
+        if self.resolve_file_path(filename) is not None:
+            return True
+        return self.is_valid_filename(filename) and await self.volumes.locate(filename) is not None
 
 
 # 创建全局实例
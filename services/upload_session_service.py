@@ -0,0 +1,401 @@
+import asyncio
+import json
+import os
+import re
+import time
+import uuid
+from contextlib import asynccontextmanager
+from pathlib import Path
+from typing import AsyncIterator, Callable, List, Optional
+import aiofiles.os
+from config import (
+    UPLOAD_DIR,
+    DATA_DIR,
+    UPLOAD_CHUNK_SIZE,
+    CHUNKED_UPLOAD_MAX_SIZE,
+    UPLOAD_SESSION_TTL
+)
+from utils.validators import validate_file_extension, get_file_extension
+
+# fcntl 仅在类 Unix 系统可用, 不可用时只支持单进程部署
+try:
+    import fcntl
+except ImportError:
+    fcntl = None
+
+_SESSION_ID_PATTERN = re.compile(r"[0-9a-f]{32}")
+
+# 过期会话的清理间隔 (秒)
+_SWEEP_INTERVAL = 600
+
+# 完成上传时等待进行中的数据块写完的最长时间 (秒)
+_FINALIZE_WAIT = 30
+
+
+class UploadSessionNotFound(ValueError):
+    """上传会话不存在或已过期"""
+
+
+class UploadSession:
+    """分块上传会话: 数据写入预分配的稀疏文件, ranges 记录已接收的区间 [start, end)"""
+    
+    def __init__(
+        self,
+        session_id: str,
+        original_filename: str,
+        extension: str,
+        size: int,
+        data_path: Path,
+        ranges: Optional[List[List[int]]] = None,
+        created_at: Optional[float] = None,
+        updated_at: Optional[float] = None
+    ):
+        self.session_id = session_id
+        self.original_filename = original_filename
+        self.extension = extension
+        self.size = size
+        self.data_path = data_path
+        self.ranges = ranges or []
+        self.created_at = created_at or time.time()
+        self.updated_at = updated_at or self.created_at
+    
+    @property
+    def received(self) -> int:
+        """已接收的字节数"""
+        return sum(end - start for start, end in self.ranges)
+    
+    @property
+    def complete(self) -> bool:
+        """是否已接收全部数据"""
+        return self.ranges == [[0, self.size]]
+    
+    def add_range(self, start: int, end: int) -> None:
+        """
+        记录已写入的区间并与已有区间合并
+        
+        Args:
+            start: 起始偏移
+            end: 结束偏移 (不含)
+        """
+        merged = []
+        for range_start, range_end in sorted([*self.ranges, [start, end]]):
+            if merged and range_start <= merged[-1][1]:
+                merged[-1][1] = max(merged[-1][1], range_end)
+            else:
+                merged.append([range_start, range_end])
+        self.ranges = merged
+        self.updated_at = time.time()
+    
+    def to_dict(self) -> dict:
+        return {
+            "session_id": self.session_id,
+            "original_filename": self.original_filename,
+            "extension": self.extension,
+            "size": self.size,
+            "data_path": str(self.data_path),
+            "ranges": self.ranges,
+            "created_at": self.created_at,
+            "updated_at": self.updated_at,
+        }
+    
+    @classmethod
+    def from_dict(cls, data: dict) -> "UploadSession":
+        return cls(**{**data, "data_path": Path(data["data_path"])})
+
+
+class UploadSessionService:
+    """
+    可续传的分块上传
+    
+    客户端创建会话后可按任意偏移 (包括并行) 上传数据块, 随时查询已接收的区间,
+    全部到齐后完成上传。数据直接写入上传目录中的隐藏文件, 完成时原地提交, 不再复制。
+    会话状态持久化到 DATA_DIR, 服务重启后仍可继续上传。
+    
+    多个 worker 进程共享会话: 状态文件是唯一的数据来源, 每次更新都在文件锁内重新读取并合并;
+    写入数据块时持有数据文件的共享锁, 完成上传时取得排他锁, 等待所有进行中的数据块写完。
+    """
+    
+    def __init__(
+        self,
+        upload_dir: Path = UPLOAD_DIR,
+        session_dir: Path = DATA_DIR / "upload_sessions",
+        max_size: int = CHUNKED_UPLOAD_MAX_SIZE,
+        ttl: int = UPLOAD_SESSION_TTL
+    ):
+        self.upload_dir = upload_dir
+        self.session_dir = session_dir
+        self.max_size = max_size
+        self.ttl = ttl
+        self._last_sweep = 0.0
+    
+    async def create(self, original_filename: str, size: int) -> UploadSession:
+        """
+        创建上传会话并预分配 (稀疏) 数据文件
+        
+        Args:
+            original_filename: 原始文件名 (用于确定文件格式)
+            size: 文件总大小
+        
+        Returns:
+            UploadSession: 上传会话
+        
+        Raises:
+            ValueError: 文件格式不支持或大小无效
+        """
+        if not validate_file_extension(original_filename):
+            raise ValueError(f"不支持的文件格式: {original_filename}")
+        if size <= 0:
+            raise ValueError("文件为空")
+        if size > self.max_size:
+            raise ValueError(f"文件过大: 超过 {self.max_size} 字节")
+        
+        await self._sweep_expired()
+        
+        session_id = uuid.uuid4().hex
+        session = UploadSession(
+            session_id=session_id,
+            original_filename=original_filename,
+            extension=get_file_extension(original_filename),
+            size=size,
+            data_path=self.upload_dir / f".{session_id}.upload"
+        )
+        await asyncio.to_thread(self._allocate, session)
+        await asyncio.to_thread(self._create_state, session)
+        return session
+    
+    @staticmethod
+    def _allocate(session: UploadSession) -> None:
+        # truncate 只设置文件长度, 未写入的部分不占用磁盘
+        fd = os.open(session.data_path, os.O_WRONLY | os.O_CREAT | os.O_EXCL, 0o644)
+        try:
+            os.ftruncate(fd, session.size)
+        finally:
+            os.close(fd)
+    
+    async def get(self, session_id: str) -> UploadSession:
+        """
+        获取上传会话
+        
+        Args:
+            session_id: 会话 ID
+        
+        Returns:
+            UploadSession: 上传会话
+        
+        Raises:
+            UploadSessionNotFound: 会话不存在或已过期
+        """
+        if not _SESSION_ID_PATTERN.fullmatch(session_id):
+            raise UploadSessionNotFound(f"上传会话不存在: {session_id}")
+        session = await asyncio.to_thread(self._read_state, session_id)
+        if session is None:
+            raise UploadSessionNotFound(f"上传会话不存在: {session_id}")
+        
+        if time.time() - session.updated_at > self.ttl:
+            await self.discard(session, remove_data=True)
+            raise UploadSessionNotFound(f"上传会话已过期: {session_id}")
+        return session
+    
+    async def write_chunk(self, session_id: str, offset: int, chunks: AsyncIterator[bytes]) -> UploadSession:
+        """
+        在指定偏移写入数据块
+        
+        数据按 UPLOAD_CHUNK_SIZE 分批写入, 请求结束 (包括连接中断) 时把已写入的区间
+        合并到共享的会话状态中, 已写入的部分不会丢失。
+        
+        Args:
+            session_id: 会话 ID
+            offset: 写入偏移
+            chunks: 数据块流
+        
+        Returns:
+            UploadSession: 更新后的上传会话
+        
+        Raises:
+            UploadSessionNotFound: 会话不存在或已过期
+            ValueError: 偏移无效或数据超出文件大小
+        """
+        session = await self.get(session_id)
+        if offset < 0 or offset >= session.size:
+            raise ValueError(f"无效的偏移: {offset} (文件大小 {session.size})")
+        
+        fd = await asyncio.to_thread(self._open_data, session, os.O_WRONLY, False)
+        written: List[List[int]] = []
+        position = offset
+        buffer = bytearray()
+        
+        async def flush() -> None:
+            nonlocal position
+            data = bytes(buffer)
+            buffer.clear()
+            await asyncio.to_thread(_pwrite_all, fd, data, position)
+            written.append([position, position + len(data)])
+            position += len(data)
+        
+        def merge(state: UploadSession) -> None:
+            for start, end in written:
+                state.add_range(start, end)
+        
+        updated = None
+        try:
+            # 取得共享锁后重新读取: 等待期间会话可能已完成或被取消, 数据文件已不属于本会话
+            session = await self.get(session_id)
+            async for chunk in chunks:
+                if position + len(buffer) + len(chunk) > session.size:
+                    raise ValueError(f"数据超出文件大小: {session.size} 字节")
+                buffer += chunk
+                if len(buffer) >= UPLOAD_CHUNK_SIZE:
+                    await flush()
+            if buffer:
+                await flush()
+        finally:
+            # 先合并区间再释放共享锁, 完成上传时读到的状态包含所有已写入的数据块
+            if written:
+                updated = await asyncio.to_thread(self._update_state, session_id, merge)
+            await asyncio.to_thread(os.close, fd)
+        if written and updated is None:
+            raise UploadSessionNotFound(f"上传会话不存在: {session_id}")
+        return updated or session
+    
+    @asynccontextmanager
+    async def finalize(self, session_id: str) -> AsyncIterator[UploadSession]:
+        """
+        完成上传: 等待所有 worker 上进行中的数据块写完, 校验数据已全部到齐后交给调用方提交
+        
+        期间持有数据文件的排他锁, 新到达的数据块请求等待锁释放后发现会话已不存在;
+        同一会话的并发完成请求只有一个能拿到数据。调用方正常退出时删除会话 (数据文件已提交),
+        抛出异常时保留会话和数据文件, 可以重新完成。
+        
+        Args:
+            session_id: 会话 ID
+        
+        Yields:
+            UploadSession: 已接收全部数据的上传会话
+        
+        Raises:
+            UploadSessionNotFound: 会话不存在或已过期
+            ValueError: 数据尚未全部接收, 或仍有数据块正在上传
+        """
+        session = await self.get(session_id)
+        fd = await asyncio.to_thread(self._open_data, session, os.O_RDONLY, True)
+        try:
+            if fcntl is not None:
+                deadline = time.monotonic() + _FINALIZE_WAIT
+                while True:
+                    try:
+                        fcntl.flock(fd, fcntl.LOCK_EX | fcntl.LOCK_NB)
+                        break
+                    except BlockingIOError:
+                        if time.monotonic() >= deadline:
+                            raise ValueError("仍有数据块正在上传, 请稍后重试")
+                        await asyncio.sleep(0.05)
+            
+            # 加锁后重新读取: 另一个完成请求可能已经提交, 或其他 worker 刚合并了区间
+            session = await self.get(session_id)
+            if not session.complete:
+                raise ValueError(f"上传未完成: 还缺少 {session.size - session.received} 字节")
+            yield session
+            await self.discard(session)
+        finally:
+            await asyncio.to_thread(os.close, fd)
+    
+    async def discard(self, session: UploadSession, remove_data: bool = False) -> None:
+        """
+        删除会话状态
+        
+        Args:
+            session: 上传会话
+            remove_data: 是否同时删除已接收的数据 (完成上传后数据文件已被提交, 无需删除)
+        """
+        await asyncio.to_thread(self._remove_state, session.session_id)
+        if remove_data:
+            try:
+                await aiofiles.os.remove(session.data_path)
+            except FileNotFoundError:
+                pass
+    
+    def _state_path(self, session_id: str) -> Path:
+        return self.session_dir / f"{session_id}.json"
+    
+    @staticmethod
+    def _open_data(session: UploadSession, flags: int, exclusive: bool) -> int:
+        try:
+            fd = os.open(session.data_path, flags)
+        except FileNotFoundError:
+            raise UploadSessionNotFound(f"上传会话不存在: {session.session_id}")
+        if fcntl is not None and not exclusive:
+            # 数据块之间共享, 阻塞到正在进行的完成请求结束
+            fcntl.flock(fd, fcntl.LOCK_SH)
+        return fd
+    
+    def _read_state(self, session_id: str) -> Optional[UploadSession]:
+        # 状态文件通过 rename 原子替换, 读取无需加锁
+        try:
+            data = self._state_path(session_id).read_text("utf-8")
+        except FileNotFoundError:
+            return None
+        return UploadSession.from_dict(json.loads(data))
+    
+    def _locked(self) -> int:
+        self.session_dir.mkdir(parents=True, exist_ok=True)
+        fd = os.open(self.session_dir / ".lock", os.O_RDWR | os.O_CREAT, 0o644)
+        if fcntl is not None:
+            fcntl.flock(fd, fcntl.LOCK_EX)
+        return fd
+    
+    def _create_state(self, session: UploadSession) -> None:
+        fd = self._locked()
+        try:
+            self._write_state(session)
+        finally:
+            os.close(fd)
+    
+    def _update_state(self, session_id: str, apply: Callable[[UploadSession], None]) -> Optional[UploadSession]:
+        # 在锁内读取 - 修改 - 写回, 不同 worker 写入的区间不会互相覆盖
+        fd = self._locked()
+        try:
+            session = self._read_state(session_id)
+            if session is None:
+                return None
+            apply(session)
+            self._write_state(session)
+            return session
+        finally:
+            os.close(fd)
+    
+    def _remove_state(self, session_id: str) -> None:
+        fd = self._locked()
+        try:
+            self._state_path(session_id).unlink(missing_ok=True)
+        finally:
+            os.close(fd)
+    
+    def _write_state(self, session: UploadSession) -> None:
+        path = self._state_path(session.session_id)
+        temp_path = path.with_suffix(".tmp")
+        temp_path.write_text(json.dumps(session.to_dict()), "utf-8")
+        os.replace(temp_path, path)
+    
+    async def _sweep_expired(self) -> None:
+        now = time.time()
+        if now - self._last_sweep < _SWEEP_INTERVAL or not self.session_dir.exists():
+            return
+        self._last_sweep = now
+        
+        for path in await asyncio.to_thread(lambda: list(self.session_dir.glob("*.json"))):
+            try:
+                await self.get(path.stem)
+            except (UploadSessionNotFound, ValueError):
+                pass
+
+
+def _pwrite_all(fd: int, data: bytes, offset: int) -> None:
+    view = memoryview(data)
+    while view:
+        written = os.pwrite(fd, view, offset)
+        view = view[written:]
+        offset += written
+
+
+# 创建全局实例
+upload_session_service = UploadSessionService()
@@ -0,0 +1,173 @@
+import asyncio
+import sqlite3
+import threading
+import time
+from collections import OrderedDict
+from pathlib import Path
+from typing import Awaitable, Callable, NamedTuple, Optional
+from config import (
+    URL_CACHE_ENABLED,
+    URL_CACHE_TTL,
+    URL_CACHE_MEMORY_ENTRIES,
+    URL_CACHE_DB_PATH
+)
+from models.schemas import FileInfo
+from services.storage_service import storage_service
+from utils.concurrency import SingleFlight
+from utils.metrics import URL_CACHE_REQUESTS
+
+_SCHEMA = """
+CREATE TABLE IF NOT EXISTS url_cache (
+    url TEXT PRIMARY KEY,
+    file_info TEXT NOT NULL,
+    etag TEXT,
+    last_modified TEXT,
+    validated_at REAL NOT NULL
+);
+CREATE INDEX IF NOT EXISTS idx_url_cache_validated ON url_cache (validated_at);
+"""
+
+# 超过该时间未再被导入的记录在启动时清理 (秒)
+_RETENTION = 30 * 86400
+
+
+class CachedUrl(NamedTuple):
+    """已导入的 URL: 保存的文件及源站的缓存校验字段"""
+    file_info: FileInfo
+    etag: Optional[str]
+    last_modified: Optional[str]
+    validated_at: float
+
+
+# 下载函数: 传入上次的缓存记录 (可能为 None) 发送条件请求,
+# 返回新的缓存记录, 源站返回 304 (内容未变化) 时返回 None
+Fetcher = Callable[[str, Optional[CachedUrl]], Awaitable[Optional[CachedUrl]]]
+
+
+class UrlCacheService:
+    """
+    URL 导入缓存
+    
+    同一 URL 在 TTL 内重复导入直接返回已保存的文件; 过期后用 ETag / Last-Modified 发送条件请求,
+    源站返回 304 时不传输响应体。并发导入同一 URL 合并为一次下载。
+    内存中按 LRU 保留最近使用的记录, 全部记录持久化在 SQLite 中, 服务重启后仍然有效。
+    """
+    
+    def __init__(
+        self,
+        enabled: bool = URL_CACHE_ENABLED,
+        ttl: int = URL_CACHE_TTL,
+        memory_entries: int = URL_CACHE_MEMORY_ENTRIES,
+        db_path: Path = URL_CACHE_DB_PATH
+    ):
+        self.enabled = enabled
+        self.ttl = ttl
+        self.memory_entries = memory_entries
+        self.db_path = db_path
+        self._memory: "OrderedDict[str, CachedUrl]" = OrderedDict()
+        self._flight = SingleFlight()
+        self._conn: Optional[sqlite3.Connection] = None
+        self._db_lock = threading.Lock()
+    
+    async def start(self) -> None:
+        """打开持久化数据库并清理长期未使用的记录 (应用启动时调用)"""
+        if not self.enabled or self._conn is not None:
+            return
+        
+        self.db_path.parent.mkdir(parents=True, exist_ok=True)
+        self._conn = sqlite3.connect(self.db_path, timeout=30, check_same_thread=False)
+        await asyncio.to_thread(self._prepare)
+    
+    def _prepare(self) -> None:
+        with self._db_lock, self._conn:
+            self._conn.execute("PRAGMA journal_mode=WAL")
+            self._conn.executescript(_SCHEMA)
+            self._conn.execute("DELETE FROM url_cache WHERE validated_at < ?", (time.time() - _RETENTION,))
+    
+    def stop(self) -> None:
+        """关闭数据库 (应用关闭时调用)"""
+        if self._conn is not None:
+            self._conn.close()
+            self._conn = None
+        self._memory.clear()
+    
+    async def fetch(self, url: str, fetcher: Fetcher) -> FileInfo:
+        """
+        导入 URL: 命中且未过期时直接返回已保存的文件, 否则 (条件) 下载
+        
+        Args:
+            url: 文件 URL
+            fetcher: 下载函数
+        
+        Returns:
+            FileInfo: 文件信息
+        
+        Raises:
+            ValueError: 下载或验证失败
+        """
+        return await self._flight.do(url, lambda: self._fetch(url, fetcher))
+    
+    async def _fetch(self, url: str, fetcher: Fetcher) -> FileInfo:
+        entry = await self._lookup(url)
+        # 文件已被删除时缓存记录作废
+        if entry is not None and not await storage_service.file_exists(entry.file_info.filename):
+            entry = None
+        
+        now = time.time()
+        if entry is not None and now - entry.validated_at < self.ttl:
+            URL_CACHE_REQUESTS.inc(1, "hit")
+            return entry.file_info
+        
+        fetched = await fetcher(url, entry)
+        if fetched is None:
+            URL_CACHE_REQUESTS.inc(1, "revalidated")
+            fetched = entry._replace(validated_at=now)
+        else:
+            URL_CACHE_REQUESTS.inc(1, "miss")
+        await self._store(url, fetched)
+        return fetched.file_info
+    
+    async def _lookup(self, url: str) -> Optional[CachedUrl]:
+        entry = self._memory.get(url)
+        if entry is not None:
+            self._memory.move_to_end(url)
+            return entry
+        if self._conn is None:
+            return None
+        
+        rows = await asyncio.to_thread(
+            self._execute,
+            "SELECT file_info, etag, last_modified, validated_at FROM url_cache WHERE url = ?",
+            (url,)
+        )
+        if not rows:
+            return None
+        file_info, etag, last_modified, validated_at = rows[0]
+        entry = CachedUrl(FileInfo.model_validate_json(file_info), etag, last_modified, validated_at)
+        self._remember(url, entry)
+        return entry
+    
+    async def _store(self, url: str, entry: CachedUrl) -> None:
+        self._remember(url, entry)
+        if self._conn is None:
+            return
+        await asyncio.to_thread(
+            self._execute,
+            "INSERT OR REPLACE INTO url_cache (url, file_info, etag, last_modified, validated_at) "
+            "VALUES (?, ?, ?, ?, ?)",
+            (url, entry.file_info.model_dump_json(), entry.etag, entry.last_modified, entry.validated_at)
+        )
+    
+    def _remember(self, url: str, entry: CachedUrl) -> None:
+        self._memory[url] = entry
+        self._memory.move_to_end(url)
+        while len(self._memory) > self.memory_entries:
+            self._memory.popitem(last=False)
+    
+    def _execute(self, sql: str, params=()) -> list:
+        with self._db_lock, self._conn:
+            return self._conn.execute(sql, params).fetchall()
+
+
+# 创建全局实例
+url_cache_service = UrlCacheService()
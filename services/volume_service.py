@@ -0,0 +1,521 @@
+import asyncio
+import os
+import stat
+import struct
+import threading
+import time
+import zlib
+from pathlib import Path
+from typing import Dict, Iterator, List, NamedTuple, Optional, Tuple
+from config import UPLOAD_DIR, VOLUME_SIZE, VOLUME_SMALL_FILE_MAX
+from services.storage_io import fsync_path, storage_io
+
+# fcntl 仅在类 Unix 系统可用, 不可用时每个进程总是新建自己的卷
+try:
+    import fcntl
+except ImportError:
+    fcntl = None
+
+# 记录头: 魔数, 类型, 文件名长度, 数据 CRC32, 写入时间 (纳秒), 数据长度
+NEEDLE_HEADER = struct.Struct(">4sBHIqQ")
+NEEDLE_MAGIC = b"LFV1"
+
+# 索引记录: 类型, 文件名长度, 记录偏移, 数据长度, 写入时间 (纳秒)
+INDEX_RECORD = struct.Struct(">BHQQq")
+
+# 记录类型
+NEEDLE_DATA = 0
+NEEDLE_TOMBSTONE = 1
+NEEDLE_DELETED = 2
+
+# 记录按 8 字节对齐
+_ALIGNMENT = 8
+
+# 索引未命中时, 两次扫描其他进程新写入数据的最小间隔 (秒)
+_REFRESH_INTERVAL = 1.0
+
+
+class Needle(NamedTuple):
+    """卷中的一条记录"""
+    flags: int
+    name: str
+    offset: int
+    size: int
+    timestamp: int
+    
+    @property
+    def data_offset(self) -> int:
+        return self.offset + NEEDLE_HEADER.size + len(self.name.encode("utf-8"))
+    
+    @property
+    def length(self) -> int:
+        return _aligned(NEEDLE_HEADER.size + len(self.name.encode("utf-8")) + self.size)
+
+
+class VolumeLocation(NamedTuple):
+    """小文件在卷中的位置"""
+    path: Path
+    volume_id: int
+    offset: int
+    size: int
+    timestamp: int
+    
+    def stat_result(self) -> os.stat_result:
+        """
+        构造与普通文件等价的文件状态 (用于 ETag / Last-Modified)
+        
+        Returns:
+            os.stat_result: 文件状态
+        """
+        seconds = self.timestamp // 1_000_000_000
+        return os.stat_result(
+            (stat.S_IFREG | 0o644, self.volume_id << 40 | self.offset, 0, 1, 0, 0, self.size, seconds, seconds, seconds),
+            {"st_mtime": self.timestamp / 1e9, "st_mtime_ns": self.timestamp}
+        )
+
+
+def _aligned(length: int) -> int:
+    return (length + _ALIGNMENT - 1) // _ALIGNMENT * _ALIGNMENT
+
+
+class _Volume:
+    def __init__(self, volume_id: int, base_dir: Path):
+        self.volume_id = volume_id
+        self.path = base_dir / f"{volume_id:08d}.dat"
+        self.index_path = base_dir / f"{volume_id:08d}.idx"
+        # 已加载到的数据末尾和索引文件位置
+        self.end = 0
+        self.index_position = 0
+        self.fd: Optional[int] = None
+        self.index_fd: Optional[int] = None
+        # 只读描述符 (所有卷都有, 查找时读取记录的删除标记)
+        self.read_fd: Optional[int] = None
+
+
+class VolumeService:
+    """
+    小文件卷存储 (Haystack 风格)
+    
+    小文件追加写入预分配的大卷文件, 每次写入一次 pwrite, 不占用独立的 inode 和目录项。
+    每个卷附带一个追加写入的索引文件, 启动时读取索引并扫描卷尾重建内存索引。
+    删除写入墓碑记录, 空间由 tools.compact_volumes 回收。
+    
+    每个进程只向自己持有 (flock) 的卷追加, 多个 worker 进程可共享同一目录;
+    其他进程新写入的文件在索引未命中时通过扫描卷尾发现 (在线程池中扫描, 不阻塞事件循环),
+    其他进程删除的文件在命中时通过原记录上的删除标记发现 (每个卷保持一个只读描述符, 一次 pread)。
+    """
+    
+    def __init__(
+        self,
+        base_dir: Path = UPLOAD_DIR / ".volumes",
+        volume_size: int = VOLUME_SIZE,
+        small_file_max: int = VOLUME_SMALL_FILE_MAX
+    ):
+        self.base_dir = base_dir
+        self.volume_size = volume_size
+        self.small_file_max = small_file_max
+        self._volumes: Dict[int, _Volume] = {}
+        self._index: Dict[str, Tuple[int, Needle]] = {}
+        self._tombstones: Dict[str, int] = {}
+        self._active: Optional[_Volume] = None
+        # 已被删除 (压缩) 的卷, 只读描述符在 close 时关闭, 避免正在查找的请求读到复用的描述符
+        self._retired: List[_Volume] = []
+        self._lock = asyncio.Lock()
+        # 扫描可能同时发生在查找线程和写入线程中
+        self._refresh_lock = threading.Lock()
+        self._loaded = False
+        self._last_refresh = 0.0
+    
+    @property
+    def enabled(self) -> bool:
+        """是否启用卷存储"""
+        return self.small_file_max > 0
+    
+    def accepts(self, size: int) -> bool:
+        """
+        文件是否应写入卷存储
+        
+        Args:
+            size: 文件大小
+        
+        Returns:
+            bool: 是否写入卷
+        """
+        return 0 < size <= self.small_file_max
+    
+    async def start(self) -> None:
+        """在线程池中加载卷索引 (应用启动时调用)"""
+        if self.enabled:
+            await asyncio.to_thread(self.load)
+    
+    def load(self) -> None:
+        """读取所有卷的索引并重建内存索引 (首次使用时自动调用)"""
+        if self._loaded:
+            return
+        self.base_dir.mkdir(parents=True, exist_ok=True)
+        self._refresh()
+        self._loaded = True
+    
+    def _refresh(self, min_interval: float = 0.0) -> None:
+        with self._refresh_lock:
+            # 等待锁期间其他线程可能刚扫描过
+            if time.monotonic() - self._last_refresh < min_interval:
+                return
+            volume_ids = sorted(
+                int(entry.name[:-4]) for entry in os.scandir(self.base_dir)
+                if entry.name.endswith(".dat") and entry.name[:-4].isdigit()
+            )
+            for volume_id in volume_ids:
+                volume = self._volumes.get(volume_id)
+                if volume is None:
+                    volume = _Volume(volume_id, self.base_dir)
+                    try:
+                        volume.read_fd = os.open(volume.path, os.O_RDONLY)
+                    except FileNotFoundError:
+                        continue
+                    self._volumes[volume_id] = volume
+                if volume is not self._active:
+                    self._load_volume(volume)
+            
+            # 被压缩工具删除的卷: 其中的有效记录已迁移到新卷, 加载新卷时已指向新位置
+            for volume_id in set(self._volumes) - set(volume_ids):
+                if self._volumes[volume_id] is not self._active:
+                    self._retire(self._volumes.pop(volume_id))
+            self._last_refresh = time.monotonic()
+    
+    def _retire(self, volume: _Volume) -> None:
+        for name, (volume_id, _) in list(self._index.items()):
+            if volume_id == volume.volume_id:
+                del self._index[name]
+        self._retired.append(volume)
+    
+    def _load_volume(self, volume: _Volume) -> None:
+        # 先读索引文件, 再扫描索引之后追加但尚未写入索引的记录 (如进程崩溃)
+        try:
+            with open(volume.index_path, "rb") as file:
+                file.seek(volume.index_position)
+                data = file.read()
+        except FileNotFoundError:
+            data = b""
+        
+        position = 0
+        while position + INDEX_RECORD.size <= len(data):
+            flags, name_length, offset, size, timestamp = INDEX_RECORD.unpack_from(data, position)
+            name_end = position + INDEX_RECORD.size + name_length
+            if name_end > len(data):
+                break
+            needle = Needle(flags, data[position + INDEX_RECORD.size:name_end].decode("utf-8"), offset, size, timestamp)
+            self._apply(volume.volume_id, needle)
+            volume.end = max(volume.end, needle.offset + needle.length)
+            position = name_end
+        volume.index_position += position
+        
+        for needle in self.scan(volume.path, volume.end):
+            self._apply(volume.volume_id, needle)
+            volume.end = needle.offset + needle.length
+    
+    def _apply(self, volume_id: int, needle: Needle) -> None:
+        current = self._index.get(needle.name)
+        if needle.flags == NEEDLE_DATA:
+            if needle.timestamp <= self._tombstones.get(needle.name, -1):
+                return
+            # 压缩后同一记录会出现在新卷中, 时间相同时以后加载的为准
+            if current is None or needle.timestamp >= current[1].timestamp:
+                self._index[needle.name] = (volume_id, needle)
+        else:
+            self._tombstones[needle.name] = max(needle.timestamp, self._tombstones.get(needle.name, -1))
+            if current is not None and current[1].timestamp <= needle.timestamp:
+                del self._index[needle.name]
+    
+    @staticmethod
+    def scan(path: Path, start: int = 0) -> Iterator[Needle]:
+        """
+        顺序扫描卷中的记录, 遇到未写入区域或不完整的记录时停止
+        
+        Args:
+            path: 卷文件路径
+            start: 起始偏移
+        
+        Yields:
+            Needle: 记录
+        """
+        with open(path, "rb") as file:
+            offset = start
+            while True:
+                file.seek(offset)
+                header = file.read(NEEDLE_HEADER.size)
+                if len(header) < NEEDLE_HEADER.size:
+                    return
+                magic, flags, name_length, crc, timestamp, size = NEEDLE_HEADER.unpack(header)
+                if magic != NEEDLE_MAGIC:
+                    return
+                name = file.read(name_length)
+                data = file.read(size)
+                if len(data) < size or (flags == NEEDLE_DATA and zlib.crc32(data) != crc):
+                    return
+                needle = Needle(flags, name.decode("utf-8"), offset, size, timestamp)
+                yield needle
+                offset += needle.length
+    
+    async def locate(self, filename: str) -> Optional[VolumeLocation]:
+        """
+        查找文件在卷中的位置
+        
+        Args:
+            filename: 文件名
+        
+        Returns:
+            Optional[VolumeLocation]: 位置, 不在卷中时返回 None
+        """
+        if not self.enabled:
+            return None
+        self.load()
+        for _ in range(2):
+            entry = self._index.get(filename)
+            if entry is not None:
+                volume_id, needle = entry
+                volume = self._volumes.get(volume_id)
+                # 其他进程删除后原记录带有删除标记; 卷已被压缩删除时重新扫描
+                if volume is not None and self._is_live(volume, needle):
+                    return VolumeLocation(volume.path, volume_id, needle.data_offset, needle.size, needle.timestamp)
+                if self._index.get(filename) is entry:
+                    del self._index[filename]
+            if time.monotonic() - self._last_refresh < _REFRESH_INTERVAL:
+                return None
+            # 可能由其他进程写入或迁移到了新卷
+            await asyncio.to_thread(self._refresh, _REFRESH_INTERVAL)
+        return None
+    
+    @staticmethod
+    def _is_live(volume: _Volume, needle: Needle) -> bool:
+        # 标记字节在页缓存中, 一次 pread 的开销与 stat 相当, 直接在事件循环中读取
+        try:
+            return os.pread(volume.read_fd, 1, needle.offset + len(NEEDLE_MAGIC)) == bytes([NEEDLE_DATA])
+        except OSError:
+            return False
+    
+    def volume_usage(self) -> Dict[int, Tuple[Path, int, int]]:
+        """
+        统计各卷的空间占用 (用于压缩)
+        
+        Returns:
+            Dict[int, Tuple[Path, int, int]]: 卷 ID -> (卷文件路径, 已写入字节数, 有效数据字节数)
+        """
+        self.load()
+        live: Dict[int, int] = {}
+        for volume_id, needle in self._index.values():
+            live[volume_id] = live.get(volume_id, 0) + needle.length
+        return {
+            volume_id: (volume.path, volume.end, live.get(volume_id, 0))
+            for volume_id, volume in self._volumes.items()
+        }
+    
+    def live_needles(self, volume_id: int) -> Iterator[Needle]:
+        """
+        列出卷中仍然有效的文件记录
+        
+        Args:
+            volume_id: 卷 ID
+        
+        Yields:
+            Needle: 记录
+        """
+        for entry_volume_id, needle in list(self._index.values()):
+            if entry_volume_id == volume_id:
+                yield needle
+    
+    def remove_volume(self, volume_id: int) -> None:
+        """
+        删除卷文件及其索引 (有效数据须已迁出)
+        
+        Args:
+            volume_id: 卷 ID
+        """
+        volume = self._volumes.pop(volume_id)
+        self._retired.append(volume)
+        for path in (volume.path, volume.index_path):
+            try:
+                os.remove(path)
+            except FileNotFoundError:
+                pass
+    
+    @staticmethod
+    def read(location: VolumeLocation) -> bytes:
+        """
+        读取卷中的文件内容 (一次 pread)
+        
+        Args:
+            location: 位置
+        
+        Returns:
+            bytes: 文件内容
+        """
+        fd = os.open(location.path, os.O_RDONLY)
+        try:
+            return os.pread(fd, location.size, location.offset)
+        finally:
+            os.close(fd)
+    
+    async def put(self, filename: str, data: bytes, timestamp: Optional[int] = None) -> VolumeLocation:
+        """
+        追加写入小文件 (开启 STORAGE_FSYNC 时返回前卷文件和索引已落盘)
+        
+        Args:
+            filename: 文件名
+            data: 文件内容
+            timestamp: 写入时间 (纳秒, 默认当前时间; 压缩时保留原时间)
+        
+        Returns:
+            VolumeLocation: 写入位置
+        """
+        self.load()
+        volume, needle = await self._append(NEEDLE_DATA, filename, data, timestamp or time.time_ns())
+        # 并发写入同一个卷的 fsync 在 group 模式下合并为一次
+        await storage_io.sync(volume.path, volume.index_path)
+        self._index[filename] = (volume.volume_id, needle)
+        return VolumeLocation(volume.path, volume.volume_id, needle.data_offset, needle.size, needle.timestamp)
+    
+    async def delete(self, filename: str) -> bool:
+        """
+        删除卷中的文件 (追加墓碑记录并标记原记录)
+        
+        Args:
+            filename: 文件名
+        
+        Returns:
+            bool: 文件是否存在并被删除
+        """
+        location = await self.locate(filename)
+        if location is None:
+            return False
+        entry = self._index.pop(filename, None)
+        if entry is None:
+            # 并发的删除已经处理
+            return False
+        _, needle = entry
+        await self._append(NEEDLE_TOMBSTONE, filename, b"", time.time_ns())
+        await storage_io.run(self._mark_deleted, location.path, needle.offset)
+        return True
+    
+    async def put_tombstone(self, filename: str, timestamp: int) -> None:
+        """
+        追加墓碑记录 (压缩时保留仍需屏蔽旧记录的删除标记)
+        
+        Args:
+            filename: 文件名
+            timestamp: 删除时间 (纳秒)
+        """
+        self.load()
+        await self._append(NEEDLE_TOMBSTONE, filename, b"", timestamp)
+    
+    @staticmethod
+    def _mark_deleted(path: Path, offset: int) -> None:
+        fd = os.open(path, os.O_WRONLY)
+        try:
+            os.pwrite(fd, bytes([NEEDLE_DELETED]), offset + len(NEEDLE_MAGIC))
+        finally:
+            os.close(fd)
+    
+    async def _append(self, flags: int, filename: str, data: bytes, timestamp: int) -> Tuple[_Volume, Needle]:
+        name = filename.encode("utf-8")
+        header = NEEDLE_HEADER.pack(NEEDLE_MAGIC, flags, len(name), zlib.crc32(data), timestamp, len(data))
+        record = header + name + data
+        record += b"\0" * (_aligned(len(record)) - len(record))
+        
+        async with self._lock:
+            volume = self._active
+            if volume is None or volume.end + len(record) > self.volume_size:
+                volume = await storage_io.run(self._open_active, len(record))
+            needle = Needle(flags, filename, volume.end, len(data), timestamp)
+            volume.end += len(record)
+            index_record = INDEX_RECORD.pack(flags, len(name), needle.offset, len(data), timestamp) + name
+            await storage_io.run(self._write, volume, record, needle.offset, index_record)
+        return volume, needle
+    
+    @staticmethod
+    def _write(volume: _Volume, record: bytes, offset: int, index_record: bytes) -> None:
+        os.pwrite(volume.fd, record, offset)
+        os.write(volume.index_fd, index_record)
+    
+    def _open_active(self, record_length: int) -> _Volume:
+        if self._active is not None:
+            self._release(self._active)
+            self._active = None
+        
+        # 优先接管其他进程已释放且仍有空间的卷
+        if fcntl is not None:
+            self._refresh()
+            for volume in sorted(self._volumes.values(), key=lambda v: v.end):
+                if volume.end + record_length <= self.volume_size and self._claim(volume, create=False):
+                    self._active = volume
+                    return volume
+        
+        volume_id = max(self._volumes, default=0) + 1
+        while True:
+            volume = _Volume(volume_id, self.base_dir)
+            if self._claim(volume, create=True):
+                volume.read_fd = os.open(volume.path, os.O_RDONLY)
+                # 并发的扫描可能已经为新卷创建了记录
+                duplicate = self._volumes.get(volume_id)
+                if duplicate is not None:
+                    self._retired.append(duplicate)
+                self._volumes[volume_id] = volume
+                self._active = volume
+                return volume
+            volume_id += 1
+    
+    def _claim(self, volume: _Volume, create: bool) -> bool:
+        flags = os.O_RDWR | (os.O_CREAT | os.O_EXCL if create else 0)
+        try:
+            fd = os.open(volume.path, flags, 0o644)
+        except FileExistsError:
+            return False
+        if fcntl is not None:
+            try:
+                fcntl.flock(fd, fcntl.LOCK_EX | fcntl.LOCK_NB)
+            except OSError:
+                os.close(fd)
+                return False
+        
+        if create:
+            if hasattr(os, "posix_fallocate"):
+                os.posix_fallocate(fd, 0, self.volume_size)
+            else:
+                os.ftruncate(fd, self.volume_size)
+        else:
+            # 加锁后重新扫描卷尾, 拿到最新的写入位置
+            with self._refresh_lock:
+                self._load_volume(volume)
+        volume.fd = fd
+        volume.index_fd = os.open(volume.index_path, os.O_WRONLY | os.O_APPEND | os.O_CREAT, 0o644)
+        if create and storage_io.durable:
+            # 新卷的目录项随首次写入一起落盘
+            fsync_path(self.base_dir)
+        return True
+    
+    @staticmethod
+    def _release(volume: _Volume) -> None:
+        for fd in (volume.fd, volume.index_fd):
+            if fd is not None:
+                os.close(fd)
+        volume.fd = volume.index_fd = None
+    
+    def close(self) -> None:
+        """释放持有的卷并关闭所有卷的只读描述符 (应用关闭时调用, 再次使用时重新加载)"""
+        if self._active is not None:
+            self._release(self._active)
+            self._active = None
+        for volume in [*self._volumes.values(), *self._retired]:
+            if volume.read_fd is not None:
+                os.close(volume.read_fd)
+                volume.read_fd = None
+        self._volumes.clear()
+        self._retired.clear()
+        self._index.clear()
+        self._tombstones.clear()
+        self._loaded = False
+        self._last_refresh = 0.0
+
+
+# 创建全局实例
+volume_service = VolumeService()
@@ -0,0 +1,151 @@
+"""流式压缩包解析器: zip / tar / tar.gz 的截断、损坏和解压限制"""
+import asyncio
+import io
+import tarfile
+import zipfile
+from typing import AsyncIterator, Dict, List, Tuple
+
+import pytest
+
+from utils.archive_stream import ArchiveError, ArchiveStreamReader
+
+FILES: Dict[str, bytes] = {
+    "docs/a.txt": b"hello " * 2000,
+    "b.png": bytes(range(256)) * 64,
+}
+
+
+def make_zip(compression: int = zipfile.ZIP_DEFLATED) -> bytes:
+    buffer = io.BytesIO()
+    with zipfile.ZipFile(buffer, "w", compression) as archive:
+        for name, data in FILES.items():
+            archive.writestr(name, data)
+    return buffer.getvalue()
+
+
+def make_tar(mode: str = "w", pax_headers: Dict[str, str] = None) -> bytes:
+    buffer = io.BytesIO()
+    with tarfile.open(fileobj=buffer, mode=mode, format=tarfile.PAX_FORMAT) as archive:
+        for name, data in FILES.items():
+            info = tarfile.TarInfo(name)
+            info.size = len(data)
+            if pax_headers:
+                info.pax_headers = pax_headers
+            archive.addfile(info, io.BytesIO(data))
+    return buffer.getvalue()
+
+
+async def chunked(data: bytes, size: int) -> AsyncIterator[bytes]:
+    for start in range(0, len(data), size):
+        yield data[start:start + size]
+
+
+def extract(data: bytes, chunk_size: int = 1000, **limits) -> List[Tuple[str, bytes]]:
+    async def collect():
+        reader = ArchiveStreamReader(chunked(data, chunk_size), **limits)
+        return [
+            (member.name, b"".join([chunk async for chunk in member.iter_chunks()]))
+            async for member in reader.members()
+        ]
+    return asyncio.run(collect())
+
+
+ARCHIVES = {
+    "zip": make_zip(),
+    "zip-stored": make_zip(zipfile.ZIP_STORED),
+    "tar": make_tar(),
+    "tar.gz": make_tar("w:gz"),
+}
+
+
+@pytest.mark.parametrize("kind", ARCHIVES)
+@pytest.mark.parametrize("chunk_size", [1, 333, 1 << 20])
+def test_archive_members_are_extracted(kind, chunk_size):
+    assert extract(ARCHIVES[kind], chunk_size) == list(FILES.items())
+
+
+@pytest.mark.parametrize("kind", ARCHIVES)
+@pytest.mark.parametrize("fraction", [0.1, 0.3, 0.5, 0.7])
+def test_truncated_archive_is_rejected(kind, fraction):
+    data = ARCHIVES[kind]
+    with pytest.raises(ArchiveError, match="不完整"):
+        extract(data[:int(len(data) * fraction)])
+
+
+@pytest.mark.parametrize("kind", ARCHIVES)
+@pytest.mark.parametrize("length", [0, 3, 100])
+def test_archive_cut_before_first_header_is_rejected(kind, length):
+    with pytest.raises(ArchiveError):
+        extract(ARCHIVES[kind][:length])
+
+
+def test_unknown_format_is_rejected():
+    with pytest.raises(ArchiveError, match="不支持的压缩包格式"):
+        extract(b"definitely not an archive" * 40)
+
+
+def test_corrupt_deflate_data_is_rejected():
+    data = bytearray(ARCHIVES["zip"])
+    data[60:80] = b"\xff" * 20
+    with pytest.raises(ArchiveError, match="压缩数据损坏"):
+        extract(bytes(data))
+
+
+def test_corrupt_gzip_data_is_rejected():
+    data = bytearray(ARCHIVES["tar.gz"])
+    data[30:40] = bytes(10)
+    with pytest.raises(ArchiveError, match="gzip"):
+        extract(bytes(data))
+
+
+def test_corrupt_tar_header_is_rejected():
+    data = bytearray(ARCHIVES["tar"])
+    data[10] ^= 0xFF
+    with pytest.raises(ArchiveError, match="无效的 tar 文件"):
+        extract(bytes(data))
+
+
+@pytest.mark.parametrize("size", ["abc", "-5"])
+def test_invalid_pax_size_is_rejected(size):
+    with pytest.raises(ArchiveError, match="扩展头"):
+        extract(make_tar(pax_headers={"size": size}))
+
+
+def test_zip_crc_mismatch_fails_only_that_member():
+    data = bytearray(ARCHIVES["zip-stored"])
+    # 改写第一个文件数据中的一个字节, 本地文件头中的 CRC 不再匹配
+    offset = data.index(FILES["docs/a.txt"][:32])
+    data[offset] ^= 0x01
+    
+    async def collect():
+        reader = ArchiveStreamReader(chunked(bytes(data), 1000))
+        results = []
+        async for member in reader.members():
+            try:
+                b"".join([chunk async for chunk in member.iter_chunks()])
+                results.append((member.name, None))
+            except ArchiveError:
+                raise
+            except ValueError as e:
+                results.append((member.name, str(e)))
+        return results
+    
+    assert asyncio.run(collect()) == [("docs/a.txt", "CRC 校验失败: docs/a.txt"), ("b.png", None)]
+
+
+def test_total_size_limit():
+    with pytest.raises(ArchiveError, match="总大小"):
+        extract(ARCHIVES["zip"], max_total_size=len(FILES["docs/a.txt"]))
+
+
+def test_member_count_limit():
+    with pytest.raises(ArchiveError, match="条目数"):
+        extract(ARCHIVES["tar"], max_members=1)
+
+
+def test_compression_ratio_limit():
+    buffer = io.BytesIO()
+    with zipfile.ZipFile(buffer, "w", zipfile.ZIP_DEFLATED) as archive:
+        archive.writestr("bomb.png", bytes(64 * 1024 * 1024))
+    with pytest.raises(ArchiveError, match="解压比例"):
+        extract(buffer.getvalue(), max_ratio=100)
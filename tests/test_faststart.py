@@ -0,0 +1,171 @@
+"""MP4 faststart: moov 移到 mdat 之前并改写 stco/co64 偏移"""
+import struct
+
+import pytest
+
+import utils.faststart as faststart_module
+from utils.faststart import faststart
+
+
+def box(box_type: bytes, body: bytes = b"") -> bytes:
+    return struct.pack(">I4s", len(body) + 8, box_type) + body
+
+
+def chunk_offsets(box_type: bytes, offsets) -> bytes:
+    fmt = ">I" if box_type == b"stco" else ">Q"
+    body = b"\x00\x00\x00\x00" + struct.pack(">I", len(offsets)) + b"".join(struct.pack(fmt, o) for o in offsets)
+    return box(box_type, body)
+
+
+def track(table: bytes) -> bytes:
+    stbl = box(b"stbl", box(b"stsd", b"\x00" * 8) + table)
+    return box(b"trak", box(b"tkhd", b"\x00" * 20) + box(b"mdia", box(b"minf", stbl)))
+
+
+def build_mp4(chunks, table_types=(b"stco", b"co64")) -> bytes:
+    """构造 moov 位于文件末尾的 MP4, chunks 均匀分给各轨道"""
+    head = box(b"ftyp", b"isom\x00\x00\x02\x00isommp41") + box(b"free", b"\x00" * 4)
+    mdat_header = struct.pack(">I4s", 8 + sum(map(len, chunks)), b"mdat")
+    position = len(head) + len(mdat_header)
+    offsets = []
+    for chunk in chunks:
+        offsets.append(position)
+        position += len(chunk)
+    tracks = b"".join(
+        track(chunk_offsets(table_type, offsets[index::len(table_types)]))
+        for index, table_type in enumerate(table_types)
+    )
+    moov = box(b"moov", box(b"mvhd", b"\x00" * 100) + tracks)
+    return head + mdat_header + b"".join(chunks) + moov + box(b"udta", b"meta")
+
+
+def parse_boxes(data: bytes, offset: int = 0, end: int = None):
+    """返回 [(类型, 盒子起始偏移, 内容起始偏移, 盒子结束偏移)]"""
+    end = len(data) if end is None else end
+    boxes = []
+    while offset < end:
+        size, box_type = struct.unpack_from(">I4s", data, offset)
+        header_size = 8
+        if size == 1:
+            size = struct.unpack_from(">Q", data, offset + 8)[0]
+            header_size = 16
+        elif size == 0:
+            size = end - offset
+        boxes.append((box_type, offset, offset + header_size, offset + size))
+        offset += size
+    return boxes
+
+
+def read_tables(data: bytes, moov_start: int, moov_end: int):
+    """按出现顺序返回 moov 中所有 (表类型, 偏移列表)"""
+    tables = []
+    for box_type, _, body, end in parse_boxes(data, moov_start, moov_end):
+        if box_type in (b"trak", b"mdia", b"minf", b"stbl"):
+            tables.extend(read_tables(data, body, end))
+        elif box_type in (b"stco", b"co64"):
+            count = struct.unpack_from(">I", data, body + 4)[0]
+            fmt = f">{count}{'I' if box_type == b'stco' else 'Q'}"
+            tables.append((box_type, list(struct.unpack_from(fmt, data, body + 8))))
+    return tables
+
+
+def chunks_at(data: bytes, tables, chunks):
+    """按各轨道的偏移表读回 chunk 内容, 顺序与 build_mp4 分配时一致"""
+    count = len(tables)
+    result = [None] * len(chunks)
+    for index, (_, offsets) in enumerate(tables):
+        for position, offset in enumerate(offsets):
+            number = index + position * count
+            result[number] = data[offset:offset + len(chunks[number])]
+    return result
+
+
+def run_faststart(tmp_path, data: bytes):
+    source = tmp_path / "source.mp4"
+    target = tmp_path / "target.mp4"
+    source.write_bytes(data)
+    converted = faststart(str(source), str(target))
+    return converted, target.read_bytes() if converted else None
+
+
+CHUNKS = [bytes([index]) * (50 + index * 13) for index in range(12)]
+
+
+@pytest.mark.parametrize("table_types", [(b"stco",), (b"co64",), (b"stco", b"co64")])
+def test_round_trip(tmp_path, table_types):
+    data = build_mp4(CHUNKS, table_types)
+    converted, output = run_faststart(tmp_path, data)
+    assert converted
+    assert len(output) == len(data)
+    
+    top = parse_boxes(output)
+    assert [box_type for box_type, *_ in top] == [b"ftyp", b"free", b"moov", b"mdat", b"udta"]
+    
+    # moov 之外的盒子原样复制
+    original = {box_type: data[start:end] for box_type, start, _, end in parse_boxes(data)}
+    for box_type, start, _, end in top:
+        if box_type != b"moov":
+            assert output[start:end] == original[box_type]
+    
+    _, moov_start, moov_body, moov_end = top[2]
+    tables = read_tables(output, moov_body, moov_end)
+    assert [table_type for table_type, _ in tables] == list(table_types)
+    assert chunks_at(output, tables, CHUNKS) == CHUNKS
+    # 所有偏移都平移了 moov 的大小
+    original_tables = read_tables(data, *parse_boxes(data)[3][2:])
+    shift = moov_end - moov_start
+    for (_, offsets), (_, old_offsets) in zip(tables, original_tables):
+        assert offsets == [offset + shift for offset in old_offsets]
+    
+    # 已是 faststart 的文件不再改写
+    converted, _ = run_faststart(tmp_path, output)
+    assert not converted
+
+
+def test_upgrades_stco_to_co64(tmp_path, monkeypatch):
+    # 降低 32 位上限, 使平移后的偏移超出 stco 的表示范围
+    data = build_mp4(CHUNKS, (b"stco",))
+    _, offsets = read_tables(data, *parse_boxes(data)[3][2:])[0]
+    monkeypatch.setattr(faststart_module, "_UINT32_MAX", max(offsets))
+    
+    converted, output = run_faststart(tmp_path, data)
+    assert converted
+    top = parse_boxes(output)
+    assert [box_type for box_type, *_ in top][:4] == [b"ftyp", b"free", b"moov", b"mdat"]
+    tables = read_tables(output, *top[2][2:])
+    assert [table_type for table_type, _ in tables] == [b"co64"]
+    # 升级后 moov 变大, 偏移按升级后的大小计算
+    assert chunks_at(output, tables, CHUNKS) == CHUNKS
+
+
+@pytest.mark.parametrize("data", [
+    b"",
+    b"not an mp4 file at all",
+    # 只有 moov 没有 mdat
+    box(b"ftyp", b"isom") + box(b"moov", box(b"mvhd")),
+    # 分片 MP4
+    box(b"ftyp", b"isom") + box(b"mdat", b"x" * 16) + box(b"moov", box(b"mvhd")) + box(b"moof"),
+    # 压缩的 moov
+    box(b"ftyp", b"isom") + box(b"mdat", b"x" * 16) + box(b"moov", box(b"cmov")),
+])
+def test_unsupported_files(tmp_path, data):
+    converted, _ = run_faststart(tmp_path, data)
+    assert not converted
+
+
+def test_rejects_invalid_offsets(tmp_path):
+    data = build_mp4(CHUNKS, (b"stco",))
+    mdat_end = parse_boxes(data)[2][3]
+    tables = read_tables(data, *parse_boxes(data)[3][2:])
+    old = chunk_offsets(b"stco", tables[0][1])
+    bad = chunk_offsets(b"stco", tables[0][1][:-1] + [len(data) + 1000])
+    assert mdat_end < len(data)
+    converted, _ = run_faststart(tmp_path, data.replace(old, bad, 1))
+    assert not converted
+
+
+def test_rejects_truncated_file(tmp_path):
+    data = build_mp4(CHUNKS)
+    for cut in (len(data) - 1, len(data) - 40, 30):
+        converted, _ = run_faststart(tmp_path, data[:cut])
+        assert not converted
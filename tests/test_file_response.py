@@ -0,0 +1,258 @@
+"""文件响应: Range 请求头解析、条件请求 (If-None-Match / If-Modified-Since / If-Range) 和多段响应"""
+import asyncio
+import os
+from email.utils import formatdate
+
+import pytest
+
+from utils.file_response import (
+    MAX_RANGES,
+    RangeNotSatisfiable,
+    build_bytes_response,
+    build_file_response,
+    make_etag,
+    parse_range_header,
+)
+
+CONTENT = bytes(range(256)) * 4
+CACHE_CONTROL = "public, max-age=60"
+
+
+@pytest.fixture
+def data_file(tmp_path):
+    path = tmp_path / "data.bin"
+    path.write_bytes(CONTENT)
+    return path
+
+
+def send_response(response, method: str = "GET"):
+    """以无零拷贝扩展的 ASGI 服务器运行响应, 返回 (状态码, 响应头, 响应体)"""
+    messages = []
+    
+    async def send(message):
+        messages.append(message)
+    
+    async def receive():
+        return {"type": "http.disconnect"}
+    
+    scope = {"type": "http", "method": method, "headers": [], "extensions": {}}
+    asyncio.run(response(scope, receive, send))
+    start = messages[0]
+    headers = {key.decode("latin-1"): value.decode("latin-1") for key, value in start["headers"]}
+    body = b"".join(message.get("body", b"") for message in messages[1:])
+    return start["status"], headers, body
+
+
+@pytest.mark.parametrize("header, expected", [
+    ("bytes=0-99", [(0, 99)]),
+    ("bytes=100-", [(100, 1023)]),
+    ("bytes=-100", [(924, 1023)]),
+    ("bytes=-5000", [(0, 1023)]),
+    ("bytes=1000-5000", [(1000, 1023)]),
+    ("BYTES = 0-0", [(0, 0)]),
+    # 重叠、相邻和乱序的区间合并
+    ("bytes=0-99,50-149", [(0, 149)]),
+    ("bytes=0-99,100-199", [(0, 199)]),
+    ("bytes=500-599,0-99,90-120", [(0, 120), (500, 599)]),
+    ("bytes=-100,0-10", [(0, 10), (924, 1023)]),
+    # 超出范围的区间被忽略
+    ("bytes=0-9,2000-3000", [(0, 9)]),
+])
+def test_parse_range_header(header, expected):
+    assert parse_range_header(header, len(CONTENT)) == expected
+
+
+@pytest.mark.parametrize("header", [
+    "items=0-99",
+    "bytes=",
+    "bytes=abc-10",
+    "bytes=10",
+    "bytes=99-10",
+    "bytes=-1-5",
+])
+def test_parse_range_header_invalid(header):
+    assert parse_range_header(header, len(CONTENT)) is None
+
+
+@pytest.mark.parametrize("header", ["bytes=1024-", "bytes=2000-3000", "bytes=-0", "bytes=5000-,-0"])
+def test_parse_range_header_unsatisfiable(header):
+    with pytest.raises(RangeNotSatisfiable):
+        parse_range_header(header, len(CONTENT))
+
+
+def test_parse_range_header_too_many_ranges():
+    spec = ",".join(f"{index * 10}-{index * 10 + 1}" for index in range(MAX_RANGES + 1))
+    assert parse_range_header(f"bytes={spec}", len(CONTENT)) is None
+    
+    spec = ",".join(f"{index * 10}-{index * 10 + 1}" for index in range(MAX_RANGES))
+    assert len(parse_range_header(f"bytes={spec}", len(CONTENT))) == MAX_RANGES
+    
+    # 合并后不超过上限时正常返回
+    spec = ",".join(f"{index}-{index}" for index in range(MAX_RANGES * 2))
+    assert parse_range_header(f"bytes={spec}", len(CONTENT)) == [(0, MAX_RANGES * 2 - 1)]
+
+
+def test_full_response(data_file):
+    stat_result = os.stat(data_file)
+    status, headers, body = send_response(build_file_response("GET", {}, data_file, stat_result, CACHE_CONTROL))
+    assert status == 200
+    assert body == CONTENT
+    assert headers["etag"] == make_etag(stat_result)
+    assert headers["content-length"] == str(len(CONTENT))
+    assert headers["accept-ranges"] == "bytes"
+    assert headers["cache-control"] == CACHE_CONTROL
+
+
+def test_single_range(data_file):
+    stat_result = os.stat(data_file)
+    response = build_file_response("GET", {"range": "bytes=-100"}, data_file, stat_result, CACHE_CONTROL)
+    status, headers, body = send_response(response)
+    assert status == 206
+    assert body == CONTENT[-100:]
+    assert headers["content-range"] == f"bytes 924-1023/{len(CONTENT)}"
+    assert headers["content-length"] == "100"
+
+
+def test_multiple_ranges(data_file):
+    stat_result = os.stat(data_file)
+    response = build_file_response(
+        "GET", {"range": "bytes=0-9,20-29,25-39"}, data_file, stat_result, CACHE_CONTROL,
+        media_type="application/octet-stream"
+    )
+    status, headers, body = send_response(response)
+    assert status == 206
+    assert headers["content-type"].startswith("multipart/byteranges; boundary=")
+    assert headers["content-length"] == str(len(body))
+    
+    boundary = headers["content-type"].split("boundary=")[1].encode()
+    parts = body.split(b"--" + boundary)
+    assert parts[0] == b"" and parts[-1] == b"--\r\n"
+    payloads = []
+    for part in parts[1:-1]:
+        part_headers, _, payload = part.partition(b"\r\n\r\n")
+        assert b"Content-Type: application/octet-stream" in part_headers
+        assert payload.endswith(b"\r\n")
+        payloads.append((part_headers.split(b"Content-Range: ")[1], payload[:-2]))
+    assert payloads == [
+        (b"bytes 0-9/1024", CONTENT[0:10]),
+        (b"bytes 20-39/1024", CONTENT[20:40]),
+    ]
+
+
+def test_range_with_file_offset(tmp_path):
+    path = tmp_path / "volume.dat"
+    path.write_bytes(b"x" * 64 + CONTENT + b"y" * 64)
+    # 卷存储中的小文件: 内容位于卷文件中的某个偏移处
+    stat_result = os.stat_result((0o100644, 1, 0, 1, 0, 0, len(CONTENT), 0, 0, 0), {"st_mtime_ns": 0})
+    response = build_file_response(
+        "GET", {"range": "bytes=10-19"}, path, stat_result, CACHE_CONTROL, file_offset=64
+    )
+    status, _, body = send_response(response)
+    assert status == 206
+    assert body == CONTENT[10:20]
+
+
+def test_unsatisfiable_range(data_file):
+    stat_result = os.stat(data_file)
+    response = build_file_response("GET", {"range": "bytes=5000-"}, data_file, stat_result, CACHE_CONTROL)
+    assert response.status_code == 416
+    assert response.headers["content-range"] == f"bytes */{len(CONTENT)}"
+
+
+def test_too_many_ranges_returns_full_content(data_file):
+    stat_result = os.stat(data_file)
+    spec = ",".join(f"{index * 10}-{index * 10 + 1}" for index in range(MAX_RANGES + 1))
+    response = build_file_response("GET", {"range": f"bytes={spec}"}, data_file, stat_result, CACHE_CONTROL)
+    status, _, body = send_response(response)
+    assert status == 200
+    assert body == CONTENT
+
+
+def test_head_request(data_file):
+    stat_result = os.stat(data_file)
+    response = build_file_response("HEAD", {"range": "bytes=0-9"}, data_file, stat_result, CACHE_CONTROL)
+    status, headers, body = send_response(response, method="HEAD")
+    assert status == 206
+    assert headers["content-length"] == "10"
+    assert body == b""
+
+
+@pytest.mark.parametrize("make_header, expected", [
+    (lambda etag: etag, 304),
+    (lambda etag: f"W/{etag}", 304),
+    (lambda etag: f'"other", {etag}', 304),
+    (lambda etag: "*", 304),
+    (lambda etag: '"other"', 200),
+])
+def test_if_none_match(data_file, make_header, expected):
+    stat_result = os.stat(data_file)
+    headers = {"if-none-match": make_header(make_etag(stat_result))}
+    response = build_file_response("GET", headers, data_file, stat_result, CACHE_CONTROL)
+    assert response.status_code == expected
+    if expected == 304:
+        assert response.headers["etag"] == make_etag(stat_result)
+
+
+def test_if_modified_since(data_file):
+    stat_result = os.stat(data_file)
+    build = lambda headers: build_file_response("GET", headers, data_file, stat_result, CACHE_CONTROL)
+    
+    assert build({"if-modified-since": formatdate(stat_result.st_mtime, usegmt=True)}).status_code == 304
+    assert build({"if-modified-since": formatdate(stat_result.st_mtime - 3600, usegmt=True)}).status_code == 200
+    assert build({"if-modified-since": "not a date"}).status_code == 200
+    # If-None-Match 存在时忽略 If-Modified-Since
+    headers = {
+        "if-none-match": '"other"',
+        "if-modified-since": formatdate(stat_result.st_mtime, usegmt=True),
+    }
+    assert build(headers).status_code == 200
+
+
+def test_if_range(data_file):
+    stat_result = os.stat(data_file)
+    etag = make_etag(stat_result)
+    build = lambda if_range: build_file_response(
+        "GET", {"range": "bytes=0-9", "if-range": if_range}, data_file, stat_result, CACHE_CONTROL
+    )
+    
+    # 匹配时返回区间, 不匹配时忽略 Range 返回完整内容
+    assert build(etag).status_code == 206
+    assert build('"other"').status_code == 200
+    # If-Range 使用强比较, 弱 ETag 不匹配
+    assert build(f"W/{etag}").status_code == 200
+    assert build(formatdate(stat_result.st_mtime, usegmt=True)).status_code == 206
+    assert build(formatdate(stat_result.st_mtime - 3600, usegmt=True)).status_code == 200
+    assert build("not a date").status_code == 200
+
+
+def test_if_range_mismatch_ignores_unsatisfiable_range(data_file):
+    stat_result = os.stat(data_file)
+    headers = {"range": "bytes=5000-", "if-range": '"other"'}
+    response = build_file_response("GET", headers, data_file, stat_result, CACHE_CONTROL)
+    assert response.status_code == 200
+
+
+def test_bytes_response(data_file):
+    stat_result = os.stat(data_file)
+    build = lambda method, headers: build_bytes_response(
+        method, headers, CONTENT, stat_result, CACHE_CONTROL, "application/octet-stream", vary="Accept"
+    )
+    
+    response = build("GET", {"range": "bytes=10-19"})
+    assert response.status_code == 206
+    assert response.body == CONTENT[10:20]
+    assert response.headers["content-range"] == f"bytes 10-19/{len(CONTENT)}"
+    assert response.headers["vary"] == "Accept"
+    
+    # 多段区间按完整内容返回
+    response = build("GET", {"range": "bytes=0-9,100-109"})
+    assert response.status_code == 200
+    assert response.body == CONTENT
+    
+    response = build("HEAD", {})
+    assert response.status_code == 200
+    assert response.body == b""
+    assert response.headers["content-length"] == str(len(CONTENT))
+    
+    assert build("GET", {"range": "bytes=5000-"}).status_code == 416
+    assert build("GET", {"if-none-match": make_etag(stat_result)}).status_code == 304
@@ -0,0 +1,181 @@
+"""共享内存热点缓存: 跨实例可见性、失效、环形覆盖, 以及并发写入时无锁读取的一致性"""
+import asyncio
+import multiprocessing
+import os
+import time
+
+import pytest
+
+from services.hot_cache_service import _EPOCH_OFFSET, _SEQ, _SLOT, _WAYS, FCNTL_AVAILABLE, HotCacheService
+
+pytestmark = pytest.mark.skipif(not FCNTL_AVAILABLE, reason="共享缓存需要 fcntl")
+
+SIZE = 64 * 1024
+
+
+def make_cache(path, size=SIZE, slots=64) -> HotCacheService:
+    cache = HotCacheService(enabled=True, path=path, size=size, max_object=size // 4, slots=slots)
+    cache.start()
+    return cache
+
+
+def close(*caches: HotCacheService) -> None:
+    for cache in caches:
+        asyncio.run(cache.stop())
+
+
+def fake_stat(size: int, inode: int = 1, mtime_ns: int = 1_700_000_000_000_000_000) -> os.stat_result:
+    return os.stat_result((0o100644, inode, 0, 1, 0, 0, size, 0, 0, 0), {"st_mtime_ns": mtime_ns})
+
+
+@pytest.fixture
+def cache_path(tmp_path):
+    return tmp_path / "hot.cache"
+
+
+def test_put_and_get_round_trip(cache_path):
+    cache = make_cache(cache_path)
+    cache.put("a.png", b"png-data", fake_stat(8, inode=42, mtime_ns=123456789))
+    cached = cache.get("a.png")
+    assert cached.content == b"png-data"
+    assert (cached.stat_result.st_size, cached.stat_result.st_ino, cached.stat_result.st_mtime_ns) == (8, 42, 123456789)
+    assert cache.get("missing.png") is None
+    close(cache)
+
+
+def test_entries_are_shared_and_invalidation_is_visible_to_other_instances(cache_path):
+    writer = make_cache(cache_path)
+    reader = make_cache(cache_path)
+    writer.put("a.png", b"shared", fake_stat(6))
+    assert reader.get("a.png").content == b"shared"
+    
+    reader.invalidate("a.png")
+    assert writer.get("a.png") is None
+    assert reader.get("a.png") is None
+    close(writer, reader)
+
+
+def test_put_after_invalidation_with_stale_epoch_is_dropped(cache_path):
+    cache = make_cache(cache_path)
+    # 模拟: 载入线程读取内容之前记录失效计数, 读取期间文件被删除
+    epoch = _SEQ.unpack_from(cache._map, _EPOCH_OFFSET)[0]
+    cache.invalidate("a.png")
+    cache.put("a.png", b"stale", fake_stat(5), epoch)
+    assert cache.get("a.png") is None
+    close(cache)
+
+
+def test_cache_is_cleared_when_no_other_process_uses_it(cache_path):
+    cache = make_cache(cache_path)
+    cache.put("a.png", b"old", fake_stat(3))
+    close(cache)
+    
+    restarted = make_cache(cache_path)
+    assert restarted.get("a.png") is None
+    close(restarted)
+
+
+def test_instance_with_different_layout_does_not_attach(cache_path):
+    cache = make_cache(cache_path)
+    other = make_cache(cache_path, size=SIZE * 2)
+    assert not other.enabled
+    assert other.get("a.png") is None
+    close(cache, other)
+
+
+def test_overwritten_entries_miss_instead_of_returning_other_content(cache_path):
+    async def run():
+        cache = make_cache(cache_path, slots=1024)
+        names = [f"{index}.bin" for index in range(64)]
+        for name in names:
+            cache.put(name, name.encode().ljust(4096, b"."), fake_stat(4096))
+        # 64 x 4KB 已写满 4 倍的环形缓冲区, 最早的内容已被覆盖
+        hits = {name: cache.get(name) for name in names}
+        await cache.stop()
+        return hits
+    
+    hits = asyncio.run(run())
+    assert hits["0.bin"] is None
+    assert hits["63.bin"] is not None
+    for name, cached in hits.items():
+        if cached is not None:
+            assert cached.content == name.encode().ljust(4096, b".")
+
+
+def test_slot_being_written_is_treated_as_miss(cache_path):
+    cache = make_cache(cache_path)
+    cache.put("a.png", b"data", fake_stat(4))
+    # 找到该文件的槽位并把序号改为奇数 (写入进行中)
+    key = b"a.png"
+    base = cache._set_base(key)
+    for way in range(_WAYS):
+        slot = base + way * _SLOT.size
+        seq, _, _, _, _, name = _SLOT.unpack_from(cache._map, slot)
+        if name.rstrip(b"\0") == key:
+            _SEQ.pack_into(cache._map, slot, seq | 1)
+            break
+    else:
+        pytest.fail("未找到槽位")
+    assert cache.get("a.png") is None
+    close(cache)
+
+
+def test_objects_over_the_size_limit_are_not_cached(cache_path):
+    cache = make_cache(cache_path)
+    cache.put("big.bin", bytes(SIZE // 4 + 1), fake_stat(SIZE // 4 + 1))
+    cache.put("empty.bin", b"", fake_stat(0))
+    cache.put("n" * 65, b"x", fake_stat(1))
+    assert cache.get("big.bin") is None
+    assert cache.get("empty.bin") is None
+    assert cache.get("n" * 65) is None
+    close(cache)
+
+
+def _content(name: str, version: int) -> bytes:
+    # 内容由文件名和版本号决定, 读者可以据此校验读到的是否是某一次完整写入
+    return name.encode() + b":" + bytes([version]) * (500 + version * 13)
+
+
+def _writer(path, stop_at: float) -> None:
+    cache = make_cache(path, slots=16)
+    version = 0
+    while time.time() < stop_at:
+        version = (version + 1) % 200
+        for index in range(8):
+            name = f"{index}.bin"
+            content = _content(name, version)
+            cache.put(name, content, fake_stat(len(content)))
+            if version % 7 == 0:
+                cache.invalidate(name)
+    asyncio.run(cache.stop())
+
+
+@pytest.mark.skipif("fork" not in multiprocessing.get_all_start_methods(), reason="需要 fork")
+def test_lock_free_reads_never_return_torn_content(cache_path):
+    reader = make_cache(cache_path, slots=16)
+    process = multiprocessing.get_context("fork").Process(target=_writer, args=(cache_path, time.time() + 1.5))
+    process.start()
+    
+    async def read_loop():
+        hits = 0
+        while process.is_alive():
+            for index in range(8):
+                name = f"{index}.bin"
+                cached = reader.get(name)
+                if cached is None:
+                    continue
+                hits += 1
+                content = cached.content
+                prefix = name.encode() + b":"
+                assert content.startswith(prefix)
+                body = content[len(prefix):]
+                assert body and body == bytes([body[0]]) * len(body) == _content(name, body[0])[len(prefix):]
+                assert cached.stat_result.st_size == len(content)
+            await asyncio.sleep(0)
+        await reader.stop()
+        return hits
+    
+    hits = asyncio.run(read_loop())
+    process.join()
+    assert process.exitcode == 0
+    assert hits > 0
@@ -0,0 +1,149 @@
+"""媒体信息探测: 各格式的正常文件头, 以及截断和格式错误的输入 (探测失败时返回 None, 不抛出异常)"""
+import struct
+import zlib
+from pathlib import Path
+
+import pytest
+
+from utils.media_probe import MediaInfo, probe_file
+
+
+def png(width: int, height: int) -> bytes:
+    ihdr = struct.pack(">IIBBBBB", width, height, 8, 2, 0, 0, 0)
+    chunk = struct.pack(">I", len(ihdr)) + b"IHDR" + ihdr + struct.pack(">I", zlib.crc32(b"IHDR" + ihdr))
+    return b"\x89PNG\r\n\x1a\n" + chunk + bytes(64)
+
+
+def jpeg(width: int, height: int, orientation: int = 0) -> bytes:
+    data = b"\xff\xd8"
+    if orientation:
+        ifd = struct.pack(">H", 1) + struct.pack(">HHIHH", 0x0112, 3, 1, orientation, 0) + bytes(4)
+        tiff = b"MM\x00\x2a" + struct.pack(">I", 8) + ifd
+        segment = b"Exif\x00\x00" + tiff
+        data += b"\xff\xe1" + struct.pack(">H", len(segment) + 2) + segment
+    sof = struct.pack(">BHHB", 8, height, width, 3) + bytes(9)
+    return data + b"\xff\xc0" + struct.pack(">H", len(sof) + 2) + sof + b"\xff\xda" + bytes(32)
+
+
+def box(box_type: bytes, body: bytes) -> bytes:
+    return struct.pack(">I4s", len(body) + 8, box_type) + body
+
+
+def full_box(box_type: bytes, body: bytes) -> bytes:
+    return box(box_type, bytes(4) + body)
+
+
+def mp4(width: int, height: int, timescale: int, duration: int) -> bytes:
+    matrix = struct.pack(">9i", 0x10000, 0, 0, 0, 0x10000, 0, 0, 0, 0x40000000)
+    tkhd = full_box(b"tkhd", struct.pack(">IIIII", 0, 0, 1, 0, 0) + bytes(16) + matrix
+                    + struct.pack(">II", width << 16, height << 16))
+    stsd = full_box(b"stsd", struct.pack(">I", 1) + box(b"avc1", bytes(20)))
+    mdia = box(b"mdia", full_box(b"hdlr", bytes(4) + b"vide" + bytes(12)) + box(b"minf", box(b"stbl", stsd)))
+    mvhd = full_box(b"mvhd", struct.pack(">IIII", 0, 0, timescale, duration) + bytes(80))
+    moov = box(b"moov", mvhd + box(b"trak", tkhd + mdia))
+    return box(b"ftyp", b"isom\0\0\0\0isom") + box(b"mdat", bytes(2000)) + moov
+
+
+def vint(value: int) -> bytes:
+    for length in range(1, 9):
+        if value < (1 << (7 * length)) - 1:
+            return ((1 << (7 * length)) | value).to_bytes(length, "big")
+    raise ValueError(value)
+
+
+def element(element_id: int, body: bytes) -> bytes:
+    return element_id.to_bytes((element_id.bit_length() + 7) // 8, "big") + vint(len(body)) + body
+
+
+def webm(width: int, height: int, duration_ms: float) -> bytes:
+    info = element(0x1549A966, element(0x2AD7B1, (1000000).to_bytes(3, "big")) + element(0x4489, struct.pack(">d", duration_ms)))
+    video = element(0xE0, element(0xB0, width.to_bytes(2, "big")) + element(0xBA, height.to_bytes(2, "big")))
+    tracks = element(0x1654AE6B, element(0xAE, element(0x83, b"\x01") + element(0x86, b"V_VP9") + video))
+    segment = element(0x18538067, info + tracks + element(0x1F43B675, bytes(200)))
+    return element(0x1A45DFA3, element(0x4282, b"webm")) + segment
+
+
+SAMPLES = {
+    "png": (png(640, 480), (640, 480)),
+    "gif": (b"GIF89a" + struct.pack("<HH", 320, 200) + bytes(32), (320, 200)),
+    "bmp": (b"BM" + bytes(12) + struct.pack("<Iii", 40, 100, -50) + bytes(40), (100, 50)),
+    "jpg": (jpeg(800, 600), (800, 600)),
+    "svg": (b'<svg xmlns="http://www.w3.org/2000/svg" viewBox="0 0 300 150" width="600"></svg>', (600, 300)),
+    "mp4": (mp4(1920, 1080, 1000, 2500), (1920, 1080)),
+    "webm": (webm(640, 360, 3210.0), (640, 360)),
+}
+
+
+def probe(tmp_path: Path, data: bytes, extension: str):
+    path = tmp_path / f"sample.{extension}"
+    path.write_bytes(data)
+    return probe_file(path, extension)
+
+
+@pytest.mark.parametrize("extension", SAMPLES)
+def test_dimensions_are_read(tmp_path, extension):
+    data, (width, height) = SAMPLES[extension]
+    media = probe(tmp_path, data, extension)
+    assert (media.width, media.height) == (width, height)
+
+
+def test_video_duration_and_codec(tmp_path):
+    media = probe(tmp_path, SAMPLES["mp4"][0], "mp4")
+    assert (media.duration, media.codec) == (2.5, "avc1")
+    media = probe(tmp_path, SAMPLES["webm"][0], "webm")
+    assert (media.duration, media.codec) == (3.21, "V_VP9")
+
+
+def test_exif_orientation_swaps_dimensions(tmp_path):
+    media = probe(tmp_path, jpeg(800, 600, orientation=6), "jpg")
+    assert (media.width, media.height) == (600, 800)
+
+
+def test_probe_reads_only_the_given_window(tmp_path):
+    data = SAMPLES["png"][0]
+    path = tmp_path / "volume.dat"
+    path.write_bytes(b"x" * 100 + data + b"y" * 100)
+    assert probe_file(path, "png", offset=100, size=len(data)) == MediaInfo(640, 480)
+
+
+@pytest.mark.parametrize("extension", SAMPLES)
+def test_truncated_input_returns_none_or_partial_info(tmp_path, extension):
+    data, _ = SAMPLES[extension]
+    for length in list(range(0, min(len(data), 96))) + [len(data) // 2, len(data) - 1]:
+        media = probe(tmp_path, data[:length], extension)
+        assert media is None or isinstance(media, MediaInfo)
+
+
+@pytest.mark.parametrize("extension", SAMPLES)
+def test_corrupted_input_never_raises(tmp_path, extension):
+    data, _ = SAMPLES[extension]
+    for position in range(len(data)):
+        for value in (0x00, 0xFF):
+            corrupted = bytearray(data)
+            corrupted[position] = value
+            media = probe(tmp_path, bytes(corrupted), extension)
+            assert media is None or isinstance(media, MediaInfo)
+
+
+@pytest.mark.parametrize("svg", [
+    b'<svg width="1e999" height="10"/>',
+    b'<svg width="10" height="1e999"/>',
+    b'<svg viewBox="0 0 1e999 1e999"/>',
+    b'<svg width="nan" height="inf"/>',
+    b'<svg width="100%" height="50%"/>',
+    b'<svg width="0" height="0"/>',
+    b'<svg height="10" viewBox="0 0 1 1e-300"/>',
+    b'<svg width="' + b"9" * 400 + b'" height="10"/>',
+    b"<svg",
+])
+def test_malformed_svg_dimensions_are_ignored(tmp_path, svg):
+    assert probe(tmp_path, svg, "svg") is None
+
+
+def test_oversized_box_is_rejected(tmp_path):
+    data = box(b"ftyp", b"isom\0\0\0\0isom") + struct.pack(">I4s", 1, b"moov") + struct.pack(">Q", 1 << 40)
+    assert probe(tmp_path, data, "mp4") is None
+
+
+def test_unknown_format_returns_none(tmp_path):
+    assert probe(tmp_path, b"plain text", "txt") is None
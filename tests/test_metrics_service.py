@@ -0,0 +1,146 @@
+"""多 worker 指标汇总: 快照合并、已退出进程的归档和仪表值处理"""
+import asyncio
+import fcntl
+import json
+import os
+
+import pytest
+
+from services.metrics_service import MetricsService
+from utils import metrics
+
+COUNTER = metrics.DOWNLOAD_ERRORS.name
+GAUGE = metrics.ADMISSION_QUEUED.name
+HISTOGRAM = metrics.HTTP_REQUEST_SECONDS.name
+BUCKETS = len(metrics.HTTP_REQUEST_SECONDS.buckets) + 1
+
+
+def histogram_entry(bucket: int, total: float) -> list:
+    counts = [0] * BUCKETS
+    counts[bucket] = 1
+    return [counts, total]
+
+
+def write_snapshot(directory, name: str, data: dict) -> None:
+    (directory / f"{name}.json").write_text(json.dumps(data), encoding="utf-8")
+    (directory / f"{name}.lock").touch()
+
+
+def sample(text: str, prefix: str) -> float:
+    for line in text.splitlines():
+        if line.startswith(prefix + " "):
+            return float(line.rsplit(" ", 1)[1])
+    return 0.0
+
+
+@pytest.fixture
+def metrics_dir(tmp_path):
+    return tmp_path / "metrics"
+
+
+def test_merge_snapshots():
+    first = {
+        COUNTER: [[["timeout"], 2], [["http_5xx"], 1]],
+        GAUGE: [[[], 3]],
+        HISTOGRAM: [[["/files", "GET"], histogram_entry(0, 0.5)]],
+    }
+    second = {
+        COUNTER: [[["timeout"], 5]],
+        GAUGE: [[[], 4]],
+        HISTOGRAM: [[["/files", "GET"], histogram_entry(2, 1.5)]],
+        "unknown_metric": [[[], 1]],
+    }
+    merged = metrics.merge_snapshots([first, second])
+    assert sorted(merged[COUNTER]) == [[["http_5xx"], 1], [["timeout"], 7]]
+    assert merged[GAUGE] == [[[], 7]]
+    counts, total = merged[HISTOGRAM][0][1]
+    assert counts[0] == 1 and counts[2] == 1 and sum(counts) == 2
+    assert total == 2.0
+    assert "unknown_metric" not in merged
+    
+    # 已退出进程的仪表值不再计入
+    assert GAUGE not in metrics.merge_snapshots([first, second], include_gauges=False)
+
+
+def test_render_merges_live_and_exited_workers(metrics_dir):
+    async def run():
+        service = MetricsService(enabled=True, directory=metrics_dir, flush_interval=3600)
+        service.start()
+        try:
+            baseline = await service.render()
+            
+            # 仍在运行的 worker: 持有快照的锁
+            write_snapshot(metrics_dir, "live", {
+                COUNTER: [[["test_live"], 3]],
+                GAUGE: [[[], 2]],
+            })
+            live_fd = os.open(metrics_dir / "live.lock", os.O_RDWR)
+            fcntl.flock(live_fd, fcntl.LOCK_EX)
+            # 已退出的 worker: 锁未被持有
+            write_snapshot(metrics_dir, "exited", {
+                COUNTER: [[["test_exited"], 4], [["test_live"], 1]],
+                GAUGE: [[[], 5]],
+            })
+            
+            try:
+                text = await service.render()
+                assert sample(text, f'{COUNTER}{{cause="test_live"}}') == 4
+                assert sample(text, f'{COUNTER}{{cause="test_exited"}}') == 4
+                assert sample(text, GAUGE) == sample(baseline, GAUGE) + 2
+                assert "worker=" not in text
+                
+                # 已退出进程的快照并入归档, 之后的采集仍然计入且只计一次
+                assert not (metrics_dir / "exited.json").exists()
+                assert not (metrics_dir / "exited.lock").exists()
+                assert (metrics_dir / "archive.json").exists()
+                text = await service.render()
+                assert sample(text, f'{COUNTER}{{cause="test_exited"}}') == 4
+                assert sample(text, f'{COUNTER}{{cause="test_live"}}') == 4
+            finally:
+                os.close(live_fd)
+            
+            # live 的锁释放后同样归档
+            text = await service.render()
+            assert sample(text, f'{COUNTER}{{cause="test_live"}}') == 4
+            assert sample(text, GAUGE) == sample(baseline, GAUGE)
+            assert {path.name for path in metrics_dir.glob("*.json")} == {"archive.json", f"{service._name}.json"}
+        finally:
+            await service.stop()
+    
+    asyncio.run(run())
+
+
+def test_stopped_worker_is_archived(metrics_dir):
+    async def run():
+        exiting = MetricsService(enabled=True, directory=metrics_dir, flush_interval=3600)
+        exiting.start()
+        metrics.DOWNLOAD_ERRORS.inc(6, "test_stopped")
+        await exiting.stop()
+        
+        # 模拟另一个进程采集: 清除本进程内存中的记录, 只留下 exiting 写出的快照
+        metrics.DOWNLOAD_ERRORS._values.pop(("test_stopped",))
+        scraper = MetricsService(enabled=True, directory=metrics_dir, flush_interval=3600)
+        scraper.start()
+        try:
+            text = await scraper.render()
+            assert sample(text, f'{COUNTER}{{cause="test_stopped"}}') == 6
+            assert not (metrics_dir / f"{exiting._name}.json").exists()
+        finally:
+            await scraper.stop()
+    
+    asyncio.run(run())
+
+
+def test_disabled_renders_local_metrics(metrics_dir):
+    async def run():
+        service = MetricsService(enabled=False, directory=metrics_dir)
+        service.start()
+        metrics.DOWNLOAD_ERRORS.inc(1, "test_local")
+        try:
+            text = await service.render()
+            assert sample(text, f'{COUNTER}{{cause="test_local"}}') == 1
+            assert not metrics_dir.exists()
+        finally:
+            metrics.DOWNLOAD_ERRORS._values.pop(("test_local",))
+    
+    asyncio.run(run())
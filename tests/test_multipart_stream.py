@@ -0,0 +1,85 @@
+"""流式 multipart 解析器: 正常请求体与截断 / 格式错误的请求体"""
+import asyncio
+from typing import AsyncIterator, List, Optional, Tuple
+
+import pytest
+
+from utils.multipart_stream import MultipartStreamReader
+
+BOUNDARY = "linkforge-boundary"
+CONTENT_TYPE = f"multipart/form-data; boundary={BOUNDARY}"
+
+
+def build_body(parts: List[Tuple[str, Optional[str], bytes]]) -> bytes:
+    body = b""
+    for name, filename, data in parts:
+        disposition = f'form-data; name="{name}"'
+        if filename is not None:
+            disposition += f'; filename="{filename}"'
+        body += f"--{BOUNDARY}\r\nContent-Disposition: {disposition}\r\n\r\n".encode() + data + b"\r\n"
+    return body + f"--{BOUNDARY}--\r\n".encode()
+
+
+async def chunked(data: bytes, size: int) -> AsyncIterator[bytes]:
+    for start in range(0, len(data), size):
+        yield data[start:start + size]
+
+
+def read_parts(body: bytes, chunk_size: int = 7, content_type: str = CONTENT_TYPE):
+    async def collect():
+        reader = MultipartStreamReader(content_type, chunked(body, chunk_size))
+        parts = []
+        async for part in reader.parts():
+            data = b"".join([chunk async for chunk in part.iter_chunks()])
+            parts.append((part.field_name, part.filename, data))
+        return parts
+    return asyncio.run(collect())
+
+
+BODY = build_body([
+    ("note", None, b"hello"),
+    # 数据中包含分隔符的前缀, 不能被误认为分段结束
+    ("file", "a.png", b"\x89PNG\r\n--linkforge-bound\r\n" + bytes(range(256))),
+])
+
+
+@pytest.mark.parametrize("chunk_size", [1, 7, 64, len(BODY)])
+def test_parts_are_split_correctly_for_any_chunking(chunk_size):
+    assert read_parts(BODY, chunk_size) == [
+        ("note", None, b"hello"),
+        ("file", "a.png", b"\x89PNG\r\n--linkforge-bound\r\n" + bytes(range(256))),
+    ]
+
+
+def test_unread_part_is_skipped():
+    async def collect():
+        reader = MultipartStreamReader(CONTENT_TYPE, chunked(BODY, 5))
+        return [part.field_name async for part in reader.parts()]
+    assert asyncio.run(collect()) == ["note", "file"]
+
+
+@pytest.mark.parametrize("length", [0, 1, len(f"--{BOUNDARY}\r\n") + 10, BODY.index(b"hello") + 2, len(BODY) - 10])
+def test_truncated_body_is_rejected(length):
+    with pytest.raises(ValueError, match="不完整"):
+        read_parts(BODY[:length])
+
+
+def test_missing_boundary_parameter_is_rejected():
+    with pytest.raises(ValueError, match="boundary"):
+        read_parts(BODY, content_type="multipart/form-data")
+
+
+def test_missing_field_name_is_rejected():
+    body = f"--{BOUNDARY}\r\nContent-Disposition: form-data\r\n\r\nx\r\n--{BOUNDARY}--\r\n".encode()
+    with pytest.raises(ValueError, match="name"):
+        read_parts(body)
+
+
+@pytest.mark.parametrize("body", [
+    b"not a multipart body at all",
+    f"--{BOUNDARY}garbage\r\n".encode(),
+    f"--{BOUNDARY}\r\nContent-Disposition: form-data; name=\"a\"\r\n\r\nx\r\n--{BOUNDARY}xx".encode(),
+])
+def test_malformed_body_raises_value_error(body):
+    with pytest.raises(ValueError):
+        read_parts(body)
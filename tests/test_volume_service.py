@@ -0,0 +1,195 @@
+"""小文件卷存储: 写入与读取、墓碑删除、重建索引和多实例共享目录"""
+import asyncio
+import os
+
+import pytest
+
+import services.volume_service as volume_module
+from services.volume_service import NEEDLE_DELETED, NEEDLE_MAGIC, NEEDLE_TOMBSTONE, VolumeService
+
+VOLUME_SIZE = 1 << 20
+
+
+def make_service(path) -> VolumeService:
+    service = VolumeService(base_dir=path, volume_size=VOLUME_SIZE, small_file_max=4096)
+    service.load()
+    return service
+
+
+async def read_back(service: VolumeService, filename: str):
+    location = await service.locate(filename)
+    return None if location is None else service.read(location)
+
+
+@pytest.fixture
+def volume_dir(tmp_path):
+    return tmp_path / ".volumes"
+
+
+@pytest.fixture(autouse=True)
+def no_refresh_delay(monkeypatch):
+    # 其他实例写入的数据在索引未命中时立即重新扫描
+    monkeypatch.setattr(volume_module, "_REFRESH_INTERVAL", 0.0)
+
+
+def test_put_and_read(volume_dir):
+    async def run():
+        service = make_service(volume_dir)
+        files = {f"{index}.png": os.urandom(100 + index * 37) for index in range(20)}
+        for name, data in files.items():
+            location = await service.put(name, data)
+            assert location.size == len(data)
+        contents = {name: await read_back(service, name) for name in files}
+        service.close()
+        return files, contents
+    
+    files, contents = asyncio.run(run())
+    assert contents == files
+
+
+def test_needles_are_aligned_and_stat_is_stable(volume_dir):
+    async def run():
+        service = make_service(volume_dir)
+        first = await service.put("a.png", b"x" * 13, timestamp=1_700_000_000_123_456_789)
+        second = await service.put("b.png", b"y")
+        service.close()
+        return first, second
+    
+    first, second = asyncio.run(run())
+    assert [needle.offset % 8 for needle in VolumeService.scan(first.path)] == [0, 0]
+    stat_result = first.stat_result()
+    assert (stat_result.st_size, stat_result.st_mtime_ns) == (13, 1_700_000_000_123_456_789)
+    assert first.stat_result().st_ino != second.stat_result().st_ino
+
+
+def test_delete_writes_tombstone_and_marks_record(volume_dir):
+    async def run():
+        service = make_service(volume_dir)
+        location = await service.put("a.png", b"data")
+        assert await service.delete("a.png")
+        assert not await service.delete("a.png")
+        assert await service.locate("a.png") is None
+        service.close()
+        return location
+    
+    location = asyncio.run(run())
+    needles = list(VolumeService.scan(location.path))
+    assert [(needle.flags, needle.name) for needle in needles] == [
+        (NEEDLE_DELETED, "a.png"),
+        (NEEDLE_TOMBSTONE, "a.png"),
+    ]
+
+
+def test_index_is_rebuilt_after_restart(volume_dir):
+    async def run():
+        service = make_service(volume_dir)
+        await service.put("kept.png", b"kept")
+        await service.put("deleted.png", b"gone")
+        await service.delete("deleted.png")
+        # 同名文件重新写入, 以最新的记录为准
+        await service.put("replaced.png", b"old")
+        await service.put("replaced.png", b"new")
+        service.close()
+        
+        restarted = make_service(volume_dir)
+        result = (
+            await read_back(restarted, "kept.png"),
+            await read_back(restarted, "deleted.png"),
+            await read_back(restarted, "replaced.png"),
+        )
+        restarted.close()
+        return result
+    
+    assert asyncio.run(run()) == (b"kept", None, b"new")
+
+
+def test_records_missing_from_the_index_file_are_recovered(volume_dir):
+    async def run():
+        service = make_service(volume_dir)
+        await service.put("a.png", b"first")
+        await service.put("b.png", b"second")
+        index_path = service._active.index_path
+        service.close()
+        
+        # 模拟写入卷之后、写入索引之前崩溃: 截掉最后一条索引记录
+        data = index_path.read_bytes()
+        index_path.write_bytes(data[:len(data) // 2])
+        restarted = make_service(volume_dir)
+        result = await read_back(restarted, "a.png"), await read_back(restarted, "b.png")
+        restarted.close()
+        return result
+    
+    assert asyncio.run(run()) == (b"first", b"second")
+
+
+def test_torn_record_at_volume_tail_is_ignored(volume_dir):
+    async def run():
+        service = make_service(volume_dir)
+        location = await service.put("a.png", b"complete")
+        torn = await service.put("b.png", b"torn-record")
+        index_path = service._active.index_path
+        service.close()
+        
+        # 最后一条记录的数据损坏 (CRC 不匹配), 且没有写入索引
+        with open(location.path, "r+b") as file:
+            file.seek(torn.offset)
+            file.write(b"\xff" * torn.size)
+        data = index_path.read_bytes()
+        index_path.write_bytes(data[:len(data) // 2])
+        restarted = make_service(volume_dir)
+        result = await read_back(restarted, "a.png"), await read_back(restarted, "b.png")
+        restarted.close()
+        return result
+    
+    assert asyncio.run(run()) == (b"complete", None)
+
+
+def test_other_instances_see_writes_and_deletes(volume_dir):
+    async def run():
+        writer = make_service(volume_dir)
+        reader = make_service(volume_dir)
+        await writer.put("a.png", b"shared")
+        seen = await read_back(reader, "a.png")
+        await writer.delete("a.png")
+        after_delete = await read_back(reader, "a.png")
+        writer.close()
+        reader.close()
+        return seen, after_delete
+    
+    assert asyncio.run(run()) == (b"shared", None)
+
+
+def test_each_instance_appends_to_its_own_volume(volume_dir):
+    async def run():
+        first = make_service(volume_dir)
+        second = make_service(volume_dir)
+        a = await first.put("a.png", b"a")
+        b = await second.put("b.png", b"b")
+        first.close()
+        second.close()
+        return a, b
+    
+    a, b = asyncio.run(run())
+    if volume_module.fcntl is not None:
+        assert a.volume_id != b.volume_id
+
+
+def test_full_volume_rolls_over(volume_dir):
+    async def run():
+        service = VolumeService(base_dir=volume_dir, volume_size=8192, small_file_max=4096)
+        service.load()
+        locations = [await service.put(f"{index}.bin", bytes([index]) * 3000) for index in range(5)]
+        contents = [await read_back(service, f"{index}.bin") for index in range(5)]
+        service.close()
+        return locations, contents
+    
+    locations, contents = asyncio.run(run())
+    assert len({location.volume_id for location in locations}) >= 3
+    assert contents == [bytes([index]) * 3000 for index in range(5)]
+
+
+def test_accepts_only_small_files(volume_dir):
+    service = VolumeService(base_dir=volume_dir, volume_size=VOLUME_SIZE, small_file_max=4096)
+    assert service.accepts(1) and service.accepts(4096)
+    assert not service.accepts(0) and not service.accepts(4097)
+    assert not VolumeService(base_dir=volume_dir, small_file_max=0).enabled
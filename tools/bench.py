@@ -0,0 +1,386 @@
+"""
+上传与直链访问的压测工具
+
+按权重混合请求 /api/upload/file、/binary、/url、/batch/files、/batch/urls 和 /files 的 Range 读取,
+URL 上传指向内置的本地源站 (可配置延迟和文件大小)。结果 (吞吐、p50/p95/p99 延迟、峰值内存)
+以 JSON 输出, 便于对比不同版本。
+
+默认在进程内运行应用 (ASGI 直连, 不经过网络), --server 时启动 uvicorn 子进程。
+上传目录和数据目录默认使用临时目录, 运行结束后删除。
+
+用法:
+    python -m tools.bench --concurrency 32 --duration 30 --output bench.json
+    python -m tools.bench --server --workers 4 --mix file=1,range=4
+"""
+import argparse
+import asyncio
+import json
+import os
+import platform
+import random
+import shutil
+import subprocess
+import sys
+import tempfile
+import time
+from typing import Dict, List, Optional, Set
+from urllib.parse import parse_qs, urlsplit
+import httpx
+
+# resource 仅在类 Unix 系统可用
+try:
+    import resource
+except ImportError:
+    resource = None
+
+# 各操作的默认权重
+DEFAULT_MIX = "file=3,binary=3,url=2,batch_files=1,batch_urls=1,range=6"
+
+OPERATIONS = ("file", "binary", "url", "batch_files", "batch_urls", "range")
+
+PNG_SIGNATURE = b"\x89PNG\r\n\x1a\n"
+JPEG_SIGNATURE = b"\xff\xd8\xff\xe0"
+
+
+def make_payload(size: int, signature: bytes, rng: random.Random) -> bytes:
+    """生成以指定魔数开头的随机内容 (随机数据避免被压缩或去重影响结果)"""
+    return signature + rng.randbytes(max(size - len(signature), 0))
+
+
+class Origin:
+    """
+    本地源站: 对任意 GET 请求返回 JPEG 内容, 支持 keep-alive
+    
+    查询参数 size / latency 可覆盖单个请求的文件大小 (字节) 和响应延迟 (秒)。
+    """
+    
+    def __init__(self, size: int, latency: float, seed: int):
+        self.size = size
+        self.latency = latency
+        self._body = make_payload(size, JPEG_SIGNATURE, random.Random(seed))
+        self._server: Optional[asyncio.AbstractServer] = None
+        self._handlers: Set[asyncio.Task] = set()
+        self.port = 0
+    
+    async def start(self) -> None:
+        self._server = await asyncio.start_server(self._handle, "127.0.0.1", 0)
+        self.port = self._server.sockets[0].getsockname()[1]
+    
+    async def stop(self) -> None:
+        self._server.close()
+        # 结束仍在等待下一个请求的 keep-alive 连接
+        for task in list(self._handlers):
+            task.cancel()
+        await asyncio.gather(*self._handlers)
+        await self._server.wait_closed()
+    
+    def url(self, name: str) -> str:
+        return f"http://127.0.0.1:{self.port}/{name}.jpg"
+    
+    def _body_of(self, size: int) -> bytes:
+        if size <= len(self._body):
+            return self._body[:size]
+        return self._body + bytes(size - len(self._body))
+    
+    async def _handle(self, reader: asyncio.StreamReader, writer: asyncio.StreamWriter) -> None:
+        task = asyncio.current_task()
+        self._handlers.add(task)
+        try:
+            while True:
+                head = await reader.readuntil(b"\r\n\r\n")
+                target = head.split(b" ", 2)[1].decode("latin-1")
+                query = parse_qs(urlsplit(target).query)
+                size = int(query.get("size", [self.size])[0])
+                latency = float(query.get("latency", [self.latency])[0])
+                if latency:
+                    await asyncio.sleep(latency)
+                
+                body = self._body_of(size)
+                writer.write(
+                    b"HTTP/1.1 200 OK\r\nContent-Type: image/jpeg\r\n"
+                    + f"Content-Length: {len(body)}\r\n\r\n".encode()
+                )
+                writer.write(body)
+                await writer.drain()
+        except (asyncio.IncompleteReadError, asyncio.CancelledError, ConnectionError):
+            pass
+        finally:
+            self._handlers.discard(task)
+            writer.close()
+
+
+def percentile(values: List[float], fraction: float) -> float:
+    """最近秩百分位数 (values 已排序)"""
+    if not values:
+        return 0.0
+    return values[min(len(values) - 1, max(0, int(round(fraction * len(values) + 0.5)) - 1))]
+
+
+class Bench:
+    """按权重混合发送请求并记录每个请求的延迟"""
+    
+    def __init__(self, client: httpx.AsyncClient, origin: Origin, args: argparse.Namespace):
+        self.client = client
+        self.origin = origin
+        self.args = args
+        self.rng = random.Random(args.seed)
+        self.payload = make_payload(args.file_size, PNG_SIGNATURE, self.rng)
+        self.seeded: List[str] = []
+        self.latencies: Dict[str, List[float]] = {op: [] for op in OPERATIONS}
+        self.errors: Dict[str, int] = {op: 0 for op in OPERATIONS}
+        self.bytes: Dict[str, int] = {op: 0 for op in OPERATIONS}
+        
+        weights = dict(item.split("=") for item in args.mix.split(","))
+        unknown = set(weights) - set(OPERATIONS)
+        if unknown:
+            raise ValueError(f"未知的操作: {', '.join(sorted(unknown))}")
+        self.operations = [op for op in OPERATIONS if float(weights.get(op, 0)) > 0]
+        self.weights = [float(weights[op]) for op in self.operations]
+    
+    async def seed(self) -> None:
+        """预先上传一批文件供 Range 读取"""
+        for _ in range(self.args.seed_files):
+            response = await self.client.post(
+                "/api/upload/binary", content=self.payload, headers={"content-type": "image/png"}
+            )
+            response.raise_for_status()
+            self.seeded.append(response.json()["data"]["filename"])
+    
+    async def run(self) -> float:
+        """
+        以 concurrency 个并发循环发送请求, 直到达到时长或请求数
+        
+        Returns:
+            float: 实际耗时 (秒)
+        """
+        deadline = time.perf_counter() + self.args.duration
+        remaining = self.args.requests
+        
+        async def worker(worker_rng: random.Random) -> None:
+            nonlocal remaining
+            while time.perf_counter() < deadline:
+                if self.args.requests:
+                    if remaining <= 0:
+                        return
+                    remaining -= 1
+                op = worker_rng.choices(self.operations, self.weights)[0]
+                started = time.perf_counter()
+                try:
+                    transferred = await getattr(self, f"op_{op}")(worker_rng)
+                except (httpx.HTTPError, ValueError):
+                    self.errors[op] += 1
+                    continue
+                self.latencies[op].append(time.perf_counter() - started)
+                self.bytes[op] += transferred
+        
+        started = time.perf_counter()
+        await asyncio.gather(*(
+            worker(random.Random(self.args.seed + i)) for i in range(self.args.concurrency)
+        ))
+        return time.perf_counter() - started
+    
+    @staticmethod
+    def _check(response: httpx.Response) -> None:
+        # 批量接口部分失败时仍返回 200, 以 success 字段为准
+        response.raise_for_status()
+        if response.json().get("success") is False:
+            raise ValueError(response.json().get("message"))
+    
+    async def op_file(self, rng: random.Random) -> int:
+        response = await self.client.post(
+            "/api/upload/file", files={"file": ("bench.png", self.payload, "image/png")}
+        )
+        self._check(response)
+        return len(self.payload)
+    
+    async def op_binary(self, rng: random.Random) -> int:
+        response = await self.client.post(
+            "/api/upload/binary", content=self.payload, headers={"content-type": "image/png"}
+        )
+        self._check(response)
+        return len(self.payload)
+    
+    async def op_url(self, rng: random.Random) -> int:
+        response = await self.client.post("/api/upload/url", json={"url": self.origin.url(f"u{rng.random()}")})
+        self._check(response)
+        return self.origin.size
+    
+    async def op_batch_files(self, rng: random.Random) -> int:
+        files = [("files", (f"bench{i}.png", self.payload, "image/png")) for i in range(self.args.batch_size)]
+        response = await self.client.post("/api/upload/batch/files", files=files)
+        self._check(response)
+        return len(self.payload) * self.args.batch_size
+    
+    async def op_batch_urls(self, rng: random.Random) -> int:
+        urls = [self.origin.url(f"b{rng.random()}") for _ in range(self.args.batch_size)]
+        response = await self.client.post("/api/upload/batch/urls", json={"urls": urls})
+        self._check(response)
+        return self.origin.size * self.args.batch_size
+    
+    async def op_range(self, rng: random.Random) -> int:
+        if not self.seeded:
+            raise ValueError("没有可读取的文件")
+        length = min(self.args.range_size, len(self.payload))
+        start = rng.randrange(0, len(self.payload) - length + 1)
+        response = await self.client.get(
+            f"/files/{rng.choice(self.seeded)}",
+            headers={"range": f"bytes={start}-{start + length - 1}"}
+        )
+        if response.status_code != 206:
+            raise ValueError(f"Range 读取返回 {response.status_code}")
+        return len(response.content)
+    
+    def report(self, elapsed: float, peak_rss: Optional[int]) -> dict:
+        operations = {}
+        for op in self.operations:
+            values = sorted(self.latencies[op])
+            operations[op] = {
+                "requests": len(values),
+                "errors": self.errors[op],
+                "throughput_rps": round(len(values) / elapsed, 2),
+                "throughput_mb_s": round(self.bytes[op] / elapsed / 1048576, 2),
+                "latency_ms": {
+                    "mean": round(sum(values) / len(values) * 1000, 3) if values else 0.0,
+                    "p50": round(percentile(values, 0.50) * 1000, 3),
+                    "p95": round(percentile(values, 0.95) * 1000, 3),
+                    "p99": round(percentile(values, 0.99) * 1000, 3),
+                    "max": round(values[-1] * 1000, 3) if values else 0.0,
+                },
+            }
+        total = sum(item["requests"] for item in operations.values())
+        return {
+            "config": {key: value for key, value in vars(self.args).items() if key != "output"},
+            "environment": {"python": platform.python_version(), "platform": platform.platform()},
+            "elapsed_seconds": round(elapsed, 3),
+            "total": {
+                "requests": total,
+                "errors": sum(item["errors"] for item in operations.values()),
+                "throughput_rps": round(total / elapsed, 2),
+            },
+            "operations": operations,
+            "peak_rss_bytes": peak_rss,
+        }
+
+
+def read_peak_rss(pid: int) -> Optional[int]:
+    """读取进程 (及其子进程) 的峰值常驻内存 (Linux /proc), 不可用时返回 None"""
+    try:
+        children = subprocess.run(
+            ["pgrep", "-P", str(pid)], capture_output=True, text=True
+        ).stdout.split()
+    except OSError:
+        children = []
+    total = 0
+    for process in [str(pid), *children]:
+        try:
+            with open(f"/proc/{process}/status") as file:
+                for line in file:
+                    if line.startswith("VmHWM:"):
+                        total += int(line.split()[1]) * 1024
+        except OSError:
+            continue
+    return total or None
+
+
+async def run_in_process(args: argparse.Namespace, origin: Origin) -> dict:
+    import main as app_module
+    
+    async with app_module.lifespan(app_module.app):
+        transport = httpx.ASGITransport(app=app_module.app)
+        async with httpx.AsyncClient(transport=transport, base_url="http://bench", timeout=args.timeout) as client:
+            bench = Bench(client, origin, args)
+            await bench.seed()
+            elapsed = await bench.run()
+    
+    if resource is None:
+        return bench.report(elapsed, None)
+    # ru_maxrss: Linux 为 KB, macOS 为字节 (含压测客户端本身)
+    peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    return bench.report(elapsed, peak if sys.platform == "darwin" else peak * 1024)
+
+
+async def run_server(args: argparse.Namespace, origin: Origin, env: Dict[str, str]) -> dict:
+    command = [
+        sys.executable, "-m", "uvicorn", "main:app",
+        "--host", "127.0.0.1", "--port", str(args.port),
+        "--workers", str(args.workers), "--log-level", "warning",
+    ]
+    process = subprocess.Popen(command, env=env)
+    base_url = f"http://127.0.0.1:{args.port}"
+    limits = httpx.Limits(max_connections=args.concurrency, max_keepalive_connections=args.concurrency)
+    try:
+        async with httpx.AsyncClient(base_url=base_url, timeout=args.timeout, limits=limits) as client:
+            for _ in range(100):
+                try:
+                    await client.get("/health")
+                    break
+                except httpx.TransportError:
+                    await asyncio.sleep(0.1)
+            else:
+                raise RuntimeError("uvicorn 启动超时")
+            
+            bench = Bench(client, origin, args)
+            await bench.seed()
+            elapsed = await bench.run()
+        return bench.report(elapsed, read_peak_rss(process.pid))
+    finally:
+        process.terminate()
+        process.wait()
+
+
+async def run(args: argparse.Namespace, env: Dict[str, str]) -> dict:
+    origin = Origin(args.origin_size, args.origin_latency, args.seed)
+    await origin.start()
+    try:
+        if args.server:
+            return await run_server(args, origin, env)
+        return await run_in_process(args, origin)
+    finally:
+        await origin.stop()
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description="上传与直链访问压测")
+    parser.add_argument("--server", action="store_true", help="启动 uvicorn 子进程 (默认进程内运行)")
+    parser.add_argument("--port", type=int, default=8765, help="uvicorn 监听端口")
+    parser.add_argument("--workers", type=int, default=1, help="uvicorn worker 进程数")
+    parser.add_argument("--concurrency", type=int, default=16, help="并发请求数")
+    parser.add_argument("--duration", type=float, default=10.0, help="压测时长 (秒)")
+    parser.add_argument("--requests", type=int, default=0, help="总请求数 (0 表示只按时长)")
+    parser.add_argument("--mix", default=DEFAULT_MIX, help="各操作的权重")
+    parser.add_argument("--file-size", type=int, default=262144, help="上传文件大小 (字节)")
+    parser.add_argument("--batch-size", type=int, default=4, help="批量请求中的文件 / URL 数")
+    parser.add_argument("--range-size", type=int, default=65536, help="Range 读取的长度 (字节)")
+    parser.add_argument("--seed-files", type=int, default=32, help="预先上传供 Range 读取的文件数")
+    parser.add_argument("--origin-size", type=int, default=262144, help="本地源站返回的文件大小 (字节)")
+    parser.add_argument("--origin-latency", type=float, default=0.02, help="本地源站的响应延迟 (秒)")
+    parser.add_argument("--timeout", type=float, default=60.0, help="单个请求超时 (秒)")
+    parser.add_argument("--seed", type=int, default=1, help="随机数种子 (相同参数下请求序列可复现)")
+    parser.add_argument("--data-dir", help="上传和数据目录 (默认使用临时目录并在结束后删除)")
+    parser.add_argument("--output", help="结果 JSON 文件 (默认输出到标准输出)")
+    args = parser.parse_args()
+    
+    base_dir = args.data_dir or tempfile.mkdtemp(prefix="linkforge-bench-")
+    env = {
+        **os.environ,
+        "UPLOAD_DIR": os.path.join(base_dir, "uploads"),
+        "DATA_DIR": os.path.join(base_dir, "data"),
+    }
+    # 进程内运行时, 配置在导入应用之前从环境变量读取
+    os.environ.update(env)
+    try:
+        result = asyncio.run(run(args, env))
+    finally:
+        if not args.data_dir:
+            shutil.rmtree(base_dir, ignore_errors=True)
+    
+    output = json.dumps(result, ensure_ascii=False, indent=2)
+    if args.output:
+        with open(args.output, "w", encoding="utf-8") as file:
+            file.write(output + "\n")
+    else:
+        print(output)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,92 @@
+"""
+压缩卷存储: 将有效数据占比过低的卷中的文件迁移到新卷, 回收已删除文件占用的空间
+
+运行中的服务在内存中保存了各文件在卷中的位置, 请在服务停止后执行。
+
+用法:
+    VOLUME_SMALL_FILE_MAX=65536 python -m tools.compact_volumes --min-garbage 0.3
+"""
+import argparse
+import asyncio
+import os
+from services.volume_service import VolumeService, NEEDLE_TOMBSTONE
+
+try:
+    import fcntl
+except ImportError:
+    fcntl = None
+
+
+def lock_volume(path) -> int:
+    """
+    锁定卷文件, 防止本次压缩把待回收的卷选作新的写入卷
+    
+    Returns:
+        int: 持有锁的文件描述符, 卷正被其他进程持有时返回 -1
+    """
+    fd = os.open(path, os.O_RDONLY)
+    if fcntl is not None:
+        try:
+            fcntl.flock(fd, fcntl.LOCK_EX | fcntl.LOCK_NB)
+        except OSError:
+            os.close(fd)
+            return -1
+    return fd
+
+
+async def compact(service: VolumeService, min_garbage: float, dry_run: bool = False) -> None:
+    usage = service.volume_usage()
+    candidates = {}
+    for volume_id, (path, used, live) in sorted(usage.items()):
+        if not used or (used - live) / used < min_garbage:
+            continue
+        if dry_run:
+            candidates[volume_id] = -1
+            continue
+        fd = lock_volume(path)
+        if fd < 0:
+            print(f"跳过 (正被其他进程写入): {path.name}")
+            continue
+        candidates[volume_id] = fd
+    
+    reclaimed = sum(usage[volume_id][1] - usage[volume_id][2] for volume_id in candidates)
+    if dry_run or not candidates:
+        print(f"可压缩 {len(candidates)} 个卷, 预计回收 {reclaimed} 字节")
+        return
+    
+    # 其他卷中仍存在同名记录时墓碑需要保留, 否则重建索引时被删除的文件会重新出现
+    shadowed = set()
+    for volume_id, (path, _, _) in usage.items():
+        if volume_id not in candidates:
+            shadowed.update(needle.name for needle in service.scan(path) if needle.flags != NEEDLE_TOMBSTONE)
+    
+    for volume_id, fd in candidates.items():
+        path = usage[volume_id][0]
+        for needle in service.scan(path):
+            if needle.flags == NEEDLE_TOMBSTONE and needle.name in shadowed:
+                await service.put_tombstone(needle.name, needle.timestamp)
+        for needle in service.live_needles(volume_id):
+            location = await service.locate(needle.name)
+            await service.put(needle.name, service.read(location), needle.timestamp)
+        os.close(fd)
+        service.remove_volume(volume_id)
+        print(f"已压缩: {path.name}")
+    
+    service.close()
+    print(f"已压缩 {len(candidates)} 个卷, 回收 {reclaimed} 字节")
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description="压缩卷存储, 回收已删除文件占用的空间")
+    parser.add_argument("--min-garbage", type=float, default=0.3, help="已删除数据占比达到该值的卷才会被压缩")
+    parser.add_argument("--dry-run", action="store_true", help="只统计可回收的空间")
+    args = parser.parse_args()
+    
+    service = VolumeService()
+    if not service.enabled:
+        parser.error("请先设置 VOLUME_SMALL_FILE_MAX (大于 0) 再执行压缩")
+    asyncio.run(compact(service, args.min_garbage, args.dry_run))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,69 @@
+"""
+将平铺在上传目录中的文件迁移到分片目录布局
+
+服务无需停机: 每个文件先硬链接到分片目录再删除原路径, 任意时刻至少有一个路径
+可用, 而 StorageService 在分片路径找不到时会回退到平铺路径。
+
+用法:
+    STORAGE_SHARD_DEPTH=2 python -m tools.migrate_sharded --workers 8
+"""
+import argparse
+import os
+from concurrent.futures import ThreadPoolExecutor
+from services.storage_service import StorageService
+
+
+def migrate_file(storage: StorageService, entry: os.DirEntry, dry_run: bool = False) -> bool:
+    """
+    迁移单个文件
+    
+    Args:
+        storage: 存储服务
+        entry: 平铺目录中的文件
+        dry_run: 只检查不移动
+    
+    Returns:
+        bool: 是否迁移
+    """
+    # 只在上传目录内迁移; 多磁盘布局下 tools.rebalance_storage 会同时完成分片和跨磁盘迁移
+    target = storage.get_shard_dir(entry.name, storage.base_dir) / entry.name
+    if dry_run:
+        return True
+    
+    target.parent.mkdir(parents=True, exist_ok=True)
+    try:
+        os.link(entry.path, target)
+    except FileExistsError:
+        # 上次迁移中断时可能已经链接过, 只有确认是同一个文件才删除原路径
+        if not os.path.samefile(entry.path, target):
+            print(f"跳过 (目标已存在且内容不同): {entry.name}")
+            return False
+    os.remove(entry.path)
+    return True
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description="将平铺的上传目录迁移到分片目录布局")
+    parser.add_argument("--workers", type=int, default=8, help="并行迁移的线程数")
+    parser.add_argument("--dry-run", action="store_true", help="只统计需要迁移的文件")
+    args = parser.parse_args()
+    
+    storage = StorageService()
+    if not storage.shard_depth:
+        parser.error("请先设置 STORAGE_SHARD_DEPTH (大于 0) 再执行迁移")
+    
+    with os.scandir(storage.base_dir) as entries:
+        files = [
+            entry for entry in entries
+            if entry.is_file(follow_symlinks=False) and storage.is_valid_filename(entry.name)
+        ]
+    
+    with ThreadPoolExecutor(max_workers=args.workers) as executor:
+        migrated = sum(executor.map(lambda entry: migrate_file(storage, entry, args.dry_run), files))
+    
+    action = "需要迁移" if args.dry_run else "已迁移"
+    print(f"{action} {migrated}/{len(files)} 个文件 -> {storage.base_dir} (分片层数 {storage.shard_depth})")
+
+
+if __name__ == "__main__":
+    main()
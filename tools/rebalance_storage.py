@@ -0,0 +1,167 @@
+"""
+调整多磁盘存储布局, 并把文件移动到新布局中的位置
+
+服务无需停机: 布局变更写入主目录的 .layout.json, 运行中的服务在 STORAGE_LAYOUT_RELOAD 秒内
+加载; 迁移期间查找文件时依次检查新旧布局计算出的位置, 直链始终可用。全部移动完成后丢弃旧布局。
+
+同一磁盘内的移动为硬链接 + 删除; 跨磁盘时先复制到目标磁盘的临时文件并 fsync, 再链接到最终路径,
+最后删除原文件。开启去重时跨磁盘移动的文件不再与原磁盘上的 blob 共享数据,
+原 blob 由 collect_garbage 回收。
+
+用法:
+    python -m tools.rebalance_storage --add /mnt/disk2          # 加入磁盘 (权重默认按剩余空间) 并迁移
+    python -m tools.rebalance_storage --drain /mnt/disk1        # 设为只读, 文件迁出到其他磁盘
+    python -m tools.rebalance_storage --remove /mnt/disk1       # 从布局中移除已排空的磁盘
+    python -m tools.rebalance_storage --dry-run                 # 只统计需要移动的文件
+"""
+import argparse
+import errno
+import os
+import shutil
+import time
+from concurrent.futures import ThreadPoolExecutor
+from pathlib import Path
+from typing import Iterator, Tuple
+from config import STORAGE_LAYOUT_RELOAD
+from services.storage_service import StorageService
+
+
+def iter_root_files(storage: StorageService, root: Path) -> Iterator[Tuple[str, Path]]:
+    """
+    遍历根目录中的文件 (跳过 .blobs / .volumes 等隐藏目录和临时文件)
+    
+    Args:
+        storage: 存储服务
+        root: 根目录
+    
+    Yields:
+        Tuple[str, Path]: (文件名, 文件路径)
+    """
+    for directory, dirnames, filenames in os.walk(root):
+        dirnames[:] = [name for name in dirnames if not name.startswith(".")]
+        for name in filenames:
+            if storage.is_valid_filename(name):
+                yield name, Path(directory) / name
+
+
+def move_file(storage: StorageService, filename: str, source: Path, dry_run: bool = False) -> bool:
+    """
+    将文件移动到当前布局中的位置
+    
+    Args:
+        storage: 存储服务
+        filename: 文件名
+        source: 文件的当前路径
+        dry_run: 只检查不移动
+    
+    Returns:
+        bool: 是否移动
+    """
+    target = storage.get_file_path(filename)
+    if source == target:
+        return False
+    if dry_run:
+        return True
+    
+    target.parent.mkdir(parents=True, exist_ok=True)
+    try:
+        os.link(source, target)
+    except FileExistsError:
+        # 上次迁移中断时可能已经链接过, 只有确认是同一个文件才删除原路径
+        if not os.path.samefile(source, target):
+            print(f"跳过 (目标已存在且不是同一个文件): {filename}")
+            return False
+    except OSError as e:
+        if e.errno != errno.EXDEV:
+            raise
+        # 跨磁盘: 复制完成并落盘后才出现在最终路径, 任意时刻至少有一个完整的副本
+        temp_path = storage.get_temp_path(filename)
+        try:
+            shutil.copy2(source, temp_path)
+            with open(temp_path, "rb") as file:
+                os.fsync(file.fileno())
+            try:
+                os.link(temp_path, target)
+            except FileExistsError:
+                if os.path.getsize(target) != os.path.getsize(source):
+                    print(f"跳过 (目标已存在且大小不同): {filename}")
+                    return False
+        finally:
+            os.remove(temp_path)
+    os.remove(source)
+    return True
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description="调整多磁盘存储布局并迁移文件")
+    action = parser.add_mutually_exclusive_group()
+    action.add_argument("--add", type=Path, metavar="PATH", help="加入存储根目录")
+    action.add_argument("--drain", type=Path, metavar="PATH", help="将根目录设为只读, 文件迁出")
+    action.add_argument("--activate", type=Path, metavar="PATH", help="恢复只读根目录为可写")
+    action.add_argument("--remove", type=Path, metavar="PATH", help="从布局中移除已排空的只读根目录")
+    parser.add_argument("--weight", type=float, help="加入根目录的权重 (默认按剩余空间, 单位 GiB)")
+    parser.add_argument("--workers", type=int, default=8, help="并行移动的线程数")
+    parser.add_argument(
+        "--wait", type=float, default=STORAGE_LAYOUT_RELOAD * 2,
+        help="写入新布局后等待运行中的服务加载的秒数"
+    )
+    parser.add_argument("--dry-run", action="store_true", help="只统计需要移动的文件, 不修改布局")
+    args = parser.parse_args()
+    
+    storage = StorageService()
+    layout = storage.layout
+    
+    try:
+        if args.add:
+            root = layout.add_root(args.add, args.weight)
+            print(f"加入根目录 {root.path} (权重 {root.weight})")
+        elif args.drain:
+            layout.set_readonly(args.drain, True)
+            print(f"根目录设为只读: {args.drain}")
+        elif args.activate:
+            layout.set_readonly(args.activate, False)
+            print(f"根目录恢复可写: {args.activate}")
+        elif args.remove:
+            target = layout.find(args.remove)
+            if target is not None and next(iter_root_files(storage, target.path), None) is not None:
+                parser.error(f"根目录中仍有文件, 请先执行 --drain 并完成迁移: {args.remove}")
+            layout.remove_root(args.remove)
+            if not args.dry_run:
+                layout.save()
+            print(f"已从布局中移除根目录: {args.remove}")
+            return
+    except ValueError as e:
+        parser.error(str(e))
+    
+    changed = any((args.add, args.drain, args.activate))
+    if changed and not args.dry_run:
+        layout.save()
+        print(f"新布局已写入, 等待 {args.wait:g} 秒让运行中的服务加载...")
+        time.sleep(args.wait)
+    
+    files = [item for root in layout.all_roots() for item in iter_root_files(storage, root.path)]
+    with ThreadPoolExecutor(max_workers=args.workers) as executor:
+        moved = sum(executor.map(lambda item: move_file(storage, item[0], item[1], args.dry_run), files))
+    
+    if args.dry_run:
+        print(f"需要移动 {moved}/{len(files)} 个文件")
+        return
+    
+    # 移动期间新上传的文件已按新布局写入; 再检查一遍, 全部就位后才丢弃旧布局
+    remaining = sum(
+        storage.get_file_path(name) != path
+        for root in layout.all_roots()
+        for name, path in iter_root_files(storage, root.path)
+    )
+    if remaining:
+        print(f"已移动 {moved}/{len(files)} 个文件, 仍有 {remaining} 个文件不在新布局的位置, 保留旧布局, 请检查后重新执行")
+        return
+    layout.finish_rebalance()
+    layout.save()
+    print(f"已移动 {moved}/{len(files)} 个文件, 迁移完成")
+    for root in layout.roots:
+        print(f"  {root.path}  权重 {root.weight}{'  (只读)' if root.readonly else ''}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,489 @@
+import struct
+import zlib
+from typing import AsyncIterator, Dict, Optional
+from config import ARCHIVE_MAX_MEMBERS, ARCHIVE_MAX_TOTAL_SIZE, ARCHIVE_MAX_RATIO
+from utils.streams import read_stream_head
+
+# 每次从压缩包中读取 / 解压产出的数据块大小
+READ_CHUNK_SIZE = 256 * 1024
+
+# 解压比例检查的最小输入量: 压缩包开头的少量数据不足以判断比例
+_RATIO_MIN_INPUT = 64 * 1024
+
+# tar 扩展头 (pax / GNU 长文件名) 的最大长度
+_MAX_EXTENDED_HEADER = 1024 * 1024
+
+_ZIP_LOCAL_HEADER = b"PK\x03\x04"
+_ZIP_DATA_DESCRIPTOR = b"PK\x07\x08"
+_ZIP_END_SIGNATURES = (b"PK\x01\x02", b"PK\x05\x06", b"PK\x06\x06", b"PK\x06\x07")
+_ZIP_STORED = 0
+_ZIP_DEFLATED = 8
+
+_TAR_BLOCK = 512
+_TAR_REGULAR_TYPES = (b"0", b"\0", b"7")
+
+
+class ArchiveError(ValueError):
+    """压缩包损坏或超出解压限制, 无法继续读取后续文件"""
+
+
+def detect_archive_format(head: bytes) -> Optional[str]:
+    """
+    根据开头的字节识别压缩包格式
+    
+    Args:
+        head: 数据开头 (至少 262 字节才能识别 tar)
+    
+    Returns:
+        Optional[str]: zip / tar / tar.gz, 无法识别时返回 None
+    """
+    if head.startswith((_ZIP_LOCAL_HEADER, b"PK\x05\x06")):
+        return "zip"
+    if head.startswith(b"\x1f\x8b"):
+        return "tar.gz"
+    if head[257:262] == b"ustar":
+        return "tar"
+    return None
+
+
+def _ignored(name: str) -> bool:
+    # 目录和 macOS 打包时附带的资源文件 (__MACOSX/, ._*) 不作为文件处理
+    basename = name.rsplit("/", 1)[-1]
+    return not basename or name.startswith("__MACOSX/") or basename.startswith("._")
+
+
+class _ByteReader:
+    """在异步数据流上按字节数读取, 支持退回多读的数据"""
+    
+    def __init__(self, stream: AsyncIterator[bytes]):
+        self._stream = stream.__aiter__()
+        self._buffer = bytearray()
+        self._eof = False
+    
+    async def _fill(self) -> bool:
+        while not self._eof:
+            try:
+                chunk = await self._stream.__anext__()
+            except StopAsyncIteration:
+                self._eof = True
+                break
+            if chunk:
+                self._buffer += chunk
+                return True
+        return False
+    
+    async def read(self, size: int) -> bytes:
+        """读取最多 size 字节, 数据流结束时返回空字节串"""
+        if not self._buffer:
+            await self._fill()
+        data = bytes(self._buffer[:size])
+        del self._buffer[:size]
+        return data
+    
+    async def read_exact(self, size: int, allow_eof: bool = False) -> bytes:
+        """
+        读取恰好 size 字节
+        
+        Raises:
+            ArchiveError: 数据不足 (allow_eof 时数据流正好结束则返回空字节串)
+        """
+        while len(self._buffer) < size:
+            if not await self._fill():
+                if allow_eof and not self._buffer:
+                    return b""
+                raise ArchiveError("压缩包不完整")
+        data = bytes(self._buffer[:size])
+        del self._buffer[:size]
+        return data
+    
+    def unread(self, data: bytes) -> None:
+        """退回多读的数据, 下次读取时优先返回"""
+        self._buffer[:0] = data
+
+
+class ArchiveMember:
+    """压缩包中的一个文件, 数据在读取时才从请求体中解出"""
+    
+    def __init__(self, reader: "ArchiveStreamReader", name: str, size: Optional[int], error: Optional[str] = None):
+        self._reader = reader
+        self.name = name
+        self.size = size
+        self.error = error
+        self._finished = False
+    
+    async def _read(self) -> bytes:
+        raise NotImplementedError
+    
+    async def iter_chunks(self) -> AsyncIterator[bytes]:
+        """
+        按块读取文件数据
+        
+        Yields:
+            bytes: 数据块
+        
+        Raises:
+            ArchiveError: 压缩包损坏或超出解压限制
+            ValueError: 文件数据校验失败
+        """
+        while not self._finished:
+            chunk = await self._read()
+            if not chunk:
+                return
+            self._reader._account(len(chunk))
+            yield chunk
+    
+    async def drain(self) -> None:
+        """丢弃文件中尚未读取的数据"""
+        try:
+            async for _ in self.iter_chunks():
+                pass
+        except ArchiveError:
+            raise
+        except ValueError:
+            # 单个文件的校验错误不影响后续文件
+            pass
+
+
+class _TarMember(ArchiveMember):
+    def __init__(self, reader: "ArchiveStreamReader", name: str, size: int):
+        super().__init__(reader, name, size)
+        self._remaining = size
+    
+    async def _read(self) -> bytes:
+        if self._remaining == 0:
+            self._finished = True
+            await self._reader._source.read_exact(-self.size % _TAR_BLOCK)
+            return b""
+        data = await self._reader._source.read(min(self._remaining, READ_CHUNK_SIZE))
+        if not data:
+            raise ArchiveError("压缩包不完整")
+        self._remaining -= len(data)
+        return data
+
+
+class _ZipMember(ArchiveMember):
+    def __init__(
+        self,
+        reader: "ArchiveStreamReader",
+        name: str,
+        method: int,
+        crc: int,
+        compressed_size: Optional[int],
+        size: Optional[int],
+        zip64: bool,
+        error: Optional[str] = None
+    ):
+        super().__init__(reader, name, size, error)
+        self._crc = crc
+        self._remaining = compressed_size
+        self._zip64 = zip64
+        self._actual_crc = 0
+        self._actual_size = 0
+        self._pending = b""
+        self._decompressor = zlib.decompressobj(-zlib.MAX_WBITS) if method == _ZIP_DEFLATED else None
+    
+    async def _read(self) -> bytes:
+        source = self._reader._source
+        if self._decompressor is None:
+            # 未压缩, 或无法解压的条目 (只跳过数据)
+            if self._remaining == 0:
+                return await self._finish(descriptor=False)
+            data = await source.read(min(self._remaining, READ_CHUNK_SIZE))
+            if not data:
+                raise ArchiveError("压缩包不完整")
+            self._remaining -= len(data)
+            if self.error is None:
+                self._update(data)
+            return data
+        
+        while True:
+            if self._decompressor.eof:
+                source.unread(self._decompressor.unused_data)
+                return await self._finish(descriptor=self._remaining is None)
+            
+            data = self._pending
+            if not data:
+                size = READ_CHUNK_SIZE if self._remaining is None else min(self._remaining, READ_CHUNK_SIZE)
+                data = await source.read(size) if size else b""
+                if not data:
+                    raise ArchiveError(f"压缩数据不完整: {self.name}")
+                if self._remaining is not None:
+                    self._remaining -= len(data)
+            
+            try:
+                output = self._decompressor.decompress(data, READ_CHUNK_SIZE)
+            except zlib.error:
+                raise ArchiveError(f"压缩数据损坏: {self.name}")
+            self._pending = self._decompressor.unconsumed_tail
+            if output:
+                self._update(output)
+                return output
+    
+    def _update(self, data: bytes) -> None:
+        self._actual_crc = zlib.crc32(data, self._actual_crc)
+        self._actual_size += len(data)
+    
+    async def _finish(self, descriptor: bool) -> bytes:
+        self._finished = True
+        if descriptor:
+            # 文件数据之后的 data descriptor: [签名] CRC 压缩后大小 原始大小
+            source = self._reader._source
+            head = await source.read_exact(4)
+            if head == _ZIP_DATA_DESCRIPTOR:
+                head = await source.read_exact(4)
+            self._crc = struct.unpack("<I", head)[0]
+            sizes = await source.read_exact(16 if self._zip64 else 8)
+            self.size = struct.unpack("<QQ" if self._zip64 else "<II", sizes)[1]
+        
+        if self.error is None:
+            if self.size is not None and self._actual_size != self.size:
+                raise ValueError(f"文件大小与压缩包记录不符: {self.name}")
+            if self._actual_crc != self._crc:
+                raise ValueError(f"CRC 校验失败: {self.name}")
+        return b""
+
+
+class ArchiveStreamReader:
+    """
+    流式压缩包解析器 (zip / tar / tar.gz)
+    
+    按顺序读取请求体中的各个文件, 数据在解压时即交给调用方, 不会先解包到临时目录。
+    zip 按本地文件头顺序读取, 不依赖文件末尾的中央目录。
+    按文件数、解压后的总大小和解压比例 (解压后大小 / 已接收大小) 限制压缩炸弹。
+    """
+    
+    def __init__(
+        self,
+        stream: AsyncIterator[bytes],
+        max_members: int = ARCHIVE_MAX_MEMBERS,
+        max_total_size: int = ARCHIVE_MAX_TOTAL_SIZE,
+        max_ratio: float = ARCHIVE_MAX_RATIO
+    ):
+        self.max_members = max_members
+        self.max_total_size = max_total_size
+        self.max_ratio = max_ratio
+        self.format: Optional[str] = None
+        self._stream = self._count_received(stream)
+        self._source: Optional[_ByteReader] = None
+        self._received = 0
+        self._extracted = 0
+        self._entries = 0
+    
+    async def _count_received(self, stream: AsyncIterator[bytes]) -> AsyncIterator[bytes]:
+        async for chunk in stream:
+            self._received += len(chunk)
+            yield chunk
+    
+    def _account(self, size: int) -> None:
+        self._extracted += size
+        if self.max_total_size and self._extracted > self.max_total_size:
+            raise ArchiveError(f"解压后的总大小超过限制: {self.max_total_size} 字节")
+        if self.max_ratio and self._extracted > self.max_ratio * max(self._received, _RATIO_MIN_INPUT):
+            raise ArchiveError(f"解压比例超过限制: {self.max_ratio:g}")
+    
+    def _count_entry(self) -> None:
+        self._entries += 1
+        if self.max_members and self._entries > self.max_members:
+            raise ArchiveError(f"压缩包中的条目数超过限制: {self.max_members}")
+    
+    async def members(self) -> AsyncIterator[ArchiveMember]:
+        """
+        依次产出压缩包中的文件 (跳过目录、链接等非普通文件)
+        
+        调用方未读完的文件数据会在取下一个文件前被自动丢弃。
+        
+        Yields:
+            ArchiveMember: 压缩包中的文件
+        
+        Raises:
+            ArchiveError: 格式不支持、压缩包损坏或超出解压限制
+        """
+        head, stream = await read_stream_head(self._stream, _TAR_BLOCK)
+        self.format = detect_archive_format(head)
+        if self.format is None:
+            raise ArchiveError("不支持的压缩包格式, 仅支持 zip / tar / tar.gz")
+        
+        self._source = _ByteReader(_gunzip(stream) if self.format == "tar.gz" else stream)
+        next_member = self._next_zip_member if self.format == "zip" else self._next_tar_member
+        while True:
+            member = await next_member()
+            if member is None:
+                return
+            yield member
+            await member.drain()
+    
+    async def _next_zip_member(self) -> Optional[ArchiveMember]:
+        while True:
+            signature = await self._source.read_exact(4, allow_eof=True)
+            if not signature or signature in _ZIP_END_SIGNATURES:
+                # 到达中央目录, 之后没有文件数据
+                return None
+            if signature != _ZIP_LOCAL_HEADER:
+                raise ArchiveError("无效的 zip 文件")
+            self._count_entry()
+            
+            (_, flags, method, _, _, crc, compressed_size, size,
+             name_length, extra_length) = struct.unpack("<HHHHHIIIHH", await self._source.read_exact(26))
+            raw_name = await self._source.read_exact(name_length)
+            extra = _parse_zip_extra(await self._source.read_exact(extra_length))
+            # 标志位 11: 文件名为 UTF-8, 否则为 CP437
+            name = raw_name.decode("utf-8" if flags & 0x800 else "cp437", errors="replace")
+            
+            zip64 = 0x0001 in extra
+            if zip64:
+                field = extra[0x0001]
+                if size == 0xFFFFFFFF and len(field) >= 8:
+                    size, field = struct.unpack("<Q", field[:8])[0], field[8:]
+                if compressed_size == 0xFFFFFFFF and len(field) >= 8:
+                    compressed_size = struct.unpack("<Q", field[:8])[0]
+            
+            # 标志位 3: 大小和 CRC 记录在数据之后的 data descriptor 中
+            descriptor = bool(flags & 0x08)
+            if descriptor and method != _ZIP_DEFLATED:
+                raise ArchiveError(f"无法流式读取的 zip 条目 (未压缩且大小未知): {name}")
+            
+            error = None
+            if flags & 0x01:
+                error = f"不支持加密的文件: {name}"
+            elif method not in (_ZIP_STORED, _ZIP_DEFLATED):
+                error = f"不支持的压缩方式 {method}: {name}"
+            if error is not None and descriptor:
+                raise ArchiveError(error)
+            
+            member = _ZipMember(
+                self,
+                name,
+                method if error is None else _ZIP_STORED,
+                crc,
+                None if descriptor else compressed_size,
+                None if descriptor else size,
+                zip64,
+                error
+            )
+            if not _ignored(name):
+                return member
+            await member.drain()
+    
+    async def _next_tar_member(self) -> Optional[ArchiveMember]:
+        long_name = None
+        pax: Dict[str, str] = {}
+        while True:
+            block = await self._source.read_exact(_TAR_BLOCK, allow_eof=True)
+            if not block or block == bytes(_TAR_BLOCK):
+                # 结束标记 (全零块); 部分打包工具省略结束标记
+                return None
+            if not _tar_checksum_ok(block):
+                raise ArchiveError("无效的 tar 文件")
+            self._count_entry()
+            
+            type_flag = block[156:157]
+            size = _tar_number(block[124:136])
+            if type_flag in (b"x", b"g", b"L", b"K"):
+                if size > _MAX_EXTENDED_HEADER:
+                    raise ArchiveError("tar 扩展头过长")
+                data = await self._source.read_exact(size + (-size % _TAR_BLOCK))
+                data = data[:size]
+                if type_flag == b"x":
+                    pax.update(_parse_pax(data))
+                elif type_flag == b"L":
+                    long_name = data.rstrip(b"\0").decode("utf-8", errors="replace")
+                continue
+            
+            name = _tar_string(block[0:100])
+            if block[257:262] == b"ustar" and block[345] != 0:
+                name = f"{_tar_string(block[345:500])}/{name}"
+            name = pax.get("path") or long_name or name
+            if "size" in pax:
+                try:
+                    size = int(pax["size"])
+                except ValueError:
+                    raise ArchiveError("无效的 tar 扩展头")
+                if size < 0:
+                    raise ArchiveError("无效的 tar 扩展头")
+            
+            member = _TarMember(self, name, size)
+            if type_flag in _TAR_REGULAR_TYPES and not _ignored(name):
+                return member
+            await member.drain()
+            long_name = None
+            pax = {}
+
+
+async def _gunzip(stream: AsyncIterator[bytes]) -> AsyncIterator[bytes]:
+    # 按块解压 gzip (支持多个 gzip 成员拼接), 单次产出不超过 READ_CHUNK_SIZE
+    decompressor = zlib.decompressobj(zlib.MAX_WBITS | 16)
+    async for chunk in stream:
+        data = chunk
+        while data:
+            try:
+                output = decompressor.decompress(data, READ_CHUNK_SIZE)
+            except zlib.error:
+                raise ArchiveError("gzip 数据损坏")
+            if output:
+                yield output
+            if decompressor.eof:
+                data = decompressor.unused_data
+                if not data.strip(b"\0"):
+                    # 末尾的填充
+                    break
+                decompressor = zlib.decompressobj(zlib.MAX_WBITS | 16)
+            else:
+                data = decompressor.unconsumed_tail
+    if not decompressor.eof:
+        # 数据流在 gzip 成员结束之前中断
+        raise ArchiveError("压缩包不完整")
+
+
+def _parse_zip_extra(extra: bytes) -> Dict[int, bytes]:
+    fields = {}
+    offset = 0
+    while offset + 4 <= len(extra):
+        header_id, length = struct.unpack_from("<HH", extra, offset)
+        fields[header_id] = extra[offset + 4:offset + 4 + length]
+        offset += 4 + length
+    return fields
+
+
+def _tar_string(field: bytes) -> str:
+    return field.split(b"\0", 1)[0].decode("utf-8", errors="replace")
+
+
+def _tar_number(field: bytes) -> int:
+    # 最高位为 1 时为 base-256 编码 (GNU 大文件), 否则为八进制文本
+    if field[0] & 0x80:
+        return int.from_bytes(bytes([field[0] & 0x7F]) + field[1:], "big")
+    text = field.split(b"\0", 1)[0].strip()
+    try:
+        return int(text, 8) if text else 0
+    except ValueError:
+        raise ArchiveError("无效的 tar 文件")
+
+
+def _tar_checksum_ok(block: bytes) -> bool:
+    # 校验和字段 (148-156) 按空格计算
+    try:
+        expected = _tar_number(block[148:156])
+    except ArchiveError:
+        return False
+    return expected == sum(block[:148]) + 32 * 8 + sum(block[156:])
+
+
+def _parse_pax(data: bytes) -> Dict[str, str]:
+    # 每条记录: "<长度> <键>=<值>\n"
+    records = {}
+    offset = 0
+    while offset < len(data):
+        space = data.find(b" ", offset)
+        if space < 0:
+            break
+        try:
+            length = int(data[offset:space])
+        except ValueError:
+            raise ArchiveError("无效的 tar 扩展头")
+        if length <= 0:
+            break
+        record = data[space + 1:offset + length - 1]
+        key, _, value = record.partition(b"=")
+        records[key.decode("utf-8", errors="replace")] = value.decode("utf-8", errors="replace")
+        offset += length
+    return records
@@ -0,0 +1,61 @@
+import asyncio
+from contextlib import asynccontextmanager
+from typing import Any, AsyncIterator, Awaitable, Callable, Dict, Hashable
+
+
+class KeyedSemaphore:
+    """按键 (如主机名) 分别限制并发的信号量, 空闲的键会被自动回收"""
+    
+    def __init__(self, limit: int):
+        self.limit = limit
+        self._semaphores: Dict[Hashable, asyncio.Semaphore] = {}
+        self._users: Dict[Hashable, int] = {}
+    
+    @asynccontextmanager
+    async def acquire(self, key: Hashable) -> AsyncIterator[None]:
+        """
+        获取指定键的并发名额
+        
+        Args:
+            key: 限流键
+        """
+        semaphore = self._semaphores.get(key)
+        if semaphore is None:
+            semaphore = self._semaphores[key] = asyncio.Semaphore(self.limit)
+        self._users[key] = self._users.get(key, 0) + 1
+        
+        try:
+            async with semaphore:
+                yield
+        finally:
+            self._users[key] -= 1
+            if not self._users[key]:
+                del self._users[key]
+                del self._semaphores[key]
+
+
+class SingleFlight:
+    """合并同一个键上的并发调用: 同时只执行一次, 其余调用方等待并共享结果"""
+    
+    def __init__(self):
+        self._inflight: Dict[Hashable, asyncio.Future] = {}
+    
+    async def do(self, key: Hashable, func: Callable[[], Awaitable[Any]]) -> Any:
+        """
+        执行或加入指定键上正在进行的调用
+        
+        Args:
+            key: 调用键
+            func: 无参数的协程函数
+        
+        Returns:
+            Any: 调用结果 (异常同样会传递给所有等待方)
+        """
+        future = self._inflight.get(key)
+        if future is not None:
+            return await asyncio.shield(future)
+        
+        future = asyncio.ensure_future(func())
+        self._inflight[key] = future
+        future.add_done_callback(lambda _: self._inflight.pop(key, None))
+        return await asyncio.shield(future)
@@ -0,0 +1,204 @@
+"""
+MP4/MOV faststart: 将 moov 移到 mdat 之前, 播放器无需先取文件尾部即可开始播放
+
+只解析 ISO-BMFF 顶层盒子和 moov 内部通往 stco/co64 的路径, 媒体数据按块流式复制,
+内存中只保留 moov 本身。
+"""
+import bisect
+import struct
+from typing import BinaryIO, List, Optional, Tuple
+
+# 需要递归解析的容器盒子 (通往 stco/co64 的路径)
+_CONTAINERS = {b"moov", b"trak", b"mdia", b"minf", b"stbl"}
+
+# 出现这些顶层盒子时不处理 (分片 MP4 / 压缩 moov 无需或无法改写)
+_UNSUPPORTED = {b"moof", b"mfra"}
+
+# moov 超过此大小时放弃改写, 避免占用过多内存
+MAX_MOOV_SIZE = 64 * 1024 * 1024
+
+COPY_CHUNK_SIZE = 1024 * 1024
+
+_UINT32_MAX = 0xFFFFFFFF
+
+
+class FaststartError(ValueError):
+    """文件结构无法解析"""
+
+
+class _Box:
+    def __init__(self, box_type: bytes, payload: bytes = b""):
+        self.type = box_type
+        self.payload = payload
+        self.children: Optional[List["_Box"]] = None
+        self.offsets: Optional[List[int]] = None
+    
+    def serialize(self, mapped: Optional[dict] = None) -> bytes:
+        if self.offsets is not None:
+            values = mapped[id(self)] if mapped is not None else self.offsets
+            fmt = ">I" if self.type == b"stco" else ">Q"
+            body = self.payload + struct.pack(">I", len(values)) + b"".join(struct.pack(fmt, v) for v in values)
+        elif self.children is not None:
+            body = b"".join(child.serialize(mapped) for child in self.children)
+        else:
+            body = self.payload
+        return _box_header(self.type, len(body)) + body
+
+
+def _box_header(box_type: bytes, body_size: int) -> bytes:
+    if body_size + 8 <= _UINT32_MAX:
+        return struct.pack(">I4s", body_size + 8, box_type)
+    return struct.pack(">I4sQ", 1, box_type, body_size + 16)
+
+
+def _parse_header(data: bytes, offset: int, remaining: int) -> Tuple[bytes, int, int]:
+    """解析 data[offset:] 处的盒子头部, remaining 为所在区域从 offset 起的剩余字节数"""
+    if len(data) - offset < 8:
+        raise FaststartError("盒子头部不完整")
+    size, box_type = struct.unpack_from(">I4s", data, offset)
+    header_size = 8
+    if size == 1:
+        if len(data) - offset < 16:
+            raise FaststartError("盒子头部不完整")
+        size = struct.unpack_from(">Q", data, offset + 8)[0]
+        header_size = 16
+    elif size == 0:
+        size = remaining
+    if size < header_size or size > remaining:
+        raise FaststartError(f"盒子大小无效: {box_type!r}")
+    return box_type, header_size, size
+
+
+def _parse_boxes(data: bytes, tables: List[_Box]) -> List[_Box]:
+    boxes = []
+    offset = 0
+    while offset < len(data):
+        box_type, header_size, size = _parse_header(data, offset, len(data) - offset)
+        body = data[offset + header_size:offset + size]
+        box = _Box(box_type)
+        if box_type == b"cmov":
+            raise FaststartError("不支持压缩的 moov")
+        if box_type in _CONTAINERS:
+            box.children = _parse_boxes(body, tables)
+        elif box_type in (b"stco", b"co64"):
+            entry_size = 4 if box_type == b"stco" else 8
+            if len(body) < 8:
+                raise FaststartError("chunk offset 表不完整")
+            count = struct.unpack_from(">I", body, 4)[0]
+            if len(body) < 8 + count * entry_size:
+                raise FaststartError("chunk offset 表不完整")
+            fmt = f">{count}{'I' if entry_size == 4 else 'Q'}"
+            box.payload = body[:4]
+            box.offsets = list(struct.unpack_from(fmt, body, 8))
+            tables.append(box)
+        else:
+            box.payload = body
+        boxes.append(box)
+        offset += size
+    return boxes
+
+
+def _scan_top_level(file: BinaryIO, file_size: int) -> List[Tuple[bytes, int, int]]:
+    boxes = []
+    offset = 0
+    while offset < file_size:
+        file.seek(offset)
+        box_type, _, size = _parse_header(file.read(16), 0, file_size - offset)
+        boxes.append((box_type, offset, size))
+        offset += size
+    return boxes
+
+
+def _copy_range(src: BinaryIO, dst: BinaryIO, offset: int, size: int) -> None:
+    src.seek(offset)
+    remaining = size
+    while remaining > 0:
+        chunk = src.read(min(COPY_CHUNK_SIZE, remaining))
+        if not chunk:
+            raise FaststartError("文件意外结束")
+        dst.write(chunk)
+        remaining -= len(chunk)
+
+
+def faststart(source: str, target: str) -> bool:
+    """
+    将 moov 移到第一个 mdat 之前并修正 chunk 偏移, 结果写入 target
+    
+    偏移超过 32 位时自动把 stco 升级为 co64。
+    
+    Args:
+        source: 原文件路径
+        target: 输出文件路径
+    
+    Returns:
+        bool: 是否生成了改写后的文件 (已是 faststart、非 MP4 或无法解析时返回 False)
+    """
+    try:
+        with open(source, "rb") as src:
+            src.seek(0, 2)
+            file_size = src.tell()
+            top_level = _scan_top_level(src, file_size)
+            
+            types = [box_type for box_type, _, _ in top_level]
+            if types.count(b"moov") != 1 or b"mdat" not in types or _UNSUPPORTED.intersection(types):
+                return False
+            moov_index = types.index(b"moov")
+            mdat_index = types.index(b"mdat")
+            if moov_index < mdat_index:
+                return False
+            
+            _, moov_offset, moov_size = top_level[moov_index]
+            if moov_size > MAX_MOOV_SIZE:
+                return False
+            src.seek(moov_offset)
+            tables: List[_Box] = []
+            moov = _parse_boxes(src.read(moov_size), tables)[0]
+            
+            # 新布局: mdat 之前的盒子, moov, 其余盒子
+            rest = [box for box in top_level if box[0] != b"moov"]
+            layout = rest[:mdat_index] + [None] + rest[mdat_index:]
+            
+            mapped = _map_offsets(moov, tables, layout)
+            with open(target, "wb") as dst:
+                for box in layout:
+                    if box is None:
+                        dst.write(moov.serialize(mapped))
+                    else:
+                        _copy_range(src, dst, box[1], box[2])
+        return True
+    except (FaststartError, struct.error):
+        return False
+
+
+def _map_offsets(moov: _Box, tables: List[_Box], layout: list) -> dict:
+    """计算每个 chunk 偏移在新布局中的位置, 必要时将 stco 升级为 co64"""
+    while True:
+        moov_size = len(moov.serialize())
+        starts, ends, shifts = [], [], []
+        position = 0
+        for box in layout:
+            if box is None:
+                position += moov_size
+                continue
+            _, offset, size = box
+            starts.append(offset)
+            ends.append(offset + size)
+            shifts.append(position - offset)
+            position += size
+        
+        mapped = {}
+        upgraded = False
+        for table in tables:
+            values = []
+            for value in table.offsets:
+                # 布局中其余盒子保持原有顺序, starts 天然有序
+                i = bisect.bisect_right(starts, value) - 1
+                if i < 0 or value >= ends[i]:
+                    raise FaststartError(f"chunk 偏移超出文件范围: {value}")
+                values.append(value + shifts[i])
+            if table.type == b"stco" and values and max(values) > _UINT32_MAX:
+                table.type = b"co64"
+                upgraded = True
+            mapped[id(table)] = values
+        if not upgraded:
+            return mapped
@@ -0,0 +1,372 @@
+import os
+import stat
+import uuid
+from email.utils import formatdate, parsedate_to_datetime
+from mimetypes import guess_type
+from typing import Dict, List, Mapping, Optional, Tuple
+import anyio
+from starlette.responses import Response
+from starlette.types import Receive, Scope, Send
+
+# 回退到普通读写时每次发送的数据块大小
+SEND_CHUNK_SIZE = 256 * 1024
+
+# 多段 Range 请求最多处理的区间数, 超过时按完整内容返回 (RFC 9110 允许忽略 Range)
+MAX_RANGES = 16
+
+Ranges = List[Tuple[int, int]]
+
+
+class RangeNotSatisfiable(Exception):
+    """Range 请求无法满足 (416)"""
+
+
+def parse_range_header(header: str, size: int) -> Optional[Ranges]:
+    """
+    解析 Range 请求头
+    
+    Args:
+        header: Range 请求头, 如 "bytes=0-99,200-"
+        size: 文件大小
+    
+    Returns:
+        Optional[Ranges]: 合并后的闭区间列表; 请求头无法解析或区间过多时返回 None (按完整内容返回)
+    
+    Raises:
+        RangeNotSatisfiable: 所有区间都超出文件范围
+    """
+    unit, _, spec = header.partition("=")
+    if unit.strip().lower() != "bytes" or not spec:
+        return None
+    
+    ranges = []
+    for part in spec.split(","):
+        start_text, sep, end_text = part.strip().partition("-")
+        if not sep:
+            return None
+        try:
+            if not start_text:
+                # 后缀区间: 最后 N 个字节
+                suffix = int(end_text)
+                if suffix <= 0:
+                    continue
+                start, end = max(size - suffix, 0), size - 1
+            else:
+                start = int(start_text)
+                end = int(end_text) if end_text else size - 1
+        except ValueError:
+            return None
+        if start < 0 or (end_text and end < start):
+            return None
+        if start >= size:
+            continue
+        ranges.append((start, min(end, size - 1)))
+    
+    if not ranges:
+        raise RangeNotSatisfiable()
+    
+    # 合并重叠或相邻的区间
+    ranges.sort()
+    merged = [ranges[0]]
+    for start, end in ranges[1:]:
+        last_start, last_end = merged[-1]
+        if start <= last_end + 1:
+            merged[-1] = (last_start, max(last_end, end))
+        else:
+            merged.append((start, end))
+    
+    if len(merged) > MAX_RANGES:
+        return None
+    return merged
+
+
+def make_etag(stat_result: os.stat_result) -> str:
+    """
+    根据文件状态生成强 ETag (文件写入后不会再修改, 状态不变即内容不变)
+    
+    Args:
+        stat_result: 文件状态
+    
+    Returns:
+        str: ETag
+    """
+    return f'"{stat_result.st_ino:x}-{stat_result.st_size:x}-{stat_result.st_mtime_ns:x}"'
+
+
+def _etag_matches(header: str, etag: str, weak: bool) -> bool:
+    if header.strip() == "*":
+        return True
+    for candidate in header.split(","):
+        candidate = candidate.strip()
+        if weak and candidate.startswith("W/"):
+            candidate = candidate[2:]
+        if candidate == etag:
+            return True
+    return False
+
+
+def _not_modified_since(header: str, mtime: float) -> bool:
+    try:
+        return int(mtime) <= parsedate_to_datetime(header).timestamp()
+    except (TypeError, ValueError):
+        return False
+
+
+class RangeFileResponse(Response):
+    """
+    支持 Range 的文件响应
+    
+    服务器支持 ASGI 零拷贝扩展 (http.response.pathsend / http.response.zerocopysend)
+    时由服务器直接 sendfile, 否则在线程池中分块读取。
+    
+    file_offset 不为 0 时, 内容为文件中从该偏移开始的 stat_result.st_size 字节
+    (如卷存储中的小文件)。
+    """
+    
+    def __init__(
+        self,
+        path: "os.PathLike[str]",
+        stat_result: os.stat_result,
+        status_code: int = 200,
+        ranges: Optional[Ranges] = None,
+        headers: Optional[Mapping[str, str]] = None,
+        media_type: Optional[str] = None,
+        file_offset: int = 0
+    ):
+        self.path = path
+        self.file_offset = file_offset
+        self.status_code = status_code
+        self.stat_result = stat_result
+        self.media_type = media_type
+        self.background = None
+        self.init_headers(headers)
+        
+        size = stat_result.st_size
+        self.ranges = ranges or []
+        self._parts: List[Tuple[bytes, int, int]] = []
+        self._closing = b""
+        
+        if not self.ranges:
+            self.headers["content-length"] = str(size)
+        elif len(self.ranges) == 1:
+            start, end = self.ranges[0]
+            self.headers["content-range"] = f"bytes {start}-{end}/{size}"
+            self.headers["content-length"] = str(end - start + 1)
+        else:
+            boundary = uuid.uuid4().hex
+            part_type = media_type or "application/octet-stream"
+            length = 0
+            for start, end in self.ranges:
+                part_header = (
+                    f"--{boundary}\r\nContent-Type: {part_type}\r\n"
+                    f"Content-Range: bytes {start}-{end}/{size}\r\n\r\n"
+                ).encode("latin-1")
+                self._parts.append((part_header, start, end))
+                length += len(part_header) + end - start + 1 + 2
+            self._closing = f"--{boundary}--\r\n".encode("latin-1")
+            length += len(self._closing)
+            self.headers["content-type"] = f"multipart/byteranges; boundary={boundary}"
+            self.headers["content-length"] = str(length)
+    
+    async def __call__(self, scope: Scope, receive: Receive, send: Send) -> None:
+        await send({
+            "type": "http.response.start",
+            "status": self.status_code,
+            "headers": self.raw_headers,
+        })
+        if scope["method"].upper() == "HEAD":
+            await send({"type": "http.response.body", "body": b"", "more_body": False})
+            return
+        
+        extensions = scope.get("extensions") or {}
+        if not self.ranges and not self.file_offset and "http.response.pathsend" in extensions:
+            await send({"type": "http.response.pathsend", "path": os.fspath(self.path)})
+            return
+        
+        segments = self._parts or [(b"", start, end) for start, end in self.ranges]
+        if not segments:
+            segments = [(b"", 0, self.stat_result.st_size - 1)]
+        
+        if "http.response.zerocopysend" in extensions:
+            await self._send_zerocopy(send, segments)
+        else:
+            await self._send_chunks(send, segments)
+    
+    async def _send_zerocopy(self, send: Send, segments: List[Tuple[bytes, int, int]]) -> None:
+        fd = await anyio.to_thread.run_sync(os.open, self.path, os.O_RDONLY)
+        try:
+            for part_header, start, end in segments:
+                if part_header:
+                    await send({"type": "http.response.body", "body": part_header, "more_body": True})
+                await send({
+                    "type": "http.response.zerocopysend",
+                    "file": fd,
+                    "offset": self.file_offset + start,
+                    "count": end - start + 1,
+                    "more_body": True,
+                })
+                if self._parts:
+                    await send({"type": "http.response.body", "body": b"\r\n", "more_body": True})
+            await send({"type": "http.response.body", "body": self._closing, "more_body": False})
+        finally:
+            os.close(fd)
+    
+    async def _send_chunks(self, send: Send, segments: List[Tuple[bytes, int, int]]) -> None:
+        async with await anyio.open_file(self.path, mode="rb") as file:
+            for part_header, start, end in segments:
+                if part_header:
+                    await send({"type": "http.response.body", "body": part_header, "more_body": True})
+                await file.seek(self.file_offset + start)
+                remaining = end - start + 1
+                while remaining > 0:
+                    chunk = await file.read(min(SEND_CHUNK_SIZE, remaining))
+                    if not chunk:
+                        break
+                    remaining -= len(chunk)
+                    await send({"type": "http.response.body", "body": chunk, "more_body": True})
+                if self._parts:
+                    await send({"type": "http.response.body", "body": b"\r\n", "more_body": True})
+        await send({"type": "http.response.body", "body": self._closing, "more_body": False})
+
+
+def _evaluate_request(
+    method: str,
+    request_headers: Mapping[str, str],
+    stat_result: os.stat_result,
+    cache_control: str,
+    vary: Optional[str]
+) -> Tuple[Dict[str, str], Optional[Response], Optional[Ranges]]:
+    """
+    生成缓存相关的响应头, 并处理条件请求和 Range 请求头
+    
+    Returns:
+        Tuple[Dict[str, str], Optional[Response], Optional[Ranges]]:
+            (响应头, 可直接返回的 304 / 416 响应, 需要返回的区间)
+    """
+    etag = make_etag(stat_result)
+    headers = {
+        "etag": etag,
+        "last-modified": formatdate(stat_result.st_mtime, usegmt=True),
+        "cache-control": cache_control,
+        "accept-ranges": "bytes",
+    }
+    if vary:
+        headers["vary"] = vary
+    
+    # 条件请求: If-None-Match 优先于 If-Modified-Since
+    if_none_match = request_headers.get("if-none-match")
+    if if_none_match is not None:
+        if _etag_matches(if_none_match, etag, weak=True):
+            return headers, Response(status_code=304, headers=headers), None
+    else:
+        if_modified_since = request_headers.get("if-modified-since")
+        if if_modified_since and _not_modified_since(if_modified_since, stat_result.st_mtime):
+            return headers, Response(status_code=304, headers=headers), None
+    
+    size = stat_result.st_size
+    range_header = request_headers.get("range")
+    ranges = None
+    if range_header and method.upper() in ("GET", "HEAD") and size > 0:
+        # If-Range 不匹配时忽略 Range, 返回完整的新内容
+        if_range = request_headers.get("if-range")
+        if if_range is None or (
+            _etag_matches(if_range, etag, weak=False)
+            if if_range.strip().startswith(('"', "W/"))
+            else _not_modified_since(if_range, stat_result.st_mtime)
+        ):
+            try:
+                ranges = parse_range_header(range_header, size)
+            except RangeNotSatisfiable:
+                headers["content-range"] = f"bytes */{size}"
+                return headers, Response(status_code=416, headers=headers), None
+    return headers, None, ranges
+
+
+def build_file_response(
+    method: str,
+    request_headers: Mapping[str, str],
+    path: "os.PathLike[str]",
+    stat_result: os.stat_result,
+    cache_control: str,
+    media_type: Optional[str] = None,
+    file_offset: int = 0,
+    vary: Optional[str] = None
+) -> Response:
+    """
+    根据条件请求头和 Range 请求头构造文件响应 (200 / 206 / 304 / 416)
+    
+    Args:
+        method: 请求方法
+        request_headers: 请求头
+        path: 文件路径
+        stat_result: 文件状态
+        cache_control: Cache-Control 响应头
+        media_type: MIME 类型(可选, 默认按文件名推断)
+        file_offset: 内容在文件中的起始偏移 (默认 0, 即整个文件)
+        vary: Vary 响应头(可选, 响应内容随请求头协商时设置)
+    
+    Returns:
+        Response: 响应
+    """
+    if not stat.S_ISREG(stat_result.st_mode):
+        return Response(status_code=404)
+    
+    if media_type is None:
+        media_type = guess_type(os.fspath(path))[0] or "application/octet-stream"
+    
+    headers, response, ranges = _evaluate_request(method, request_headers, stat_result, cache_control, vary)
+    if response is not None:
+        return response
+    
+    return RangeFileResponse(
+        path,
+        stat_result,
+        status_code=206 if ranges else 200,
+        ranges=ranges,
+        headers=headers,
+        media_type=media_type,
+        file_offset=file_offset
+    )
+
+
+def build_bytes_response(
+    method: str,
+    request_headers: Mapping[str, str],
+    content: bytes,
+    stat_result: os.stat_result,
+    cache_control: str,
+    media_type: str,
+    vary: Optional[str] = None
+) -> Response:
+    """
+    构造内存中文件内容的响应 (与 build_file_response 的响应头和状态码一致)
+    
+    多段 Range 请求按完整内容返回 (RFC 9110 允许忽略 Range)。
+    
+    Args:
+        method: 请求方法
+        request_headers: 请求头
+        content: 文件内容
+        stat_result: 文件状态 (用于 ETag / Last-Modified)
+        cache_control: Cache-Control 响应头
+        media_type: MIME 类型
+        vary: Vary 响应头(可选)
+    
+    Returns:
+        Response: 响应
+    """
+    headers, response, ranges = _evaluate_request(method, request_headers, stat_result, cache_control, vary)
+    if response is not None:
+        return response
+    
+    status_code = 200
+    if ranges and len(ranges) == 1:
+        start, end = ranges[0]
+        headers["content-range"] = f"bytes {start}-{end}/{len(content)}"
+        content = content[start:end + 1]
+        status_code = 206
+    
+    headers["content-length"] = str(len(content))
+    if method.upper() == "HEAD":
+        content = b""
+    return Response(content, status_code=status_code, headers=headers, media_type=media_type)
@@ -0,0 +1,496 @@
+"""
+媒体文件头探测: 只读取文件头部 (和必要的元数据盒子) 获取尺寸、时长和编码, 不解码像素或帧
+
+- 图片: PNG IHDR、JPEG SOFn (按 EXIF 方向换算显示尺寸)、GIF / WebP / BMP / ICO 文件头、SVG 的 width/height/viewBox
+- 视频: MP4/MOV 的 mvhd / tkhd / stsd, Matroska/WebM 的 Info 和 Tracks
+
+格式按文件头签名判断, 签名无法识别时按扩展名; 无法解析时返回 None, 不影响上传。
+"""
+import math
+import os
+import re
+import struct
+from typing import BinaryIO, Dict, Iterator, NamedTuple, Optional, Tuple
+from utils.sniffer import sniff_extension
+
+# 图片文件头读取长度 (JPEG 的 SOF 段在此之后时逐段 seek)
+HEAD_SIZE = 64 * 1024
+
+# moov / Matroska 元数据超过此大小时不解析, 避免占用过多内存
+MAX_METADATA_SIZE = 16 * 1024 * 1024
+
+# JPEG 最多扫描的段数
+_MAX_JPEG_SEGMENTS = 256
+
+# Matroska Segment 下最多扫描的顶层元素数
+_MAX_EBML_ELEMENTS = 64
+
+# SOFn 标记 (不含 DHT 0xC4 / JPG 0xC8 / DAC 0xCC)
+_JPEG_SOF = set(range(0xC0, 0xD0)) - {0xC4, 0xC8, 0xCC}
+
+# 没有长度字段的 JPEG 标记
+_JPEG_STANDALONE = {0x01} | set(range(0xD0, 0xD8))
+
+# EXIF 方向 5~8 表示图片需要旋转 90°, 显示宽高与存储宽高互换
+_EXIF_TRANSPOSED = {5, 6, 7, 8}
+
+_SVG_TAG = re.compile(rb"<svg\b[^>]*>", re.IGNORECASE | re.DOTALL)
+_SVG_LENGTH = re.compile(r"^\s*([0-9]*\.?[0-9]+)\s*(px)?\s*$")
+
+# SVG 宽高上限 (像素), 超出 (包括溢出为 inf 的超长数字) 视为无效
+_SVG_MAX_LENGTH = 1 << 20
+
+# Matroska 元素 ID
+_EBML_HEADER = 0x1A45DFA3
+_MKV_SEGMENT = 0x18538067
+_MKV_INFO = 0x1549A966
+_MKV_TRACKS = 0x1654AE6B
+_MKV_CLUSTER = 0x1F43B675
+_MKV_TIMECODE_SCALE = 0x2AD7B1
+_MKV_DURATION = 0x4489
+_MKV_TRACK_ENTRY = 0xAE
+_MKV_TRACK_TYPE = 0x83
+_MKV_CODEC_ID = 0x86
+_MKV_VIDEO = 0xE0
+_MKV_PIXEL_WIDTH = 0xB0
+_MKV_PIXEL_HEIGHT = 0xBA
+
+
+class MediaInfo(NamedTuple):
+    """探测到的媒体信息 (无法获取的字段为 None)"""
+    width: Optional[int] = None
+    height: Optional[int] = None
+    duration: Optional[float] = None
+    codec: Optional[str] = None
+
+
+class _Window:
+    """文件中从 offset 开始的 size 字节 (卷存储中的小文件), 提供 seek / read"""
+    
+    def __init__(self, file: BinaryIO, offset: int, size: int):
+        self._file = file
+        self._offset = offset
+        self.size = size
+        self._pos = 0
+    
+    def seek(self, pos: int) -> None:
+        self._pos = min(max(pos, 0), self.size)
+    
+    def read(self, n: int) -> bytes:
+        n = min(n, self.size - self._pos)
+        if n <= 0:
+            return b""
+        data = os.pread(self._file.fileno(), n, self._offset + self._pos)
+        self._pos += len(data)
+        return data
+
+
+def probe_file(path: "os.PathLike[str]", extension: str, offset: int = 0, size: Optional[int] = None) -> Optional[MediaInfo]:
+    """
+    探测文件的媒体信息 (同步执行, 只读取文件头和元数据)
+    
+    Args:
+        path: 文件路径
+        extension: 文件扩展名 (签名无法识别时使用)
+        offset: 内容在文件中的起始偏移 (默认 0, 卷存储中的小文件为卷内偏移)
+        size: 内容大小 (默认到文件末尾)
+    
+    Returns:
+        Optional[MediaInfo]: 媒体信息, 格式不支持或无法解析时返回 None
+    
+    Raises:
+        OSError: 文件读取失败
+    """
+    with open(path, "rb") as file:
+        if size is None:
+            size = os.fstat(file.fileno()).st_size - offset
+        window = _Window(file, offset, size)
+        head = window.read(HEAD_SIZE)
+        probe = _PROBES.get(sniff_extension(head) or extension.lower())
+        if probe is None:
+            return None
+        try:
+            return probe(window, head)
+        except (struct.error, ValueError, IndexError, OverflowError):
+            return None
+
+
+def _probe_png(window: _Window, head: bytes) -> Optional[MediaInfo]:
+    if head[:8] != b"\x89PNG\r\n\x1a\n" or head[12:16] != b"IHDR":
+        return None
+    width, height = struct.unpack_from(">II", head, 16)
+    return MediaInfo(width, height)
+
+
+def _probe_gif(window: _Window, head: bytes) -> Optional[MediaInfo]:
+    if head[:6] not in (b"GIF87a", b"GIF89a"):
+        return None
+    width, height = struct.unpack_from("<HH", head, 6)
+    return MediaInfo(width, height)
+
+
+def _probe_webp(window: _Window, head: bytes) -> Optional[MediaInfo]:
+    if head[:4] != b"RIFF" or head[8:12] != b"WEBP":
+        return None
+    chunk = head[12:16]
+    if chunk == b"VP8 ":
+        # 有损: 关键帧起始码之后为 14 位宽高
+        if head[23:26] != b"\x9d\x01\x2a":
+            return None
+        width, height = struct.unpack_from("<HH", head, 26)
+        return MediaInfo(width & 0x3FFF, height & 0x3FFF)
+    if chunk == b"VP8L":
+        # 无损: 签名 0x2F 之后为各 14 位的 (宽 - 1) 和 (高 - 1)
+        if head[20] != 0x2F:
+            return None
+        bits = int.from_bytes(head[21:25], "little")
+        return MediaInfo((bits & 0x3FFF) + 1, ((bits >> 14) & 0x3FFF) + 1)
+    if chunk == b"VP8X":
+        # 扩展格式 (动画 / 透明通道): 24 位的 (画布宽 - 1) 和 (画布高 - 1)
+        width = int.from_bytes(head[24:27], "little") + 1
+        height = int.from_bytes(head[27:30], "little") + 1
+        return MediaInfo(width, height)
+    return None
+
+
+def _probe_bmp(window: _Window, head: bytes) -> Optional[MediaInfo]:
+    if head[:2] != b"BM":
+        return None
+    if struct.unpack_from("<I", head, 14)[0] == 12:
+        width, height = struct.unpack_from("<HH", head, 18)
+    else:
+        # 高度为负表示自上而下存储
+        width, height = struct.unpack_from("<ii", head, 18)
+    return MediaInfo(abs(width), abs(height))
+
+
+def _probe_ico(window: _Window, head: bytes) -> Optional[MediaInfo]:
+    if head[:4] != b"\x00\x00\x01\x00":
+        return None
+    # 取面积最大的图标, 宽高字节为 0 表示 256
+    count = struct.unpack_from("<H", head, 4)[0]
+    best = None
+    for index in range(min(count, (len(head) - 6) // 16)):
+        width = head[6 + index * 16] or 256
+        height = head[7 + index * 16] or 256
+        if best is None or width * height > best[0] * best[1]:
+            best = (width, height)
+    return MediaInfo(*best) if best else None
+
+
+def _probe_jpeg(window: _Window, head: bytes) -> Optional[MediaInfo]:
+    if head[:2] != b"\xff\xd8":
+        return None
+    pos = 2
+    orientation = None
+    for _ in range(_MAX_JPEG_SEGMENTS):
+        window.seek(pos)
+        marker = window.read(4)
+        if len(marker) < 4 or marker[0] != 0xFF:
+            return None
+        code = marker[1]
+        if code == 0xFF:
+            # 填充字节
+            pos += 1
+            continue
+        if code in _JPEG_STANDALONE:
+            pos += 2
+            continue
+        if code in (0xD9, 0xDA):
+            # 图像数据之前没有 SOF
+            return None
+        length = struct.unpack_from(">H", marker, 2)[0]
+        if code in _JPEG_SOF:
+            height, width = struct.unpack_from(">HH", window.read(5), 1)
+            if orientation in _EXIF_TRANSPOSED:
+                width, height = height, width
+            return MediaInfo(width, height)
+        if code == 0xE1 and orientation is None:
+            orientation = _exif_orientation(window.read(min(length - 2, HEAD_SIZE)))
+        pos += 2 + length
+    return None
+
+
+def _exif_orientation(segment: bytes) -> Optional[int]:
+    # APP1: "Exif\0\0" + TIFF 头, 在 IFD0 中查找 Orientation (0x0112)
+    if segment[:6] != b"Exif\x00\x00":
+        return None
+    tiff = segment[6:]
+    order = {b"II": "<", b"MM": ">"}.get(tiff[:2])
+    if order is None:
+        return None
+    ifd = struct.unpack_from(order + "I", tiff, 4)[0]
+    count = struct.unpack_from(order + "H", tiff, ifd)[0]
+    for index in range(count):
+        entry = ifd + 2 + index * 12
+        if entry + 12 > len(tiff):
+            break
+        tag = struct.unpack_from(order + "H", tiff, entry)[0]
+        if tag == 0x0112:
+            return struct.unpack_from(order + "H", tiff, entry + 8)[0]
+    return None
+
+
+def _probe_svg(window: _Window, head: bytes) -> Optional[MediaInfo]:
+    match = _SVG_TAG.search(head)
+    if match is None:
+        return None
+    tag = match.group().decode("utf-8", "replace")
+    attributes = dict(
+        (name.lower(), value)
+        for name, value in re.findall(r"([\w:-]+)\s*=\s*[\"']([^\"']*)[\"']", tag)
+    )
+    width = _svg_length(attributes.get("width"))
+    height = _svg_length(attributes.get("height"))
+    
+    view_box = attributes.get("viewbox", "").replace(",", " ").split()
+    if len(view_box) == 4:
+        box_width, box_height = _svg_number(view_box[2]), _svg_number(view_box[3])
+        if box_width is not None and box_height is not None:
+            # 只给出一边时按 viewBox 的宽高比补全, 都没有时使用 viewBox 尺寸
+            if width is None and height is None:
+                width, height = box_width, box_height
+            elif width is None:
+                width = height * box_width / box_height
+            elif height is None:
+                height = width * box_height / box_width
+    
+    # 按比例补全的一边可能超出上限
+    if width is None or height is None or not (0 < width <= _SVG_MAX_LENGTH and 0 < height <= _SVG_MAX_LENGTH):
+        return None
+    return MediaInfo(max(round(width), 1), max(round(height), 1))
+
+
+def _svg_length(value: Optional[str]) -> Optional[float]:
+    # 只接受无单位或 px 的长度, 百分比和 em 等相对单位无法确定像素尺寸
+    match = _SVG_LENGTH.match(value) if value else None
+    return _svg_number(match.group(1)) if match else None
+
+
+def _svg_number(text: str) -> Optional[float]:
+    # 拒绝 nan / inf (包括超长数字溢出) 和超出上限的值
+    try:
+        value = float(text)
+    except ValueError:
+        return None
+    return value if math.isfinite(value) and 0 < value <= _SVG_MAX_LENGTH else None
+
+
+def _probe_isobmff(window: _Window, head: bytes) -> Optional[MediaInfo]:
+    # 顶层盒子逐个 seek, moov 在文件尾部时也只读取 moov
+    pos = 0
+    while pos + 8 <= window.size:
+        window.seek(pos)
+        header = window.read(16)
+        box_size, box_type = struct.unpack_from(">I4s", header)
+        header_size = 8
+        if box_size == 1:
+            box_size = struct.unpack_from(">Q", header, 8)[0]
+            header_size = 16
+        elif box_size == 0:
+            box_size = window.size - pos
+        if box_size < header_size:
+            return None
+        if box_type == b"moov":
+            if box_size > MAX_METADATA_SIZE:
+                return None
+            window.seek(pos + header_size)
+            return _parse_moov(window.read(box_size - header_size))
+        pos += box_size
+    return None
+
+
+def _iter_boxes(data: bytes, start: int = 0, end: Optional[int] = None) -> Iterator[Tuple[bytes, int, int]]:
+    end = len(data) if end is None else end
+    pos = start
+    while pos + 8 <= end:
+        box_size, box_type = struct.unpack_from(">I4s", data, pos)
+        header_size = 8
+        if box_size == 1:
+            box_size = struct.unpack_from(">Q", data, pos + 8)[0]
+            header_size = 16
+        elif box_size == 0:
+            box_size = end - pos
+        if box_size < header_size or pos + box_size > end:
+            return
+        yield box_type, pos + header_size, pos + box_size
+        pos += box_size
+
+
+def _find_box(data: bytes, start: int, end: int, *path: bytes) -> Optional[Tuple[int, int]]:
+    for box_type, payload_start, payload_end in _iter_boxes(data, start, end):
+        if box_type == path[0]:
+            if len(path) == 1:
+                return payload_start, payload_end
+            return _find_box(data, payload_start, payload_end, *path[1:])
+    return None
+
+
+def _parse_moov(moov: bytes) -> MediaInfo:
+    duration = None
+    video = None
+    fallback_codec = None
+    for box_type, start, end in _iter_boxes(moov):
+        if box_type == b"mvhd":
+            if moov[start] == 1:
+                timescale, length = struct.unpack_from(">IQ", moov, start + 20)
+                unknown = (1 << 64) - 1
+            else:
+                timescale, length = struct.unpack_from(">II", moov, start + 12)
+                unknown = (1 << 32) - 1
+            # 分片 MP4 的 mvhd 时长可能为 0 或全 1 (未知)
+            if timescale and 0 < length < unknown:
+                duration = length / timescale
+        elif box_type == b"trak":
+            handler, codec, size = _parse_trak(moov, start, end)
+            if handler == b"vide" and video is None:
+                video = (size, codec)
+            elif fallback_codec is None:
+                fallback_codec = codec
+    
+    if video is None:
+        return MediaInfo(duration=duration, codec=fallback_codec)
+    (width, height), codec = video
+    return MediaInfo(width, height, duration, codec)
+
+
+def _parse_trak(moov: bytes, start: int, end: int) -> Tuple[Optional[bytes], Optional[str], Tuple[Optional[int], Optional[int]]]:
+    width = height = None
+    tkhd = _find_box(moov, start, end, b"tkhd")
+    if tkhd is not None:
+        # tkhd: 时间字段之后依次为 reserved(8) layer/group/volume/reserved(8) matrix(36) width height (16.16 定点)
+        matrix = tkhd[0] + 4 + (32 if moov[tkhd[0]] == 1 else 20) + 16
+        a, b = struct.unpack_from(">ii", moov, matrix)
+        width, height = struct.unpack_from(">II", moov, matrix + 36)
+        width, height = width >> 16, height >> 16
+        if a == 0 and b != 0:
+            # 旋转 90° / 270°, 显示宽高互换
+            width, height = height, width
+    
+    handler = None
+    hdlr = _find_box(moov, start, end, b"mdia", b"hdlr")
+    if hdlr is not None:
+        handler = moov[hdlr[0] + 8:hdlr[0] + 12]
+    
+    codec = None
+    stsd = _find_box(moov, start, end, b"mdia", b"minf", b"stbl", b"stsd")
+    if stsd is not None:
+        # stsd: version/flags(4) entry_count(4), 第一个样本描述的盒子类型即编码 (avc1 / hvc1 / mp4a ...)
+        entry = moov[stsd[0] + 12:stsd[0] + 16]
+        if len(entry) == 4:
+            codec = entry.decode("latin-1").strip() or None
+    return handler, codec, (width or None, height or None)
+
+
+def _read_vint(data: bytes, pos: int, keep_marker: bool = False) -> Tuple[Optional[int], int]:
+    # EBML 变长整数: 首字节前导 0 的个数决定长度; 元素 ID 保留长度标记位, 大小去掉标记位
+    first = data[pos]
+    if first == 0:
+        raise ValueError("invalid EBML vint")
+    length = 9 - first.bit_length()
+    if pos + length > len(data):
+        raise ValueError("truncated EBML vint")
+    value = first if keep_marker else first & (0xFF >> length)
+    all_ones = value == (0xFF >> length)
+    for byte in data[pos + 1:pos + length]:
+        value = (value << 8) | byte
+        all_ones = all_ones and byte == 0xFF
+    # 大小的值位全为 1 表示未知大小 (直播流)
+    return (None if all_ones and not keep_marker else value), pos + length
+
+
+def _read_element(data: bytes, pos: int) -> Tuple[int, Optional[int], int]:
+    element_id, pos = _read_vint(data, pos, keep_marker=True)
+    size, pos = _read_vint(data, pos)
+    return element_id, size, pos
+
+
+def _iter_elements(data: bytes, start: int, end: int) -> Iterator[Tuple[int, int, int]]:
+    pos = start
+    while pos < end:
+        element_id, size, pos = _read_element(data, pos)
+        if size is None or pos + size > end:
+            return
+        yield element_id, pos, pos + size
+        pos += size
+
+
+def _probe_matroska(window: _Window, head: bytes) -> Optional[MediaInfo]:
+    element_id, size, pos = _read_element(head, 0)
+    if element_id != _EBML_HEADER or size is None:
+        return None
+    window.seek(pos + size)
+    element_id, segment_size, header_size = _read_element(window.read(12), 0)
+    if element_id != _MKV_SEGMENT:
+        return None
+    pos += size + header_size
+    segment_end = window.size if segment_size is None else min(pos + segment_size, window.size)
+    
+    # 逐个 seek Segment 的子元素, 读取 Info 和 Tracks, 遇到 Cluster (媒体数据) 即停止
+    info = tracks = None
+    for _ in range(_MAX_EBML_ELEMENTS):
+        if pos >= segment_end or (info is not None and tracks is not None):
+            break
+        window.seek(pos)
+        element_id, size, header_size = _read_element(window.read(12), 0)
+        if element_id == _MKV_CLUSTER or size is None:
+            break
+        if element_id in (_MKV_INFO, _MKV_TRACKS) and size <= MAX_METADATA_SIZE:
+            window.seek(pos + header_size)
+            payload = window.read(size)
+            if element_id == _MKV_INFO:
+                info = payload
+            else:
+                tracks = payload
+        pos += header_size + size
+    
+    duration = None
+    if info is not None:
+        values = _element_values(info, 0, len(info))
+        timecode_scale = int.from_bytes(values.get(_MKV_TIMECODE_SCALE, b""), "big") or 1000000
+        raw = values.get(_MKV_DURATION)
+        if raw is not None and len(raw) in (4, 8):
+            duration = struct.unpack(">f" if len(raw) == 4 else ">d", raw)[0] * timecode_scale / 1e9
+    
+    width = height = codec = None
+    if tracks is not None:
+        for element_id, start, end in _iter_elements(tracks, 0, len(tracks)):
+            if element_id != _MKV_TRACK_ENTRY:
+                continue
+            values = _element_values(tracks, start, end)
+            track_codec = values.get(_MKV_CODEC_ID, b"").rstrip(b"\x00").decode("ascii", "replace") or None
+            # TrackType 1 为视频
+            if int.from_bytes(values.get(_MKV_TRACK_TYPE, b""), "big") == 1 and _MKV_VIDEO in values:
+                video = _element_values(values[_MKV_VIDEO], 0, len(values[_MKV_VIDEO]))
+                width = int.from_bytes(video.get(_MKV_PIXEL_WIDTH, b""), "big") or None
+                height = int.from_bytes(video.get(_MKV_PIXEL_HEIGHT, b""), "big") or None
+                codec = track_codec
+                break
+            if codec is None:
+                codec = track_codec
+    return MediaInfo(width, height, duration, codec)
+
+
+def _element_values(data: bytes, start: int, end: int) -> Dict[int, bytes]:
+    # 同一 ID 出现多次时取第一个
+    values: Dict[int, bytes] = {}
+    for element_id, payload_start, payload_end in _iter_elements(data, start, end):
+        values.setdefault(element_id, data[payload_start:payload_end])
+    return values
+
+
+_PROBES = {
+    "png": _probe_png,
+    "jpg": _probe_jpeg,
+    "jpeg": _probe_jpeg,
+    "gif": _probe_gif,
+    "webp": _probe_webp,
+    "bmp": _probe_bmp,
+    "ico": _probe_ico,
+    "svg": _probe_svg,
+    "mp4": _probe_isobmff,
+    "mov": _probe_isobmff,
+    "m4v": _probe_isobmff,
+    "mkv": _probe_matroska,
+    "webm": _probe_matroska,
+}
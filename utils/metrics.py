@@ -0,0 +1,348 @@
+import bisect
+import contextvars
+import time
+from typing import Any, Dict, Iterable, List, Optional, Sequence, Tuple
+
+# 耗时直方图的默认分桶 (秒)
+DEFAULT_BUCKETS = (0.001, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0, 60.0)
+
+# 未匹配任何路由的请求 (如 404) 统一归入该端点, 避免标签数量无限增长
+UNMATCHED_ENDPOINT = "other"
+
+# 不在请求中执行的任务 (如后台导入任务) 的端点标签
+BACKGROUND_ENDPOINT = "background"
+
+_request_scope: contextvars.ContextVar[Optional[dict]] = contextvars.ContextVar("request_scope", default=None)
+
+# 路由处理函数 -> 路由路径模板, 首次使用时从应用的路由表构建
+_route_paths: Dict[object, str] = {}
+
+
+class _Metric:
+    """指标基类: 按标签值元组分别记录"""
+    
+    type_name = ""
+    
+    def __init__(self, name: str, documentation: str, labelnames: Sequence[str] = ()):
+        self.name = name
+        self.documentation = documentation
+        self.labelnames = tuple(labelnames)
+        self._values: Dict[Tuple[str, ...], Any] = {}
+        REGISTRY.append(self)
+    
+    def samples(self, values: Dict[Tuple[str, ...], Any]) -> List[Tuple[str, Tuple[str, ...], float]]:
+        raise NotImplementedError
+    
+    def combine(self, current: Any, value: Any) -> Any:
+        """合并两个进程中同一标签值的记录"""
+        return current + value
+    
+    def render(self, values: Optional[Dict[Tuple[str, ...], Any]] = None) -> str:
+        lines = [f"# HELP {self.name} {self.documentation}", f"# TYPE {self.name} {self.type_name}"]
+        for name, labels, value in self.samples(self._values if values is None else values):
+            lines.append(f"{name}{_format_labels(labels)} {_format_value(value)}")
+        return "\n".join(lines)
+
+
+class Counter(_Metric):
+    """只增不减的计数器"""
+    
+    type_name = "counter"
+    
+    def inc(self, amount: float = 1, *labels: str) -> None:
+        """
+        增加计数
+        
+        Args:
+            amount: 增量
+            *labels: 标签值 (顺序与 labelnames 一致)
+        """
+        self._values[labels] = self._values.get(labels, 0) + amount
+    
+    def samples(self, values: Dict[Tuple[str, ...], Any]) -> List[Tuple[str, Tuple[str, ...], float]]:
+        return [(self.name, tuple(zip(self.labelnames, labels)), value) for labels, value in values.items()]
+
+
+class Gauge(Counter):
+    """可增可减的当前值 (多个进程的当前值相加)"""
+    
+    type_name = "gauge"
+    
+    def dec(self, amount: float = 1, *labels: str) -> None:
+        """
+        减少当前值
+        
+        Args:
+            amount: 减量
+            *labels: 标签值
+        """
+        self._values[labels] = self._values.get(labels, 0) - amount
+    
+    def set(self, value: float, *labels: str) -> None:
+        """
+        设置当前值
+        
+        Args:
+            value: 当前值
+            *labels: 标签值
+        """
+        self._values[labels] = value
+
+
+class Histogram(_Metric):
+    """分桶直方图 (记录时只累加所在桶, 导出时再累计)"""
+    
+    type_name = "histogram"
+    
+    def __init__(
+        self,
+        name: str,
+        documentation: str,
+        labelnames: Sequence[str] = (),
+        buckets: Sequence[float] = DEFAULT_BUCKETS
+    ):
+        super().__init__(name, documentation, labelnames)
+        self.buckets = tuple(sorted(buckets))
+        # 标签值 -> [各桶计数 (最后一个为 +Inf), 总和]
+        self._values: Dict[Tuple[str, ...], list] = {}
+    
+    def combine(self, current: list, value: list) -> list:
+        if len(current[0]) != len(value[0]):
+            # 分桶不同 (如升级前的旧快照) 时无法合并, 保留当前记录
+            return current
+        return [[a + b for a, b in zip(current[0], value[0])], current[1] + value[1]]
+    
+    def observe(self, value: float, *labels: str) -> None:
+        """
+        记录一次观测值
+        
+        Args:
+            value: 观测值
+            *labels: 标签值
+        """
+        entry = self._values.get(labels)
+        if entry is None:
+            entry = self._values[labels] = [[0] * (len(self.buckets) + 1), 0.0]
+        entry[0][bisect.bisect_left(self.buckets, value)] += 1
+        entry[1] += value
+    
+    def samples(self, values: Dict[Tuple[str, ...], Any]) -> List[Tuple[str, Tuple[str, ...], float]]:
+        samples = []
+        bounds = [*map(_format_value, self.buckets), "+Inf"]
+        for labels, (counts, total) in values.items():
+            pairs = tuple(zip(self.labelnames, labels))
+            cumulative = 0
+            for bound, count in zip(bounds, counts):
+                cumulative += count
+                samples.append((f"{self.name}_bucket", (*pairs, ("le", bound)), cumulative))
+            samples.append((f"{self.name}_sum", pairs, total))
+            samples.append((f"{self.name}_count", pairs, cumulative))
+        return samples
+
+
+REGISTRY: List[_Metric] = []
+
+
+def _format_labels(labels: Tuple[Tuple[str, str], ...]) -> str:
+    if not labels:
+        return ""
+    return "{" + ",".join(f'{key}="{_escape(value)}"' for key, value in labels) + "}"
+
+
+def _escape(value: str) -> str:
+    return value.replace("\\", "\\\\").replace('"', '\\"').replace("\n", "\\n")
+
+
+def _format_value(value: float) -> str:
+    return str(int(value)) if float(value).is_integer() else repr(float(value))
+
+
+def snapshot() -> Dict[str, list]:
+    """
+    导出本进程所有指标的原始记录 (可序列化为 JSON, 用于多进程汇总)
+    
+    Returns:
+        Dict[str, list]: 指标名 -> [[标签值列表, 记录], ...]
+    """
+    return {
+        metric.name: [[list(labels), value] for labels, value in metric._values.items()]
+        for metric in REGISTRY
+        if metric._values
+    }
+
+
+def merge_snapshots(snapshots: Iterable[Dict[str, list]], include_gauges: bool = True) -> Dict[str, list]:
+    """
+    合并多个进程的指标快照: 计数器和直方图累加, 仪表值相加
+    
+    Args:
+        snapshots: 指标快照列表
+        include_gauges: 是否包含仪表值 (已退出进程的当前值不再有意义)
+    
+    Returns:
+        Dict[str, list]: 合并后的指标快照
+    """
+    merged = _merge(snapshots, include_gauges)
+    return {
+        name: [[list(labels), value] for labels, value in values.items()]
+        for name, values in merged.items()
+        if values
+    }
+
+
+def _merge(snapshots: Iterable[Dict[str, list]], include_gauges: bool) -> Dict[str, dict]:
+    metrics = {metric.name: metric for metric in REGISTRY}
+    merged: Dict[str, dict] = {}
+    for data in snapshots:
+        for name, entries in data.items():
+            metric = metrics.get(name)
+            if metric is None or (not include_gauges and isinstance(metric, Gauge)):
+                continue
+            values = merged.setdefault(name, {})
+            for labels, value in entries:
+                labels = tuple(labels)
+                values[labels] = value if labels not in values else metric.combine(values[labels], value)
+    return merged
+
+
+def render(snapshots: Optional[Iterable[Dict[str, list]]] = None) -> str:
+    """
+    导出所有指标 (Prometheus 文本格式)
+    
+    Args:
+        snapshots: 需要汇总的各进程指标快照 (可选, 默认只导出本进程)
+    
+    Returns:
+        str: 指标文本
+    """
+    if snapshots is None:
+        return "\n".join(metric.render() for metric in REGISTRY) + "\n"
+    merged = _merge(snapshots, include_gauges=True)
+    return "\n".join(metric.render(merged.get(metric.name, {})) for metric in REGISTRY) + "\n"
+
+
+def current_endpoint() -> str:
+    """
+    当前请求匹配的路由路径模板 (如 /files/{filename})
+    
+    Returns:
+        str: 端点标签
+    """
+    scope = _request_scope.get()
+    if scope is None:
+        return BACKGROUND_ENDPOINT
+    endpoint = scope.get("endpoint")
+    if endpoint is None:
+        return UNMATCHED_ENDPOINT
+    if not _route_paths:
+        for route in scope["app"].routes:
+            if hasattr(route, "endpoint"):
+                _route_paths[route.endpoint] = route.path
+    return _route_paths.get(endpoint, UNMATCHED_ENDPOINT)
+
+
+def observe_stage(stage: str, seconds: float, file_format: str = "") -> None:
+    """
+    记录一个处理阶段的耗时
+    
+    Args:
+        stage: 阶段名 (receive / detect / validate / store / faststart / fetch)
+        seconds: 耗时 (秒)
+        file_format: 文件格式
+    """
+    STAGE_SECONDS.observe(seconds, current_endpoint(), stage, file_format or "unknown")
+
+
+# HTTP 请求
+HTTP_REQUESTS = Counter(
+    "linkforge_http_requests_total", "HTTP requests", ("endpoint", "method", "status")
+)
+HTTP_REQUEST_SECONDS = Histogram(
+    "linkforge_http_request_duration_seconds", "HTTP request latency", ("endpoint", "method")
+)
+HTTP_REQUESTS_IN_FLIGHT = Gauge("linkforge_http_requests_in_flight", "HTTP requests being processed")
+HTTP_RECEIVED_BYTES = Counter("linkforge_http_received_bytes_total", "HTTP request body bytes", ("endpoint",))
+HTTP_SENT_BYTES = Counter("linkforge_http_sent_bytes_total", "HTTP response body bytes", ("endpoint",))
+
+# 文件处理
+STAGE_SECONDS = Histogram(
+    "linkforge_stage_duration_seconds", "File processing stage latency", ("endpoint", "stage", "format")
+)
+STORED_BYTES = Counter("linkforge_stored_bytes_total", "Bytes written to storage", ("endpoint", "format"))
+UPLOADS_IN_FLIGHT = Gauge("linkforge_uploads_in_flight", "Files being received")
+UPLOAD_BYTES_IN_FLIGHT = Gauge("linkforge_upload_bytes_in_flight", "Bytes received by unfinished files")
+
+# URL 下载
+DOWNLOAD_ERRORS = Counter("linkforge_download_errors_total", "URL download failures", ("cause",))
+URL_CACHE_REQUESTS = Counter("linkforge_url_cache_requests_total", "URL import cache lookups", ("result",))
+
+# 准入控制
+ADMISSION_QUEUED = Gauge("linkforge_admission_queued", "Uploads waiting for admission")
+ADMISSION_REJECTED = Counter("linkforge_admission_rejected_total", "Uploads rejected with 503", ("class",))
+ADMISSION_RESERVED_BYTES = Gauge("linkforge_admission_reserved_bytes", "Bytes reserved by admitted uploads", ("resource",))
+
+# 生命周期管理
+LIFECYCLE_REMOVED = Counter("linkforge_lifecycle_removed_total", "Files removed by the lifecycle sweeper", ("reason",))
+LIFECYCLE_USED_BYTES = Gauge("linkforge_lifecycle_used_bytes", "Total size of indexed files at the last sweep")
+
+# 热点缓存
+HOT_CACHE_REQUESTS = Counter("linkforge_hot_cache_requests_total", "Hot object cache lookups", ("result",))
+HOT_CACHE_INSERTED_BYTES = Counter("linkforge_hot_cache_inserted_bytes_total", "Bytes written to the hot object cache")
+
+# 存储落盘
+STORAGE_SYNC_REQUESTS = Counter("linkforge_storage_sync_requests_total", "Paths submitted for fsync by storage commits")
+STORAGE_FSYNCS = Counter("linkforge_storage_fsyncs_total", "fsync calls issued by storage commits")
+
+
+class MetricsMiddleware:
+    """
+    记录 HTTP 请求数、耗时、进行中的请求和收发字节数的 ASGI 中间件
+    
+    收发字节在请求内用局部变量累加, 请求结束时按端点记录一次。
+    """
+    
+    def __init__(self, app):
+        self.app = app
+    
+    async def __call__(self, scope, receive, send):
+        if scope["type"] != "http":
+            await self.app(scope, receive, send)
+            return
+        
+        token = _request_scope.set(scope)
+        started = time.perf_counter()
+        received = 0
+        sent = 0
+        content_length: Optional[int] = None
+        status = 500
+        
+        async def counting_receive():
+            nonlocal received
+            message = await receive()
+            received += len(message.get("body", b""))
+            return message
+        
+        async def counting_send(message):
+            nonlocal sent, content_length, status
+            if message["type"] == "http.response.start":
+                status = message["status"]
+                for key, value in message.get("headers", ()):
+                    if key.lower() == b"content-length":
+                        content_length = int(value)
+            elif message["type"] == "http.response.body":
+                sent += len(message.get("body", b""))
+            await send(message)
+        
+        HTTP_REQUESTS_IN_FLIGHT.inc()
+        try:
+            await self.app(scope, counting_receive, counting_send)
+        finally:
+            HTTP_REQUESTS_IN_FLIGHT.dec()
+            endpoint = current_endpoint()
+            method = scope["method"]
+            HTTP_REQUESTS.inc(1, endpoint, method, str(status))
+            HTTP_REQUEST_SECONDS.observe(time.perf_counter() - started, endpoint, method)
+            HTTP_RECEIVED_BYTES.inc(received, endpoint)
+            # 零拷贝发送的文件不经过 body 消息, 以 Content-Length 为准
+            HTTP_SENT_BYTES.inc(content_length if content_length is not None and method != "HEAD" else sent, endpoint)
+            _request_scope.reset(token)
@@ -0,0 +1,163 @@
+from collections import deque
+from typing import AsyncIterator, Deque, List, Optional, Tuple
+from multipart.multipart import MultipartParser, parse_options_header
+
+# 解析器事件类型
+_PART_HEADERS = 1
+_PART_DATA = 2
+_PART_END = 3
+
+
+class StreamingPart:
+    """multipart 中的一个分段, 数据以流的形式按块读取"""
+    
+    def __init__(
+        self,
+        reader: "MultipartStreamReader",
+        field_name: str,
+        filename: Optional[str],
+        content_type: Optional[str]
+    ):
+        self._reader = reader
+        self.field_name = field_name
+        self.filename = filename
+        self.content_type = content_type
+        self._finished = False
+    
+    async def iter_chunks(self) -> AsyncIterator[bytes]:
+        """
+        按块读取分段数据
+        
+        Yields:
+            bytes: 数据块
+        """
+        while not self._finished:
+            event = await self._reader._next_event()
+            if event is None:
+                raise ValueError("multipart 请求体不完整")
+            kind, payload = event
+            if kind == _PART_DATA:
+                yield payload
+            elif kind == _PART_END:
+                self._finished = True
+    
+    async def drain(self) -> None:
+        """丢弃分段中尚未读取的数据"""
+        async for _ in self.iter_chunks():
+            pass
+
+
+class MultipartStreamReader:
+    """
+    流式 multipart 解析器
+    
+    直接消费请求体数据流, 每个分段的数据在到达时即交给调用方,
+    不会像 UploadFile 那样先整体缓存到内存或临时文件。
+    """
+    
+    def __init__(self, content_type: str, stream: AsyncIterator[bytes]):
+        _, params = parse_options_header(content_type)
+        boundary = params.get(b"boundary")
+        if not boundary:
+            raise ValueError("无效的 multipart 请求: 缺少 boundary")
+        
+        charset = params.get(b"charset", b"utf-8")
+        self._charset = charset.decode("latin-1") if isinstance(charset, bytes) else charset
+        self._stream = stream.__aiter__()
+        self._events: Deque[Tuple[int, object]] = deque()
+        self._eof = False
+        # 是否读到了结束分隔符 (python-multipart 的 finalize 不检查请求体是否完整)
+        self._complete = False
+        self._header_name = b""
+        self._header_value = b""
+        self._headers: List[Tuple[bytes, bytes]] = []
+        self._parser = MultipartParser(boundary, {
+            "on_part_begin": self._on_part_begin,
+            "on_part_data": self._on_part_data,
+            "on_part_end": self._on_part_end,
+            "on_header_field": self._on_header_field,
+            "on_header_value": self._on_header_value,
+            "on_header_end": self._on_header_end,
+            "on_headers_finished": self._on_headers_finished,
+            "on_end": self._on_end,
+        })
+    
+    def _decode(self, value: bytes) -> str:
+        try:
+            return value.decode(self._charset)
+        except (UnicodeDecodeError, LookupError):
+            return value.decode("latin-1")
+    
+    def _on_part_begin(self) -> None:
+        self._headers = []
+    
+    def _on_part_data(self, data: bytes, start: int, end: int) -> None:
+        self._events.append((_PART_DATA, data[start:end]))
+    
+    def _on_part_end(self) -> None:
+        self._events.append((_PART_END, None))
+    
+    def _on_header_field(self, data: bytes, start: int, end: int) -> None:
+        self._header_name += data[start:end]
+    
+    def _on_header_value(self, data: bytes, start: int, end: int) -> None:
+        self._header_value += data[start:end]
+    
+    def _on_header_end(self) -> None:
+        self._headers.append((self._header_name.lower(), self._header_value))
+        self._header_name = b""
+        self._header_value = b""
+    
+    def _on_headers_finished(self) -> None:
+        headers = dict(self._headers)
+        _, options = parse_options_header(headers.get(b"content-disposition", b""))
+        if b"name" not in options:
+            raise ValueError("无效的 multipart 请求: Content-Disposition 缺少 name")
+        
+        filename = options.get(b"filename")
+        content_type = headers.get(b"content-type")
+        self._events.append((_PART_HEADERS, (
+            self._decode(options[b"name"]),
+            self._decode(filename) if filename is not None else None,
+            content_type.decode("latin-1") if content_type else None,
+        )))
+    
+    def _on_end(self) -> None:
+        self._complete = True
+    
+    async def _next_event(self) -> Optional[Tuple[int, object]]:
+        while not self._events:
+            if self._eof:
+                if not self._complete:
+                    raise ValueError("multipart 请求体不完整")
+                return None
+            try:
+                chunk = await self._stream.__anext__()
+            except StopAsyncIteration:
+                self._eof = True
+                self._parser.finalize()
+                continue
+            if chunk:
+                self._parser.write(chunk)
+        return self._events.popleft()
+    
+    async def parts(self) -> AsyncIterator[StreamingPart]:
+        """
+        依次产出请求体中的分段
+        
+        调用方未读完的分段数据会在取下一个分段前被自动丢弃。
+        
+        Yields:
+            StreamingPart: multipart 分段
+        """
+        while True:
+            event = await self._next_event()
+            if event is None:
+                return
+            kind, payload = event
+            if kind != _PART_HEADERS:
+                continue
+            
+            part = StreamingPart(self, *payload)
+            yield part
+            await part.drain()
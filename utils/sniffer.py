@@ -0,0 +1,109 @@
+from typing import Callable, Optional, Tuple, Union
+
+# 文件头检测只需要很少的字节, 以下长度足以覆盖所有签名
+SNIFF_HEADER_SIZE = 4096
+
+# ISO-BMFF (ftyp) 主品牌 -> 扩展名, 未列出的品牌按 mp4 处理
+_FTYP_BRANDS = {
+    b"qt  ": "mov",
+    b"M4V ": "m4v",
+    b"M4VH": "m4v",
+    b"M4VP": "m4v",
+}
+
+# 非视频的 ISO-BMFF 品牌 (HEIF/AVIF 图片等), 不能当作 mp4
+_FTYP_NON_VIDEO_BRANDS = {b"avif", b"avis", b"heic", b"heix", b"mif1", b"msf1", b"M4A ", b"M4B ", b"M4P "}
+
+# 没有 ftyp 的旧版 QuickTime 文件以这些顶层 box 开头
+_QUICKTIME_ATOMS = {b"moov", b"mdat", b"wide", b"free", b"skip", b"pnot"}
+
+# BMP 信息头长度 (BITMAPCOREHEADER ~ BITMAPV5HEADER)
+_BMP_DIB_HEADER_SIZES = {12, 16, 40, 52, 56, 64, 108, 124}
+
+
+def _sniff_riff(data: bytes) -> Optional[str]:
+    form = data[8:12]
+    if form == b"WEBP":
+        return "webp"
+    if form == b"AVI ":
+        return "avi"
+    return None
+
+
+def _sniff_ftyp(data: bytes) -> Optional[str]:
+    brand = data[8:12]
+    if brand in _FTYP_NON_VIDEO_BRANDS:
+        return None
+    return _FTYP_BRANDS.get(brand, "mp4")
+
+
+def _sniff_ebml(data: bytes) -> Optional[str]:
+    # DocType 元素 (ID 0x4282) 位于 EBML 头部, 内容为 "webm" 或 "matroska"
+    pos = data.find(b"\x42\x82", 4, 64)
+    if pos != -1:
+        doc_type = data[pos + 3:pos + 11]
+        if doc_type.startswith(b"webm"):
+            return "webm"
+    return "mkv"
+
+
+def _sniff_bmp(data: bytes) -> Optional[str]:
+    if len(data) >= 18 and int.from_bytes(data[14:18], "little") in _BMP_DIB_HEADER_SIZES:
+        return "bmp"
+    return None
+
+
+def _sniff_ico(data: bytes) -> Optional[str]:
+    # 图标数量不能为 0
+    if len(data) >= 6 and int.from_bytes(data[4:6], "little") > 0:
+        return "ico"
+    return None
+
+
+# 签名表: (偏移量, 魔数, 扩展名或进一步判断的函数)
+_SIGNATURES: Tuple[Tuple[int, bytes, Union[str, Callable[[bytes], Optional[str]]]], ...] = (
+    (0, b"\xff\xd8\xff", "jpg"),
+    (0, b"\x89PNG\r\n\x1a\n", "png"),
+    (0, b"GIF87a", "gif"),
+    (0, b"GIF89a", "gif"),
+    (0, b"RIFF", _sniff_riff),
+    (4, b"ftyp", _sniff_ftyp),
+    (0, b"\x1a\x45\xdf\xa3", _sniff_ebml),
+    (0, b"FLV\x01", "flv"),
+    (0, b"\x30\x26\xb2\x75\x8e\x66\xcf\x11\xa6\xd9\x00\xaa\x00\x62\xce\x6c", "wmv"),
+    (0, b"\x00\x00\x01\xba", "mpg"),
+    (0, b"\x00\x00\x01\xb3", "mpg"),
+    (0, b"BM", _sniff_bmp),
+    (0, b"\x00\x00\x01\x00", _sniff_ico),
+)
+
+
+def _sniff_svg(data: bytes) -> Optional[str]:
+    text = data[:SNIFF_HEADER_SIZE].lstrip(b"\xef\xbb\xbf \t\r\n").lower()
+    if (text.startswith(b"<?xml") or text.startswith(b"<!--") or text.startswith(b"<!doctype svg")
+            or text.startswith(b"<svg")) and b"<svg" in text:
+        return "svg"
+    return None
+
+
+def sniff_extension(data: bytes) -> Optional[str]:
+    """
+    根据文件头部字节 (魔数) 识别文件格式
+    
+    Args:
+        data: 文件开头的数据 (SNIFF_HEADER_SIZE 字节即可)
+    
+    Returns:
+        Optional[str]: 文件扩展名, 无法识别时返回 None
+    """
+    for offset, magic_bytes, result in _SIGNATURES:
+        if data.startswith(magic_bytes, offset):
+            extension = result if isinstance(result, str) else result(data)
+            if extension:
+                return extension
+    
+    # 旧版 QuickTime 文件
+    if data[4:8] in _QUICKTIME_ATOMS and int.from_bytes(data[:4], "big") >= 8:
+        return "mov"
+    
+    return _sniff_svg(data)
@@ -0,0 +1,44 @@
+from typing import AsyncIterator, Tuple
+
+
+async def prepend_stream(head: bytes, stream: AsyncIterator[bytes]) -> AsyncIterator[bytes]:
+    """
+    在数据流前拼接已读取的数据
+    
+    Args:
+        head: 已读取的数据
+        stream: 剩余数据流
+    
+    Yields:
+        bytes: 数据块
+    """
+    if head:
+        yield head
+    async for chunk in stream:
+        yield chunk
+
+
+async def read_stream_head(
+    stream: AsyncIterator[bytes],
+    size: int
+) -> Tuple[bytes, AsyncIterator[bytes]]:
+    """
+    读取数据流开头至少 size 字节 (数据流更短时读完为止)
+    
+    Args:
+        stream: 数据流
+        size: 需要读取的字节数
+    
+    Returns:
+        Tuple[bytes, AsyncIterator[bytes]]: (头部数据, 包含头部在内的完整数据流)
+    """
+    iterator = stream.__aiter__()
+    buffer = bytearray()
+    while len(buffer) < size:
+        try:
+            buffer += await iterator.__anext__()
+        except StopAsyncIteration:
+            break
+    
+    head = bytes(buffer)
+    return head, prepend_stream(head, iterator)
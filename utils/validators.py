@@ -1,6 +1,7 @@
 from pathlib import Path
 from typing import Optional
 from config import ALLOWED_FORMATS, MAX_FILE_SIZE
+from utils.sniffer import sniff_extension
 
 # 尝试导入 magic 库,如果失败则使用降级方案
 try:
@@ -9,6 +10,16 @@ try:
 except ImportError:
     MAGIC_AVAILABLE = False
 
+# 复用的 libmagic 句柄 (创建时需要加载规则库, 开销较大)
+_magic_instance = None
+
+
+def _get_magic():
+    global _magic_instance
+    if _magic_instance is None:
+        _magic_instance = magic.Magic(mime=True)
+    return _magic_instance
+
 
 def validate_file_extension(filename: str) -> bool:
     """
@@ -64,12 +75,50 @@ def detect_mime_type(file_path: Path) -> Optional[str]:
         return None
     
     try:
-        mime = magic.Magic(mime=True)
-        return mime.from_file(str(file_path))
+        return _get_magic().from_file(str(file_path))
+    except Exception:
+        return None
+
+
+def detect_mime_type_from_buffer(data: bytes) -> Optional[str]:
+    """
+    根据文件开头的字节检测 MIME 类型
+    
+    Args:
+        data: 文件头部数据
+    
+    Returns:
+        Optional[str]: MIME 类型
+    """
+    if not MAGIC_AVAILABLE or not data:
+        return None
+    
+    try:
+        return _get_magic().from_buffer(data)
     except Exception:
         return None
 
 
+def detect_extension_from_buffer(data: bytes) -> Optional[str]:
+    """
+    根据文件开头的字节识别文件扩展名
+    
+    优先使用内置的魔数签名表, 无法识别时再回退到 libmagic (如已安装)。
+    
+    Args:
+        data: 文件头部数据
+    
+    Returns:
+        Optional[str]: 文件扩展名
+    """
+    extension = sniff_extension(data)
+    if extension:
+        return extension
+    
+    mime_type = detect_mime_type_from_buffer(data)
+    return get_extension_from_mime(mime_type) if mime_type else None
+
+
 def get_extension_from_mime(mime_type: str) -> Optional[str]:
     """
     从 MIME 类型获取文件扩展名